@@ -1,19 +1,25 @@
 # api_routes.py - REST API 路由（取代前端 IndexedDB）
 
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 import os
+import re
 import json
 import uuid
-from datetime import datetime
-from PIL import Image
-from io import BytesIO
+import hashlib
+import mimetypes
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import base64
 import requests
 from urllib.parse import quote
 
 import db
 import config
+import collab
+import image_pipeline
+import json_patch
+import upload_paths
 from auth import check_ip_whitelist
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
@@ -64,6 +70,25 @@ def apply_auth(f):
     # 啟用 IP 白名單檢查
     return check_ip_whitelist(f)
 
+# === 條件式 GET（ETag）===
+# 讀取前先以一次索引查詢取得版本資訊；If-None-Match 相符時直接回 304，
+# 不再查詢與序列化完整內容。Cache-Control: no-cache 讓瀏覽器每次都帶 ETag 重新驗證。
+
+def _etag(*parts):
+    """由版本資訊算出 ETag；資料沒變時相同"""
+    return hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()[:20]
+
+def _with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _not_modified(etag):
+    """If-None-Match 相符時回傳 304 回應，否則 None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return _with_etag(Response(status=304), etag)
+
 # === Accounts API ===
 
 @api_bp.route('/accounts', methods=['GET'])
@@ -212,10 +237,17 @@ def create_project():
 def get_project(project_id):
     """取得專案詳情（含所有 Rich Menu）"""
     try:
+        version = db.get_project_version(project_id)
+        if version is None:
+            return jsonify({'ok': False, 'message': '找不到專案'}), 404
+        etag = _etag('project', project_id, *version)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
         project = db.get_project(project_id)
         if not project:
             return jsonify({'ok': False, 'message': '找不到專案'}), 404
-        return jsonify({'ok': True, 'data': project})
+        return _with_etag(jsonify({'ok': True, 'data': project}), etag)
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
@@ -242,6 +274,41 @@ def delete_project(project_id):
 
 # === Rich Menus API ===
 
+def _lock_conflict_response(rich_menu_id):
+    """其他協作者持有編輯鎖時回傳 423；鎖的持有者以 X-Lock-Token 標頭通過"""
+    lock = collab.lock_conflict(None, rich_menu_id, token=request.headers.get('X-Lock-Token'))
+    if lock is None:
+        return None
+    return jsonify({
+        'ok': False,
+        'message': f'{lock["user_name"]} 正在編輯這個 Rich Menu',
+        'lock': lock
+    }), 423
+
+def _rich_menu_fields(data):
+    """將前端格式（name、alias、rich_menu_id、metadata）轉換為資料庫欄位"""
+    fields = {}
+    if 'name' in data:
+        fields['name'] = data['name']
+    if 'alias' in data:
+        fields['alias'] = data['alias']
+    # LINE Rich Menu ID (字串，如 "richmenu-xxx")
+    if 'rich_menu_id' in data:
+        fields['rich_menu_id'] = data['rich_menu_id']
+    
+    if 'metadata' in data:
+        meta = data['metadata']
+        if 'chatBarText' in meta:
+            fields['chat_bar_text'] = meta['chatBarText']
+        if 'size' in meta:
+            fields['size_width'] = meta['size']['width']
+            fields['size_height'] = meta['size']['height']
+        if 'selected' in meta:
+            fields['selected'] = meta['selected']
+        if 'areas' in meta:
+            fields['areas'] = meta['areas']
+    return fields
+
 @api_bp.route('/projects/<int:project_id>/richmenus', methods=['POST'])
 @apply_auth
 def create_richmenu(project_id):
@@ -264,12 +331,23 @@ def create_richmenu(project_id):
 @api_bp.route('/richmenus/<int:rich_menu_id>', methods=['GET'])
 @apply_auth
 def get_richmenu(rich_menu_id):
-    """取得 Rich Menu"""
+    """取得 Rich Menu
+
+    ETag 為「版本.背景欄位摘要」：縮圖、圖片處理狀態與 LINE ID 改變時重新下載，
+    但可直接當 PATCH 的 If-Match（只比對版本）。
+    """
     try:
+        state = db.get_rich_menu_etag_state(rich_menu_id)
+        if state is None:
+            return jsonify({'ok': False, 'message': '找不到 Rich Menu'}), 404
+        etag = f'{state[0]}.{_etag(*state[1:])[:8]}'
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
         rm = db.get_rich_menu(rich_menu_id)
         if not rm:
             return jsonify({'ok': False, 'message': '找不到 Rich Menu'}), 404
-        return jsonify({'ok': True, 'data': rm})
+        return _with_etag(jsonify({'ok': True, 'data': rm}), etag)
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
@@ -278,41 +356,150 @@ def get_richmenu(rich_menu_id):
 def update_richmenu(rich_menu_id):
     """更新 Rich Menu metadata"""
     try:
+        locked = _lock_conflict_response(rich_menu_id)
+        if locked:
+            return locked
         data = request.get_json()
         
-        # 將前端格式轉換為資料庫格式
-        update_data = {}
-        if 'name' in data:
-            update_data['name'] = data['name']
-        if 'alias' in data:
-            update_data['alias'] = data['alias']
-        # LINE Rich Menu ID (字串，如 "richmenu-xxx")
-        if 'rich_menu_id' in data:
-            update_data['rich_menu_id'] = data['rich_menu_id']
-        
-        if 'metadata' in data:
-            meta = data['metadata']
-            if 'chatBarText' in meta:
-                update_data['chat_bar_text'] = meta['chatBarText']
-            if 'size' in meta:
-                update_data['size_width'] = meta['size']['width']
-                update_data['size_height'] = meta['size']['height']
-            if 'selected' in meta:
-                update_data['selected'] = meta['selected']
-            if 'areas' in meta:
-                update_data['areas'] = meta['areas']
-        
-        db.update_rich_menu(rich_menu_id, **update_data)
-        return jsonify({'ok': True})
+        db.update_rich_menu(rich_menu_id, **_rich_menu_fields(data))
+        # 專案正在協作時，伺服器上的即時文件改以這次寫入為準
+        if 'name' in data or 'alias' in data or 'metadata' in data:
+            collab.refresh_rich_menu(rich_menu_id)
+        return jsonify({'ok': True, 'data': {'version': db.get_rich_menu_version(rich_menu_id)}})
     
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
+def _version_etag(version):
+    return f'"{version}"'
+
+def _parse_if_match(value):
+    """If-Match 標頭 → 版本；* 回傳 '*'，無法解析回傳 None
+
+    接受 PATCH 回傳的 "版本" 與 GET 回傳的 "版本.摘要"（摘要是背景欄位，不比對）。
+    """
+    value = value.strip()
+    if value == '*':
+        return '*'
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"').split('.')[0])
+    except ValueError:
+        return None
+
+def _check_rich_menu_document(document):
+    """PATCH 套用後的文件仍須是合法的 Rich Menu"""
+    if not isinstance(document, dict) or not isinstance(document.get('metadata'), dict):
+        raise ValueError('Rich Menu 必須包含 metadata 物件')
+    if not isinstance(document.get('name'), str) or not document['name'].strip():
+        raise ValueError('Rich Menu 名稱不能為空')
+    if not isinstance(document.get('alias') or '', str):
+        raise ValueError('alias 必須是字串')
+    meta = document['metadata']
+    size = meta.get('size')
+    if not isinstance(size, dict) or not all(
+            isinstance(size.get(key), int) and not isinstance(size.get(key), bool) and size[key] > 0
+            for key in ('width', 'height')):
+        raise ValueError('metadata.size 格式錯誤')
+    if not isinstance(meta.get('chatBarText', ''), str):
+        raise ValueError('metadata.chatBarText 必須是字串')
+    if not isinstance(meta.get('selected', True), bool):
+        raise ValueError('metadata.selected 必須是布林值')
+    areas = meta.get('areas', [])
+    if not isinstance(areas, list) or not all(isinstance(area, dict) for area in areas):
+        raise ValueError('metadata.areas 必須是物件陣列')
+
+def _fill_cleared_fields(document):
+    """被移除的選填欄位（merge-patch 的 null 或 remove 操作）寫回空值，而不是忽略"""
+    meta = document['metadata']
+    if 'selected' not in meta:
+        raise ValueError('metadata.selected 不能移除')
+    document.setdefault('alias', '')
+    document.setdefault('rich_menu_id', None)
+    meta.setdefault('chatBarText', '')
+    meta.setdefault('areas', [])
+
+@api_bp.route('/richmenus/<int:rich_menu_id>', methods=['PATCH'])
+@apply_auth
+def patch_richmenu(rich_menu_id):
+    """部分更新 Rich Menu，以 If-Match 版本做樂觀並行控制
+
+    Content-Type 為 application/json-patch+json（或內容是陣列）時套用 RFC 6902 操作，
+    其他（application/merge-patch+json、application/json）視為 RFC 7396 merge-patch。
+    文件格式同 GET 回傳的 name、alias、rich_menu_id、metadata，只寫入實際變動的欄位；
+    移除 alias、rich_menu_id、chatBarText、areas 代表清空，name、size、selected 不能移除。
+    If-Match 必填（可用 *）；版本不符回傳 412 與目前的版本。
+    """
+    try:
+        if_match = request.headers.get('If-Match')
+        if not if_match:
+            return jsonify({'ok': False, 'message': '需要 If-Match 版本'}), 428
+        locked = _lock_conflict_response(rich_menu_id)
+        if locked:
+            return locked
+        rm = db.get_rich_menu(rich_menu_id)
+        if not rm:
+            return jsonify({'ok': False, 'message': '找不到 Rich Menu'}), 404
+
+        expected = _parse_if_match(if_match)
+        if expected != '*' and expected != rm['version']:
+            return _version_conflict_response(rm['version'])
+
+        patch = request.get_json(force=True, silent=True)
+        if patch is None:
+            return jsonify({'ok': False, 'message': 'patch 內容必須是 JSON'}), 400
+        document = {key: rm[key] for key in ('name', 'alias', 'rich_menu_id', 'metadata')}
+        try:
+            if request.mimetype == 'application/json-patch+json' or isinstance(patch, list):
+                patched = json_patch.apply_patch(document, patch)
+            else:
+                patched = json_patch.apply_merge_patch(document, patch)
+            _check_rich_menu_document(patched)
+            _fill_cleared_fields(patched)
+        except json_patch.PatchConflict as e:
+            return jsonify({'ok': False, 'message': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'ok': False, 'message': str(e)}), 400
+
+        current = _rich_menu_fields(document)
+        changed = {
+            key: value for key, value in _rich_menu_fields(patched).items()
+            if current.get(key) != value
+        }
+        version = rm['version']
+        if changed:
+            version = db.update_rich_menu_if_version(rich_menu_id, changed, rm['version'])
+            if version is None:
+                # 讀取之後、寫入之前被別人更新
+                return _version_conflict_response(db.get_rich_menu_version(rich_menu_id))
+            collab.refresh_rich_menu(rich_menu_id)
+
+        response = jsonify({'ok': True, 'data': {'version': version, 'changed': sorted(changed)}})
+        response.headers['ETag'] = _version_etag(version)
+        return response
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
+def _version_conflict_response(version):
+    response = jsonify({
+        'ok': False,
+        'code': 'version_conflict',
+        'message': 'Rich Menu 已被其他人更新，請重新讀取',
+        'version': version
+    })
+    if version is not None:
+        response.headers['ETag'] = _version_etag(version)
+    return response, 412
+
 @api_bp.route('/richmenus/<int:rich_menu_id>', methods=['DELETE'])
 @apply_auth
 def delete_richmenu(rich_menu_id):
     """刪除本機 Rich Menu，以及它在 LINE 上擁有的版本與 Alias。"""
     try:
+        locked = _lock_conflict_response(rich_menu_id)
+        if locked:
+            return locked
         rm = db.get_rich_menu(rich_menu_id)
         if not rm:
             return jsonify({'ok': False, 'message': '找不到 Rich Menu'}), 404
@@ -348,127 +535,355 @@ def _delete_owned_line_rich_menu(token, remote_rich_menu_id, alias_id):
     if not remote_rich_menu_id:
         return result
 
-    headers = {'Authorization': f'Bearer {token}'}
-    alias_id = (alias_id or '').strip()
-    if alias_id:
-        encoded_alias = quote(alias_id, safe='')
-        alias_response = requests.get(
-            f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{encoded_alias}',
-            headers=headers,
-            timeout=30
-        )
-        if alias_response.status_code == 200:
-            alias_target = alias_response.json().get('richMenuId')
-            if alias_target == remote_rich_menu_id:
-                delete_alias_response = requests.delete(
-                    f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{encoded_alias}',
-                    headers=headers,
-                    timeout=30
-                )
-                if delete_alias_response.status_code not in (200, 404):
-                    raise ValueError(
-                        f'刪除 LINE Alias「{alias_id}」失敗 '
-                        f'({delete_alias_response.status_code}): '
-                        f'{delete_alias_response.text[:200]}'
+    try:
+        headers = {'Authorization': f'Bearer {token}'}
+        alias_id = (alias_id or '').strip()
+        if alias_id:
+            encoded_alias = quote(alias_id, safe='')
+            alias_response = requests.get(
+                f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{encoded_alias}',
+                headers=headers,
+                timeout=30
+            )
+            if alias_response.status_code == 200:
+                alias_target = alias_response.json().get('richMenuId')
+                if alias_target == remote_rich_menu_id:
+                    delete_alias_response = requests.delete(
+                        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{encoded_alias}',
+                        headers=headers,
+                        timeout=30
                     )
+                    if delete_alias_response.status_code not in (200, 404):
+                        raise ValueError(
+                            f'刪除 LINE Alias「{alias_id}」失敗 '
+                            f'({delete_alias_response.status_code}): '
+                            f'{delete_alias_response.text[:200]}'
+                        )
+                    result['alias_deleted'] = True
+                else:
+                    # Alias 已切到其他版本，不能因刪除舊紀錄而誤刪。
+                    result['alias_preserved'] = True
+            elif alias_response.status_code == 404:
+                # 遠端已不存在；視同完成，並一併清掉可能殘留的本機 Alias 紀錄。
                 result['alias_deleted'] = True
             else:
-                # Alias 已切到其他版本，不能因刪除舊紀錄而誤刪。
-                result['alias_preserved'] = True
-        elif alias_response.status_code == 404:
-            # 遠端已不存在；視同完成，並一併清掉可能殘留的本機 Alias 紀錄。
-            result['alias_deleted'] = True
+                raise ValueError(
+                    f'查詢 LINE Alias「{alias_id}」失敗 '
+                    f'({alias_response.status_code}): {alias_response.text[:200]}'
+                )
+
+        delete_response = requests.delete(
+            f'{config.LINE_API_BASE}/v2/bot/richmenu/{quote(remote_rich_menu_id, safe="")}',
+            headers=headers,
+            timeout=30
+        )
+        if delete_response.status_code == 404:
+            result['remote_missing'] = True
+        elif delete_response.status_code == 200:
+            result['remote_deleted'] = True
         else:
             raise ValueError(
-                f'查詢 LINE Alias「{alias_id}」失敗 '
-                f'({alias_response.status_code}): {alias_response.text[:200]}'
+                f'刪除 LINE Rich Menu 失敗 ({delete_response.status_code}): '
+                f'{delete_response.text[:200]}'
             )
-
-    delete_response = requests.delete(
-        f'{config.LINE_API_BASE}/v2/bot/richmenu/{quote(remote_rich_menu_id, safe="")}',
-        headers=headers,
-        timeout=30
-    )
-    if delete_response.status_code == 404:
-        result['remote_missing'] = True
-    elif delete_response.status_code == 200:
-        result['remote_deleted'] = True
-    else:
-        raise ValueError(
-            f'刪除 LINE Rich Menu 失敗 ({delete_response.status_code}): '
-            f'{delete_response.text[:200]}'
-        )
+    finally:
+        # 刪除 Alias 或選單後（逾時也可能已刪除），排程預覽快取的遠端狀態已過期
+        from scheduler import invalidate_remote_state
+        invalidate_remote_state(token)
     return result
 
+@api_bp.route('/projects/<int:project_id>/snapshot', methods=['PUT'])
+@apply_auth
+def save_project_snapshot(project_id):
+    """以整份專案狀態儲存專案與所有 Rich Menu
+
+    Body: {name, description, rich_menus: [{id, name, alias, rich_menu_id, metadata}]}
+    id 為數字者更新既有的 Rich Menu（只寫入有變動的欄位），其他（前端暫時 ID）新增，
+    資料庫中有但不在清單內的刪除（含 LINE 上擁有的版本與 Alias）。資料庫的變更在同一個
+    交易內完成，回傳暫時 ID → 新 ID 的對照；圖片仍由 /richmenus/<id>/upload 上傳。
+    """
+    try:
+        data = request.get_json() or {}
+        project = db.get_project(project_id)
+        if not project:
+            return jsonify({'ok': False, 'message': '找不到專案'}), 404
+        items = data.get('rich_menus')
+        if not isinstance(items, list):
+            return jsonify({'ok': False, 'message': 'rich_menus 必須是陣列'}), 400
+
+        existing = {rm['id']: rm for rm in project['rich_menus']}
+        submitted = set()
+        creates = []
+        temp_ids = []
+        updates = []
+        for item in items:
+            if not isinstance(item, dict):
+                return jsonify({'ok': False, 'message': 'Rich Menu 格式錯誤'}), 400
+            item_id = item.get('id')
+            if isinstance(item_id, int) and not isinstance(item_id, bool):
+                if item_id not in existing:
+                    return jsonify({'ok': False, 'message': f'Rich Menu {item_id} 不屬於此專案'}), 400
+                submitted.add(item_id)
+                current = _rich_menu_fields(existing[item_id])
+                changed = {
+                    key: value for key, value in _rich_menu_fields(item).items()
+                    if current.get(key) != value
+                }
+                if changed:
+                    updates.append((item_id, changed))
+                continue
+            name = (item.get('name') or '').strip()
+            if not name:
+                return jsonify({'ok': False, 'message': 'Rich Menu 名稱不能為空'}), 400
+            creates.append((name, (item.get('alias') or '').strip(), item.get('metadata')))
+            temp_ids.append(str(item_id))
+        removed = [rm for rm_id, rm in existing.items() if rm_id not in submitted]
+
+        for rm_id in [rm_id for rm_id, _ in updates] + [rm['id'] for rm in removed]:
+            locked = _lock_conflict_response(rm_id)
+            if locked:
+                return locked
+
+        # LINE 上的版本與 Alias 無法放進交易，先清理；失敗的留在資料庫，下次儲存再刪
+        deletes = []
+        failed = []
+        account = db.get_account(project['account_id']) if removed else None
+        for rm in removed:
+            try:
+                if rm.get('rich_menu_id') and not account:
+                    raise ValueError('找不到專案所屬帳號')
+                remote_result = _delete_owned_line_rich_menu(
+                    account['channel_access_token'] if account else None,
+                    rm.get('rich_menu_id'),
+                    rm.get('alias')
+                )
+            except Exception as e:
+                failed.append({'id': rm['id'], 'message': str(e)})
+                continue
+            if remote_result['alias_deleted'] and rm.get('alias'):
+                db.delete_alias(account['id'], rm['alias'])
+            deletes.append(rm['id'])
+
+        project_fields = {
+            key: data[key] for key in ('name', 'description')
+            if data.get(key) is not None and data[key] != project[key]
+        }
+        new_ids = db.apply_project_snapshot(project_id, project_fields, creates, updates, deletes)
+        # 專案正在協作時，伺服器上的即時文件改以這次寫入為準
+        for rm_id, _ in updates:
+            collab.refresh_rich_menu(rm_id)
+
+        return jsonify({'ok': True, 'data': {
+            'created': dict(zip(temp_ids, new_ids)),
+            'updated': [rm_id for rm_id, _ in updates],
+            'deleted': deletes,
+            'failed': failed
+        }})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
 @api_bp.route('/richmenus/<int:rich_menu_id>/upload', methods=['POST'])
 @apply_auth
 def upload_richmenu_image(rich_menu_id):
-    """上傳圖片（保存原圖 + 生成縮圖）"""
+    """上傳圖片（保存原圖，縮圖等衍生檔於背景產生）"""
     try:
-        if 'image' not in request.files:
-            return jsonify({'ok': False, 'message': '沒有上傳圖片'}), 400
-        
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'ok': False, 'message': '檔案名稱為空'}), 400
-        
-        # 檢查檔案類型
-        if not allowed_file(file.filename):
-            return jsonify({'ok': False, 'message': '只接受 PNG 或 JPEG 格式'}), 400
-        
-        # 讀取圖片
-        image_data = file.read()
-        image = Image.open(BytesIO(image_data))
+        locked = _lock_conflict_response(rich_menu_id)
+        if locked:
+            return locked
         
-        # 驗證尺寸（2500x1686 或 2500x843 或 1200x810）
-        valid_sizes = [(2500, 1686), (2500, 843), (1200, 810)]
-        if image.size not in valid_sizes:
+        # 還沒讀 body 之前先看 Content-Length，超過最大尺寸上限就不必收下整個檔案
+        upload_limit = max(config.RICHMENU_IMAGE_MAX_BYTES.values()) + 64 * 1024
+        if request.content_length and request.content_length > upload_limit:
             return jsonify({
                 'ok': False,
-                'message': f'圖片尺寸必須為 2500x1686、2500x843 或 1200x810，目前是 {image.size[0]}x{image.size[1]}'
-            }), 400
-        
-        # 每次上傳使用唯一檔名，避免替換圖片後瀏覽器仍顯示舊快取。
-        safe_original = secure_filename(file.filename)
-        extension = os.path.splitext(safe_original)[1].lower()
-        filename = f'rm_{rich_menu_id}_{uuid.uuid4().hex[:12]}{extension}'
-        filepath = os.path.join(config.UPLOAD_FOLDER, filename)
-        with open(filepath, 'wb') as f:
-            f.write(image_data)
-        
-        # 生成縮圖（400x266 or 400x225）
-        thumb_width = 400
-        thumb_height = int(thumb_width * image.size[1] / image.size[0])
-        thumbnail = image.copy()
-        thumbnail.thumbnail((thumb_width, thumb_height), Image.Resampling.LANCZOS)
-        
-        thumb_filename = f'thumb_{filename}'
-        thumb_filepath = os.path.join(config.UPLOAD_FOLDER, thumb_filename)
-        thumbnail.save(thumb_filepath)
-        
-        # 更新資料庫
-        db.update_rich_menu(rich_menu_id, image_path=filename, thumbnail_path=thumb_filename)
+                'message': f'圖片不可超過 {upload_limit // (1024 * 1024)} MB'
+            }), 413
+        
+        # 不用 request.files（會先收下整個 body）：直接讀請求串流，讀到檔頭就驗證
+        # 格式與尺寸（2500x1686、2500x843 或 1200x810），寫入時超過該尺寸的上限即中止。
+        # 完整解碼留給背景處理。
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({'ok': False, 'message': '沒有上傳圖片'}), 400
+        upload = image_pipeline.MultipartUpload(request.stream, boundary)
+        try:
+            client_filename = upload.open('image')
+            if client_filename is None:
+                return jsonify({'ok': False, 'message': '沒有上傳圖片'}), 400
+            if client_filename == '':
+                return jsonify({'ok': False, 'message': '檔案名稱為空'}), 400
+            
+            # 檢查檔案類型
+            if not allowed_file(client_filename):
+                return jsonify({'ok': False, 'message': '只接受 PNG 或 JPEG 格式'}), 400
+            
+            image_format, (width, height) = upload.probe()
+            
+            # 每次上傳使用唯一檔名，避免替換圖片後瀏覽器仍顯示舊快取。
+            # 副檔名依實際格式決定，避免 .png 檔名裝 JPEG 內容
+            extension = '.png' if image_format == 'PNG' else '.jpg'
+            filename = f'rm_{rich_menu_id}_{uuid.uuid4().hex[:12]}{extension}'
+            filepath = upload_paths.path_for(filename, create=True)
+            size_bytes, content_hash = upload.save(filepath)
+        except ValueError as e:
+            return jsonify({'ok': False, 'message': str(e)}), 400
+        
+        # 先保存原圖即回應；縮圖與 LINE 用 JPEG 由背景行程產生，完成後以
+        # Socket.IO richmenu:image_ready 通知。
+        db.record_image(
+            rich_menu_id, filename,
+            content_type='image/png' if image_format == 'PNG' else 'image/jpeg',
+            size_bytes=size_bytes, width=width, height=height,
+            image_format=image_format, content_hash=content_hash
+        )
+        db.update_rich_menu(rich_menu_id, image_path=filename, thumbnail_path=None)
+        image_pipeline.submit(rich_menu_id, filename)
+        rm = db.get_rich_menu(rich_menu_id) or {}
         
         return jsonify({
             'ok': True,
             'data': {
                 'image_path': filename,
-                'thumbnail_path': thumb_filename
+                'thumbnail_path': rm.get('thumbnail_path'),
+                'image_status': rm.get('image_status')
             }
         })
     
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
+# 檔名含上傳時產生的 uuid（rm_<id>_<uuid12>、broadcast_<id>_<uuid32>_ 及其衍生檔），
+# 內容永遠不會改變，可讓瀏覽器長期快取而不必重新驗證。
+UNIQUE_UPLOAD_NAME = re.compile(r'_[0-9a-f]{12}(?:[0-9a-f]{20})?[._]')
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+# 內容雜湊 ETag 快取：以 (路徑, mtime, 大小) 為鍵，檔案沒變就不必重新計算
+_upload_etags = OrderedDict()
+UPLOAD_ETAG_CACHE_SIZE = 4096
+
+def _upload_etag(filepath, stat):
+    key = (filepath, stat.st_mtime_ns, stat.st_size)
+    etag = _upload_etags.get(key)
+    if etag is not None:
+        _upload_etags.move_to_end(key)
+        return etag
+
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()[:32]
+    _upload_etags[key] = etag
+    if len(_upload_etags) > UPLOAD_ETAG_CACHE_SIZE:
+        _upload_etags.popitem(last=False)
+    return etag
+
+def _send_upload(filepath, mimetype=None, immutable=False, etag=None):
+    """以內容雜湊 ETag 回傳上傳檔案，支援 304 與 Range；可交給 NGINX X-Accel-Redirect
+
+    etag 取自 images 表時不必讀檔計算；未提供時以檔案內容雜湊計算。
+    """
+    etag = etag or _upload_etag(filepath, os.stat(filepath))
+    mimetype = mimetype or mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+
+    if config.UPLOADS_X_ACCEL_PREFIX:
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            relative_path = os.path.relpath(filepath, config.UPLOAD_FOLDER).replace(os.sep, '/')
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = (
+                f'{config.UPLOADS_X_ACCEL_PREFIX.rstrip("/")}/{quote(relative_path)}'
+            )
+        response.set_etag(etag)
+    else:
+        response = send_file(filepath, mimetype=mimetype, etag=etag, conditional=True)
+
+    response.headers['Cache-Control'] = (
+        IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    )
+    response.headers.pop('Expires', None)
+    return response
+
 @api_bp.route('/uploads/<filename>', methods=['GET'])
 @apply_auth
 def get_upload(filename):
-    """取得上傳的圖片"""
+    """取得上傳的圖片
+
+    ?w=<px> 會回傳不小於該寬度的最小預覽版本（依 Accept 選 WebP 或 PNG），
+    尚未產生或要求寬度超過預覽版本時回傳原圖。
+    uuid 檔名的檔案回傳 immutable 快取標頭，其餘以 ETag 重新驗證。
+    """
     try:
-        filepath = os.path.join(config.UPLOAD_FOLDER, secure_filename(filename))
-        if not os.path.exists(filepath):
+        safe_name = secure_filename(filename)
+        if not safe_name:
+            return jsonify({'ok': False, 'message': '檔案不存在'}), 404
+        immutable = bool(UNIQUE_UPLOAD_NAME.search(safe_name))
+        requested_width = request.args.get('w', type=int)
+        accept_webp = request.accept_mimetypes['image/webp'] > 0
+
+        # Rich Menu 原圖：路徑、MIME、ETag 與預覽版本都從 images 表取得
+        image = db.get_image(safe_name) if safe_name.startswith('rm_') else None
+        if image:
+            filepath = upload_paths.path_for(safe_name)
+            original_etag = (image['content_hash'] or '')[:32] or None
+            if not requested_width:
+                return _send_upload(filepath, image['content_type'], immutable, original_etag)
+            rendition = image_pipeline.select_rendition(
+                image['renditions'], requested_width, accept_webp
+            )
+            if rendition:
+                response = _send_upload(
+                    upload_paths.path_for(rendition['name']),
+                    'image/webp' if accept_webp else 'image/png',
+                    immutable, rendition['content_hash'][:32]
+                )
+            else:
+                # 比所有預覽版本都寬，或預覽版本還沒產生：以原圖回應，處理中時不可長期快取
+                processed = image['line_jpeg_path'] is not None
+                response = _send_upload(filepath, image['content_type'],
+                                        immutable and processed, original_etag)
+            response.vary.add('Accept')
+            return response
+
+        # 沒有 images 紀錄的舊檔與其他上傳檔：查檔案系統
+        filepath = upload_paths.resolve(safe_name)
+        if not filepath:
             return jsonify({'ok': False, 'message': '檔案不存在'}), 404
-        return send_file(filepath, max_age=0)
+
+        if not requested_width:
+            return _send_upload(filepath, immutable=immutable)
+
+        rendition = image_pipeline.pick_rendition(
+            config.UPLOAD_FOLDER, safe_name, requested_width, accept_webp
+        )
+        if rendition:
+            mimetype = 'image/webp' if rendition.endswith('.webp') else 'image/png'
+            response = _send_upload(rendition, mimetype, immutable)
+        else:
+            # 預覽版本可能只是還沒產生，暫以原圖回應但不可長期快取
+            response = _send_upload(filepath)
+        response.vary.add('Accept')
+        return response
+    except FileNotFoundError:
+        return jsonify({'ok': False, 'message': '檔案不存在'}), 404
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
+@api_bp.route('/uploads/gc', methods=['POST'])
+@apply_auth
+def collect_orphaned_uploads():
+    """清理沒有被引用的上傳檔；預設 dry_run 只回報，{"dry_run": false} 才刪除"""
+    try:
+        import upload_gc
+        data = request.get_json(silent=True) or {}
+        grace_hours = data.get('grace_hours')
+        report = upload_gc.collect(
+            dry_run=data.get('dry_run', True) is not False,
+            grace_seconds=None if grace_hours is None else float(grace_hours) * 3600
+        )
+        return jsonify({'ok': True, 'data': report})
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
@@ -525,8 +940,12 @@ def delete_alias(account_id, alias_id):
 def list_flex_messages():
     """列出所有 Flex Messages"""
     try:
+        etag = _etag('flex-messages', *db.get_flex_messages_version())
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
         msgs = db.list_flex_messages()
-        return jsonify({'ok': True, 'data': msgs})
+        return _with_etag(jsonify({'ok': True, 'data': msgs}), etag)
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
@@ -558,10 +977,17 @@ def create_flex_message():
 def get_flex_message(flex_id):
     """取得 Flex Message (內部用)"""
     try:
+        version = db.get_flex_message_version(flex_id)
+        if version is None:
+            return jsonify({'ok': False, 'message': '找不到 Flex Message'}), 404
+        etag = _etag('flex-message', flex_id, version)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
         msg = db.get_flex_message(flex_id)
         if not msg:
             return jsonify({'ok': False, 'message': '找不到 Flex Message'}), 404
-        return jsonify({'ok': True, 'data': msg})
+        return _with_etag(jsonify({'ok': True, 'data': msg}), etag)
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
@@ -600,15 +1026,22 @@ def delete_flex_message(flex_id):
 def get_flex_message_public(flex_id):
     """取得 Flex Message (給外部 Bot 呼叫用)"""
     try:
+        version = db.get_flex_message_version(flex_id)
+        if version is None:
+            return jsonify({'ok': False, 'message': 'Not Found'}), 404
+        etag = _etag('public-flex-message', flex_id, version)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
         msg = db.get_flex_message(flex_id)
         if not msg:
             return jsonify({'ok': False, 'message': 'Not Found'}), 404
         
         # Return both name and contents
-        return jsonify({
+        return _with_etag(jsonify({
             'name': msg['name'],
             'contents': msg['json_content']
-        })
+        }), etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -619,8 +1052,12 @@ def get_flex_message_public(flex_id):
 def list_schedules(project_id):
     """列出該專案的所有排程"""
     try:
+        etag = _etag('schedules', project_id, *db.get_scheduled_jobs_version(project_id))
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
         jobs = db.list_scheduled_jobs_by_project(project_id)
-        return jsonify({'ok': True, 'data': jobs})
+        return _with_etag(jsonify({'ok': True, 'data': jobs}), etag)
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
@@ -688,6 +1125,49 @@ def delete_schedule(job_id):
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
+@api_bp.route('/schedules/<int:job_id>/plan', methods=['GET'])
+@apply_auth
+def plan_schedule(job_id):
+    """預覽排程發佈會做的變更（不寫入 LINE）"""
+    try:
+        from scheduler import plan_job
+        job = db.get_scheduled_job(job_id)
+        if not job:
+            return jsonify({'ok': False, 'message': '找不到排程'}), 404
+        refresh = request.args.get('refresh', '0') == '1'
+        try:
+            plan = plan_job(job, use_cache=not refresh)
+        except ValueError as e:
+            return jsonify({'ok': False, 'message': str(e)}), 400
+        return jsonify({'ok': True, 'data': plan})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
+@api_bp.route('/projects/<int:project_id>/publish-plan', methods=['POST'])
+@apply_auth
+def plan_project_publish(project_id):
+    """以尚未儲存的發佈設定預覽變更，欄位與排程相同"""
+    try:
+        from scheduler import plan_job
+        data = request.get_json() or {}
+        job = {
+            'id': None,
+            'project_id': project_id,
+            'scope': data.get('scope', 'all'),
+            'current_tab_index': data.get('current_tab_index', 0),
+            'publish_target': data.get('publish_target', 'all'),
+            'user_ids': data.get('user_ids'),
+            'default_menu_index': data.get('default_menu_index', -1)
+        }
+        refresh = request.args.get('refresh', '0') == '1'
+        try:
+            plan = plan_job(job, use_cache=not refresh)
+        except ValueError as e:
+            return jsonify({'ok': False, 'message': str(e)}), 400
+        return jsonify({'ok': True, 'data': plan})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
 @api_bp.route('/schedules/<int:job_id>/run-now', methods=['POST'])
 @apply_auth
 def run_schedule_now(job_id):
@@ -699,6 +1179,66 @@ def run_schedule_now(job_id):
     except Exception as e:
         return jsonify({'ok': False, 'message': str(e)}), 500
 
+@api_bp.route('/scheduler/status', methods=['GET'])
+@apply_auth
+def scheduler_status():
+    """排程 leader lease 狀態（多 worker 部署時確認由哪個行程執行排程）"""
+    try:
+        from scheduler import get_leader_status
+        return jsonify({'ok': True, 'data': get_leader_status()})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
+@api_bp.route('/collab/stats', methods=['GET'])
+@apply_auth
+def collab_stats():
+    """多人協作統計（游標合併省下的訊息數等），本行程的數據"""
+    try:
+        return jsonify({'ok': True, 'data': collab.get_stats()})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
+@api_bp.route('/schedules/<int:job_id>/runs', methods=['GET'])
+@apply_auth
+def list_schedule_runs(job_id):
+    """列出排程的執行紀錄（新到舊）"""
+    try:
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        runs = db.list_scheduled_job_runs(
+            job_id=job_id, status=request.args.get('status'), limit=limit
+        )
+        return jsonify({'ok': True, 'data': runs})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
+@api_bp.route('/projects/<int:project_id>/schedule-runs', methods=['GET'])
+@apply_auth
+def list_project_schedule_runs(project_id):
+    """列出專案所有排程的執行紀錄（新到舊）"""
+    try:
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        runs = db.list_scheduled_job_runs(
+            project_id=project_id, status=request.args.get('status'), limit=limit
+        )
+        return jsonify({'ok': True, 'data': runs})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
+@api_bp.route('/projects/<int:project_id>/schedule-runs/stats', methods=['GET'])
+@apply_auth
+def project_schedule_run_stats(project_id):
+    """專案排程執行的延遲百分位數（p50/p90/p95/p99）與成功率；?days= 限定最近天數"""
+    try:
+        from scheduler import _taipei_now
+        days = request.args.get('days', type=int)
+        since = None
+        if days:
+            since = (_taipei_now() - timedelta(days=days)).isoformat()
+        stats = db.get_scheduled_job_run_stats(project_id, since=since)
+        return jsonify({'ok': True, 'data': stats})
+    except Exception as e:
+        return jsonify({'ok': False, 'message': str(e)}), 500
+
 # === Broadcast Events API ===
 
 @api_bp.route('/broadcast-events', methods=['GET'])
@@ -786,19 +1326,11 @@ def delete_broadcast_event(event_id):
         return jsonify({'ok': False, 'message': str(e)}), 500
 
 def _delete_broadcast_event_attachments(event):
-    """刪除事件所保存的附件；僅允許刪除該事件命名空間內的檔案。"""
-    event_id = event.get('id')
-    expected_prefix = f'broadcast_{event_id}_'
-    for stored_name in os.listdir(config.UPLOAD_FOLDER):
-        if not stored_name.startswith(expected_prefix):
-            continue
-        filepath = os.path.join(config.UPLOAD_FOLDER, stored_name)
-        try:
-            if os.path.isfile(filepath):
-                os.remove(filepath)
-        except OSError as exc:
-            # 不因單一附件清理失敗而留下無法刪除的事件；記錄供管理員追查。
-            print(f'刪除群發附件失敗 {stored_name}: {exc}')
+    """刪除事件所保存的附件；每個事件的附件都在自己的目錄，不必列出整個上傳資料夾。
+
+    尚未搬移到分層目錄的舊附件會由 upload_gc 在事件刪除後清掉。
+    """
+    upload_paths.delete_broadcast_attachments(event.get('id'))
 
 @api_bp.route('/broadcast-events/<int:event_id>/contacts', methods=['POST'])
 @apply_auth
@@ -836,7 +1368,7 @@ def upload_broadcast_event_attachment(event_id):
         message_type = request.form.get('message_type', 'file')
         message_index = request.form.get('message_index', type=int)
         stored_name = f'broadcast_{event_id}_{uuid.uuid4().hex}_{safe_name}'
-        filepath = os.path.join(config.UPLOAD_FOLDER, stored_name)
+        filepath = upload_paths.path_for(stored_name, create=True)
 
         file.save(filepath)
         size = os.path.getsize(filepath)
@@ -7,6 +7,8 @@ eventlet.monkey_patch()
 
 import config
 import db
+import collab
+import collab_wire
 from api_routes import api_bp
 from line_proxy import line_proxy_bp
 from webhook import webhook_bp
@@ -18,9 +20,12 @@ app.config['SECRET_KEY'] = config.SECRET_KEY
 app.config['MAX_CONTENT_LENGTH'] = config.MAX_CONTENT_LENGTH
 
 # 初始化 Socket.IO（使用 eventlet）
+# 設定 SOCKETIO_MESSAGE_QUEUE（例如 redis://localhost:6379/0）後，各 worker 的廣播
+# 經由訊息佇列轉送，可同時執行多個 worker
 socketio = SocketIO(
     app,
     cors_allowed_origins=config.SOCKETIO_CORS_ALLOWED_ORIGINS,
+    message_queue=config.SOCKETIO_MESSAGE_QUEUE,
     async_mode='eventlet'
 )
 
@@ -33,8 +38,8 @@ app.register_blueprint(webhook_bp)
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Headers'] = 'Origin, X-Requested-With, Content-Type, Accept, Authorization, X-Line-User-Id'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Origin, X-Requested-With, Content-Type, Accept, Authorization, X-Line-User-Id, If-Match, If-None-Match'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, DELETE, OPTIONS'
     return response
 
 # === 路由 ===
@@ -57,8 +62,37 @@ def privacy_line_broadcast_console():
 
 # === Socket.IO 事件 ===
 
-# 儲存每個房間（專案）的線上使用者
-online_users = {}  # {project_id: {sid: {user_id, user_name, color, rich_menu_id}}}
+# 每個房間（專案）的線上使用者存放在 collab.presence（含 sid → 房間 的反向索引；
+# 多 worker 模式時為共用資料庫），編輯鎖存放在 collab.locks，由檔案末的 collab.init 決定實作
+
+def _release_locks(sid, project_id=None, reason='disconnected'):
+    """釋放連線持有的編輯鎖並通知房間"""
+    for lock in collab.locks.release_sid(sid, project_id):
+        emit('richmenu:unlocked', {**collab.public_lock(lock), 'reason': reason},
+             room=lock['project_id'])
+
+def _emit_collab(event, payload, compact_event, compact_payload, project_id):
+    """高頻協作事件：JSON 與 msgpack 客戶端的子房間各送一次（略過送出者）"""
+    emit(event, payload, room=collab_wire.room(project_id, collab_wire.JSON), skip_sid=request.sid)
+    emit(compact_event, compact_payload,
+         room=collab_wire.room(project_id, collab_wire.MSGPACK), skip_sid=request.sid)
+
+def _short_id(project_id):
+    """送出者在房間內的 short_id；不在房間回傳 None"""
+    info = collab.presence.member(project_id, request.sid)
+    return info['short_id'] if info else None
+
+def _locked_ack(project_id, rich_menu_id):
+    """別人持有編輯鎖時拒絕寫入，回傳給送出者的確認；沒有衝突回傳 None"""
+    lock = collab.lock_conflict(project_id, rich_menu_id, sid=request.sid)
+    if lock is None:
+        return None
+    return {
+        'ok': False,
+        'code': 'locked',
+        'message': f'{lock["user_name"]} 正在編輯這個 Rich Menu',
+        'lock': lock
+    }
 
 @socketio.on('connect')
 def handle_connect():
@@ -70,57 +104,53 @@ def handle_connect():
 def handle_disconnect():
     """客戶端斷線"""
     print(f'Client disconnected: {request.sid}')
+    _release_locks(request.sid)
     
-    # 從所有房間移除該使用者
-    for project_id in list(online_users.keys()):
-        if request.sid in online_users[project_id]:
-            user_info = online_users[project_id][request.sid]
-            del online_users[project_id][request.sid]
-            
-            # 廣播使用者離開
-            emit('user:left', {
-                'user_id': user_info['user_id'],
-                'user_name': user_info['user_name']
-            }, room=project_id)
-            
-            # 如果房間已空，清理
-            if not online_users[project_id]:
-                del online_users[project_id]
+    # 只處理該使用者加入過的房間
+    for project_id, user_info in collab.presence.leave_all(request.sid):
+        if collab.cursors:
+            collab.cursors.discard(project_id, user_info['user_id'])
+        if not collab.presence.room_size(project_id):
+            collab.release_project(project_id)
+        
+        # 廣播使用者離開
+        emit('user:left', {
+            'user_id': user_info['user_id'],
+            'user_name': user_info['user_name'],
+            'short_id': user_info['short_id']
+        }, room=project_id)
 
 @socketio.on('join_project')
 def handle_join_project(data):
-    """加入專案房間"""
+    """加入專案房間
+
+    wire='msgpack' 的客戶端改收精簡格式的游標、區域操作與標籤事件（見 collab_wire）；
+    回傳值給送出者：實際採用的格式與自己在房間內的 short_id。
+    """
     project_id = str(data.get('project_id'))
     user_id = data.get('user_id', request.sid)
     user_name = data.get('user_name', 'Anonymous')
     color = data.get('color', '#02a568')
+    wire = collab_wire.negotiate(data.get('wire'))
     
-    # 加入 Socket.IO 房間
+    # 加入 Socket.IO 房間，以及依傳輸格式分的子房間
     join_room(project_id)
+    join_room(collab_wire.room(project_id, wire))
     
     # 記錄使用者資訊
-    if project_id not in online_users:
-        online_users[project_id] = {}
-    online_users[project_id][request.sid] = {
-        'user_id': user_id,
-        'user_name': user_name,
-        'color': color,
-        'rich_menu_id': None  # 初始尚未選擇任何標籤
-    }
+    others = collab.presence.join(project_id, request.sid, user_id, user_name, color)
+    short_id = _short_id(project_id)
     
     # 廣播使用者加入
     emit('user:joined', {
         'user_id': user_id,
         'user_name': user_name,
-        'color': color
+        'color': color,
+        'short_id': short_id
     }, room=project_id, skip_sid=request.sid)
     
     # 回傳當前房間的所有使用者及其標籤狀態
-    users_list = [
-        {**info, 'sid': sid}
-        for sid, info in online_users[project_id].items()
-        if sid != request.sid
-    ]
+    users_list = [{**info, 'sid': sid} for sid, info in others.items()]
     emit('users:list', {'users': users_list})
     
     # 發送現有用戶的標籤狀態給新加入的用戶
@@ -131,13 +161,21 @@ def handle_join_project(data):
             'color': info['color'],
             'rich_menu_id': info['rich_menu_id']
         }
-        for sid, info in online_users[project_id].items()
-        if sid != request.sid and info.get('rich_menu_id') is not None
+        for info in others.values()
+        if info.get('rich_menu_id') is not None
     ]
     if active_tabs:
         emit('tabs:initial_state', {'active_tabs': active_tabs})
     
+    # 伺服器上正在編輯中的 Rich Menu 最新內容與區域版本（未列出的以資料庫為準，版本為 0）
+    # 及目前有效的編輯鎖
+    emit('richmenu:snapshot', {
+        'menus': collab.documents.project_snapshot(project_id),
+        'locks': [collab.public_lock(lock) for lock in collab.locks.project_locks(project_id)]
+    })
+    
     print(f'User {user_name} joined project {project_id}')
+    return {'ok': True, 'wire': wire, 'short_id': short_id}
 
 @socketio.on('leave_project')
 def handle_leave_project(data):
@@ -146,54 +184,128 @@ def handle_leave_project(data):
     
     # 離開 Socket.IO 房間
     leave_room(project_id)
+    for wire in collab_wire.WIRES:
+        leave_room(collab_wire.room(project_id, wire))
     
     # 移除使用者記錄
-    if project_id in online_users and request.sid in online_users[project_id]:
-        user_info = online_users[project_id][request.sid]
-        del online_users[project_id][request.sid]
+    _release_locks(request.sid, project_id, 'left')
+    user_info = collab.presence.leave(project_id, request.sid)
+    if user_info:
+        if collab.cursors:
+            collab.cursors.discard(project_id, user_info['user_id'])
+        if not collab.presence.room_size(project_id):
+            collab.release_project(project_id)
         
         # 廣播使用者離開
         emit('user:left', {
             'user_id': user_info['user_id'],
-            'user_name': user_info['user_name']
+            'user_name': user_info['user_name'],
+            'short_id': user_info['short_id']
         }, room=project_id)
         
-        # 清理空房間
-        if not online_users[project_id]:
-            del online_users[project_id]
-        
         print(f'User {user_info["user_name"]} left project {project_id}')
 
 # === Rich Menu 編輯同步事件 ===
 
+@socketio.on('richmenu:area_op')
+def handle_richmenu_area_op(data):
+    """單一區域的操作（新增、移動/縮放、更新 action、刪除）
+
+    伺服器驗證並排序後只轉送該操作；回傳值是給送出者的確認（含新版本），
+    失敗時附上 snapshot 讓客戶端重新同步。
+    """
+    project_id = str(data.get('project_id'))
+    rich_menu_id = data.get('rich_menu_id')
+    sender = data.get('sender', request.sid)
+    
+    locked = _locked_ack(project_id, rich_menu_id)
+    if locked:
+        return locked
+    
+    try:
+        version, op = collab.documents.apply(
+            project_id, rich_menu_id, data.get('op'), data.get('base_version')
+        )
+    except collab.AreaOpError as e:
+        snapshot = None
+        if e.code == 'stale':
+            snapshot = collab.documents.snapshot(project_id, rich_menu_id)
+        return {'ok': False, 'code': e.code, 'message': str(e), 'snapshot': snapshot}
+    
+    _emit_collab('richmenu:area_op', {
+        'rich_menu_id': rich_menu_id,
+        'version': version,
+        'op': op,
+        'sender': sender
+    }, 'c:area_op', collab_wire.encode_area_op(rich_menu_id, version, _short_id(project_id), op),
+        project_id)
+    return {'ok': True, 'version': version, 'op': op}
+
+@socketio.on('richmenu:resync')
+def handle_richmenu_resync(data):
+    """落後的客戶端取回某個 Rich Menu 的區域與版本"""
+    project_id = str(data.get('project_id'))
+    try:
+        return {'ok': True, 'snapshot': collab.documents.snapshot(project_id, data.get('rich_menu_id'))}
+    except collab.AreaOpError as e:
+        return {'ok': False, 'code': e.code, 'message': str(e)}
+
 @socketio.on('richmenu:update_areas')
 def handle_richmenu_update_areas(data):
-    """Rich Menu 區域更新"""
+    """Rich Menu 區域整批更新（舊版客戶端）；視為 replace 操作"""
     project_id = str(data.get('project_id'))
     rich_menu_id = data.get('rich_menu_id')
     areas = data.get('areas')
     sender = data.get('sender', request.sid)
     
-    # 廣播到房間內其他使用者
-    emit('richmenu:update_areas', {
+    if _locked_ack(project_id, rich_menu_id):
+        return
+    
+    try:
+        version, op = collab.documents.apply(
+            project_id, rich_menu_id, {'type': 'replace', 'areas': areas}
+        )
+    except collab.AreaOpError:
+        return
+    
+    _emit_collab('richmenu:area_op', {
         'rich_menu_id': rich_menu_id,
-        'areas': areas,
+        'version': version,
+        'op': op,
         'sender': sender
-    }, room=project_id, skip_sid=request.sid)
+    }, 'c:area_op', collab_wire.encode_area_op(rich_menu_id, version, _short_id(project_id), op),
+        project_id)
 
 @socketio.on('richmenu:update_metadata')
 def handle_richmenu_update_metadata(data):
-    """Rich Menu metadata 更新"""
+    """Rich Menu metadata 更新
+
+    套用到伺服器的即時文件（稍後批次寫回資料庫）再轉送；圖片欄位只轉送。
+    """
     project_id = str(data.get('project_id'))
     rich_menu_id = data.get('rich_menu_id')
     metadata = data.get('metadata')
     sender = data.get('sender', request.sid)
     
+    locked = _locked_ack(project_id, rich_menu_id)
+    if locked:
+        return locked
+    
+    try:
+        collab.documents.update_metadata(project_id, rich_menu_id, metadata)
+        result = {'ok': True}
+    except collab.AreaOpError as e:
+        result = {'ok': False, 'code': e.code, 'message': str(e)}
+        # 伺服器沒有這個 Rich Menu 的文件（尚未儲存）時照舊轉送，由客戶端自行儲存
+        if e.code != 'not_found':
+            return result
+    
     emit('richmenu:update_metadata', {
         'rich_menu_id': rich_menu_id,
         'metadata': metadata,
         'sender': sender
     }, room=project_id, skip_sid=request.sid)
+    return result
 
 @socketio.on('richmenu:new')
 def handle_richmenu_new(data):
@@ -202,6 +314,10 @@ def handle_richmenu_new(data):
     rich_menu = data.get('rich_menu')
     sender = data.get('sender', request.sid)
     
+    if isinstance(rich_menu, dict) and rich_menu.get('id') is not None:
+        collab.documents.seed(project_id, rich_menu['id'], rich_menu.get('metadata'),
+                              rich_menu.get('alias') or '')
+    
     emit('richmenu:new', {
         'rich_menu': rich_menu,
         'sender': sender
@@ -214,6 +330,11 @@ def handle_richmenu_delete(data):
     rich_menu_id = data.get('rich_menu_id')
     sender = data.get('sender', request.sid)
     
+    locked = _locked_ack(project_id, rich_menu_id)
+    if locked:
+        return locked
+    collab.documents.drop(project_id, rich_menu_id)
+    
     emit('richmenu:delete', {
         'rich_menu_id': rich_menu_id,
         'sender': sender
@@ -223,91 +344,172 @@ def handle_richmenu_delete(data):
 
 @socketio.on('cursor:move')
 def handle_cursor_move(data):
-    """游標移動"""
-    project_id = str(data.get('project_id'))
-    rich_menu_id = data.get('rich_menu_id')  # 新增
-    relative_x = data.get('relative_x')  # 改為相對座標
-    relative_y = data.get('relative_y')  # 改為相對座標
-    user_id = data.get('user_id', request.sid)
-    user_name = data.get('user_name', 'Anonymous')
-    color = data.get('color', '#02a568')
-    
-    # 廣播到房間內其他使用者
-    emit('cursor:move', {
+    """游標移動（msgpack 客戶端送來的是 bytes，身分取自加入房間時的紀錄）"""
+    if isinstance(data, bytes):
+        try:
+            project_id, rich_menu_id, relative_x, relative_y = collab_wire.decode_cursor(data)
+        except ValueError:
+            return
+        member = collab.presence.member(project_id, request.sid)
+        if member is None:
+            return
+        user_id, user_name, color = member['user_id'], member['user_name'], member['color']
+    else:
+        project_id = str(data.get('project_id'))
+        rich_menu_id = data.get('rich_menu_id')  # 新增
+        relative_x = data.get('relative_x')  # 改為相對座標
+        relative_y = data.get('relative_y')  # 改為相對座標
+        user_id = data.get('user_id', request.sid)
+        user_name = data.get('user_name', 'Anonymous')
+        color = data.get('color', '#02a568')
+    cursor = {
         'rich_menu_id': rich_menu_id,  # 新增
         'relative_x': relative_x,  # 改為相對座標
         'relative_y': relative_y,  # 改為相對座標
         'user_id': user_id,
         'user_name': user_name,
-        'color': color
-    }, room=project_id, skip_sid=request.sid)
+        'color': color,
+        'short_id': _short_id(project_id)
+    }
+    
+    # 交給合併器，由背景迴圈定時以 cursors:update 批次送出
+    if collab.cursors:
+        collab.cursors.push(project_id, cursor)
+        return
+    
+    # 廣播到房間內其他使用者
+    legacy = {key: value for key, value in cursor.items() if key != 'short_id'}
+    if cursor['short_id'] is None:
+        emit('cursor:move', legacy, room=project_id, skip_sid=request.sid)
+        return
+    _emit_collab('cursor:move', legacy, 'c:cursors', collab_wire.encode_cursors([cursor]), project_id)
 
 @socketio.on('cursor:leave')
 def handle_cursor_leave(data):
     """游標離開 Canvas"""
-    project_id = str(data.get('project_id'))
-    rich_menu_id = data.get('rich_menu_id')
-    user_id = data.get('user_id', request.sid)
+    if isinstance(data, bytes):
+        try:
+            project_id, rich_menu_id = collab_wire.decode_target(data)
+        except ValueError:
+            return
+        member = collab.presence.member(project_id, request.sid)
+        if member is None:
+            return
+        user_id = member['user_id']
+    else:
+        project_id = str(data.get('project_id'))
+        rich_menu_id = data.get('rich_menu_id')
+        user_id = data.get('user_id', request.sid)
     
-    emit('cursor:leave', {
+    if collab.cursors:
+        collab.cursors.discard(project_id, user_id)
+    
+    _emit_collab('cursor:leave', {
         'rich_menu_id': rich_menu_id,
         'user_id': user_id
-    }, room=project_id, skip_sid=request.sid)
+    }, 'c:cursor_leave', collab_wire.encode_cursor_leave(_short_id(project_id), rich_menu_id),
+        project_id)
 
 @socketio.on('tab:switch')
 def handle_tab_switch(data):
     """Tab 切換"""
-    project_id = str(data.get('project_id'))
-    rich_menu_id = data.get('rich_menu_id')
-    user_id = data.get('user_id', request.sid)
-    user_name = data.get('user_name', 'Anonymous')
-    color = data.get('color', '#02a568')
+    if isinstance(data, bytes):
+        try:
+            project_id, rich_menu_id = collab_wire.decode_target(data)
+        except ValueError:
+            return
+        member = collab.presence.member(project_id, request.sid)
+        if member is None:
+            return
+        user_id, user_name, color = member['user_id'], member['user_name'], member['color']
+    else:
+        project_id = str(data.get('project_id'))
+        rich_menu_id = data.get('rich_menu_id')
+        user_id = data.get('user_id', request.sid)
+        user_name = data.get('user_name', 'Anonymous')
+        color = data.get('color', '#02a568')
     
     # 更新用戶當前的標籤狀態
-    if project_id in online_users and request.sid in online_users[project_id]:
-        online_users[project_id][request.sid]['rich_menu_id'] = rich_menu_id
+    collab.presence.switch_tab(project_id, request.sid, rich_menu_id)
     
-    emit('tab:switch', {
+    _emit_collab('tab:switch', {
         'rich_menu_id': rich_menu_id,
         'user_id': user_id,
         'user_name': user_name,
         'color': color
-    }, room=project_id, skip_sid=request.sid)
+    }, 'c:tab', collab_wire.encode_tab(_short_id(project_id), rich_menu_id), project_id)
 
-# === 鎖定機制（可選進階功能）===
+# === 鎖定機制 ===
 
 @socketio.on('richmenu:lock')
 def handle_richmenu_lock(data):
-    """鎖定 Rich Menu（防止多人同時編輯）"""
+    """鎖定 Rich Menu（防止多人同時編輯）
+
+    由伺服器記錄持有者並拒絕其他人的 Socket 與 REST 寫入；持有者須在 TTL 內送出
+    richmenu:lock_heartbeat，斷線或離開房間時自動釋放。成功時回傳 REST 寫入用的
+    token（X-Lock-Token 標頭），被別人鎖住時回傳對方的鎖。
+    """
     project_id = str(data.get('project_id'))
     rich_menu_id = data.get('rich_menu_id')
     user_id = data.get('user_id', request.sid)
     user_name = data.get('user_name', 'Anonymous')
     
-    emit('richmenu:locked', {
-        'rich_menu_id': rich_menu_id,
-        'user_id': user_id,
-        'user_name': user_name
-    }, room=project_id, skip_sid=request.sid)
+    acquired, lock = collab.locks.acquire(project_id, rich_menu_id, request.sid, user_id, user_name)
+    if not acquired:
+        return {'ok': False, 'code': 'locked', 'lock': collab.public_lock(lock)}
+    
+    emit('richmenu:locked', collab.public_lock(lock), room=project_id, skip_sid=request.sid)
+    return {'ok': True, 'token': lock['token'], 'ttl': config.COLLAB_LOCK_TTL,
+            'lock': collab.public_lock(lock)}
+
+@socketio.on('richmenu:lock_heartbeat')
+def handle_richmenu_lock_heartbeat(data):
+    """延長自己持有的鎖；已過期時回傳 expired，需重新鎖定"""
+    project_id = str(data.get('project_id'))
+    lock = collab.locks.heartbeat(project_id, data.get('rich_menu_id'), request.sid)
+    if lock is None:
+        return {'ok': False, 'code': 'expired'}
+    return {'ok': True, 'lock': collab.public_lock(lock)}
 
 @socketio.on('richmenu:unlock')
 def handle_richmenu_unlock(data):
-    """解鎖 Rich Menu"""
+    """解鎖 Rich Menu（只有持有者可以解鎖）"""
     project_id = str(data.get('project_id'))
     rich_menu_id = data.get('rich_menu_id')
-    user_id = data.get('user_id', request.sid)
     
-    emit('richmenu:unlocked', {
-        'rich_menu_id': rich_menu_id,
-        'user_id': user_id
-    }, room=project_id, skip_sid=request.sid)
-
-# === 初始化資料庫（在模組載入時執行）===
-db.init_db()
-
-# === 初始化排程器 ===
-import scheduler as sched_module
-sched_module.init_scheduler(app)
+    lock = collab.locks.release(project_id, rich_menu_id, request.sid)
+    if lock is None:
+        return {'ok': False, 'code': 'not_owner'}
+    
+    emit('richmenu:unlocked', {**collab.public_lock(lock), 'reason': 'released'},
+         room=project_id, skip_sid=request.sid)
+    return {'ok': True}
+
+# === 初始化資料庫與背景工作（在模組載入時執行）===
+# 以 python app.py 啟動時，圖片處理子行程（forkserver/spawn）會以 __mp_main__ 重新執行
+# 本檔；子行程只做圖片處理，不初始化資料庫、排程與協作。
+if __name__ != '__mp_main__':
+    db.init_db()
+
+    # 初始化排程器
+    import scheduler as sched_module
+    sched_module.init_scheduler(app)
+
+    # 圖片背景處理完成通知（寫回與通知在 eventlet hub 上執行）
+    import image_pipeline
+
+    def _notify_image_ready(project_id, payload):
+        """縮圖與 LINE 用 JPEG 產生完成（或失敗）時通知專案房間"""
+        socketio.emit('richmenu:image_ready', payload, room=str(project_id))
+
+    image_pipeline.set_notifier(_notify_image_ready, socketio.start_background_task)
+
+    # 線上名單、游標合併送出與即時文件寫回
+    collab.init(
+        lambda event, payload, room: socketio.emit(event, payload, room=room),
+        socketio.start_background_task,
+        socketio.sleep
+    )
 
 # === 啟動應用 ===
 
@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+# bench_collab.py - 多人協作 Socket.IO 負載產生器
+#
+# 在暫存資料庫建立合成專案，以子行程啟動 app.py（只聽 127.0.0.1），再於本行程
+# 開啟數百個 Socket.IO 客戶端分散到多個專案房間。全部 join_project 後依設定的
+# 頻率送出 cursor:move、tab:switch 與 richmenu:update_areas，並記錄：
+#   - 端到端轉送延遲（送出 → 房間內其他客戶端收到）的 p50/p90/p99
+#   - 遺失的訊息：tab:switch 與區域更新應送達房間內每個其他成員；
+#     游標由伺服器合併（COLLAB_CURSOR_HZ）本來就會略過中間位置，另列為合併數
+#   - 伺服器行程的 CPU 使用率與 RSS（讀取 /proc，僅 Linux）
+#   - 產生器本身的 CPU 使用率（接近 100% 時延遲數據包含客戶端排隊時間）
+# 結果存成 JSON，可用 --compare 與先前結果比較找出效能退化（基準在執行前讀入；
+# 輸出與基準為同一檔案的規則同 bench_publish.py）。
+# 客戶端需要 websocket-client（pip install "python-socketio[client]"）。
+#
+# 用法：
+#   python bench_collab.py                                   # 200 個客戶端、20 個房間、30 秒
+#   python bench_collab.py --clients 500 --rooms 50 --cursor-hz 30
+#   python bench_collab.py --wire msgpack --compare bench_collab.json --tolerance 0.2
+
+import argparse
+import heapq
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+import socketio
+
+import collab_wire
+import config
+import db
+from bench_publish import (
+    _grid_areas, add_report_arguments, finish_report, isolated_storage, load_baseline
+)
+
+MENU_SIZE = (2500, 1686)
+AREAS_PER_MENU = 6
+KINDS = ('cursor', 'tab', 'areas')
+
+# 比較時關注的指標；數值越大越差
+COMPARED_METRICS = [
+    ('events', 'cursor', 'latency_ms', 'p50'),
+    ('events', 'cursor', 'latency_ms', 'p99'),
+    ('events', 'tab', 'latency_ms', 'p99'),
+    ('events', 'areas', 'latency_ms', 'p50'),
+    ('events', 'areas', 'latency_ms', 'p99'),
+    ('server', 'cpu_avg_pct'),
+    ('server', 'rss_peak_mb'),
+]
+
+# 在子行程中把資料庫與上傳資料夾指到暫存目錄後再載入 app（import 時即初始化資料庫）
+SERVER_BOOTSTRAP = '''
+import sys
+import config
+config.DATABASE_PATH, config.UPLOAD_FOLDER = sys.argv[1], sys.argv[2]
+import app
+app.socketio.run(app.app, host='127.0.0.1', port=int(sys.argv[3]), log_output=False)
+'''
+
+
+def percentiles(values):
+    """延遲（秒）→ 毫秒統計；沒有樣本時回傳 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(point):
+        index = max(int(round(point / 100 * len(ordered))) - 1, 0)
+        return round(ordered[min(index, len(ordered) - 1)] * 1000, 2)
+
+    return {
+        'samples': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 2),
+        'p50': rank(50),
+        'p90': rank(90),
+        'p99': rank(99),
+        'max': round(ordered[-1] * 1000, 2)
+    }
+
+
+def read_cpu_seconds(pid):
+    """行程累計的 user + system CPU 秒數（/proc/<pid>/stat）"""
+    with open(f'/proc/{pid}/stat') as f:
+        # 行程名稱可能含空白，從最後一個右括號之後開始切
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def read_rss_bytes(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class ProcessSampler:
+    """背景執行緒定時取樣伺服器行程的 CPU 與 RSS"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.available = os.path.exists(f'/proc/{pid}/stat')
+        self.cpu_samples = []
+        self.rss_samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def rss_mb(self):
+        return round(read_rss_bytes(self.pid) / 1e6, 1) if self.available else None
+
+    def start(self):
+        if not self.available:
+            return
+        self._started = (time.perf_counter(), read_cpu_seconds(self.pid))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last_wall, last_cpu = self._started
+        while not self._stop.wait(self.interval):
+            try:
+                wall, cpu = time.perf_counter(), read_cpu_seconds(self.pid)
+                self.rss_samples.append(read_rss_bytes(self.pid))
+            except OSError:
+                return
+            self.cpu_samples.append((cpu - last_cpu) / (wall - last_wall) * 100)
+            last_wall, last_cpu = wall, cpu
+
+    def stop(self):
+        """停止取樣並回傳摘要；無法讀取 /proc 時回傳 None"""
+        if not self.available:
+            return None
+        self._stop.set()
+        self._thread.join()
+        started_wall, started_cpu = self._started
+        try:
+            cpu_avg = (read_cpu_seconds(self.pid) - started_cpu) / (time.perf_counter() - started_wall) * 100
+            rss_end = read_rss_bytes(self.pid)
+        except OSError:
+            return None
+        return {
+            'cpu_avg_pct': round(cpu_avg, 1),
+            'cpu_peak_pct': round(max(self.cpu_samples, default=cpu_avg), 1),
+            'rss_peak_mb': round(max(self.rss_samples + [rss_end]) / 1e6, 1),
+            'rss_end_mb': round(rss_end / 1e6, 1)
+        }
+
+
+class Recorder:
+    """所有客戶端共用的送出／收到紀錄（同一行程，送出時間可直接比對）
+
+    tab:switch 與區域更新在同一條連線上依序送達，第 n 則收到的訊息就是送出者的
+    第 n 則；游標會被合併，改以 relative_y 夾帶的序號（0..QUANT）對應送出時間。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = {kind: 0 for kind in KINDS}
+        self.expected = {kind: 0 for kind in KINDS}
+        self.received = {kind: 0 for kind in KINDS}
+        self.latencies = {kind: [] for kind in KINDS}
+        self.unmatched = 0
+        self._cursor_sent = {}
+        self._ordinal_sent = {'tab': {}, 'areas': {}}
+        self._ordinal_received = {'tab': {}, 'areas': {}}
+        self._short_ids = {}
+
+    def register(self, project_id, short_id, user_id):
+        with self._lock:
+            self._short_ids[(str(project_id), short_id)] = user_id
+
+    def user_for(self, project_id, short_id):
+        return self._short_ids.get((str(project_id), short_id))
+
+    def sending(self, kind, user_id, receivers, tag=None):
+        now = time.perf_counter()
+        with self._lock:
+            self.sent[kind] += 1
+            self.expected[kind] += receivers
+            if kind == 'cursor':
+                self._cursor_sent[(user_id, tag)] = now
+            else:
+                self._ordinal_sent[kind].setdefault(user_id, []).append(now)
+
+    def received_cursor(self, user_id, tag):
+        now = time.perf_counter()
+        with self._lock:
+            sent_at = self._cursor_sent.get((user_id, tag))
+            if sent_at is None:
+                self.unmatched += 1
+                return
+            self.received['cursor'] += 1
+            self.latencies['cursor'].append(now - sent_at)
+
+    def received_ordinal(self, kind, receiver, user_id):
+        now = time.perf_counter()
+        with self._lock:
+            key = (receiver, user_id)
+            index = self._ordinal_received[kind].get(key, 0)
+            sent = self._ordinal_sent[kind].get(user_id, [])
+            if index >= len(sent):
+                self.unmatched += 1
+                return
+            self._ordinal_received[kind][key] = index + 1
+            self.received[kind] += 1
+            self.latencies[kind].append(now - sent[index])
+
+    def summary(self):
+        events = {}
+        for kind in KINDS:
+            missing = max(self.expected[kind] - self.received[kind], 0)
+            events[kind] = {
+                'sent': self.sent[kind],
+                'expected': self.expected[kind],
+                'received': self.received[kind],
+                # 游標的「少收」是合併造成的，不算遺失
+                ('coalesced' if kind == 'cursor' else 'dropped'): missing,
+                'latency_ms': percentiles(self.latencies[kind])
+            }
+        return events
+
+
+class BenchClient:
+    """一個模擬的編輯者：一條 Socket.IO 連線，加入一個專案房間"""
+
+    def __init__(self, index, project_id, menu_ids, wire, recorder):
+        self.index = index
+        self.project_id = project_id
+        self.menu_ids = menu_ids
+        self.wire = wire
+        self.recorder = recorder
+        self.user_id = f'bench-{index}'
+        self.room_size = 0
+        self.cursor_seq = 0
+        self.rich_menu_id = menu_ids[index % len(menu_ids)]
+        self.random = random.Random(index)
+        self.sio = socketio.Client(reconnection=False)
+        self._register_handlers()
+
+    def _register_handlers(self):
+        on = self.sio.on
+        on('cursors:update', lambda data: [self._on_cursor(c['user_id'], c['relative_y'])
+                                           for c in data.get('cursors', [])])
+        on('cursor:move', lambda data: self._on_cursor(data['user_id'], data['relative_y']))
+        on('tab:switch', lambda data: self._on_ordinal('tab', data['user_id']))
+        on('richmenu:area_op', lambda data: self._on_ordinal('areas', data['sender']))
+        on('c:cursors', self._on_compact_cursors)
+        on('c:tab', lambda data: self._on_ordinal(
+            'tab', self.recorder.user_for(self.project_id, collab_wire.unpack(data)[0])))
+        on('c:area_op', lambda data: self._on_ordinal(
+            'areas', self.recorder.user_for(self.project_id, collab_wire.unpack(data)[2])))
+
+    def _on_cursor(self, user_id, relative_y):
+        if user_id != self.user_id:
+            self.recorder.received_cursor(user_id, collab_wire.quantise(relative_y))
+
+    def _on_compact_cursors(self, data):
+        items = collab_wire.unpack(data)
+        for start in range(0, len(items), 4):
+            user_id = self.recorder.user_for(self.project_id, items[start])
+            if user_id != self.user_id:
+                self.recorder.received_cursor(user_id, items[start + 3])
+
+    def _on_ordinal(self, kind, user_id):
+        self.recorder.received_ordinal(kind, self.user_id, user_id)
+
+    def connect(self, url, transport):
+        self.sio.connect(url, transports=[transport], wait_timeout=30)
+        ack = self.sio.call('join_project', {
+            'project_id': self.project_id,
+            'user_id': self.user_id,
+            'user_name': f'Bench {self.index}',
+            'color': f'#{self.random.randrange(0x1000000):06x}',
+            'wire': self.wire
+        }, timeout=30)
+        self.recorder.register(self.project_id, ack.get('short_id'), self.user_id)
+
+    def move_cursor(self):
+        self.cursor_seq += 1
+        tag = self.cursor_seq % collab_wire.QUANT
+        relative_x = self.random.random()
+        relative_y = tag / collab_wire.QUANT
+        self.recorder.sending('cursor', self.user_id, self.room_size - 1, tag)
+        if self.wire == collab_wire.MSGPACK:
+            self.sio.emit('cursor:move', collab_wire.pack([
+                self.project_id, self.rich_menu_id, collab_wire.quantise(relative_x), tag
+            ]))
+            return
+        self.sio.emit('cursor:move', {
+            'project_id': self.project_id,
+            'rich_menu_id': self.rich_menu_id,
+            'relative_x': relative_x,
+            'relative_y': relative_y,
+            'user_id': self.user_id,
+            'user_name': f'Bench {self.index}',
+            'color': '#02a568'
+        })
+
+    def switch_tab(self):
+        self.rich_menu_id = self.random.choice(self.menu_ids)
+        self.recorder.sending('tab', self.user_id, self.room_size - 1)
+        if self.wire == collab_wire.MSGPACK:
+            self.sio.emit('tab:switch', collab_wire.pack([self.project_id, self.rich_menu_id]))
+            return
+        self.sio.emit('tab:switch', {
+            'project_id': self.project_id,
+            'rich_menu_id': self.rich_menu_id,
+            'user_id': self.user_id,
+            'user_name': f'Bench {self.index}',
+            'color': '#02a568'
+        })
+
+    def update_areas(self):
+        width, height = MENU_SIZE
+        areas = _grid_areas(AREAS_PER_MENU, width, height)
+        # 模擬拖曳：隨機縮小其中一個區域
+        bounds = self.random.choice(areas)['bounds']
+        bounds['width'] -= self.random.randrange(bounds['width'] // 2)
+        bounds['height'] -= self.random.randrange(bounds['height'] // 2)
+        self.recorder.sending('areas', self.user_id, self.room_size - 1)
+        self.sio.emit('richmenu:update_areas', {
+            'project_id': self.project_id,
+            'rich_menu_id': self.rich_menu_id,
+            'areas': areas,
+            'sender': self.user_id
+        })
+
+    def disconnect(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def _drive_room(clients, rates, until):
+    """依各客戶端的頻率排程送出事件（每個房間一條執行緒）"""
+    actions = {
+        'cursor': BenchClient.move_cursor,
+        'tab': BenchClient.switch_tab,
+        'areas': BenchClient.update_areas
+    }
+    now = time.perf_counter()
+    queue = []
+    for position, client in enumerate(clients):
+        for kind, rate in rates.items():
+            if rate > 0:
+                # 隨機相位，避免同一房間的客戶端同時送出
+                heapq.heappush(queue, (now + client.random.random() / rate, position, kind))
+
+    while queue:
+        due, position, kind = heapq.heappop(queue)
+        if due >= until:
+            continue
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        client = clients[position]
+        try:
+            actions[kind](client)
+        except socketio.exceptions.SocketIOError:
+            continue
+        heapq.heappush(queue, (due + 1 / rates[kind], position, kind))
+
+
+def seed_projects(rooms, menus_per_room):
+    """在目前的暫存資料庫建立 rooms 個專案，回傳 {project_id: [rich_menu_id, ...]}"""
+    width, height = MENU_SIZE
+    account_id = db.create_account('bench', 'bench-token')
+    projects = {}
+    for room in range(rooms):
+        project_id = db.create_project(account_id, f'bench room {room + 1}')
+        projects[project_id] = [
+            db.create_rich_menu(project_id, f'Bench {index + 1}', f'bench-{project_id}-{index}', {
+                'size': {'width': width, 'height': height},
+                'selected': index == 0,
+                'name': f'Bench {index + 1}',
+                'chatBarText': '選單',
+                'areas': _grid_areas(AREAS_PER_MENU, width, height)
+            })
+            for index in range(menus_per_room)
+        ]
+    return projects
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, log_path, timeout=60):
+    """以子行程啟動 app.py，等到 Socket.IO 端點可以回應"""
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_BOOTSTRAP, config.DATABASE_PATH, config.UPLOAD_FOLDER, str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+    log.close()
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path, encoding='utf-8', errors='replace') as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f'伺服器啟動失敗（exit {process.returncode}）:\n{tail}')
+        try:
+            requests.get(f'{url}/socket.io/?EIO=4&transport=polling', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'伺服器 {timeout} 秒內沒有回應')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _wire_for(index, wire):
+    if wire == 'mixed':
+        return collab_wire.WIRES[index % len(collab_wire.WIRES)]
+    return wire
+
+
+def run(args, url, server_pid):
+    """連線、加入房間、送出負載、收尾，回傳報告的量測部分"""
+    projects = seed_projects(args.rooms, args.menus)
+    project_ids = list(projects)
+    recorder = Recorder()
+    clients = [
+        BenchClient(index, project_ids[index % len(project_ids)],
+                    projects[project_ids[index % len(project_ids)]],
+                    _wire_for(index, args.wire), recorder)
+        for index in range(args.clients)
+    ]
+    sampler = ProcessSampler(server_pid)
+    rss_idle_mb = sampler.rss_mb()
+
+    connect_errors = []
+
+    def connect(client):
+        try:
+            client.connect(url, args.transport)
+            return client
+        except Exception as exc:
+            connect_errors.append(f'{client.user_id}: {exc}')
+            return None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.connect_concurrency) as pool:
+        connected = [client for client in pool.map(connect, clients) if client]
+    connect_s = time.perf_counter() - started
+
+    by_room = {}
+    for client in connected:
+        by_room.setdefault(client.project_id, []).append(client)
+    for members in by_room.values():
+        for client in members:
+            client.room_size = len(members)
+    # 讓 join 造成的廣播（user:joined、users:list）先消化完再開始計時
+    time.sleep(1)
+    rss_joined_mb = sampler.rss_mb()
+
+    rates = {'cursor': args.cursor_hz, 'tab': args.tab_rate, 'areas': args.areas_rate}
+    client_cpu = time.process_time()
+    sampler.start()
+    started = time.perf_counter()
+    until = started + args.duration
+    drivers = [
+        threading.Thread(target=_drive_room, args=(members, rates, until), daemon=True)
+        for members in by_room.values()
+    ]
+    for driver in drivers:
+        driver.start()
+    for driver in drivers:
+        driver.join()
+    time.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+    server = sampler.stop()
+    client_cpu_pct = (time.process_time() - client_cpu) / elapsed * 100
+
+    try:
+        server_stats = requests.get(f'{url}/api/collab/stats', timeout=5).json().get('data')
+    except (requests.RequestException, ValueError):
+        server_stats = None
+
+    with ThreadPoolExecutor(args.connect_concurrency) as pool:
+        list(pool.map(BenchClient.disconnect, connected))
+
+    if server is not None:
+        server['rss_idle_mb'] = rss_idle_mb
+        server['rss_joined_mb'] = rss_joined_mb
+    return {
+        'connect': {
+            'clients': len(connected),
+            'errors': len(connect_errors),
+            'error_samples': connect_errors[:10],
+            'connect_s': round(connect_s, 2)
+        },
+        'events': recorder.summary(),
+        'unmatched': recorder.unmatched,
+        'server': server,
+        'client_cpu_pct': round(client_cpu_pct, 1),
+        'server_stats': server_stats
+    }
+
+
+def _metric(report, path):
+    value = report
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def compare(current, baseline, tolerance):
+    """回傳超出容忍範圍的退化項目；遺失訊息比基準多即算退化"""
+    regressions = []
+    for path in COMPARED_METRICS:
+        old_value = _metric(baseline, path) or 0
+        new_value = _metric(current, path) or 0
+        if old_value and new_value > old_value * (1 + tolerance):
+            regressions.append(
+                f'{".".join(path)}: {old_value} → {new_value} '
+                f'(+{(new_value / old_value - 1) * 100:.0f}%)'
+            )
+    for kind in ('tab', 'areas'):
+        path = ('events', kind, 'dropped')
+        old_value = _metric(baseline, path) or 0
+        new_value = _metric(current, path) or 0
+        if new_value > old_value:
+            regressions.append(f'{".".join(path)}: {old_value} → {new_value}')
+    return regressions
+
+
+def _print_summary(report):
+    connect = report['connect']
+    print(f'連線 {connect["clients"]} 個客戶端（失敗 {connect["errors"]}），'
+          f'{connect["connect_s"]:.1f}s')
+    for kind, measured in report['events'].items():
+        latency = measured['latency_ms'] or {}
+        missing = measured.get('dropped', measured.get('coalesced'))
+        label = '遺失' if 'dropped' in measured else '合併'
+        print(
+            f'{kind:<7} sent {measured["sent"]:>7} received {measured["received"]:>8}/'
+            f'{measured["expected"]:<8} {label} {missing:>7} | '
+            f'p50 {latency.get("p50", 0):>8.2f}ms p90 {latency.get("p90", 0):>8.2f}ms '
+            f'p99 {latency.get("p99", 0):>8.2f}ms'
+        )
+    server = report['server']
+    if server:
+        print(f'server  CPU avg {server["cpu_avg_pct"]:.1f}% peak {server["cpu_peak_pct"]:.1f}% | '
+              f'RSS idle {server["rss_idle_mb"]} MB joined {server["rss_joined_mb"]} MB '
+              f'peak {server["rss_peak_mb"]} MB')
+    print(f'client  CPU {report["client_cpu_pct"]:.1f}%')
+    if report['client_cpu_pct'] > 90:
+        print('  ⚠️ 產生器 CPU 接近飽和，延遲數據包含客戶端排隊時間')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='多人協作 Socket.IO 負載產生器')
+    parser.add_argument('--clients', type=int, default=200, help='客戶端數量')
+    parser.add_argument('--rooms', type=int, default=20, help='專案房間數量（客戶端平均分配）')
+    parser.add_argument('--menus', type=int, default=3, help='每個專案的 Rich Menu 數量')
+    parser.add_argument('--duration', type=float, default=30, help='送出負載的秒數')
+    parser.add_argument('--drain', type=float, default=2, help='停止送出後等待訊息送達的秒數')
+    parser.add_argument('--cursor-hz', type=float, default=10, help='每個客戶端每秒 cursor:move 次數')
+    parser.add_argument('--tab-rate', type=float, default=0.2, help='每個客戶端每秒 tab:switch 次數')
+    parser.add_argument('--areas-rate', type=float, default=0.5,
+                        help='每個客戶端每秒 richmenu:update_areas 次數')
+    parser.add_argument('--wire', choices=[*collab_wire.WIRES, 'mixed'], default=collab_wire.JSON,
+                        help='客戶端宣告的傳輸格式（mixed 為各半）')
+    parser.add_argument('--transport', choices=['websocket', 'polling'], default='websocket')
+    parser.add_argument('--connect-concurrency', type=int, default=20, help='同時建立連線的數量')
+    parser.add_argument('--port', type=int, help='伺服器埠號（預設自動挑選）')
+    parser.add_argument('--server-log', help='伺服器輸出存檔路徑（預設丟在暫存目錄）')
+    add_report_arguments(parser, 'bench_collab.json')
+    args = parser.parse_args(argv)
+
+    if args.clients < 2 or args.rooms < 1 or args.clients < args.rooms * 2:
+        parser.error('每個房間至少要有 2 個客戶端（--clients ≥ 2 × --rooms）')
+    if args.menus < 1:
+        parser.error('--menus 至少為 1')
+    baseline = load_baseline(parser, args)
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            key: getattr(args, key) for key in (
+                'clients', 'rooms', 'menus', 'duration', 'cursor_hz', 'tab_rate',
+                'areas_rate', 'wire', 'transport'
+            )
+        },
+        'server_cursor_hz': config.COLLAB_CURSOR_HZ
+    }
+
+    with isolated_storage() as tmpdir:
+        log_path = args.server_log or os.path.join(tmpdir, 'server.log')
+        process, url = start_server(args.port or _free_port(), log_path)
+        try:
+            report.update(run(args, url, process.pid))
+        finally:
+            stop_server(process)
+
+    _print_summary(report)
+    return finish_report(report, args, baseline, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
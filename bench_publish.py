@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# bench_publish.py - 排程發佈端到端效能基準
+#
+# 在暫存資料庫與上傳資料夾中建立合成專案，對 fake_line_api.py 的本機
+# LINE 替身（可注入延遲）執行 scheduler._execute_job（首次發佈）與
+# scheduler.execute_single_job（再次發佈，含舊版清理），並記錄：
+#   - wall time
+#   - LINE API 呼叫次數（含寫入次數）
+#   - 上傳位元組數
+#   - 圖片編碼所花的 CPU 時間
+# 結果存成 JSON，可用 --compare 與先前結果比較找出效能退化。基準在執行前就讀入；
+# 未指定 --output 且預設輸出就是基準檔時改寫到 bench_publish.new.json，
+# 明確指定同一個檔案則拒絕執行，免得拿剛寫入的結果與自己比較。
+#
+# 用法：
+#   python bench_publish.py                          # 預設情境
+#   python bench_publish.py --matrix --latency 0.05  # 全部組合
+#   python bench_publish.py --compare bench_publish.json --tolerance 0.2
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from PIL import Image
+
+import config
+import db
+import scheduler
+from fake_line_api import FakeLineApi
+
+MENU_COUNTS = [1, 5, 10, 25, 50]
+AREA_COUNTS = [1, 6, 20]
+IMAGE_SIZES = [(2500, 1686), (2500, 843), (1200, 810)]
+
+# 比較時關注的指標；數值越大越差
+COMPARED_METRICS = ['wall_s', 'line_calls', 'bytes_uploaded', 'encode_cpu_s']
+
+
+def build_scenarios(matrix=False, menu_counts=None):
+    """產生情境清單；預設只沿單一維度變化以控制總時間"""
+    menu_counts = menu_counts or MENU_COUNTS
+    if matrix:
+        return [
+            {'menus': menus, 'areas': areas, 'size': list(size)}
+            for menus, areas, size in itertools.product(menu_counts, AREA_COUNTS, IMAGE_SIZES)
+        ]
+
+    scenarios = [
+        {'menus': menus, 'areas': 6, 'size': [2500, 1686]}
+        for menus in menu_counts
+    ]
+    scenarios += [
+        {'menus': 10, 'areas': areas, 'size': [2500, 1686]}
+        for areas in AREA_COUNTS if areas != 6
+    ]
+    scenarios += [
+        {'menus': 10, 'areas': 6, 'size': list(size)}
+        for size in IMAGE_SIZES if list(size) != [2500, 1686]
+    ]
+    return scenarios
+
+
+def _scenario_key(scenario):
+    width, height = scenario['size']
+    return f'menus={scenario["menus"]} areas={scenario["areas"]} size={width}x{height}'
+
+
+def _grid_areas(count, width, height):
+    """將畫布切成 count 個不重疊的格子"""
+    columns = min(count, 5)
+    rows = (count + columns - 1) // columns
+    cell_width = width // columns
+    cell_height = height // rows
+    areas = []
+    for index in range(count):
+        row, column = divmod(index, columns)
+        areas.append({
+            'bounds': {
+                'x': column * cell_width,
+                'y': row * cell_height,
+                'width': cell_width,
+                'height': cell_height
+            },
+            'action': {'type': 'message', 'text': f'area {index + 1}'}
+        })
+    return areas
+
+
+_image_cache = {}
+
+
+def _synthetic_image(path, width, height, seed):
+    """漸層加雜訊，讓 JPEG 編碼成本接近真實設計稿；相同尺寸只產生少數幾張再複製"""
+    key = (width, height, seed % 4)
+    cached = _image_cache.get(key)
+    if cached is None or not os.path.exists(cached):
+        base = Image.linear_gradient('L').resize((width, height))
+        noise = Image.effect_noise((width, height), 24 + seed % 4)
+        cached = os.path.join(os.path.dirname(path), f'bench_source_{width}x{height}_{seed % 4}.png')
+        Image.merge('RGB', (base, noise, base.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(
+            cached, compress_level=1
+        )
+        _image_cache[key] = cached
+    shutil.copyfile(cached, path)
+
+
+def create_project(scenario):
+    """在目前的暫存資料庫建立合成專案，回傳排程 ID"""
+    width, height = scenario['size']
+    account = db.get_account_by_name('bench')
+    account_id = account['id'] if account else db.create_account('bench', 'bench-token')
+    project_id = db.create_project(account_id, f'bench {time.time_ns()}')
+
+    for index in range(scenario['menus']):
+        name = f'Bench {index + 1}'
+        rm_id = db.create_rich_menu(project_id, name, f'bench-{project_id}-{index}', {
+            'size': {'width': width, 'height': height},
+            'selected': True,
+            'name': name,
+            'chatBarText': '選單',
+            'areas': _grid_areas(scenario['areas'], width, height)
+        })
+        filename = f'rm_{rm_id}_bench.png'
+        _synthetic_image(os.path.join(config.UPLOAD_FOLDER, filename), width, height, index)
+        db.update_rich_menu(rm_id, image_path=filename)
+
+    return db.create_scheduled_job(
+        project_id, start_date='2000-01-01', end_date='2999-12-31'
+    )
+
+
+class EncodeTimer:
+    """包住 scheduler._encode_line_image，累計編碼所用的執行緒 CPU 時間"""
+
+    def __init__(self):
+        self.cpu_s = 0.0
+        self.calls = 0
+
+    @contextmanager
+    def installed(self):
+        original = scheduler._encode_line_image
+
+        def timed(image_path, line_jpeg_path=None):
+            started = time.thread_time()
+            try:
+                return original(image_path, line_jpeg_path)
+            finally:
+                self.cpu_s += time.thread_time() - started
+                self.calls += 1
+
+        scheduler._encode_line_image = timed
+        try:
+            yield self
+        finally:
+            scheduler._encode_line_image = original
+
+
+def _measure(fake, run):
+    fake.clear_calls()
+    timer = EncodeTimer()
+    with timer.installed():
+        started = time.perf_counter()
+        run()
+        wall_s = time.perf_counter() - started
+    stats = fake.stats()
+    return {
+        'wall_s': round(wall_s, 4),
+        'line_calls': stats['calls'],
+        'write_calls': stats['write_calls'],
+        'bytes_uploaded': stats['bytes_uploaded'],
+        'encode_cpu_s': round(timer.cpu_s, 4),
+        'encoded_images': timer.calls,
+        'by_endpoint': stats['by_endpoint']
+    }
+
+
+def run_scenario(fake, scenario, repeat=1):
+    """執行一個情境：首次發佈與再次發佈各 repeat 次，取 wall time 最小值"""
+    results = {}
+    for _ in range(repeat):
+        # 每次從空的遠端狀態開始，避免前一個情境的同名選單被當成舊版清理
+        fake.reset()
+        job_id = create_project(scenario)
+        measurements = {
+            'execute_job': _measure(
+                fake, lambda: scheduler._execute_job(db.get_scheduled_job(job_id))
+            ),
+            'execute_single_job': _measure(
+                fake, lambda: scheduler.execute_single_job(job_id)
+            )
+        }
+        for mode, measured in measurements.items():
+            best = results.get(mode)
+            if best is None or measured['wall_s'] < best['wall_s']:
+                results[mode] = measured
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """回傳超出容忍範圍的退化項目"""
+    baseline_by_key = {item['key']: item for item in baseline.get('scenarios', [])}
+    regressions = []
+    for item in current['scenarios']:
+        previous = baseline_by_key.get(item['key'])
+        if not previous:
+            continue
+        for mode, measured in item['results'].items():
+            before = previous['results'].get(mode)
+            if not before:
+                continue
+            for metric in COMPARED_METRICS:
+                old_value = before.get(metric) or 0
+                new_value = measured.get(metric) or 0
+                if old_value and new_value > old_value * (1 + tolerance):
+                    regressions.append(
+                        f'{item["key"]} [{mode}] {metric}: {old_value} → {new_value} '
+                        f'(+{(new_value / old_value - 1) * 100:.0f}%)'
+                    )
+    return regressions
+
+
+@contextmanager
+def isolated_storage():
+    """暫時把資料庫與上傳資料夾換成暫存目錄"""
+    tmpdir = tempfile.mkdtemp(prefix='bench_publish_')
+    original = (config.DATABASE_PATH, config.UPLOAD_FOLDER)
+    config.DATABASE_PATH = os.path.join(tmpdir, 'bench.db')
+    config.UPLOAD_FOLDER = os.path.join(tmpdir, 'uploads')
+    os.makedirs(config.UPLOAD_FOLDER)
+    try:
+        db.init_db()
+        yield tmpdir
+    finally:
+        config.DATABASE_PATH, config.UPLOAD_FOLDER = original
+        _image_cache.clear()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def add_report_arguments(parser, default_output):
+    """加入結果輸出與基準比較的參數（bench_publish 與 bench_collab 共用）"""
+    parser.add_argument('--output', help=f'結果 JSON 路徑（預設 {default_output}）')
+    parser.add_argument('--compare', help='與先前的結果 JSON 比較')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='比較時允許的退化比例')
+    parser.set_defaults(default_output=default_output)
+
+
+def load_baseline(parser, args):
+    """決定輸出路徑並在執行前讀入 --compare 的基準；未指定 --compare 回傳 None
+
+    輸出與基準不可為同一個檔案，否則比較的是剛寫入的結果本身。
+    """
+    output = args.output or args.default_output
+    if args.compare and os.path.abspath(output) == os.path.abspath(args.compare):
+        if args.output:
+            parser.error('--output 與 --compare 不可為同一個檔案')
+        root, extension = os.path.splitext(output)
+        output = f'{root}.new{extension}'
+    args.output = output
+    if not args.compare:
+        return None
+    try:
+        with open(args.compare, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as exc:
+        parser.error(f'無法讀取基準 {args.compare}: {exc}')
+
+
+def finish_report(report, args, baseline, compare_fn):
+    """寫出結果，有基準時以 compare_fn(report, baseline, tolerance) 比較；回傳結束碼"""
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'\n結果已寫入 {args.output}')
+
+    if baseline is None:
+        return 0
+    if baseline.get('settings') != report.get('settings'):
+        print('\n⚠️ 基準的負載設定不同，比較結果僅供參考')
+    regressions = compare_fn(report, baseline, args.tolerance)
+    if regressions:
+        print(f'\n❌ 發現 {len(regressions)} 項效能退化：')
+        for line in regressions:
+            print(f'  - {line}')
+        return 1
+    print('\n✅ 與基準相比沒有超出容忍範圍的退化')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='排程發佈端到端效能基準')
+    parser.add_argument('--latency', type=float, default=0.02, help='LINE 替身每個請求的延遲（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='LINE 替身額外隨機延遲上限（秒）')
+    parser.add_argument('--matrix', action='store_true', help='執行選單數 × 區域數 × 圖片尺寸的所有組合')
+    parser.add_argument('--menus', type=int, nargs='+', help='覆寫選單數清單（1-50）')
+    parser.add_argument('--repeat', type=int, default=1, help='每個情境重複次數，取最快一次')
+    add_report_arguments(parser, 'bench_publish.json')
+    args = parser.parse_args(argv)
+
+    if args.menus and not all(1 <= count <= 50 for count in args.menus):
+        parser.error('--menus 必須介於 1 到 50')
+    baseline = load_baseline(parser, args)
+
+    scenarios = build_scenarios(args.matrix, args.menus)
+    report = {
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency_s': args.latency,
+        'jitter_s': args.jitter,
+        'scenarios': []
+    }
+
+    with FakeLineApi(latency=args.latency, jitter=args.jitter) as fake, \
+            fake.patch_config(), isolated_storage():
+        for scenario in scenarios:
+            key = _scenario_key(scenario)
+            results = run_scenario(fake, scenario, args.repeat)
+            report['scenarios'].append({'key': key, **scenario, 'results': results})
+            first = results['execute_job']
+            again = results['execute_single_job']
+            print(
+                f'{key:<40} publish {first["wall_s"]:>7.2f}s '
+                f'{first["line_calls"]:>4} calls {first["bytes_uploaded"] / 1e6:>7.2f} MB '
+                f'encode {first["encode_cpu_s"]:>6.2f}s | '
+                f'republish {again["wall_s"]:>7.2f}s {again["line_calls"]:>4} calls'
+            )
+
+    return finish_report(report, args, baseline, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1054 @@
+# collab.py - 多人協作（Socket.IO）的伺服器端狀態
+#
+# app.py 的事件處理只負責解析參數與回應；需要跨事件保留的狀態放在這裡，
+# 方便單獨測試，也讓 /api/collab/stats 能讀到統計數據。
+
+import os
+import copy
+import time
+import json
+import uuid
+import atexit
+import socket
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+import config
+import db
+import collab_wire
+
+logger = logging.getLogger('collab')
+
+_INSTANCE_ID = uuid.uuid4().hex[:8]
+
+
+class CursorAggregator:
+    """合併游標移動：每個房間只保留每位使用者最新的位置，定時送出一個 cursors:update
+
+    原本每個 cursor:move 都立即轉送給房間內其他人，N 人同時移動時每秒訊息量是
+    O(N²)；改為每個 tick 每房間一則，中間被後來位置取代的就直接丟棄。
+    """
+
+    def __init__(self, emit, interval, room_size):
+        self._emit = emit  # emit(event, payload, room)
+        self.interval = interval
+        self._room_size = room_size  # room_size(room) → 線上人數，估算轉送數用
+        self._pending = {}  # {room: {user_id: cursor}}
+        self._received = {}  # {room: 本次 tick 收到的 cursor:move 數}
+        self._lock = threading.Lock()
+        self._running = False
+        self._counters = {
+            'received': 0,  # 收到的 cursor:move
+            'superseded': 0,  # 送出前就被同一使用者新位置取代而丟棄
+            'frames': 0,  # 送出的 cursors:update
+            'cursors_sent': 0,  # cursors:update 內的游標總數
+            'deliveries': 0,  # 實際送達的訊息數（每則 frame × 房間人數）
+            'relay_deliveries': 0  # 逐筆轉送時會產生的訊息數
+        }
+
+    def push(self, room, cursor):
+        """記錄使用者最新游標位置（cursor 需含 user_id）"""
+        with self._lock:
+            cursors = self._pending.setdefault(room, {})
+            if cursor['user_id'] in cursors:
+                self._counters['superseded'] += 1
+            cursors[cursor['user_id']] = cursor
+            self._received[room] = self._received.get(room, 0) + 1
+            self._counters['received'] += 1
+
+    def discard(self, room, user_id):
+        """使用者游標離開或斷線：尚未送出的位置不再送出"""
+        with self._lock:
+            cursors = self._pending.get(room)
+            if cursors and cursors.pop(user_id, None) is not None and not cursors:
+                del self._pending[room]
+
+    def flush(self):
+        """送出所有房間累積的游標，回傳送出的 frame 數"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            received, self._received = self._received, {}
+
+        for room, cursors in pending.items():
+            if not cursors:
+                continue
+            self._emit('cursors:update', {'cursors': list(cursors.values())}, room)
+            # 人數每個 tick 每房間只查一次
+            room_size = self._room_size(room)
+            with self._lock:
+                self._counters['frames'] += 1
+                self._counters['cursors_sent'] += len(cursors)
+                self._counters['deliveries'] += room_size
+                self._counters['relay_deliveries'] += received.get(room, 0) * max(room_size - 1, 0)
+        return len(pending)
+
+    def run(self, sleep):
+        """背景迴圈：每 interval 秒 flush 一次；sleep 由 socketio.sleep 提供"""
+        self._running = True
+        while self._running:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.error(f'❌ 游標合併送出失敗: {exc}')
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending_rooms'] = len(self._pending)
+        stats['tick_hz'] = round(1 / self.interval, 2) if self.interval else 0
+        stats['saved'] = max(stats['relay_deliveries'] - stats['deliveries'], 0)
+        return stats
+
+
+class Presence:
+    """每個專案房間的線上使用者，附 sid → 房間 的反向索引
+
+    斷線、離開與切換標籤只需處理該 sid 所在的房間，不必掃過所有房間。
+    每位成員在房間內有一個 short_id（精簡傳輸格式用來取代 user_id/名稱/顏色）。
+    """
+
+    def __init__(self):
+        self._rooms = {}  # {project_id: {sid: {user_id, user_name, color, rich_menu_id, short_id}}}
+        self._sid_rooms = {}  # {sid: {project_id}}
+        self._lock = threading.Lock()
+
+    def join(self, project_id, sid, user_id, user_name, color):
+        """加入房間，回傳房間內其他人 {sid: info}"""
+        info = {
+            'user_id': user_id,
+            'user_name': user_name,
+            'color': color,
+            'rich_menu_id': None  # 初始尚未選擇任何標籤
+        }
+        with self._lock:
+            members = self._rooms.setdefault(project_id, {})
+            members.pop(sid, None)
+            info['short_id'] = max((item['short_id'] for item in members.values()), default=0) + 1
+            members[sid] = info
+            self._sid_rooms.setdefault(sid, set()).add(project_id)
+            return {other: dict(item) for other, item in members.items() if other != sid}
+
+    def leave(self, project_id, sid):
+        """離開房間，回傳離開者資訊；原本不在房間回傳 None"""
+        with self._lock:
+            info = self._remove(project_id, sid)
+            project_ids = self._sid_rooms.get(sid)
+            if project_ids is not None:
+                project_ids.discard(project_id)
+                if not project_ids:
+                    del self._sid_rooms[sid]
+            return info
+
+    def leave_all(self, sid):
+        """斷線：離開所有加入過的房間，回傳 [(project_id, info)]"""
+        with self._lock:
+            left = []
+            for project_id in self._sid_rooms.pop(sid, ()):
+                info = self._remove(project_id, sid)
+                if info:
+                    left.append((project_id, info))
+            return left
+
+    def member(self, project_id, sid):
+        """房間內某個連線的資訊（含 short_id）；不在房間回傳 None"""
+        info = self._rooms.get(project_id, {}).get(sid)
+        return dict(info) if info else None
+
+    def switch_tab(self, project_id, sid, rich_menu_id):
+        """記錄使用者目前的標籤；不在房間回傳 False"""
+        with self._lock:
+            info = self._rooms.get(project_id, {}).get(sid)
+            if info is None:
+                return False
+            info['rich_menu_id'] = rich_menu_id
+            return True
+
+    def room_size(self, project_id):
+        return len(self._rooms.get(project_id, ()))
+
+    def _remove(self, project_id, sid):
+        members = self._rooms.get(project_id)
+        if not members or sid not in members:
+            return None
+        info = members.pop(sid)
+        if not members:
+            del self._rooms[project_id]
+        return info
+
+    def stats(self):
+        """目前的線上狀態（gauge）"""
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'connections': len(self._sid_rooms),
+                'members': sum(len(members) for members in self._rooms.values()),
+                'largest_room': max((len(m) for m in self._rooms.values()), default=0)
+            }
+
+
+
+class SharedPresence:
+    """多 worker 部署用的線上名單：存放在共用的 SQLite（collab_presence 表）
+
+    介面與 Presence 相同。每個 worker 定期送出心跳；worker 異常結束而沒有
+    送出 disconnect 時，其他 worker 在心跳逾時後清掉它留下的連線並廣播 user:left。
+    連線的事件只會送到它所在的 worker，因此 member 只查本 worker 的連線快取。
+
+    room_size 每個游標 tick 都會呼叫，人數快取到下一次名單變動：本 worker 的
+    join／leave 立即更新，其他 worker 的變動最晚在下一次心跳時生效。
+    """
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self._members = {}  # 本 worker 的連線 {(project_id, sid): info}
+        self._room_sizes = {}  # {project_id: 人數}，心跳時清空
+
+    def join(self, project_id, sid, user_id, user_name, color):
+        own, others = db.join_collab_presence(project_id, sid, self.worker_id,
+                                              user_id, user_name, color)
+        self._members[(project_id, sid)] = _presence_info(own)
+        self._room_sizes[project_id] = len(others) + 1
+        return {row['sid']: _presence_info(row) for row in others}
+
+    def leave(self, project_id, sid):
+        self._members.pop((project_id, sid), None)
+        removed = db.leave_collab_presence(sid, project_id)
+        self._room_sizes.pop(project_id, None)
+        return _presence_info(removed[0]) if removed else None
+
+    def leave_all(self, sid):
+        for key in [key for key in self._members if key[1] == sid]:
+            del self._members[key]
+        removed = db.leave_collab_presence(sid)
+        for row in removed:
+            self._room_sizes.pop(row['project_id'], None)
+        return [(row['project_id'], _presence_info(row)) for row in removed]
+
+    def member(self, project_id, sid):
+        info = self._members.get((project_id, sid))
+        return dict(info) if info else None
+
+    def switch_tab(self, project_id, sid, rich_menu_id):
+        if (project_id, sid) in self._members:
+            self._members[(project_id, sid)]['rich_menu_id'] = rich_menu_id
+        return db.update_collab_presence_tab(project_id, sid, rich_menu_id)
+
+    def room_size(self, project_id):
+        size = self._room_sizes.get(project_id)
+        if size is None:
+            size = self._room_sizes[project_id] = db.count_collab_presence(project_id)
+        return size
+
+    def heartbeat(self, now=None):
+        """更新自己的心跳並清掉逾時 worker 的連線，回傳被清掉的 [(project_id, info)]"""
+        now = time.time() if now is None else now
+        db.heartbeat_collab_worker(self.worker_id, now)
+        removed = db.prune_collab_workers(now - config.COLLAB_WORKER_TTL)
+        self._room_sizes.clear()
+        return [(row['project_id'], _presence_info(row)) for row in removed]
+
+    def close(self):
+        db.remove_collab_worker(self.worker_id)
+
+    def stats(self):
+        return db.get_collab_presence_stats()
+
+
+def _presence_info(row):
+    return {
+        'user_id': row['user_id'],
+        'user_name': row['user_name'],
+        'color': row['color'],
+        'rich_menu_id': row['rich_menu_id'],
+        'short_id': row['short_id']
+    }
+
+
+def worker_id():
+    """本行程的識別（與排程 lease 相同格式）"""
+    return f'{socket.gethostname()}:{os.getpid()}:{_INSTANCE_ID}'
+
+
+class Locks:
+    """Rich Menu 編輯鎖：每個 (專案, Rich Menu) 最多一個持有者，附 sid → 鎖 的反向索引
+
+    鎖有 TTL，持有者須在 COLLAB_LOCK_TTL 內送出心跳；過期的鎖視為不存在，
+    由背景迴圈清掉並通知房間。斷線時釋放該 sid 的所有鎖。
+    """
+
+    def __init__(self):
+        self._locks = {}  # {(project_id, str(rich_menu_id)): lock}
+        self._sid_locks = {}  # {sid: {(project_id, str(rich_menu_id))}}
+        self._lock = threading.Lock()
+
+    def acquire(self, project_id, rich_menu_id, sid, user_id, user_name, now=None):
+        """取得或延長鎖，回傳 (是否由 sid 持有, 目前的鎖)"""
+        now = time.time() if now is None else now
+        key = (project_id, str(rich_menu_id))
+        with self._lock:
+            lock = self._active(key, now)
+            if lock is None:
+                lock = self._locks[key] = {
+                    'project_id': project_id, 'rich_menu_id': key[1], 'sid': sid,
+                    'user_id': user_id, 'user_name': user_name, 'token': uuid.uuid4().hex
+                }
+                self._sid_locks.setdefault(sid, set()).add(key)
+            if lock['sid'] == sid:
+                lock['expires_at'] = now + config.COLLAB_LOCK_TTL
+            return lock['sid'] == sid, dict(lock)
+
+    def heartbeat(self, project_id, rich_menu_id, sid, now=None):
+        """持有者延長鎖；已過期或不是持有者回傳 None"""
+        now = time.time() if now is None else now
+        with self._lock:
+            lock = self._active((project_id, str(rich_menu_id)), now)
+            if lock is None or lock['sid'] != sid:
+                return None
+            lock['expires_at'] = now + config.COLLAB_LOCK_TTL
+            return dict(lock)
+
+    def release(self, project_id, rich_menu_id, sid):
+        """持有者釋放鎖，回傳被釋放的鎖；不是持有者回傳 None"""
+        key = (project_id, str(rich_menu_id))
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None or lock['sid'] != sid:
+                return None
+            return self._remove(key)
+
+    def release_sid(self, sid, project_id=None):
+        """斷線或離開房間：釋放 sid 持有的鎖，回傳被釋放的鎖"""
+        with self._lock:
+            keys = [key for key in self._sid_locks.get(sid, ())
+                    if project_id is None or key[0] == project_id]
+            return [self._remove(key) for key in keys]
+
+    def holder(self, project_id, rich_menu_id, now=None):
+        """目前有效的鎖；project_id 為 None 時不限專案（REST 只知道 Rich Menu ID）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if project_id is not None:
+                lock = self._active((project_id, str(rich_menu_id)), now)
+                return dict(lock) if lock else None
+            for key in self._locks:
+                if key[1] == str(rich_menu_id) and self._active(key, now):
+                    return dict(self._locks[key])
+            return None
+
+    def project_locks(self, project_id, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return [dict(lock) for key, lock in self._locks.items()
+                    if key[0] == project_id and lock['expires_at'] > now]
+
+    def expire(self, now=None):
+        """清掉過期的鎖，回傳被清掉的鎖"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [self._remove(key) for key, lock in list(self._locks.items())
+                    if lock['expires_at'] <= now]
+
+    def stats(self):
+        with self._lock:
+            return {'locks': len(self._locks)}
+
+    def _active(self, key, now):
+        lock = self._locks.get(key)
+        return lock if lock is not None and lock['expires_at'] > now else None
+
+    def _remove(self, key):
+        lock = self._locks.pop(key)
+        keys = self._sid_locks.get(lock['sid'])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._sid_locks[lock['sid']]
+        return lock
+
+
+class SharedLocks:
+    """多 worker 部署用的編輯鎖：存放在共用的 SQLite（collab_locks 表），介面與 Locks 相同
+
+    worker 異常結束時它的連線不會送出 disconnect，鎖會在 TTL 後過期。
+    """
+
+    def acquire(self, project_id, rich_menu_id, sid, user_id, user_name, now=None):
+        now = time.time() if now is None else now
+        lock = db.acquire_collab_lock(project_id, str(rich_menu_id), sid, user_id, user_name,
+                                      uuid.uuid4().hex, now, now + config.COLLAB_LOCK_TTL)
+        return lock['sid'] == sid, lock
+
+    def heartbeat(self, project_id, rich_menu_id, sid, now=None):
+        now = time.time() if now is None else now
+        return db.refresh_collab_lock(project_id, str(rich_menu_id), sid,
+                                      now, now + config.COLLAB_LOCK_TTL)
+
+    def release(self, project_id, rich_menu_id, sid):
+        removed = db.release_collab_locks(sid, project_id, str(rich_menu_id))
+        return removed[0] if removed else None
+
+    def release_sid(self, sid, project_id=None):
+        return db.release_collab_locks(sid, project_id)
+
+    def holder(self, project_id, rich_menu_id, now=None):
+        now = time.time() if now is None else now
+        rows = db.list_collab_locks(now, project_id, str(rich_menu_id))
+        return rows[0] if rows else None
+
+    def project_locks(self, project_id, now=None):
+        return db.list_collab_locks(time.time() if now is None else now, project_id)
+
+    def expire(self, now=None):
+        return db.expire_collab_locks(time.time() if now is None else now)
+
+    def stats(self):
+        return {'locks': len(db.list_collab_locks(time.time()))}
+
+
+def public_lock(lock, now=None):
+    """給客戶端的鎖資訊（不含 token 與 sid）"""
+    now = time.time() if now is None else now
+    rich_menu_id = lock['rich_menu_id']
+    return {
+        'rich_menu_id': int(rich_menu_id) if rich_menu_id.isdigit() else rich_menu_id,
+        'user_id': lock['user_id'],
+        'user_name': lock['user_name'],
+        'expires_in': max(round(lock['expires_at'] - now, 1), 0)
+    }
+
+
+class AreaOpError(ValueError):
+    """區域操作無法套用；code 為 'invalid'、'stale' 或 'not_found'"""
+
+    def __init__(self, message, code='invalid'):
+        super().__init__(message)
+        self.code = code
+
+
+class MenuDocuments:
+    """專案內 Rich Menu 的伺服器端即時文件
+
+    有人開啟專案後，伺服器保有每個 Rich Menu 的權威內容（名稱、Alias、chatBarText、
+    尺寸、selected 與區域），Socket 收到的編輯直接套用在這裡，再以 persist 在停止
+    編輯一段時間後批次寫回 rich_menus；不再由每個瀏覽器各自 PUT 一次。後加入的人
+    由 project_snapshot 取得最新內容，不必等資料庫。
+
+    區域採操作式同步：每個 Rich Menu 各有版本號，每套用一個操作加一。客戶端送出
+    操作時附上它看過的版本（base_version）；期間別人刪除了區域時依操作紀錄調整
+    索引，無法調整或落後太多時回傳 stale，客戶端改以 snapshot 重新同步。
+    """
+
+    MAX_AREAS = 20  # LINE Rich Menu 上限
+    LOG_SIZE = 200
+    META_FIELDS = ('name', 'alias', 'chatBarText', 'selected')
+
+    def __init__(self, load, save=None):
+        self._load = load  # load(project_id, rich_menu_id) → {'size', 'areas', ...}，不存在回傳 None
+        self._save = save  # save([(db_id, {欄位: 值})])，單一交易寫回
+        self._docs = {}  # {(project_id, str(rich_menu_id)): {version, size, areas, meta, log, dirty, ...}}
+        self._lock = threading.Lock()
+        self._counters = {'edits': 0, 'batches': 0, 'menus_written': 0}
+
+    def apply(self, project_id, rich_menu_id, op, base_version=None):
+        """套用區域操作，回傳 (新版本, 實際套用的操作)"""
+        if not isinstance(op, dict) or op.get('type') not in self._APPLY:
+            raise AreaOpError('不支援的區域操作')
+        op = copy.deepcopy(op)
+        with self._document(project_id, rich_menu_id, create=op['type'] == 'replace') as doc:
+            self._rebase(doc, op, base_version)
+            self._APPLY[op['type']](self, doc, op)
+            doc['version'] += 1
+            doc['log'].append((doc['version'], op))
+            self._touch(doc, ('size', 'areas') if op['type'] == 'replace' else ('areas',))
+            return doc['version'], copy.deepcopy(op)
+
+    def update_metadata(self, project_id, rich_menu_id, metadata):
+        """套用 metadata 編輯（name、alias、chatBarText、size、selected），回傳實際套用的欄位
+
+        其他欄位（例如圖片路徑）由 REST 寫入，這裡忽略。
+        """
+        if not isinstance(metadata, dict):
+            raise AreaOpError('metadata 格式錯誤')
+        changes = {}
+        for key in ('name', 'alias', 'chatBarText'):
+            if key in metadata:
+                if not isinstance(metadata[key], str):
+                    raise AreaOpError(f'{key} 必須是字串')
+                changes[key] = metadata[key]
+        if 'selected' in metadata:
+            changes['selected'] = bool(metadata['selected'])
+        if 'size' in metadata:
+            changes['size'] = self._check_size(metadata['size'])
+        with self._document(project_id, rich_menu_id) as doc:
+            if not changes:
+                return {}
+            if 'size' in changes:
+                doc['size'] = changes['size']
+            for key in self.META_FIELDS:
+                if key in changes:
+                    doc['meta'][key] = changes[key]
+            self._touch(doc, changes)
+            return copy.deepcopy(changes)
+
+    def snapshot(self, project_id, rich_menu_id):
+        with self._document(project_id, rich_menu_id) as doc:
+            return self._snapshot(str(rich_menu_id), doc)
+
+    def project_snapshot(self, project_id):
+        """專案內已載入文件的最新內容（給剛加入的人）；未列出的以資料庫為準"""
+        with self._open(project_id) as docs:
+            return [self._snapshot(key, doc) for (pid, key), doc in docs.items()
+                    if pid == project_id]
+
+    def versions(self, project_id):
+        """專案內已載入的 Rich Menu 版本 {rich_menu_id: version}"""
+        with self._open(project_id) as docs:
+            return {key: doc['version'] for (pid, key), doc in docs.items()
+                    if pid == project_id}
+
+    def live_values(self):
+        """所有已載入文件的內容（含未寫回的編輯），給 upload_gc 保留仍被引用的檔案"""
+        with self._open() as docs:
+            return [self._values(doc) for doc in docs.values()]
+
+    def seed(self, project_id, rich_menu_id, metadata, alias=''):
+        """尚未存入資料庫的新 Rich Menu（richmenu:new）以客戶端內容建立文件"""
+        metadata = metadata or {}
+        key = (project_id, str(rich_menu_id))
+        with self._open(*key) as docs:
+            if key not in docs and not key[1].isdigit():
+                docs[key] = self._new_doc({**metadata, 'alias': alias})
+
+    def reload(self, rich_menu_id):
+        """REST 直接寫入資料庫後，以資料庫內容為準，重新套上尚未寫回的即時編輯
+
+        即時文件改過、REST 沒改到的欄位保留即時編輯（仍待寫回）；兩邊都改了的欄位以
+        剛寫入的資料庫內容為準，列在 overwritten 讓房間內的人收到通知。
+        回傳 [(project_id, 版本, replace 操作或 None, snapshot, overwritten)]；區域有變動時
+        以 replace 操作推進版本，讓其他人的舊操作回傳 stale。
+        """
+        key = str(rich_menu_id)
+        with self._open(rich_menu_id=key) as docs:
+            projects = [pid for pid, rid in docs if rid == key]
+        # 在鎖外讀資料庫，其他操作不必等這次查詢
+        loaded = {project_id: self._load(project_id, rich_menu_id) for project_id in projects}
+
+        reloaded = []
+        with self._open(rich_menu_id=key) as docs:
+            for project_id, fresh in loaded.items():
+                doc = docs.get((project_id, key))
+                if doc is None:
+                    continue
+                if fresh is None:
+                    del docs[(project_id, key)]
+                    continue
+                op, overwritten = self._rebase_pending(doc, self._values(self._new_doc(fresh)))
+                reloaded.append((project_id, doc['version'], op, self._snapshot(key, doc), overwritten))
+        return reloaded
+
+    def persist(self, project_id=None, force=False, now=None):
+        """把有變動的文件寫回資料庫，回傳寫入的 Rich Menu 數
+
+        最後一次編輯超過 COLLAB_PERSIST_DELAY，或第一筆未寫回的編輯超過
+        COLLAB_PERSIST_MAX_DELAY 才寫；force 時全部寫回。所有 Rich Menu 一次交易。
+        尚未存入資料庫的 Rich Menu（'rm_' 開頭）由客戶端建立，不在這裡寫入。
+        """
+        now = time.time() if now is None else now
+        with self._open(project_id, dirty=True) as docs:
+            batch = self._take_dirty(docs, project_id, force, now)
+        if not batch or self._save is None:
+            return 0
+
+        try:
+            self._save([(int(key[1]), row) for key, _, row, _ in batch])
+        except Exception:
+            # 寫入失敗：標回未寫回，下一輪再試
+            with self._open(project_id) as docs:
+                for key, fields, _, _ in batch:
+                    if key in docs:
+                        self._mark_dirty(docs[key], fields, now)
+            raise
+        with self._open(project_id) as docs:
+            for key, _, _, values in batch:
+                if key in docs:
+                    docs[key]['base'].update(values)
+        with self._lock:
+            self._counters['batches'] += 1
+            self._counters['menus_written'] += len(batch)
+        return len(batch)
+
+    def drop(self, project_id, rich_menu_id):
+        key = (project_id, str(rich_menu_id))
+        with self._open(*key) as docs:
+            docs.pop(key, None)
+
+    def drop_project(self, project_id):
+        """房間沒有人時釋放該專案的文件（未寫回的編輯須先 persist）"""
+        with self._open(project_id) as docs:
+            for key in [key for key in docs if key[0] == project_id]:
+                del docs[key]
+
+    def run(self, sleep, interval=1.0):
+        """背景迴圈：定時寫回停止編輯的文件"""
+        while True:
+            sleep(interval)
+            try:
+                self.persist()
+            except Exception as exc:
+                logger.error(f'❌ 協作文件寫回失敗: {exc}')
+
+    def stats(self):
+        with self._open() as docs:
+            edits = self._counters['edits']
+            return {
+                **self._counters,
+                'documents': len(docs),
+                'dirty': sum(1 for doc in docs.values() if doc['dirty']),
+                # 原本每個編輯、每個瀏覽器各 PUT 一次；這裡只算單一瀏覽器的下限
+                'writes_saved': max(edits - self._counters['menus_written'], 0)
+            }
+
+    @contextmanager
+    def _open(self, project_id=None, rich_menu_id=None, dirty=False):
+        """取得文件集合 {(project_id, rich_menu_id): doc}，期間其他人不能讀寫
+
+        篩選條件給共用存放（SharedDocuments）只讀出需要的文件；記憶體版直接給全部。
+        """
+        with self._lock:
+            yield self._docs
+
+    @contextmanager
+    def _document(self, project_id, rich_menu_id, create=False):
+        """取得單一文件；還沒載入時在鎖外讀資料庫，免得其他操作等這次查詢"""
+        key = (project_id, str(rich_menu_id))
+        with self._open(*key) as docs:
+            if key in docs:
+                yield docs[key]
+                return
+        loaded = self._load(project_id, rich_menu_id)
+        # 已存檔（數字 ID）的 Rich Menu 只能從資料庫載入，免得寫回別的專案
+        if loaded is None and (not create or key[1].isdigit()):
+            raise AreaOpError('找不到 Rich Menu', 'not_found')
+        with self._open(*key) as docs:
+            if key not in docs:  # 讀資料庫期間可能已有別人載入
+                docs[key] = self._new_doc(loaded or {})
+            yield docs[key]
+
+    def _take_dirty(self, docs, project_id, force, now):
+        """取出該寫回的文件並清除未寫回標記，回傳 [(key, 欄位, rich_menus 欄位, 寫回的值)]"""
+        batch = []
+        for key, doc in docs.items():
+            if not doc['dirty'] or not key[1].isdigit() or project_id not in (None, key[0]):
+                continue
+            if not force and now - doc['changed_at'] < config.COLLAB_PERSIST_DELAY and \
+                    now - doc['dirty_since'] < config.COLLAB_PERSIST_MAX_DELAY:
+                continue
+            values = {field: value for field, value in self._values(doc).items() if field in doc['dirty']}
+            batch.append((key, doc['dirty'], self._row_fields(doc, doc['dirty']), values))
+            doc.update(dirty=set(), changed_at=None, dirty_since=None)
+        return batch
+
+    def _values(self, doc):
+        """文件內容攤平成 {欄位: 值}（欄位名稱同 dirty）"""
+        return copy.deepcopy({'size': doc['size'], 'areas': doc['areas'], **doc['meta']})
+
+    def _rebase_pending(self, doc, incoming):
+        """以 incoming（資料庫最新內容）為準重新套上未寫回的編輯，回傳 (replace 操作或 None, 被覆蓋的欄位)"""
+        current = self._values(doc)
+        merged, dirty, overwritten = dict(incoming), set(), []
+        for field in doc['dirty']:
+            if current[field] == incoming[field]:
+                continue
+            if doc['base'].get(field) == incoming[field]:
+                # REST 沒改到這個欄位：保留即時編輯，之後照常寫回
+                merged[field] = current[field]
+                dirty.add(field)
+            else:
+                overwritten.append(field)
+        op = None
+        if merged['areas'] != current['areas'] or merged['size'] != current['size']:
+            op = {'type': 'replace', 'size': merged['size'], 'areas': merged['areas']}
+            doc['version'] += 1
+            doc['log'].append((doc['version'], copy.deepcopy(op)))
+        doc.update(size=copy.deepcopy(merged['size']), areas=copy.deepcopy(merged['areas']),
+                   meta={field: merged[field] for field in self.META_FIELDS},
+                   base=copy.deepcopy(incoming), dirty=dirty)
+        if not dirty:
+            doc.update(changed_at=None, dirty_since=None)
+        return copy.deepcopy(op), sorted(overwritten)
+
+    def _new_doc(self, loaded):
+        doc = {
+            'version': 0,
+            'size': dict(loaded.get('size') or {}),
+            'areas': copy.deepcopy(loaded.get('areas') or []),
+            'meta': {
+                'name': loaded.get('name') or '',
+                'alias': loaded.get('alias') or '',
+                'chatBarText': loaded.get('chatBarText') or '',
+                'selected': bool(loaded.get('selected'))
+            },
+            'log': deque(maxlen=self.LOG_SIZE),
+            'dirty': set(),  # 尚未寫回的欄位
+            'changed_at': None,
+            'dirty_since': None
+        }
+        doc['base'] = self._values(doc)  # 最後一次載入或寫回時的內容，reload 時判斷哪邊改過
+        return doc
+
+    def _snapshot(self, key, doc):
+        return {
+            'rich_menu_id': int(key) if key.isdigit() else key,
+            'version': doc['version'],
+            'size': dict(doc['size']),
+            'areas': copy.deepcopy(doc['areas']),
+            **doc['meta']
+        }
+
+    def _touch(self, doc, fields):
+        self._counters['edits'] += 1
+        self._mark_dirty(doc, fields, time.time())
+
+    def _mark_dirty(self, doc, fields, now):
+        doc['dirty'] |= set(fields)
+        doc['changed_at'] = now
+        if doc['dirty_since'] is None:
+            doc['dirty_since'] = now
+
+    def _row_fields(self, doc, fields):
+        """文件欄位轉成 rich_menus 欄位"""
+        row = {}
+        if 'areas' in fields:
+            row['areas'] = copy.deepcopy(doc['areas'])
+        if 'size' in fields and doc['size']:
+            row['size_width'] = doc['size']['width']
+            row['size_height'] = doc['size']['height']
+        if 'name' in fields:
+            row['name'] = doc['meta']['name']
+        if 'alias' in fields:
+            row['alias'] = doc['meta']['alias']
+        if 'chatBarText' in fields:
+            row['chat_bar_text'] = doc['meta']['chatBarText']
+        if 'selected' in fields:
+            row['selected'] = doc['meta']['selected']
+        return row
+
+    def _rebase(self, doc, op, base_version):
+        """把根據 base_version 產生的操作調整到目前版本"""
+        if base_version is None or base_version == doc['version']:
+            return
+        if not isinstance(base_version, int) or base_version > doc['version']:
+            raise AreaOpError('版本不一致', 'stale')
+        if not doc['log'] or doc['log'][0][0] > base_version + 1:
+            raise AreaOpError('落後太多版本', 'stale')
+        if 'index' not in op:
+            return
+        for version, applied in doc['log']:
+            if version <= base_version:
+                continue
+            if applied['type'] == 'replace':
+                raise AreaOpError('區域已被整批更新', 'stale')
+            if applied['type'] == 'delete' and isinstance(op['index'], int):
+                if applied['index'] == op['index']:
+                    raise AreaOpError('區域已被刪除', 'stale')
+                if applied['index'] < op['index']:
+                    op['index'] -= 1
+
+    def _index(self, doc, op):
+        index = op.get('index')
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(doc['areas']):
+            raise AreaOpError('區域索引超出範圍', 'stale')
+        return index
+
+    def _check_bounds(self, doc, bounds):
+        if not isinstance(bounds, dict):
+            raise AreaOpError('bounds 格式錯誤')
+        values = [bounds.get(key) for key in ('x', 'y', 'width', 'height')]
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            raise AreaOpError('bounds 必須為整數')
+        x, y, width, height = values
+        if x < 0 or y < 0 or width < 1 or height < 1:
+            raise AreaOpError('bounds 超出範圍')
+        size = doc['size']
+        if size.get('width') and x + width > size['width'] or \
+                size.get('height') and y + height > size['height']:
+            raise AreaOpError('區域超出 Rich Menu 範圍')
+        return {'x': x, 'y': y, 'width': width, 'height': height}
+
+    def _check_size(self, size):
+        if not isinstance(size, dict) or not all(
+                isinstance(size.get(key), int) and not isinstance(size.get(key), bool) and size[key] > 0
+                for key in ('width', 'height')):
+            raise AreaOpError('size 格式錯誤')
+        return {'width': size['width'], 'height': size['height']}
+
+    def _check_action(self, action):
+        if action is None:
+            return None
+        if not isinstance(action, dict) or not isinstance(action.get('type'), str):
+            raise AreaOpError('action 格式錯誤')
+        return action
+
+    def _check_area(self, doc, area):
+        if not isinstance(area, dict):
+            raise AreaOpError('區域格式錯誤')
+        checked = {'bounds': self._check_bounds(doc, area.get('bounds'))}
+        action = self._check_action(area.get('action'))
+        if action is not None:
+            checked['action'] = action
+        return checked
+
+    def _apply_add(self, doc, op):
+        if len(doc['areas']) >= self.MAX_AREAS:
+            raise AreaOpError(f'區域最多 {self.MAX_AREAS} 個')
+        op['area'] = self._check_area(doc, op.get('area'))
+        op['index'] = len(doc['areas'])
+        doc['areas'].append(copy.deepcopy(op['area']))
+
+    def _apply_bounds(self, doc, op):
+        index = self._index(doc, op)
+        op['bounds'] = self._check_bounds(doc, op.get('bounds'))
+        doc['areas'][index]['bounds'] = dict(op['bounds'])
+
+    def _apply_action(self, doc, op):
+        index = self._index(doc, op)
+        action = self._check_action(op.get('action'))
+        if action is None:
+            doc['areas'][index].pop('action', None)
+        else:
+            doc['areas'][index]['action'] = copy.deepcopy(action)
+
+    def _apply_delete(self, doc, op):
+        del doc['areas'][self._index(doc, op)]
+
+    def _apply_replace(self, doc, op):
+        if op.get('size') is not None:
+            doc['size'] = self._check_size(op['size'])
+        areas = op.get('areas')
+        if not isinstance(areas, list) or len(areas) > self.MAX_AREAS:
+            raise AreaOpError(f'areas 必須是最多 {self.MAX_AREAS} 個區域的陣列')
+        op['areas'] = [self._check_area(doc, area) for area in areas]
+        doc['areas'] = copy.deepcopy(op['areas'])
+
+    _APPLY = {
+        'add': _apply_add,
+        'bounds': _apply_bounds,
+        'action': _apply_action,
+        'delete': _apply_delete,
+        'replace': _apply_replace
+    }
+
+
+class SharedDocuments(MenuDocuments):
+    """多 worker 部署用的即時文件：存放在共用的 SQLite（collab_documents 表），介面與 MenuDocuments 相同
+
+    每次讀寫都在一個寫入交易內讀出文件、修改後寫回，版本號與操作紀錄因此由所有
+    worker 共用：協作者不論連到哪個 worker，收到的操作都屬於同一串版本。
+    """
+
+    def persist(self, project_id=None, force=False, now=None):
+        """同 MenuDocuments.persist，但取出文件與寫入 rich_menus 在同一個交易
+
+        save 為 save(cursor, [(db_id, {欄位: 值})])。兩個 worker 同時寫回時不會有
+        較舊的內容晚一步蓋掉較新的；寫入失敗時整個交易還原，文件仍標為未寫回。
+        """
+        now = time.time() if now is None else now
+        with db.collab_document_transaction() as cursor:
+            with self._documents(cursor, project_id, dirty=True) as docs:
+                batch = self._take_dirty(docs, project_id, force, now)
+                for key, _, _, values in batch:
+                    docs[key]['base'].update(values)
+            if batch and self._save is not None:
+                self._save(cursor, [(int(key[1]), row) for key, _, row, _ in batch])
+        if not batch or self._save is None:
+            return 0
+        with self._lock:
+            self._counters['batches'] += 1
+            self._counters['menus_written'] += len(batch)
+        return len(batch)
+
+    @contextmanager
+    def _open(self, project_id=None, rich_menu_id=None, dirty=False):
+        with db.collab_document_transaction() as cursor:
+            with self._documents(cursor, project_id, rich_menu_id, dirty) as docs:
+                yield docs
+
+    @contextmanager
+    def _documents(self, cursor, project_id=None, rich_menu_id=None, dirty=False):
+        """在呼叫端的交易內讀出文件，離開時寫回有變動的"""
+        stored = db.load_collab_documents(cursor, project_id, rich_menu_id, dirty)
+        docs = {key: self._decode(state) for key, state in stored.items()}
+        yield docs
+        changed = {}
+        for key, doc in docs.items():
+            state = self._encode(doc)
+            if state != stored.get(key):
+                changed[key] = (state, bool(doc['dirty']))
+        db.store_collab_documents(cursor, changed, [key for key in stored if key not in docs])
+
+    def _encode(self, doc):
+        return json.dumps({**doc, 'log': list(doc['log']), 'dirty': sorted(doc['dirty'])},
+                          ensure_ascii=False, sort_keys=True)
+
+    def _decode(self, state):
+        doc = json.loads(state)
+        doc['log'] = deque((tuple(entry) for entry in doc['log']), maxlen=self.LOG_SIZE)
+        doc['dirty'] = set(doc['dirty'])
+        return doc
+
+
+def _load_menu_document(project_id, rich_menu_id):
+    """從資料庫載入 Rich Menu；只接受屬於該專案的 Rich Menu"""
+    if not str(rich_menu_id).isdigit():
+        return None
+    rm = db.get_rich_menu(int(rich_menu_id))
+    if not rm or str(rm['project_id']) != str(project_id):
+        return None
+    return {**rm['metadata'], 'name': rm['name'], 'alias': rm['alias']}
+
+
+presence = Presence()
+locks = Locks()
+documents = MenuDocuments(_load_menu_document, db.update_rich_menus)
+cursors = None
+_emit = None
+
+
+def init(emit, start_background_task, sleep):
+    """由 app.py 呼叫：選擇線上名單與編輯鎖的存放方式，並啟動游標合併、心跳、
+    文件寫回與鎖過期的背景迴圈
+
+    設定 SOCKETIO_MESSAGE_QUEUE（多 worker）時線上名單、編輯鎖與即時文件改存共用資料庫；
+    COLLAB_CURSOR_HZ <= 0 時不合併游標。
+    """
+    global presence, locks, documents, cursors, _emit
+    _emit = emit
+    if config.SOCKETIO_MESSAGE_QUEUE:
+        presence = SharedPresence(worker_id())
+        locks = SharedLocks()
+        documents = SharedDocuments(_load_menu_document, db.update_rich_menu_rows)
+        presence.heartbeat()
+        start_background_task(_heartbeat_loop, presence, emit, sleep)
+        atexit.register(presence.close)
+        logger.info(f'🔗 Socket.IO 多 worker 模式（{presence.worker_id}）')
+    else:
+        presence = Presence()
+        locks = Locks()
+        documents = MenuDocuments(_load_menu_document, db.update_rich_menus)
+
+    if config.COLLAB_CURSOR_HZ <= 0:
+        cursors = None
+    else:
+        cursors = CursorAggregator(
+            lambda event, payload, room: emit_cursors(emit, payload['cursors'], room),
+            1.0 / config.COLLAB_CURSOR_HZ, presence.room_size
+        )
+        start_background_task(cursors.run, sleep)
+
+    start_background_task(documents.run, sleep)
+    start_background_task(_lock_expiry_loop, emit, sleep)
+    atexit.register(_persist_documents)
+    return presence
+
+
+def emit_cursors(emit, cursors, project_id):
+    """游標送給房間：JSON 客戶端收 cursors:update，msgpack 客戶端收 c:cursors"""
+    legacy = [{key: value for key, value in cursor.items() if key != 'short_id'} for cursor in cursors]
+    emit('cursors:update', {'cursors': legacy}, collab_wire.room(project_id, collab_wire.JSON))
+    compact = [cursor for cursor in cursors if cursor.get('short_id')]
+    if compact:
+        emit('c:cursors', collab_wire.encode_cursors(compact),
+             collab_wire.room(project_id, collab_wire.MSGPACK))
+
+
+def _lock_expiry_loop(emit, sleep):
+    while True:
+        sleep(max(config.COLLAB_LOCK_TTL / 3, 1))
+        try:
+            for lock in locks.expire():
+                emit('richmenu:unlocked', {**public_lock(lock), 'reason': 'expired'},
+                     lock['project_id'])
+        except Exception as exc:
+            logger.error(f'❌ 清除過期編輯鎖失敗: {exc}')
+
+
+def lock_conflict(project_id, rich_menu_id, sid=None, token=None):
+    """別人持有 Rich Menu 的編輯鎖時回傳該鎖（public_lock），否則 None
+
+    持有者以 sid（Socket）或 token（REST 的 X-Lock-Token 標頭）辨識。
+    """
+    lock = locks.holder(project_id, rich_menu_id)
+    if lock is None or sid is not None and lock['sid'] == sid or \
+            token is not None and lock['token'] == token:
+        return None
+    return public_lock(lock)
+
+
+def _persist_documents():
+    """結束前寫回所有未寫回的編輯"""
+    try:
+        documents.persist(force=True)
+    except Exception as exc:
+        logger.error(f'❌ 協作文件寫回失敗: {exc}')
+
+
+def release_project(project_id):
+    """房間最後一人離開：先寫回再釋放該專案的文件"""
+    try:
+        documents.persist(project_id, force=True)
+    except Exception as exc:
+        # 寫回失敗時保留文件，交給背景迴圈重試
+        logger.error(f'❌ 協作文件寫回失敗: {exc}')
+        return
+    documents.drop_project(project_id)
+
+
+def refresh_rich_menu(rich_menu_id):
+    """REST 直接更新 Rich Menu 後同步已載入的文件，並通知房間內的人
+
+    即時編輯被 REST 寫入蓋掉的欄位另外送 richmenu:edits_overwritten 提醒。
+    """
+    for project_id, version, op, snapshot, overwritten in documents.reload(rich_menu_id):
+        if _emit is None:
+            continue
+        if overwritten:
+            _emit('richmenu:edits_overwritten', {'rich_menu_id': snapshot['rich_menu_id'],
+                                                 'fields': overwritten}, project_id)
+        if op is not None:
+            _emit('richmenu:area_op', {'rich_menu_id': snapshot['rich_menu_id'], 'version': version,
+                                       'op': op, 'sender': 'server'}, project_id)
+        metadata = {key: snapshot[key] for key in ('name', 'alias', 'chatBarText', 'size', 'selected')}
+        _emit('richmenu:update_metadata', {'rich_menu_id': snapshot['rich_menu_id'],
+                                           'metadata': metadata, 'sender': 'server'}, project_id)
+
+
+def _heartbeat_loop(shared, emit, sleep):
+    while True:
+        sleep(config.COLLAB_WORKER_HEARTBEAT_SECONDS)
+        try:
+            removed = shared.heartbeat()
+            for project_id, info in removed:
+                emit('user:left', {'user_id': info['user_id'], 'short_id': info['short_id'],
+                                   'user_name': info['user_name']}, project_id)
+            # 異常結束的 worker 留下的空房間：寫回並釋放共用的即時文件
+            for project_id in {project_id for project_id, _ in removed}:
+                if not shared.room_size(project_id):
+                    release_project(project_id)
+        except Exception as exc:
+            logger.error(f'❌ 協作 worker 心跳失敗: {exc}')
+
+
+def get_stats():
+    """協作相關統計（/api/collab/stats）"""
+    return {
+        'presence': presence.stats(),
+        'cursors': cursors.stats() if cursors else None,
+        'documents': documents.stats(),
+        'locks': locks.stats()
+    }
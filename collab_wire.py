@@ -0,0 +1,101 @@
+# collab_wire.py - 協作事件的精簡傳輸格式（msgpack）
+#
+# 游標、區域操作與標籤切換是最頻繁的協作事件；JSON 版本每則都帶著 user_id、
+# user_name、color 等字串。加入專案時以 wire='msgpack' 宣告支援精簡格式的客戶端：
+#   - 使用者以房間內的短整數 short_id 表示（加入時配發，名稱與顏色由 users:list 取得）
+#   - 相對座標量化為 0..QUANT 的整數
+#   - 內容以 msgpack 陣列編碼成 bytes，經 Socket.IO 的 binary 附件傳送
+# 房間內的客戶端依格式再分到子房間，同一事件對 JSON 與 msgpack 客戶端各送一次；
+# 沒有宣告的舊客戶端照舊收 JSON。
+#
+# 精簡事件（伺服器 → 客戶端）：
+#   c:cursors       [short_id, rich_menu_id, qx, qy, short_id, rich_menu_id, qx, qy, ...]
+#   c:cursor_leave  [short_id, rich_menu_id]
+#   c:tab           [short_id, rich_menu_id]
+#   c:area_op       [rich_menu_id, version, sender short_id（0 為伺服器）, op]
+# 客戶端 → 伺服器（事件名稱不變，內容改為 bytes）：
+#   cursor:move     [project_id, rich_menu_id, qx, qy]
+#   cursor:leave    [project_id, rich_menu_id]
+#   tab:switch      [project_id, rich_menu_id]
+
+import msgpack
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+WIRES = (JSON, MSGPACK)
+QUANT = 10000  # 相對座標解析度（2500 px 寬約 0.25 px）
+
+
+def room(project_id, wire):
+    """專案房間內某種格式的子房間"""
+    return f'{project_id}:{wire}'
+
+
+def negotiate(requested):
+    """客戶端在 join_project 宣告的格式；不認得的一律 JSON"""
+    return requested if requested in WIRES else JSON
+
+
+def quantise(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return int(round(min(max(value, 0.0), 1.0) * QUANT))
+
+
+def dequantise(value):
+    return min(max(int(value), 0), QUANT) / QUANT
+
+
+def pack(items):
+    return msgpack.packb(items, use_bin_type=True)
+
+
+def unpack(data):
+    """解開客戶端送來的 msgpack 陣列；格式不符時丟出 ValueError"""
+    try:
+        items = msgpack.unpackb(bytes(data), raw=False)
+    except Exception as exc:
+        raise ValueError(f'無法解析 msgpack: {exc}') from exc
+    if not isinstance(items, list):
+        raise ValueError('msgpack 內容必須是陣列')
+    return items
+
+
+def encode_cursors(cursors):
+    """合併後的游標（含 short_id 的 dict）→ c:cursors"""
+    items = []
+    for cursor in cursors:
+        items += [cursor['short_id'], cursor['rich_menu_id'],
+                  quantise(cursor['relative_x']), quantise(cursor['relative_y'])]
+    return pack(items)
+
+
+def encode_cursor_leave(short_id, rich_menu_id):
+    return pack([short_id, rich_menu_id])
+
+
+def encode_tab(short_id, rich_menu_id):
+    return pack([short_id, rich_menu_id])
+
+
+def encode_area_op(rich_menu_id, version, short_id, op):
+    return pack([rich_menu_id, version, short_id or 0, op])
+
+
+def decode_cursor(data):
+    """cursor:move → (project_id, rich_menu_id, relative_x, relative_y)"""
+    items = unpack(data)
+    if len(items) != 4:
+        raise ValueError('cursor:move 格式錯誤')
+    project_id, rich_menu_id, qx, qy = items
+    return str(project_id), rich_menu_id, dequantise(qx), dequantise(qy)
+
+
+def decode_target(data):
+    """cursor:leave / tab:switch → (project_id, rich_menu_id)"""
+    items = unpack(data)
+    if len(items) != 2:
+        raise ValueError('事件格式錯誤')
+    return str(items[0]), items[1]
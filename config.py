@@ -14,6 +14,26 @@ DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'database.db')
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
+# 縮圖與 LINE 用 JPEG 在獨立行程產生；設為 0 則在請求行程內同步處理（測試用）
+IMAGE_PROCESS_WORKERS = int(os.environ.get('IMAGE_PROCESS_WORKERS', 2))
+
+# Rich Menu 圖片允許的尺寸與各尺寸的檔案大小上限（bytes）；只讀檔頭即可判斷，超過直接拒絕
+RICHMENU_IMAGE_MAX_BYTES = {
+    (2500, 1686): 12 * 1024 * 1024,
+    (2500, 843): 8 * 1024 * 1024,
+    (1200, 810): 4 * 1024 * 1024
+}
+
+# 設定後 /api/uploads 只做權限與快取判斷，檔案交給 NGINX 的 internal location 傳送
+# （例如 '/protected-uploads'，需與 nginx_line-setting.conf 一致）；留空則由 Flask 直接傳送
+UPLOADS_X_ACCEL_PREFIX = os.environ.get('UPLOADS_X_ACCEL_PREFIX', '')
+
+# 孤兒上傳檔清理（upload_gc.py）：由排程 leader 定期執行；寬限期內的新檔案不會被刪
+# 寬限期須長於協作寫回延遲（COLLAB_PERSIST_MAX_DELAY）加上一次編輯工作階段，
+# 單一 worker 時命令列清理看不到未寫回的即時文件，只能靠寬限期保護
+UPLOAD_GC_INTERVAL_HOURS = float(os.environ.get('UPLOAD_GC_INTERVAL_HOURS', 6))
+UPLOAD_GC_GRACE_HOURS = float(os.environ.get('UPLOAD_GC_GRACE_HOURS', 24))
+UPLOAD_GC_BATCH_SIZE = 200
 
 # IP 白名單（只允許這些 IP 存取）
 ALLOWED_IPS = [
@@ -28,14 +48,31 @@ ALLOWED_IPS = [
 # LINE Login API 端點（預留）
 LINE_LOGIN_VERIFY_API = os.environ.get('LINE_LOGIN_VERIFY_API', '')
 
-# LINE API 基礎 URL
-LINE_API_BASE = 'https://api.line.me'
-LINE_API_DATA_BASE = 'https://api-data.line.me'
+# LINE API 基礎 URL（可用環境變數指向 fake_line_api.py 的本機替身，離線測試與壓測用）
+LINE_API_BASE = os.environ.get('LINE_API_BASE', 'https://api.line.me')
+LINE_API_DATA_BASE = os.environ.get('LINE_API_DATA_BASE', 'https://api-data.line.me')
+
+# 排程 leader 選舉（多 worker / 多副本時只有持有 lease 的行程會執行排程）
+SCHEDULER_LEASE_TTL = int(os.environ.get('SCHEDULER_LEASE_TTL', 30))  # 秒；leader 失聯超過此時間即由其他行程接手
+SCHEDULER_HEARTBEAT_SECONDS = int(os.environ.get('SCHEDULER_HEARTBEAT_SECONDS', 10))
 
 # Socket.IO 設定
-SOCKETIO_MESSAGE_QUEUE = None
+# 多 worker 時設定訊息佇列（redis://... 需安裝 redis 套件，amqp:// 等需安裝 kombu）；
+# 設定後線上名單改存資料庫，各 worker 共用
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
 SOCKETIO_CORS_ALLOWED_ORIGINS = '*'
 
+# 游標合併送出頻率（每秒 cursors:update 次數）；設為 0 則每個 cursor:move 立即轉送
+COLLAB_CURSOR_HZ = float(os.environ.get('COLLAB_CURSOR_HZ', 20))
+# 多 worker 模式的 worker 心跳；超過 TTL 沒有心跳的 worker 留下的連線由其他 worker 清除
+COLLAB_WORKER_HEARTBEAT_SECONDS = 10
+COLLAB_WORKER_TTL = 30
+# 協作即時文件：最後一次編輯後等待多久批次寫回資料庫（秒），持續編輯時最長延遲
+COLLAB_PERSIST_DELAY = float(os.environ.get('COLLAB_PERSIST_DELAY', 2))
+COLLAB_PERSIST_MAX_DELAY = float(os.environ.get('COLLAB_PERSIST_MAX_DELAY', 10))
+# Rich Menu 編輯鎖：持有者須在 TTL（秒）內送出心跳，否則自動釋放
+COLLAB_LOCK_TTL = float(os.environ.get('COLLAB_LOCK_TTL', 30))
+
 # 確保上傳資料夾存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
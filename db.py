@@ -2,10 +2,13 @@
 
 import sqlite3
 import json
-from datetime import datetime
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from cryptography.fernet import Fernet
 import os
 import config
+import migrations
 
 # 加密金鑰（用於加密 Channel Access Token）
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY')
@@ -31,177 +34,9 @@ def get_db():
     return conn
 
 def init_db():
-    """初始化資料庫表結構"""
+    """初始化資料庫：套用尚未執行的 schema 遷移（見 migrations.py）"""
     conn = get_db()
-    cursor = conn.cursor()
-    
-    # accounts 表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS accounts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            channel_access_token TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-    ''')
-    
-    # projects 表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS projects (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            account_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            description TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE,
-            UNIQUE (account_id, name)
-        )
-    ''')
-    
-    # rich_menus 表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS rich_menus (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            project_id INTEGER NOT NULL,
-            rich_menu_id TEXT,
-            name TEXT NOT NULL,
-            alias TEXT,
-            chat_bar_text TEXT,
-            size_width INTEGER NOT NULL DEFAULT 2500,
-            size_height INTEGER NOT NULL DEFAULT 1686,
-            selected BOOLEAN NOT NULL DEFAULT 1,
-            areas TEXT,
-            image_path TEXT,
-            thumbnail_path TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY (project_id) REFERENCES projects (id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # aliases 表（用於 LINE API alias 管理）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS aliases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            account_id INTEGER NOT NULL,
-            alias_id TEXT NOT NULL,
-            rich_menu_id TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE,
-            UNIQUE (account_id, alias_id)
-        )
-    ''')
-    
-    # images 表（圖片元數據）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            rich_menu_id INTEGER NOT NULL,
-            original_path TEXT NOT NULL,
-            thumbnail_path TEXT,
-            content_type TEXT NOT NULL,
-            size_bytes INTEGER NOT NULL,
-            FOREIGN KEY (rich_menu_id) REFERENCES rich_menus (id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # flex_messages 表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS flex_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            json_content TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-    ''')
-    
-    # scheduled_jobs 表（定時排程上傳）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scheduled_jobs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            project_id INTEGER NOT NULL,
-            scope TEXT NOT NULL DEFAULT 'all',
-            current_tab_index INTEGER DEFAULT 0,
-            publish_target TEXT NOT NULL DEFAULT 'all',
-            user_ids TEXT,
-            default_menu_index INTEGER DEFAULT -1,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            run_time TEXT NOT NULL DEFAULT '00:00',
-            repeat_type TEXT NOT NULL DEFAULT 'daily',
-            repeat_weekday INTEGER,
-            repeat_day INTEGER,
-            enabled INTEGER NOT NULL DEFAULT 1,
-            last_run_at TEXT,
-            last_run_status TEXT,
-            last_run_message TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY (project_id) REFERENCES projects (id) ON DELETE CASCADE
-        )
-    ''')
-
-    # broadcast_events 表（LINE Biz 後台手動群發續傳事件）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS broadcast_events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            bot_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            description TEXT,
-            status TEXT NOT NULL DEFAULT 'active',
-            selected_filters TEXT,
-            message_plan TEXT,
-            created_by TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL
-        )
-    ''')
-
-    # broadcast_event_contacts 表（事件的目標聯絡人快照與進度）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS broadcast_event_contacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            event_id INTEGER NOT NULL,
-            contact_id TEXT NOT NULL,
-            display_name TEXT,
-            profile_name TEXT,
-            nickname TEXT,
-            tags TEXT,
-            position INTEGER NOT NULL DEFAULT 0,
-            status TEXT NOT NULL DEFAULT 'pending',
-            sent_count INTEGER NOT NULL DEFAULT 0,
-            failed_count INTEGER NOT NULL DEFAULT 0,
-            last_error TEXT,
-            last_actor TEXT,
-            last_sent_at TEXT,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY (event_id) REFERENCES broadcast_events (id) ON DELETE CASCADE,
-            UNIQUE (event_id, contact_id)
-        )
-    ''')
-
-    # broadcast_event_logs 表（每次送出或失敗的細節）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS broadcast_event_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            event_id INTEGER NOT NULL,
-            contact_id TEXT,
-            message_index INTEGER,
-            message_type TEXT,
-            status TEXT NOT NULL,
-            actor TEXT,
-            error TEXT,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY (event_id) REFERENCES broadcast_events (id) ON DELETE CASCADE
-        )
-    ''')
-
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_events_bot_id ON broadcast_events (bot_id, updated_at)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_contacts_event_status ON broadcast_event_contacts (event_id, status)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_logs_event ON broadcast_event_logs (event_id, created_at)')
-    
-    conn.commit()
+    migrations.migrate(conn)
     conn.close()
     print('✓ 資料庫初始化完成')
 
@@ -332,7 +167,7 @@ def get_project(project_id):
     
     # 取得該專案的所有 Rich Menu
     cursor.execute('''
-        SELECT * FROM rich_menus WHERE project_id = ? ORDER BY created_at ASC
+        SELECT * FROM rich_menus WHERE project_id = ? ORDER BY created_at ASC, id ASC
     ''', (project_id,))
     rich_menu_rows = cursor.fetchall()
     
@@ -354,6 +189,8 @@ def get_project(project_id):
             },
             'image_path': rm['image_path'],
             'thumbnail_path': rm['thumbnail_path'],
+            'image_status': rm['image_status'],
+            'version': rm['version'],
             'created_at': rm['created_at'],
             'updated_at': rm['updated_at']
         })
@@ -368,6 +205,24 @@ def get_project(project_id):
         'updated_at': project_row['updated_at']
     }
 
+def get_project_version(project_id):
+    """專案與其 Rich Menu 的版本資訊（ETag 用，單一查詢）；專案不存在回傳 None
+    
+    Rich Menu 數量涵蓋刪除，最新的 updated_at 涵蓋新增與修改。
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT p.updated_at,
+               (SELECT COUNT(*) FROM rich_menus WHERE project_id = p.id) AS rich_menu_count,
+               (SELECT MAX(updated_at) FROM rich_menus WHERE project_id = p.id) AS rich_menu_updated_at
+        FROM projects p
+        WHERE p.id = ?
+    ''', (project_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return tuple(row) if row else None
+
 def list_projects_by_account(account_id):
     """列出該帳號的所有專案"""
     conn = get_db()
@@ -424,12 +279,7 @@ def check_project_name_exists(account_id, name):
 
 # === Rich Menus API ===
 
-def create_rich_menu(project_id, name, alias='', metadata=None):
-    """新增 Rich Menu"""
-    conn = get_db()
-    cursor = conn.cursor()
-    now = datetime.utcnow().isoformat()
-    
+def _insert_rich_menu(cursor, project_id, name, alias, metadata, now):
     if metadata is None:
         metadata = {
             'size': {'width': 2500, 'height': 1686},
@@ -452,9 +302,17 @@ def create_rich_menu(project_id, name, alias='', metadata=None):
         json.dumps(metadata.get('areas', [])),
         now, now
     ))
+    return cursor.lastrowid
+
+def create_rich_menu(project_id, name, alias='', metadata=None):
+    """新增 Rich Menu"""
+    conn = get_db()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    
+    rm_id = _insert_rich_menu(cursor, project_id, name, alias, metadata, now)
     
     conn.commit()
-    rm_id = cursor.lastrowid
     conn.close()
     return rm_id
 
@@ -482,11 +340,56 @@ def get_rich_menu(rich_menu_id):
             },
             'image_path': row['image_path'],
             'thumbnail_path': row['thumbnail_path'],
+            'image_status': row['image_status'],
+            'version': row['version'],
             'created_at': row['created_at'],
             'updated_at': row['updated_at']
         }
     return None
 
+_RICH_MENU_UPDATE_FIELDS = ['name', 'alias', 'chat_bar_text', 'rich_menu_id',
+                            'size_width', 'size_height', 'selected', 'areas',
+                            'image_path', 'thumbnail_path', 'image_status']
+
+# 使用者編輯的欄位：只有這些欄位的值真的改變時版本才加一。
+# rich_menu_id（發佈）、縮圖與圖片處理狀態由背景寫入，不讓持有版本的客戶端收到 412。
+_RICH_MENU_CONTENT_FIELDS = ('name', 'alias', 'chat_bar_text', 'size_width', 'size_height',
+                             'selected', 'areas', 'image_path')
+
+def _update_rich_menu_row(cursor, db_id, fields, now, expected_version=None):
+    """更新一列；使用者編輯的欄位有變動時版本加一，指定 expected_version 時只在版本相符時寫入"""
+    updates = []
+    values = []
+    changed = []
+    changed_values = []
+    
+    for key, value in fields.items():
+        if key in _RICH_MENU_UPDATE_FIELDS:
+            if key == 'areas' and isinstance(value, (list, dict)):
+                value = json.dumps(value)
+            updates.append(f'{key} = ?')
+            values.append(value)
+            if key in _RICH_MENU_CONTENT_FIELDS:
+                # SET 的右側讀到的是更新前的值
+                changed.append(f'{key} IS NOT ?')
+                changed_values.append(value)
+    
+    if not updates:
+        return False
+    
+    updates.append('updated_at = ?')
+    values.append(now)
+    if changed:
+        updates.append(f'version = version + (CASE WHEN {" OR ".join(changed)} THEN 1 ELSE 0 END)')
+        values.extend(changed_values)
+    values.append(db_id)
+    sql = f'UPDATE rich_menus SET {", ".join(updates)} WHERE id = ?'
+    if expected_version is not None:
+        sql += ' AND version = ?'
+        values.append(expected_version)
+    cursor.execute(sql, values)
+    return cursor.rowcount > 0
+
 def update_rich_menu(db_id, **kwargs):
     """更新 Rich Menu
     
@@ -498,39 +401,200 @@ def update_rich_menu(db_id, **kwargs):
     cursor = conn.cursor()
     now = datetime.utcnow().isoformat()
     
-    allowed_fields = ['name', 'alias', 'chat_bar_text', 'rich_menu_id', 
-                      'size_width', 'size_height', 'selected', 'areas',
-                      'image_path', 'thumbnail_path']
-    
-    updates = []
-    values = []
+    if _update_rich_menu_row(cursor, db_id, kwargs, now):
+        conn.commit()
     
-    for key, value in kwargs.items():
-        if key in allowed_fields:
-            if key == 'areas' and isinstance(value, (list, dict)):
-                value = json.dumps(value)
-            updates.append(f'{key} = ?')
-            values.append(value)
+    conn.close()
+
+def update_rich_menu_if_version(db_id, fields, expected_version):
+    """樂觀並行控制：版本仍是 expected_version 時才更新，回傳新版本；版本不符回傳 None"""
+    conn = get_db()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
     
-    if updates:
-        updates.append('updated_at = ?')
-        values.append(now)
-        values.append(db_id)
-        
-        sql = f'UPDATE rich_menus SET {", ".join(updates)} WHERE id = ?'
-        cursor.execute(sql, values)
+    version = None
+    if _update_rich_menu_row(cursor, db_id, fields, now, expected_version):
+        cursor.execute('SELECT version FROM rich_menus WHERE id = ?', (db_id,))
+        version = cursor.fetchone()['version']
         conn.commit()
     
     conn.close()
+    return version
+
+def get_rich_menu_etag_state(rich_menu_id):
+    """GET 的 ETag 來源：版本加上背景寫入的欄位（主鍵查詢）；不存在回傳 None"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT version, rich_menu_id, thumbnail_path, image_status FROM rich_menus WHERE id = ?
+    ''', (rich_menu_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return tuple(row) if row else None
+
+def get_rich_menu_version(rich_menu_id):
+    """只取 Rich Menu 的版本（主鍵查詢）；不存在回傳 None"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM rich_menus WHERE id = ?', (rich_menu_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row['version'] if row else None
+
+def update_rich_menus(updates):
+    """批次更新多個 Rich Menu（協作即時文件寫回），全部在同一個交易內
+    
+    Args:
+        updates: [(db_id, {欄位: 值})]，欄位同 update_rich_menu
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    update_rich_menu_rows(cursor, updates)
+    conn.commit()
+    conn.close()
+
+def update_rich_menu_rows(cursor, updates):
+    """同 update_rich_menus，但在呼叫端的交易內寫入（多 worker 的協作文件寫回）"""
+    now = datetime.utcnow().isoformat()
+    for db_id, fields in updates:
+        _update_rich_menu_row(cursor, db_id, fields, now)
+
+def _delete_rich_menu_rows(cursor, rich_menu_id):
+    cursor.execute('DELETE FROM rich_menus WHERE id = ?', (rich_menu_id,))
+    cursor.execute('DELETE FROM images WHERE rich_menu_id = ?', (rich_menu_id,))
 
 def delete_rich_menu(rich_menu_id):
     """刪除 Rich Menu"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM rich_menus WHERE id = ?', (rich_menu_id,))
+    _delete_rich_menu_rows(cursor, rich_menu_id)
+    conn.commit()
+    conn.close()
+
+def apply_project_snapshot(project_id, project_fields=None, creates=(), updates=(), deletes=()):
+    """一次套用整份專案的變更（PUT /projects/<id>/snapshot），全部在同一個交易內
+    
+    Args:
+        project_fields: 專案要更新的欄位 {'name'、'description': 值}
+        creates: [(name, alias, metadata)]，依序新增
+        updates: [(db_id, {欄位: 值})]，欄位同 update_rich_menu
+        deletes: 要刪除的 Rich Menu ID
+    Returns:
+        新增的 Rich Menu ID，順序同 creates
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    
+    fields = {key: value for key, value in (project_fields or {}).items()
+              if key in ('name', 'description')}
+    if fields:
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        cursor.execute(
+            f'UPDATE projects SET {assignments}, updated_at = ? WHERE id = ?',
+            (*fields.values(), now, project_id)
+        )
+    for rich_menu_id in deletes:
+        _delete_rich_menu_rows(cursor, rich_menu_id)
+    for db_id, menu_fields in updates:
+        _update_rich_menu_row(cursor, db_id, menu_fields, now)
+    created = [
+        _insert_rich_menu(cursor, project_id, name, alias, metadata, now)
+        for name, alias, metadata in creates
+    ]
+    
+    conn.commit()
+    conn.close()
+    return created
+
+# === Images API ===
+
+def record_image(rich_menu_id, original_path, content_type, size_bytes,
+                 width=None, height=None, image_format=None, content_hash=None):
+    """記錄新上傳原圖的元數據；每個 Rich Menu 只保留目前圖片的一筆"""
+    conn = get_db()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    cursor.execute('DELETE FROM images WHERE rich_menu_id = ? AND original_path != ?',
+                   (rich_menu_id, original_path))
+    cursor.execute('''
+        INSERT INTO images (rich_menu_id, original_path, content_type, size_bytes,
+                            width, height, format, content_hash, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (original_path) DO UPDATE SET
+            rich_menu_id = excluded.rich_menu_id,
+            content_type = excluded.content_type,
+            size_bytes = excluded.size_bytes,
+            width = excluded.width,
+            height = excluded.height,
+            format = excluded.format,
+            content_hash = excluded.content_hash,
+            updated_at = excluded.updated_at
+    ''', (rich_menu_id, original_path, content_type, size_bytes,
+          width, height, image_format, content_hash, now, now))
+    conn.commit()
+    conn.close()
+
+def update_image(original_path, **kwargs):
+    """更新衍生檔資訊（thumbnail_path、line_jpeg_path、line_jpeg_bytes、renditions）"""
+    allowed_fields = ['thumbnail_path', 'line_jpeg_path', 'line_jpeg_bytes', 'renditions']
+    updates = []
+    values = []
+    for key, value in kwargs.items():
+        if key in allowed_fields:
+            if key == 'renditions':
+                value = _json_dumps(value)
+            updates.append(f'{key} = ?')
+            values.append(value)
+    if not updates:
+        return
+
+    conn = get_db()
+    cursor = conn.cursor()
+    updates.append('updated_at = ?')
+    values.extend([datetime.utcnow().isoformat(), original_path])
+    cursor.execute(f'UPDATE images SET {", ".join(updates)} WHERE original_path = ?', values)
     conn.commit()
     conn.close()
 
+def get_image(original_path):
+    """依原圖檔名取得圖片元數據；沒有紀錄（舊資料）回傳 None"""
+    return get_images([original_path]).get(original_path)
+
+def get_images(original_paths):
+    """批次取得圖片元數據，回傳 {原圖檔名: 元數據}"""
+    original_paths = [path for path in original_paths if path]
+    if not original_paths:
+        return {}
+    conn = get_db()
+    cursor = conn.cursor()
+    placeholders = ', '.join('?' for _ in original_paths)
+    cursor.execute(
+        f'SELECT * FROM images WHERE original_path IN ({placeholders})', original_paths
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return {row['original_path']: _row_to_image(row) for row in rows}
+
+def _row_to_image(row):
+    return {
+        'id': row['id'],
+        'rich_menu_id': row['rich_menu_id'],
+        'original_path': row['original_path'],
+        'thumbnail_path': row['thumbnail_path'],
+        'content_type': row['content_type'],
+        'size_bytes': row['size_bytes'],
+        'width': row['width'],
+        'height': row['height'],
+        'format': row['format'],
+        'content_hash': row['content_hash'],
+        'line_jpeg_path': row['line_jpeg_path'],
+        'line_jpeg_bytes': row['line_jpeg_bytes'],
+        'renditions': _json_loads(row['renditions'], []),
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at']
+    }
+
 # === Aliases API ===
 
 def create_alias(account_id, alias_id, rich_menu_id):
@@ -602,9 +666,9 @@ def create_flex_message(name, json_content):
         json_content = json.dumps(json_content, ensure_ascii=False)
         
     cursor.execute('''
-        INSERT INTO flex_messages (name, json_content, created_at)
-        VALUES (?, ?, ?)
-    ''', (name, json_content, created_at))
+        INSERT INTO flex_messages (name, json_content, created_at, updated_at)
+        VALUES (?, ?, ?, ?)
+    ''', (name, json_content, created_at, created_at))
     
     conn.commit()
     msg_id = cursor.lastrowid
@@ -628,6 +692,29 @@ def get_flex_message(flex_id):
         }
     return None
 
+def get_flex_message_version(flex_id):
+    """Flex Message 的最後更新時間（ETag 用）；不存在回傳 None"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT COALESCE(updated_at, created_at) AS version FROM flex_messages WHERE id = ?',
+        (flex_id,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row['version'] if row else None
+
+def get_flex_messages_version():
+    """Flex Message 列表的版本資訊（數量、最後更新時間）"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*), MAX(COALESCE(updated_at, created_at)) FROM flex_messages
+    ''')
+    row = cursor.fetchone()
+    conn.close()
+    return tuple(row)
+
 def list_flex_messages():
     """列出所有 Flex Messages"""
     conn = get_db()
@@ -663,6 +750,8 @@ def update_flex_message(flex_id, name=None, json_content=None):
         values.append(json_content)
         
     if updates:
+        updates.append('updated_at = ?')
+        values.append(datetime.utcnow().isoformat())
         values.append(flex_id)
         sql = f'UPDATE flex_messages SET {", ".join(updates)} WHERE id = ?'
         cursor.execute(sql, values)
@@ -736,6 +825,17 @@ def list_scheduled_jobs_by_project(project_id):
     
     return [_row_to_scheduled_job(row) for row in rows]
 
+def get_scheduled_jobs_version(project_id):
+    """專案排程列表的版本資訊（數量、最後更新時間）"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*), MAX(updated_at) FROM scheduled_jobs WHERE project_id = ?
+    ''', (project_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return tuple(row)
+
 def list_due_scheduled_jobs(today_str, current_time_str, weekday, day_of_month):
     """取得當前應執行的排程任務
     
@@ -852,6 +952,513 @@ def _row_to_scheduled_job(row):
     }
 
 
+# === Upload GC ===
+
+def list_upload_references():
+    """列出仍被引用的上傳檔案，供 upload_gc 判斷孤兒檔
+
+    rich_menus 只計入專案與帳號仍存在的資料列（SQLite 未啟用 foreign_keys，
+    刪除專案或帳號時 rich_menus 不會連帶刪除）。
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT rm.image_path, rm.thumbnail_path, i.id AS image_id,
+               i.thumbnail_path AS image_thumbnail, i.line_jpeg_path, i.renditions
+        FROM rich_menus rm
+        JOIN projects p ON p.id = rm.project_id
+        JOIN accounts a ON a.id = p.account_id
+        LEFT JOIN images i ON i.original_path = rm.image_path
+        WHERE rm.image_path IS NOT NULL OR rm.thumbnail_path IS NOT NULL
+    ''')
+    rich_menu_rows = cursor.fetchall()
+    cursor.execute('SELECT id, message_plan FROM broadcast_events')
+    event_rows = cursor.fetchall()
+    conn.close()
+
+    # images 有紀錄的原圖直接給出衍生檔清單；沒有紀錄的舊圖由呼叫端依命名規則推算
+    derivatives = {}
+    for row in rich_menu_rows:
+        if row['image_path'] and row['image_id'] is not None:
+            names = {row['image_thumbnail'], row['line_jpeg_path']}
+            names.update(item['name'] for item in _json_loads(row['renditions'], []))
+            derivatives[row['image_path']] = {name for name in names if name}
+
+    return {
+        'images': {row['image_path'] for row in rich_menu_rows if row['image_path']},
+        'derivatives': derivatives,
+        'thumbnails': {row['thumbnail_path'] for row in rich_menu_rows if row['thumbnail_path']},
+        'broadcast_plans': {row['id']: _json_loads(row['message_plan'], []) for row in event_rows}
+    }
+
+# === Scheduled Job Runs API ===
+
+# 執行紀錄的時間與排程器一律用帶時區的台北時間（scheduler._taipei_now 也由此取得），
+# started_at 的排序與 since 篩選才不會因 UTC 與台北時間混存而錯開 8 小時
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+def taipei_now():
+    return datetime.now(TAIPEI_TZ)
+
+def create_scheduled_job_run(job_id, project_id, trigger='schedule', started_at=None):
+    """記錄一次排程執行的開始，回傳紀錄 ID"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO scheduled_job_runs (job_id, project_id, trigger, status, started_at)
+        VALUES (?, ?, ?, 'running', ?)
+    ''', (job_id, project_id, trigger, started_at or taipei_now().isoformat()))
+    conn.commit()
+    run_id = cursor.lastrowid
+    conn.close()
+    return run_id
+
+def finish_scheduled_job_run(run_id, status, finished_at=None, duration_ms=None,
+                             phase_ms=None, line_calls=0, bytes_uploaded=0,
+                             warnings=None, message=''):
+    """寫入排程執行結果；訊息保留完整內容，不截斷"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE scheduled_job_runs
+        SET status = ?, finished_at = ?, duration_ms = ?, phase_ms = ?,
+            line_calls = ?, bytes_uploaded = ?, warnings = ?, message = ?
+        WHERE id = ?
+    ''', (
+        status, finished_at or taipei_now().isoformat(), duration_ms,
+        _json_dumps(phase_ms or {}), line_calls, bytes_uploaded,
+        _json_dumps(warnings or {}), message, run_id
+    ))
+    conn.commit()
+    conn.close()
+
+def list_scheduled_job_runs(job_id=None, project_id=None, status=None, limit=50):
+    """列出排程執行紀錄（新到舊），可依排程、專案或狀態篩選"""
+    conn = get_db()
+    cursor = conn.cursor()
+    conditions = []
+    params = []
+    if job_id is not None:
+        conditions.append('job_id = ?')
+        params.append(job_id)
+    if project_id is not None:
+        conditions.append('project_id = ?')
+        params.append(project_id)
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+    params.append(limit)
+    cursor.execute(f'''
+        SELECT * FROM scheduled_job_runs
+        {where}
+        ORDER BY started_at DESC, id DESC
+        LIMIT ?
+    ''', params)
+    rows = cursor.fetchall()
+    conn.close()
+    return [_row_to_scheduled_job_run(row) for row in rows]
+
+def get_scheduled_job_run_stats(project_id, since=None):
+    """彙總專案的排程執行統計：成功/失敗次數與各階段耗時百分位數"""
+    conn = get_db()
+    cursor = conn.cursor()
+    params = [project_id]
+    since_clause = ''
+    if since:
+        since_clause = 'AND started_at >= ?'
+        params.append(since)
+    cursor.execute(f'''
+        SELECT status, duration_ms, phase_ms, line_calls, bytes_uploaded
+        FROM scheduled_job_runs
+        WHERE project_id = ? AND status != 'running' {since_clause}
+    ''', params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    succeeded = [row for row in rows if row['status'] == 'success']
+    phases = {}
+    for row in succeeded:
+        for phase, elapsed in _json_loads(row['phase_ms'], {}).items():
+            phases.setdefault(phase, []).append(elapsed)
+
+    return {
+        'project_id': project_id,
+        'since': since,
+        'runs': len(rows),
+        'success': len(succeeded),
+        'error': len(rows) - len(succeeded),
+        'duration_ms': _percentiles([row['duration_ms'] or 0 for row in succeeded]),
+        'phase_ms': {phase: _percentiles(values) for phase, values in phases.items()},
+        'avg_line_calls': _average([row['line_calls'] for row in succeeded]),
+        'avg_bytes_uploaded': _average([row['bytes_uploaded'] for row in succeeded])
+    }
+
+def _percentiles(values):
+    """nearest-rank 百分位數；樣本數少時也不內插，結果一定是實際出現過的值"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        index = max(0, -(-len(ordered) * p // 100) - 1)
+        return ordered[int(index)]
+
+    return {
+        'count': len(ordered),
+        'p50': rank(50),
+        'p90': rank(90),
+        'p95': rank(95),
+        'p99': rank(99),
+        'max': ordered[-1]
+    }
+
+def _average(values):
+    return round(sum(values) / len(values), 1) if values else None
+
+def _row_to_scheduled_job_run(row):
+    return {
+        'id': row['id'],
+        'job_id': row['job_id'],
+        'project_id': row['project_id'],
+        'trigger': row['trigger'],
+        'status': row['status'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+        'duration_ms': row['duration_ms'],
+        'phase_ms': _json_loads(row['phase_ms'], {}),
+        'line_calls': row['line_calls'],
+        'bytes_uploaded': row['bytes_uploaded'],
+        'warnings': _json_loads(row['warnings'], {}),
+        'message': row['message']
+    }
+
+
+# === Scheduler Lease API ===
+
+def acquire_scheduler_lease(name, holder, ttl, now=None):
+    """取得或續約 lease；只有目前持有者或 lease 已過期時才會成功
+
+    以單一 UPDATE 做 compare-and-set，多個行程同時競爭也只有一個會拿到。
+    """
+    now = time.time() if now is None else now
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT OR IGNORE INTO scheduler_leases (name, holder, acquired_at, heartbeat_at, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (name, holder, now, now, now + ttl))
+    if cursor.rowcount == 0:
+        cursor.execute('''
+            UPDATE scheduler_leases
+            SET acquired_at = CASE WHEN holder = ? THEN acquired_at ELSE ? END,
+                holder = ?, heartbeat_at = ?, expires_at = ?
+            WHERE name = ? AND (holder = ? OR expires_at < ?)
+        ''', (holder, now, holder, now, now + ttl, name, holder, now))
+    acquired = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    return acquired
+
+def release_scheduler_lease(name, holder):
+    """主動釋出 lease，讓其他行程不必等到過期就能接手"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'DELETE FROM scheduler_leases WHERE name = ? AND holder = ?', (name, holder)
+    )
+    conn.commit()
+    conn.close()
+
+def get_scheduler_lease(name):
+    """取得 lease 目前狀態"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM scheduler_leases WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def claim_scheduled_job_run(job_id, run_key, holder):
+    """認領某排程的某次執行；同一 (job_id, run_key) 只有第一個呼叫者會拿到 True"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT OR IGNORE INTO scheduled_job_claims (job_id, run_key, holder, claimed_at)
+        VALUES (?, ?, ?, ?)
+    ''', (job_id, run_key, holder, datetime.utcnow().isoformat()))
+    claimed = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    return claimed
+
+def prune_scheduled_job_claims(before):
+    """刪除早於 before（ISO 時間）的認領紀錄"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM scheduled_job_claims WHERE claimed_at < ?', (before,))
+    deleted = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
+
+
+# === Collaboration Presence API ===
+
+def heartbeat_collab_worker(worker_id, now=None):
+    """Socket.IO worker 存活訊號；超過 TTL 沒更新的 worker 視為已停止"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO collab_workers (worker_id, heartbeat_at) VALUES (?, ?)
+        ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+    ''', (worker_id, time.time() if now is None else now))
+    conn.commit()
+    conn.close()
+
+def prune_collab_workers(expired_before):
+    """移除心跳早於 expired_before 的 worker 及其連線，回傳被移除的線上紀錄"""
+    conn = get_db()
+    cursor = conn.cursor()
+    stale = '''
+        SELECT p.rowid FROM collab_presence p
+        LEFT JOIN collab_workers w ON w.worker_id = p.worker_id
+        WHERE w.worker_id IS NULL OR w.heartbeat_at < ?
+    '''
+    cursor.execute(f'SELECT * FROM collab_presence WHERE rowid IN ({stale})', (expired_before,))
+    removed = [dict(row) for row in cursor.fetchall()]
+    cursor.execute(f'DELETE FROM collab_presence WHERE rowid IN ({stale})', (expired_before,))
+    cursor.execute('DELETE FROM collab_workers WHERE heartbeat_at < ?', (expired_before,))
+    conn.commit()
+    conn.close()
+    return removed
+
+def remove_collab_worker(worker_id):
+    """worker 正常結束時清掉自己的連線"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM collab_presence WHERE worker_id = ?', (worker_id,))
+    cursor.execute('DELETE FROM collab_workers WHERE worker_id = ?', (worker_id,))
+    conn.commit()
+    conn.close()
+
+def join_collab_presence(project_id, sid, worker_id, user_id, user_name, color, now=None):
+    """加入專案房間（配發房間內的 short_id），回傳 (自己的紀錄, 房間內其他連線)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM collab_presence WHERE project_id = ? AND sid = ?', (project_id, sid))
+    cursor.execute('''
+        INSERT INTO collab_presence
+            (project_id, sid, worker_id, user_id, user_name, color, rich_menu_id, short_id, joined_at)
+        SELECT ?, ?, ?, ?, ?, ?, NULL, COALESCE(MAX(short_id), 0) + 1, ?
+        FROM collab_presence WHERE project_id = ?
+    ''', (project_id, sid, worker_id, user_id, user_name, color,
+          time.time() if now is None else now, project_id))
+    cursor.execute('''
+        SELECT * FROM collab_presence WHERE project_id = ? ORDER BY joined_at
+    ''', (project_id,))
+    rows = [dict(row) for row in cursor.fetchall()]
+    conn.commit()
+    conn.close()
+    own = next(row for row in rows if row['sid'] == sid)
+    return own, [row for row in rows if row['sid'] != sid]
+
+def leave_collab_presence(sid, project_id=None):
+    """離開房間（project_id 為 None 時離開所有房間），回傳被移除的紀錄"""
+    where, params = ('sid = ?', (sid,)) if project_id is None else \
+        ('sid = ? AND project_id = ?', (sid, project_id))
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT * FROM collab_presence WHERE {where}', params)
+    removed = [dict(row) for row in cursor.fetchall()]
+    if removed:
+        cursor.execute(f'DELETE FROM collab_presence WHERE {where}', params)
+        conn.commit()
+    conn.close()
+    return removed
+
+def update_collab_presence_tab(project_id, sid, rich_menu_id):
+    """記錄連線目前的標籤；不在房間回傳 False"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE collab_presence SET rich_menu_id = ? WHERE project_id = ? AND sid = ?
+    ''', (rich_menu_id, project_id, sid))
+    updated = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    return updated
+
+def count_collab_presence(project_id):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM collab_presence WHERE project_id = ?', (project_id,))
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+def get_collab_presence_stats():
+    """所有 worker 合計的線上狀態"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(DISTINCT project_id) AS rooms, COUNT(DISTINCT sid) AS connections,
+               COUNT(*) AS members
+        FROM collab_presence
+    ''')
+    stats = dict(cursor.fetchone())
+    cursor.execute('''
+        SELECT COUNT(*) FROM collab_presence GROUP BY project_id ORDER BY COUNT(*) DESC LIMIT 1
+    ''')
+    largest = cursor.fetchone()
+    cursor.execute('SELECT COUNT(*) FROM collab_workers')
+    stats['workers'] = cursor.fetchone()[0]
+    conn.close()
+    stats['largest_room'] = largest[0] if largest else 0
+    return stats
+
+
+# === Collaboration Locks API ===
+
+def acquire_collab_lock(project_id, rich_menu_id, sid, user_id, user_name, token, now, expires_at):
+    """取得或延長編輯鎖（過期的鎖視為不存在），回傳目前持有者的紀錄"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM collab_locks WHERE project_id = ? AND rich_menu_id = ? AND expires_at <= ?
+    ''', (project_id, rich_menu_id, now))
+    cursor.execute('''
+        INSERT INTO collab_locks
+            (project_id, rich_menu_id, sid, user_id, user_name, token, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (project_id, rich_menu_id) DO UPDATE SET expires_at = excluded.expires_at
+        WHERE collab_locks.sid = excluded.sid
+    ''', (project_id, rich_menu_id, sid, user_id, user_name, token, expires_at))
+    cursor.execute('''
+        SELECT * FROM collab_locks WHERE project_id = ? AND rich_menu_id = ?
+    ''', (project_id, rich_menu_id))
+    holder = dict(cursor.fetchone())
+    conn.commit()
+    conn.close()
+    return holder
+
+def refresh_collab_lock(project_id, rich_menu_id, sid, now, expires_at):
+    """持有者的鎖心跳；鎖已過期或不屬於 sid 回傳 None"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE collab_locks SET expires_at = ?
+        WHERE project_id = ? AND rich_menu_id = ? AND sid = ? AND expires_at > ?
+    ''', (expires_at, project_id, rich_menu_id, sid, now))
+    cursor.execute('''
+        SELECT * FROM collab_locks WHERE project_id = ? AND rich_menu_id = ? AND sid = ?
+            AND expires_at > ?
+    ''', (project_id, rich_menu_id, sid, now))
+    row = cursor.fetchone()
+    conn.commit()
+    conn.close()
+    return dict(row) if row else None
+
+def release_collab_locks(sid, project_id=None, rich_menu_id=None):
+    """釋放 sid 持有的鎖（可限定專案與 Rich Menu），回傳被釋放的紀錄"""
+    where, params = ['sid = ?'], [sid]
+    if project_id is not None:
+        where.append('project_id = ?')
+        params.append(project_id)
+    if rich_menu_id is not None:
+        where.append('rich_menu_id = ?')
+        params.append(rich_menu_id)
+    where = ' AND '.join(where)
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT * FROM collab_locks WHERE {where}', params)
+    removed = [dict(row) for row in cursor.fetchall()]
+    if removed:
+        cursor.execute(f'DELETE FROM collab_locks WHERE {where}', params)
+        conn.commit()
+    conn.close()
+    return removed
+
+def list_collab_locks(now, project_id=None, rich_menu_id=None):
+    """未過期的鎖（可依專案或 Rich Menu 篩選）"""
+    where, params = ['expires_at > ?'], [now]
+    if project_id is not None:
+        where.append('project_id = ?')
+        params.append(project_id)
+    if rich_menu_id is not None:
+        where.append('rich_menu_id = ?')
+        params.append(rich_menu_id)
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT * FROM collab_locks WHERE {" AND ".join(where)}', params)
+    rows = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+def expire_collab_locks(now):
+    """刪除已過期的鎖，回傳被刪除的紀錄"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM collab_locks WHERE expires_at <= ?', (now,))
+    removed = [dict(row) for row in cursor.fetchall()]
+    if removed:
+        cursor.execute('DELETE FROM collab_locks WHERE expires_at <= ?', (now,))
+        conn.commit()
+    conn.close()
+    return removed
+
+
+# === Collaboration Documents API ===
+
+@contextmanager
+def collab_document_transaction():
+    """協作即時文件的寫入交易：BEGIN IMMEDIATE 讓多個 worker 對文件的讀改寫依序進行"""
+    conn = get_db()
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        yield cursor
+        cursor.execute('COMMIT')
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def load_collab_documents(cursor, project_id=None, rich_menu_id=None, dirty_only=False):
+    """讀出協作文件 {(project_id, rich_menu_id): state}（可依專案、Rich Menu、未寫回篩選）"""
+    where, params = [], []
+    if project_id is not None:
+        where.append('project_id = ?')
+        params.append(project_id)
+    if rich_menu_id is not None:
+        where.append('rich_menu_id = ?')
+        params.append(str(rich_menu_id))
+    if dirty_only:
+        where.append('dirty = 1')
+    sql = 'SELECT project_id, rich_menu_id, state FROM collab_documents'
+    if where:
+        sql += f' WHERE {" AND ".join(where)}'
+    cursor.execute(sql, params)
+    return {(row['project_id'], row['rich_menu_id']): row['state'] for row in cursor.fetchall()}
+
+def store_collab_documents(cursor, changed, deleted=()):
+    """寫回協作文件：changed 為 {(project_id, rich_menu_id): (state, dirty)}，deleted 為要移除的 key"""
+    now = time.time()
+    for (project_id, rich_menu_id), (state, dirty) in changed.items():
+        cursor.execute('''
+            INSERT INTO collab_documents (project_id, rich_menu_id, state, dirty, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (project_id, rich_menu_id) DO UPDATE SET
+                state = excluded.state, dirty = excluded.dirty, updated_at = excluded.updated_at
+        ''', (project_id, rich_menu_id, state, int(dirty), now))
+    for project_id, rich_menu_id in deleted:
+        cursor.execute('DELETE FROM collab_documents WHERE project_id = ? AND rich_menu_id = ?',
+                       (project_id, rich_menu_id))
+
+
 # === Broadcast Events API ===
 
 def _json_dumps(value):
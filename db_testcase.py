@@ -0,0 +1,81 @@
+# db_testcase.py - 測試共用的資料庫 fixture
+#
+# DatabaseTestCase：每個測試使用暫存目錄裡的全新資料庫，並建立一組帳號與專案。
+# FakeLineApiTestCase：另外把 LINE API 指到同一個行程內的 FakeLineApi，
+# 並提供暫存的上傳目錄，可直接執行發佈流程。
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+from PIL import Image
+
+import config
+import db
+import scheduler
+from fake_line_api import FakeLineApi
+
+
+class DatabaseTestCase(unittest.TestCase):
+    account_name = 'test-bot'
+    channel_access_token = 'token-123'
+    project_name = 'demo'
+    # 是否同時把 config.UPLOAD_FOLDER 換成暫存目錄
+    use_upload_folder = False
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.patch_config(DATABASE_PATH=os.path.join(self.tmpdir, 'test.db'))
+        if self.use_upload_folder:
+            self.patch_config(UPLOAD_FOLDER=os.path.join(self.tmpdir, 'uploads'))
+            os.makedirs(config.UPLOAD_FOLDER)
+        db.init_db()
+
+        self.account_id = db.create_account(self.account_name, self.channel_access_token)
+        self.project_id = db.create_project(self.account_id, self.project_name)
+
+    def patch_config(self, **values):
+        """暫時覆寫 config 設定，測試結束後還原"""
+        for name, value in values.items():
+            self.addCleanup(setattr, config, name, getattr(config, name))
+            setattr(config, name, value)
+
+    def make_client(self, *blueprints):
+        """建立註冊指定 blueprint 的 Flask 測試 client（預設為 api_bp）"""
+        if not blueprints:
+            from api_routes import api_bp
+            blueprints = (api_bp,)
+        app = Flask(__name__)
+        for blueprint in blueprints:
+            app.register_blueprint(blueprint)
+        return app.test_client()
+
+    def attach_image(self, rm_id, size, suffix='test', color=(0, 0, 0)):
+        """在上傳目錄產生 Rich Menu 圖片並寫回 image_path，回傳檔名"""
+        filename = f'rm_{rm_id}_{suffix}.png'
+        Image.new('RGB', size, color).save(os.path.join(config.UPLOAD_FOLDER, filename))
+        db.update_rich_menu(rm_id, image_path=filename)
+        return filename
+
+
+class FakeLineApiTestCase(DatabaseTestCase):
+    use_upload_folder = True
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeLineApi()
+        cls.fake.start()
+        cls.addClassCleanup(cls.fake.stop)
+
+    def setUp(self):
+        super().setUp()
+        self.fake.reset()
+        self.fake.clear_errors()
+        config_patch = self.fake.patch_config()
+        config_patch.__enter__()
+        self.addCleanup(config_patch.__exit__, None, None, None)
+        scheduler._remote_state_cache.clear()
@@ -0,0 +1,514 @@
+# fake_line_api.py - 本機 LINE Messaging API 替身（測試與壓力測試用）
+#
+# 在同一個行程內啟動一個小型 HTTP 伺服器，實作 scheduler / line_proxy /
+# api_routes 會用到的 Rich Menu、Alias、圖片上傳、預設選單、使用者綁定
+# 與 reply 端點。把 config.LINE_API_BASE / LINE_API_DATA_BASE 指到
+# FakeLineApi.base_url 即可離線執行整個發佈流程。
+#
+# 獨立啟動（供壓測或手動測試使用）：
+#   python fake_line_api.py --port 8787 --latency 0.05
+#   LINE_API_BASE=http://127.0.0.1:8787 LINE_API_DATA_BASE=http://127.0.0.1:8787 python app.py
+
+import argparse
+import fnmatch
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from flask import Flask, jsonify, request, Response
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+import config
+
+RATE_LIMIT_MESSAGE = 'The API rate limit has been exceeded. Try again later.'
+ALIAS_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+class FakeLineApi:
+    """可設定延遲、錯誤注入與 429 行為的 LINE API 替身。
+
+    Args:
+        latency: 每個請求固定延遲秒數
+        jitter: 額外隨機延遲上限（秒）
+        rate_limit: (次數, 秒數)；同一個 token 在時間窗內超過次數即回 429
+        valid_tokens: 允許的 Channel Access Token；None 代表接受任何 Bearer token
+        max_content_bytes: 圖片大小上限；None 代表不限制
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=None,
+                 valid_tokens=None, max_content_bytes=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.valid_tokens = set(valid_tokens) if valid_tokens else None
+        self.max_content_bytes = max_content_bytes
+        self._lock = threading.Lock()
+        self._error_rules = []
+        self._request_times = {}
+        self._server = None
+        self._thread = None
+        self.app = self._build_app()
+        self.reset()
+
+    # === 狀態 ===
+
+    def reset(self):
+        """清空遠端狀態與呼叫紀錄（錯誤規則保留）"""
+        with self._lock:
+            self.rich_menus = {}        # {richMenuId: metadata}
+            self.contents = {}          # {richMenuId: (content_type, bytes)}
+            self.aliases = {}           # {aliasId: richMenuId}
+            self.default_rich_menu_id = None
+            self.user_links = {}        # {userId: richMenuId}
+            self.replies = []
+            self.calls = []             # [{method, path, status, bytes_in}]
+            self._request_times = {}
+
+    def clear_calls(self):
+        """只清空呼叫紀錄，保留遠端狀態（量測連續兩次發佈時使用）"""
+        with self._lock:
+            self.calls = []
+
+    def stats(self):
+        """回傳呼叫次數與上傳位元組統計"""
+        with self._lock:
+            calls = list(self.calls)
+        by_endpoint = {}
+        for call in calls:
+            key = f'{call["method"]} {call["endpoint"]}'
+            by_endpoint[key] = by_endpoint.get(key, 0) + 1
+        return {
+            'calls': len(calls),
+            'write_calls': sum(1 for call in calls if call['method'] != 'GET'),
+            'bytes_uploaded': sum(
+                call['bytes_in'] for call in calls if call['endpoint'] == 'content'
+            ),
+            'throttled': sum(1 for call in calls if call['status'] == 429),
+            'by_endpoint': by_endpoint
+        }
+
+    def inject_error(self, method, path_pattern, status=500, times=1, message=None,
+                     retry_after=None):
+        """讓符合的請求回傳指定錯誤
+
+        Args:
+            method: HTTP 方法，'*' 代表全部
+            path_pattern: fnmatch 樣式，例如 '/v2/bot/richmenu/*/content'
+            status: 回應狀態碼（429 會附帶 Retry-After）
+            times: 生效次數；None 代表永久
+        """
+        with self._lock:
+            self._error_rules.append({
+                'method': method.upper(),
+                'pattern': path_pattern,
+                'status': status,
+                'remaining': times,
+                'message': message or f'Injected error ({status})',
+                'retry_after': retry_after
+            })
+
+    def clear_errors(self):
+        with self._lock:
+            self._error_rules = []
+
+    # === 伺服器生命週期 ===
+
+    def start(self, host='127.0.0.1', port=0):
+        """在背景執行緒啟動伺服器，回傳 base URL"""
+        if self._server:
+            return self.base_url
+        self._server = make_server(
+            host, port, self.app, threaded=True, request_handler=_QuietRequestHandler
+        )
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name='fake-line-api',
+            daemon=True
+        )
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join(timeout=5)
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        if not self._server:
+            return None
+        return f'http://{self._server.host}:{self._server.port}'
+
+    @contextmanager
+    def patch_config(self):
+        """暫時把 config 的 LINE API URL 指向此替身"""
+        original = (config.LINE_API_BASE, config.LINE_API_DATA_BASE)
+        config.LINE_API_BASE = self.base_url
+        config.LINE_API_DATA_BASE = self.base_url
+        try:
+            yield self
+        finally:
+            config.LINE_API_BASE, config.LINE_API_DATA_BASE = original
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    # === 請求前處理 ===
+
+    def _record(self, endpoint, status):
+        with self._lock:
+            self.calls.append({
+                'method': request.method,
+                'path': request.path,
+                'endpoint': endpoint,
+                'status': status,
+                'bytes_in': request.content_length or 0
+            })
+
+    def _match_error(self):
+        with self._lock:
+            for rule in self._error_rules:
+                if rule['remaining'] == 0:
+                    continue
+                if rule['method'] not in ('*', request.method):
+                    continue
+                if not fnmatch.fnmatchcase(request.path, rule['pattern']):
+                    continue
+                if rule['remaining'] is not None:
+                    rule['remaining'] -= 1
+                return dict(rule)
+        return None
+
+    def _throttled(self, token):
+        if not self.rate_limit:
+            return False
+        limit, window = self.rate_limit
+        now = time.monotonic()
+        with self._lock:
+            history = self._request_times.setdefault(token, deque())
+            while history and now - history[0] > window:
+                history.popleft()
+            if len(history) >= limit:
+                return True
+            history.append(now)
+        return False
+
+    def _before_request(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        auth = request.headers.get('Authorization', '')
+        if not auth.startswith('Bearer '):
+            return _error(401, 'Authorization header required.')
+        token = auth[len('Bearer '):]
+        if self.valid_tokens is not None and token not in self.valid_tokens:
+            return _error(401, 'Authentication failed due to the following reason: invalid token.')
+
+        rule = self._match_error()
+        if rule:
+            response = _error(rule['status'], rule['message'])
+            if rule['status'] == 429:
+                response.headers['Retry-After'] = str(rule['retry_after'] or 1)
+            return response
+
+        if self._throttled(token):
+            response = _error(429, RATE_LIMIT_MESSAGE)
+            response.headers['Retry-After'] = str(int(self.rate_limit[1]) or 1)
+            return response
+        return None
+
+    # === 路由 ===
+
+    def _build_app(self):
+        app = Flask('fake_line_api')
+        api = self
+
+        @app.before_request
+        def before_request():
+            return api._before_request()
+
+        @app.after_request
+        def after_request(response):
+            # before_request 直接回傳的錯誤（驗證、注入、429）也會經過這裡
+            api._record(_endpoint_name(request.path), response.status_code)
+            return response
+
+        @app.route('/v2/bot/richmenu/list', methods=['GET'])
+        def list_richmenus():
+            with api._lock:
+                menus = [
+                    {**metadata, 'richMenuId': rich_menu_id}
+                    for rich_menu_id, metadata in api.rich_menus.items()
+                ]
+            return jsonify({'richmenus': menus})
+
+        @app.route('/v2/bot/richmenu', methods=['POST'])
+        def create_richmenu():
+            metadata = request.get_json(silent=True)
+            problem = _validate_rich_menu(metadata)
+            if problem:
+                return _error(400, 'The request body has 1 error(s)', details=[problem])
+            rich_menu_id = f'richmenu-{uuid.uuid4().hex}'
+            with api._lock:
+                api.rich_menus[rich_menu_id] = metadata
+            return jsonify({'richMenuId': rich_menu_id})
+
+        @app.route('/v2/bot/richmenu/<rich_menu_id>', methods=['GET'])
+        def get_richmenu(rich_menu_id):
+            with api._lock:
+                metadata = api.rich_menus.get(rich_menu_id)
+            if metadata is None:
+                return _error(404, 'Not found')
+            return jsonify({**metadata, 'richMenuId': rich_menu_id})
+
+        @app.route('/v2/bot/richmenu/<rich_menu_id>', methods=['DELETE'])
+        def delete_richmenu(rich_menu_id):
+            with api._lock:
+                if rich_menu_id not in api.rich_menus:
+                    return _error(404, 'Not found')
+                del api.rich_menus[rich_menu_id]
+                api.contents.pop(rich_menu_id, None)
+                if api.default_rich_menu_id == rich_menu_id:
+                    api.default_rich_menu_id = None
+                api.user_links = {
+                    user_id: linked for user_id, linked in api.user_links.items()
+                    if linked != rich_menu_id
+                }
+            return jsonify({})
+
+        @app.route('/v2/bot/richmenu/<rich_menu_id>/content', methods=['POST'])
+        def upload_content(rich_menu_id):
+            content_type = (request.content_type or '').split(';')[0]
+            if content_type not in ('image/jpeg', 'image/png'):
+                return _error(415, 'Unsupported Media Type')
+            body = request.get_data()
+            if api.max_content_bytes is not None and len(body) > api.max_content_bytes:
+                return _error(413, 'Request Entity Too Large')
+            with api._lock:
+                if rich_menu_id not in api.rich_menus:
+                    return _error(404, 'Not found')
+                if rich_menu_id in api.contents:
+                    return _error(400, 'An image has already been uploaded to the richmenu')
+                api.contents[rich_menu_id] = (content_type, body)
+            return jsonify({})
+
+        @app.route('/v2/bot/richmenu/<rich_menu_id>/content', methods=['GET'])
+        def download_content(rich_menu_id):
+            with api._lock:
+                content = api.contents.get(rich_menu_id)
+            if content is None:
+                return _error(404, 'Not found')
+            return Response(content[1], content_type=content[0])
+
+        @app.route('/v2/bot/richmenu/alias/list', methods=['GET'])
+        def list_aliases():
+            with api._lock:
+                aliases = [
+                    {'richMenuAliasId': alias_id, 'richMenuId': rich_menu_id}
+                    for alias_id, rich_menu_id in api.aliases.items()
+                ]
+            return jsonify({'aliases': aliases})
+
+        @app.route('/v2/bot/richmenu/alias', methods=['POST'])
+        def create_alias():
+            data = request.get_json(silent=True) or {}
+            alias_id = data.get('richMenuAliasId', '')
+            rich_menu_id = data.get('richMenuId', '')
+            if not ALIAS_ID_PATTERN.match(alias_id):
+                return _error(400, 'The request body has 1 error(s)',
+                              details=[{'property': 'richMenuAliasId', 'message': 'invalid'}])
+            with api._lock:
+                if alias_id in api.aliases:
+                    return _error(400, 'conflict richmenu alias id')
+                problem = api._alias_target_problem(rich_menu_id)
+                if problem:
+                    return problem
+                api.aliases[alias_id] = rich_menu_id
+            return jsonify({})
+
+        @app.route('/v2/bot/richmenu/alias/<alias_id>', methods=['GET'])
+        def get_alias(alias_id):
+            with api._lock:
+                rich_menu_id = api.aliases.get(alias_id)
+            if rich_menu_id is None:
+                return _error(404, 'richmenu alias not found')
+            return jsonify({'richMenuAliasId': alias_id, 'richMenuId': rich_menu_id})
+
+        @app.route('/v2/bot/richmenu/alias/<alias_id>', methods=['POST'])
+        def update_alias(alias_id):
+            data = request.get_json(silent=True) or {}
+            rich_menu_id = data.get('richMenuId', '')
+            with api._lock:
+                if alias_id not in api.aliases:
+                    return _error(404, 'richmenu alias not found')
+                problem = api._alias_target_problem(rich_menu_id)
+                if problem:
+                    return problem
+                api.aliases[alias_id] = rich_menu_id
+            return jsonify({})
+
+        @app.route('/v2/bot/richmenu/alias/<alias_id>', methods=['DELETE'])
+        def delete_alias(alias_id):
+            with api._lock:
+                if api.aliases.pop(alias_id, None) is None:
+                    return _error(404, 'richmenu alias not found')
+            return jsonify({})
+
+        @app.route('/v2/bot/user/all/richmenu/<rich_menu_id>', methods=['POST'])
+        def set_default(rich_menu_id):
+            with api._lock:
+                problem = api._link_target_problem(rich_menu_id)
+                if problem:
+                    return problem
+                api.default_rich_menu_id = rich_menu_id
+            return jsonify({})
+
+        @app.route('/v2/bot/user/all/richmenu', methods=['GET'])
+        def get_default():
+            with api._lock:
+                rich_menu_id = api.default_rich_menu_id
+            if not rich_menu_id:
+                return _error(404, 'no default richmenu')
+            return jsonify({'richMenuId': rich_menu_id})
+
+        @app.route('/v2/bot/user/all/richmenu', methods=['DELETE'])
+        def unset_default():
+            with api._lock:
+                api.default_rich_menu_id = None
+            return jsonify({})
+
+        @app.route('/v2/bot/user/<user_id>/richmenu/<rich_menu_id>', methods=['POST'])
+        def link_user(user_id, rich_menu_id):
+            with api._lock:
+                problem = api._link_target_problem(rich_menu_id)
+                if problem:
+                    return problem
+                api.user_links[user_id] = rich_menu_id
+            return jsonify({})
+
+        @app.route('/v2/bot/user/<user_id>/richmenu', methods=['GET'])
+        def get_user_link(user_id):
+            with api._lock:
+                rich_menu_id = api.user_links.get(user_id)
+            if not rich_menu_id:
+                return _error(404, 'the user has no richmenu')
+            return jsonify({'richMenuId': rich_menu_id})
+
+        @app.route('/v2/bot/user/<user_id>/richmenu', methods=['DELETE'])
+        def unlink_user(user_id):
+            with api._lock:
+                api.user_links.pop(user_id, None)
+            return jsonify({})
+
+        @app.route('/v2/bot/message/reply', methods=['POST'])
+        def reply():
+            data = request.get_json(silent=True) or {}
+            if not data.get('replyToken') or not data.get('messages'):
+                return _error(400, 'The request body has 1 error(s)')
+            with api._lock:
+                api.replies.append(data)
+            return jsonify({'sentMessages': [
+                {'id': uuid.uuid4().hex[:18]} for _ in data['messages']
+            ]})
+
+        return app
+
+    # 以下兩個檢查需在持有 _lock 時呼叫
+    def _alias_target_problem(self, rich_menu_id):
+        if rich_menu_id not in self.rich_menus:
+            return _error(400, 'richmenu not found')
+        if rich_menu_id not in self.contents:
+            return _error(400, 'richmenu image not found')
+        return None
+
+    def _link_target_problem(self, rich_menu_id):
+        if rich_menu_id not in self.rich_menus:
+            return _error(404, 'Not found')
+        if rich_menu_id not in self.contents:
+            return _error(400, 'must upload richmenu image before applying it to user')
+        return None
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """大量請求時不逐筆輸出 access log"""
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+def _error(status, message, details=None):
+    body = {'message': message}
+    if details:
+        body['details'] = details
+    response = jsonify(body)
+    response.status_code = status
+    return response
+
+
+def _endpoint_name(path):
+    """將路徑歸類成統計用端點名稱"""
+    if path.endswith('/content'):
+        return 'content'
+    if '/richmenu/alias' in path:
+        return 'alias'
+    if path.startswith('/v2/bot/user/all/'):
+        return 'default'
+    if path.startswith('/v2/bot/user/'):
+        return 'user_link'
+    if path.startswith('/v2/bot/message/'):
+        return 'message'
+    if path == '/v2/bot/richmenu/list':
+        return 'list'
+    return 'richmenu'
+
+
+def _validate_rich_menu(metadata):
+    """只做 LINE 會直接拒絕的基本檢查"""
+    if not isinstance(metadata, dict):
+        return {'message': 'must be a JSON object'}
+    size = metadata.get('size') or {}
+    if size.get('width') not in (2500, 1200) or not size.get('height'):
+        return {'property': 'size', 'message': 'invalid size'}
+    if not metadata.get('name') or len(metadata['name']) > 300:
+        return {'property': 'name', 'message': 'invalid name'}
+    chat_bar_text = metadata.get('chatBarText') or ''
+    if not chat_bar_text or len(chat_bar_text) > 14:
+        return {'property': 'chatBarText', 'message': 'invalid chatBarText'}
+    areas = metadata.get('areas')
+    if not isinstance(areas, list) or not 1 <= len(areas) <= 20:
+        return {'property': 'areas', 'message': 'must have 1-20 areas'}
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='啟動本機 LINE Messaging API 替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--latency', type=float, default=0.0, help='每個請求的固定延遲（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='額外隨機延遲上限（秒）')
+    parser.add_argument('--rate-limit', type=int, default=0, help='每個 token 每秒請求上限；0 代表不限')
+    args = parser.parse_args()
+
+    fake = FakeLineApi(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=(args.rate_limit, 1.0) if args.rate_limit else None
+    )
+    print(f'🧪 Fake LINE API 啟動於 {fake.start(args.host, args.port)}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,439 @@
+# image_pipeline.py - 上傳圖片的背景衍生檔處理
+#
+# upload_richmenu_image 只負責保存原圖並立即回應；縮圖與發佈到 LINE 用的
+# JPEG 交給獨立行程產生，避免 Pillow 的 CPU 工作卡住 eventlet worker 上
+# 的其他請求與 Socket.IO 事件。完成後更新 rich_menus.image_status，並透過
+# set_notifier 註冊的回呼通知前端；寫回與通知在 set_notifier 給的
+# start_background_task 內執行，eventlet 下即在 hub 上，不在行程池的執行緒。
+#
+# 原圖的尺寸、大小、內容雜湊與各衍生檔都記錄在 images 表，排程發佈、
+# /api/uploads 與 upload_gc 直接查表，不必再逐一 stat 或開檔。
+
+import os
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Data, Epilogue, File
+
+import config
+import db
+import upload_paths
+
+logger = logging.getLogger('image_pipeline')
+
+THUMBNAIL_WIDTH = 400
+# 編輯器預覽用的縮小版本；只產生比原圖窄的寬度，更寬的請求直接回原圖
+RENDITION_WIDTHS = (200, 400, 800, 1250)
+RENDITION_FORMATS = {'webp': 'WEBP', 'png': 'PNG'}
+LINE_MAX_BYTES = 4_500_000  # 與前端 uploadAllRichMenus 一致
+# 衍生檔先寫到「檔名 + TEMP_SUFFIX」再改名；upload_gc 依此辨認中斷的寫入
+TEMP_SUFFIX = '.tmp'
+
+STATUS_PROCESSING = 'processing'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+_executor = None
+_notifier = None
+_start_background_task = None
+
+
+def thumbnail_filename(filename):
+    return f'thumb_{filename}'
+
+
+def line_jpeg_filename(filename):
+    return f'line_{os.path.splitext(filename)[0]}.jpg'
+
+
+def rendition_filename(filename, width, extension):
+    return f'r{width}_{os.path.splitext(filename)[0]}.{extension}'
+
+
+def pick_rendition(upload_folder, filename, width, accept_webp):
+    """挑選不小於 width 的最小版本；沒有合適的（尚未產生或比原圖寬）回傳 None"""
+    extension = 'webp' if accept_webp else 'png'
+    for candidate in RENDITION_WIDTHS:
+        if candidate < width:
+            continue
+        path = upload_paths.resolve(rendition_filename(filename, candidate, extension), upload_folder)
+        if path:
+            return path
+    return None
+
+
+def select_rendition(renditions, width, accept_webp):
+    """從 images 表記錄的預覽版本中挑選不小於 width 的最小版本，沒有回傳 None"""
+    extension = 'webp' if accept_webp else 'png'
+    candidates = [
+        item for item in renditions
+        if item['width'] >= width and item['name'].endswith(f'.{extension}')
+    ]
+    return min(candidates, key=lambda item: item['width']) if candidates else None
+
+
+def line_jpeg_path(image_path):
+    """原圖對應的 LINE 用 JPEG 路徑（與原圖放在同一資料夾）"""
+    folder, filename = os.path.split(image_path)
+    return os.path.join(folder, line_jpeg_filename(filename))
+
+
+def encode_line_jpeg(image_path):
+    """將圖片壓縮為 JPEG bytes，確保不超過 LINE 限制"""
+    with Image.open(image_path) as img:
+        # 轉為 RGB（去除 alpha channel，JPEG 不支援）
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # 嘗試不同品質，直到檔案大小低於限制
+        quality = 90
+        while quality >= 60:
+            buf = BytesIO()
+            img.save(buf, format='JPEG', quality=quality, optimize=True)
+            if buf.tell() <= LINE_MAX_BYTES:
+                break
+            quality -= 10
+
+    return buf.getvalue()
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 帶有尺寸資訊的 JPEG SOF marker（排除 DHT 0xC4、JPG 0xC8、DAC 0xCC）
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# 找 SOF 最多掃描的位元組數；正常檔案的 EXIF/ICC 都遠小於此
+PROBE_LIMIT = 1024 * 1024
+
+
+class IncompleteHeader(ValueError):
+    """檔頭資料不足（串流上傳時可再多讀一些）"""
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise IncompleteHeader('圖片檔頭不完整')
+    return data
+
+
+def probe_image_header(stream):
+    """只讀 PNG/JPEG 檔頭取得 (format, width, height)，不解碼像素
+
+    stream 需可 seek；讀完會回到開頭。非 PNG/JPEG 或檔頭損毀時拋出 ValueError。
+    """
+    start = stream.tell()
+    try:
+        head = _read_exact(stream, 8)
+        if head == PNG_SIGNATURE:
+            length_and_type = _read_exact(stream, 8)
+            if length_and_type[4:] != b'IHDR':
+                raise ValueError('PNG 檔頭損毀')
+            ihdr = _read_exact(stream, 8)
+            return 'PNG', int.from_bytes(ihdr[:4], 'big'), int.from_bytes(ihdr[4:], 'big')
+
+        if head[:2] == b'\xff\xd8':
+            stream.seek(start + 2)
+            while stream.tell() - start < PROBE_LIMIT:
+                if _read_exact(stream, 1) != b'\xff':
+                    raise ValueError('JPEG 檔頭損毀')
+                marker = _read_exact(stream, 1)[0]
+                while marker == 0xFF:  # marker 前可有填充的 0xFF
+                    marker = _read_exact(stream, 1)[0]
+                if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                    continue
+                if marker in (0xD9, 0xDA):
+                    break  # 影像資料開始前都沒有 SOF
+                length = int.from_bytes(_read_exact(stream, 2), 'big')
+                if length < 2:
+                    raise ValueError('JPEG 檔頭損毀')
+                if marker in JPEG_SOF_MARKERS:
+                    sof = _read_exact(stream, 5)
+                    return 'JPEG', int.from_bytes(sof[3:5], 'big'), int.from_bytes(sof[1:3], 'big')
+                stream.seek(length - 2, os.SEEK_CUR)
+            raise ValueError('找不到 JPEG 尺寸資訊')
+
+        raise ValueError('只接受 PNG 或 JPEG 格式')
+    finally:
+        stream.seek(start)
+
+
+def validate_upload(stream):
+    """Rich Menu 圖片上傳的前置檢查：格式、尺寸與該尺寸的位元組上限
+
+    回傳 (format, (width, height), size_bytes)；不符時拋出 ValueError。
+    """
+    image_format, width, height = probe_image_header(stream)
+    max_bytes = _max_bytes(width, height)
+
+    start = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size_bytes = stream.tell() - start
+    stream.seek(start)
+    if size_bytes > max_bytes:
+        raise ValueError(_too_large_message(width, height, max_bytes, size_bytes))
+    return image_format, (width, height), size_bytes
+
+
+def _max_bytes(width, height):
+    """該尺寸的位元組上限；不是允許的尺寸時拋出 ValueError"""
+    max_bytes = config.RICHMENU_IMAGE_MAX_BYTES.get((width, height))
+    if max_bytes is None:
+        allowed = '、'.join(f'{w}x{h}' for w, h in config.RICHMENU_IMAGE_MAX_BYTES)
+        raise ValueError(f'圖片尺寸必須為 {allowed}，目前是 {width}x{height}')
+    return max_bytes
+
+
+def _too_large_message(width, height, max_bytes, size_bytes=None):
+    message = f'{width}x{height} 圖片不可超過 {max_bytes // (1024 * 1024)} MB'
+    if size_bytes is not None:
+        message += f'，目前是 {size_bytes / (1024 * 1024):.1f} MB'
+    return message
+
+
+class MultipartUpload:
+    """直接從 multipart 請求串流讀出單一檔案欄位：讀到檔頭就驗證，邊讀邊寫入
+
+    request.files 會先把整個請求收下（大檔暫存到磁碟）才交給呼叫端；這裡讀到
+    能判斷格式與尺寸的檔頭就檢查，不符時其餘內容不再讀取，寫入途中超過該尺寸
+    的上限也立即中止。用法：open() 找到欄位 → probe() 驗證 → save() 寫入。
+    """
+
+    def __init__(self, stream, boundary, chunk_size=64 * 1024):
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._chunk_size = chunk_size
+        self._head = b''  # probe 讀出、尚未寫入的內容
+        self._more = True  # 檔案欄位是否還有後續內容
+        self._limit = None  # (width, height, max_bytes)
+
+    def open(self, field):
+        """讀到 field 的檔案部分，回傳客戶端檔名；沒有這個欄位回傳 None"""
+        while True:
+            event = self._next_event()
+            if isinstance(event, File) and event.name == field:
+                return event.filename
+            if isinstance(event, Epilogue):
+                return None
+
+    def probe(self):
+        """只讀檔頭驗證格式與尺寸（規則同 validate_upload），回傳 (format, (width, height))"""
+        while True:
+            try:
+                image_format, width, height = probe_image_header(BytesIO(self._head))
+                break
+            except IncompleteHeader:
+                chunk = self._read()
+                if not chunk or len(self._head) >= PROBE_LIMIT:
+                    raise
+                self._head += chunk
+        self._limit = (width, height, _max_bytes(width, height))
+        return image_format, (width, height)
+
+    def save(self, path):
+        """把檔案內容寫入 path，回傳 (位元組數, SHA-256 hex)；超過上限時刪除已寫入的部分並拋出 ValueError"""
+        width, height, max_bytes = self._limit
+        digest = hashlib.sha256()
+        size_bytes = 0
+        try:
+            with open(path, 'wb') as f:
+                chunk, self._head = self._head or self._read(), b''
+                while chunk:
+                    size_bytes += len(chunk)
+                    if size_bytes > max_bytes:
+                        raise ValueError(_too_large_message(width, height, max_bytes))
+                    digest.update(chunk)
+                    f.write(chunk)
+                    chunk = self._read()
+        except BaseException:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            raise
+        return size_bytes, digest.hexdigest()
+
+    def _next_event(self):
+        while True:
+            event = self._decoder.next_event()
+            if event is not NEED_DATA:
+                return event
+            # 請求提早結束時 receive_data(None) 讓 decoder 拋出 ValueError
+            self._decoder.receive_data(self._stream.read(self._chunk_size) or None)
+
+    def _read(self):
+        """檔案欄位的下一段內容；讀完回傳 b''"""
+        while self._more:
+            event = self._next_event()
+            if isinstance(event, Data):
+                self._more = event.more_data
+                if event.data:
+                    return event.data
+        return b''
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}{TEMP_SUFFIX}'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def generate_derivatives(upload_folder, filename):
+    """產生縮圖、各寬度的 WebP/PNG 預覽與 LINE 用 JPEG；在子行程執行，只依賴檔案系統"""
+    image_path = upload_paths.resolve(filename, upload_folder)
+    if not image_path:
+        raise FileNotFoundError(filename)
+    # 衍生檔一律與原圖放在同一個目錄
+    folder = os.path.dirname(image_path)
+
+    with Image.open(image_path) as image:
+        image.load()
+        thumb_height = int(THUMBNAIL_WIDTH * image.size[1] / image.size[0])
+        thumbnail = image.copy()
+    thumbnail.thumbnail((THUMBNAIL_WIDTH, thumb_height), Image.Resampling.LANCZOS)
+
+    thumb_filename = thumbnail_filename(filename)
+    buf = BytesIO()
+    extension = os.path.splitext(filename)[1].lower()
+    thumbnail.save(buf, format='JPEG' if extension in ('.jpg', '.jpeg') else 'PNG')
+    _write_atomic(os.path.join(folder, thumb_filename), buf.getvalue())
+
+    renditions = []
+    with Image.open(image_path) as image:
+        image.load()
+        for width in RENDITION_WIDTHS:
+            if width >= image.width:
+                continue
+            resized = image.resize(
+                (width, round(image.height * width / image.width)), Image.Resampling.LANCZOS
+            )
+            for extension, image_format in RENDITION_FORMATS.items():
+                buf = BytesIO()
+                if image_format == 'WEBP':
+                    resized.save(buf, format=image_format, quality=80, method=4)
+                else:
+                    resized.save(buf, format=image_format)
+                name = rendition_filename(filename, width, extension)
+                data = buf.getvalue()
+                _write_atomic(os.path.join(folder, name), data)
+                renditions.append({
+                    'name': name,
+                    'width': width,
+                    'size_bytes': len(data),
+                    'content_hash': hashlib.sha256(data).hexdigest()
+                })
+
+    line_data = encode_line_jpeg(image_path)
+    _write_atomic(line_jpeg_path(image_path), line_data)
+
+    return {
+        'thumbnail_path': thumb_filename,
+        'renditions': renditions,
+        'line_jpeg_path': line_jpeg_filename(filename),
+        'line_jpeg_bytes': len(line_data)
+    }
+
+
+def set_notifier(callback, start_background_task=None):
+    """註冊完成通知：callback(project_id, payload)
+
+    start_background_task(target, *args) 用來執行寫回與通知（app.py 傳入
+    socketio.start_background_task）；未提供時改用一般執行緒。
+    """
+    global _notifier, _start_background_task
+    _notifier = callback
+    _start_background_task = start_background_task
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # 不用 fork：主行程已 eventlet monkey patch 且有多條執行緒，fork 出的子行程可能
+        # 帶著別的執行緒持有中的鎖。forkserver（不支援時用 spawn）從乾淨的直譯器啟動，
+        # 子行程只預先匯入本模組與 Pillow，不載入 Flask 應用。
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context('spawn')
+        _executor = ProcessPoolExecutor(
+            max_workers=config.IMAGE_PROCESS_WORKERS, mp_context=context
+        )
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def submit(rich_menu_id, filename):
+    """排入背景處理；IMAGE_PROCESS_WORKERS 為 0 時直接在目前行程處理（測試用）"""
+    db.update_rich_menu(rich_menu_id, image_status=STATUS_PROCESSING)
+    upload_folder = config.UPLOAD_FOLDER
+
+    if config.IMAGE_PROCESS_WORKERS <= 0:
+        try:
+            result = generate_derivatives(upload_folder, filename)
+        except Exception as exc:
+            _finish(rich_menu_id, filename, error=exc)
+        else:
+            _finish(rich_menu_id, filename, result=result)
+        return None
+
+    future = _get_executor().submit(generate_derivatives, upload_folder, filename)
+    if _start_background_task is not None:
+        _start_background_task(_complete, future, rich_menu_id, filename)
+    else:
+        threading.Thread(target=_complete, args=(future, rich_menu_id, filename), daemon=True).start()
+    return future
+
+
+def _complete(future, rich_menu_id, filename):
+    """等子行程結果並寫回；不用 add_done_callback，免得在行程池的執行緒上寫資料庫與 emit"""
+    exc = future.exception()
+    if exc is not None:
+        _finish(rich_menu_id, filename, error=exc)
+    else:
+        _finish(rich_menu_id, filename, result=future.result())
+
+
+def _finish(rich_menu_id, filename, result=None, error=None):
+    try:
+        rm = db.get_rich_menu(rich_menu_id)
+        # 處理期間又換了新圖：舊結果不寫回，讓新圖的工作決定最終狀態
+        if not rm or rm['image_path'] != filename:
+            return
+
+        if error is not None:
+            logger.error(f'❌ 圖片衍生檔產生失敗 ({filename}): {error}')
+            db.update_rich_menu(rich_menu_id, image_status=STATUS_FAILED)
+            payload = {'rich_menu_id': rich_menu_id, 'image_path': filename,
+                       'status': STATUS_FAILED, 'message': str(error)}
+        else:
+            db.update_image(
+                filename,
+                thumbnail_path=result['thumbnail_path'],
+                line_jpeg_path=result['line_jpeg_path'],
+                line_jpeg_bytes=result['line_jpeg_bytes'],
+                renditions=result['renditions']
+            )
+            db.update_rich_menu(
+                rich_menu_id,
+                thumbnail_path=result['thumbnail_path'],
+                image_status=STATUS_READY
+            )
+            payload = {'rich_menu_id': rich_menu_id, 'image_path': filename,
+                       'status': STATUS_READY, **result}
+
+        if _notifier:
+            _notifier(rm['project_id'], payload)
+    except Exception as exc:
+        logger.error(f'❌ 更新圖片處理狀態失敗 ({filename}): {exc}')
@@ -0,0 +1,150 @@
+# json_patch.py - JSON Patch（RFC 6902）與 JSON Merge Patch（RFC 7396）
+#
+# 供 PATCH /api/richmenus/<id> 部分更新使用。兩個函式都不修改傳入的文件，
+# 回傳套用後的新文件；格式錯誤丟出 PatchError，test 操作不符丟出 PatchConflict。
+
+import copy
+
+
+class PatchError(ValueError):
+    """patch 格式錯誤或路徑不存在"""
+
+
+class PatchConflict(PatchError):
+    """test 操作比對失敗（文件已不是預期的內容）"""
+
+
+def _parse_pointer(pointer):
+    """RFC 6901 JSON Pointer → 路徑片段"""
+    if not isinstance(pointer, str) or pointer and not pointer.startswith('/'):
+        raise PatchError(f'無效的 JSON Pointer: {pointer!r}')
+    if pointer == '':
+        return []
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _index(array, token, allow_end=False):
+    if allow_end and token == '-':
+        return len(array)
+    if not token.isdigit() or len(token) > 1 and token.startswith('0'):
+        raise PatchError(f'無效的陣列索引: {token!r}')
+    index = int(token)
+    if index > len(array) or index == len(array) and not allow_end:
+        raise PatchError(f'陣列索引超出範圍: {index}')
+    return index
+
+
+def _resolve(document, tokens):
+    value = document
+    for token in tokens:
+        if isinstance(value, dict):
+            if token not in value:
+                raise PatchError(f'路徑不存在: /{"/".join(tokens)}')
+            value = value[token]
+        elif isinstance(value, list):
+            value = value[_index(value, token)]
+        else:
+            raise PatchError(f'路徑不存在: /{"/".join(tokens)}')
+    return value
+
+
+def _add(document, tokens, value):
+    if not tokens:
+        return value
+    parent = _resolve(document, tokens[:-1])
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        parent[key] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, key, allow_end=True), value)
+    else:
+        raise PatchError(f'無法在 /{"/".join(tokens)} 新增值')
+    return document
+
+
+def _remove(document, tokens):
+    if not tokens:
+        raise PatchError('不能移除整份文件')
+    parent = _resolve(document, tokens[:-1])
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise PatchError(f'路徑不存在: /{"/".join(tokens)}')
+        return parent.pop(key)
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, key))
+    raise PatchError(f'路徑不存在: /{"/".join(tokens)}')
+
+
+def _json_type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    if value is None:
+        return 'null'
+    return 'object' if isinstance(value, dict) else 'array'
+
+
+def _json_equal(a, b):
+    """RFC 6902 test 的比較：JSON 型別必須相同（1 與 true 不相等），數字比數值，物件與陣列逐項比較"""
+    if _json_type(a) != _json_type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_json_equal(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def apply_patch(document, operations):
+    """依序套用 RFC 6902 操作（add、remove、replace、move、copy、test）"""
+    if not isinstance(operations, list):
+        raise PatchError('JSON Patch 必須是操作陣列')
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise PatchError('JSON Patch 操作必須是物件')
+        op = operation.get('op')
+        path = _parse_pointer(operation.get('path'))
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise PatchError(f'{op} 操作缺少 value')
+
+        if op == 'add':
+            document = _add(document, path, copy.deepcopy(operation['value']))
+        elif op == 'remove':
+            _remove(document, path)
+        elif op == 'replace':
+            if path:
+                _remove(document, path)
+            document = _add(document, path, copy.deepcopy(operation['value']))
+        elif op in ('move', 'copy'):
+            source = _parse_pointer(operation.get('from'))
+            if op == 'move':
+                if path[:len(source)] == source and path != source:
+                    raise PatchError('不能把值移到自己的子路徑')
+                value = _remove(document, source)
+            else:
+                value = copy.deepcopy(_resolve(document, source))
+            document = _add(document, path, value)
+        elif op == 'test':
+            if not _json_equal(_resolve(document, path), operation['value']):
+                raise PatchConflict(f'test 失敗: {operation.get("path")}')
+        else:
+            raise PatchError(f'不支援的操作: {op!r}')
+    return document
+
+
+def apply_merge_patch(document, patch):
+    """RFC 7396：物件逐層合併，null 代表刪除，其他值（含陣列）整個取代"""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = copy.deepcopy(document) if isinstance(document, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
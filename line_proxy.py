@@ -7,9 +7,6 @@ from auth import check_ip_whitelist
 
 line_proxy_bp = Blueprint('line_proxy', __name__, url_prefix='/proxy')
 
-LINE_BASE = config.LINE_API_BASE
-LINE_DATA_BASE = config.LINE_API_DATA_BASE
-
 def proxy_request(upstream_url, method='GET', data=None, headers=None, is_data_api=False):
     """
     通用的代理請求函式
@@ -66,6 +63,11 @@ def proxy_request(upstream_url, method='GET', data=None, headers=None, is_data_a
         return {'message': 'Request timeout'}, 504
     except requests.exceptions.RequestException as e:
         return {'message': f'Upstream request failed: {str(e)}'}, 502
+    finally:
+        # 建立、刪除、綁定選單或 Alias 後，排程預覽快取的遠端狀態已過期（逾時也可能已寫入）
+        if method != 'GET':
+            from scheduler import invalidate_remote_state
+            invalidate_remote_state(auth.split(' ', 1)[-1])
 
 # === Rich Menu 相關 API ===
 
@@ -74,7 +76,7 @@ def proxy_request(upstream_url, method='GET', data=None, headers=None, is_data_a
 def list_richmenus():
     if request.method == 'OPTIONS':
         return '', 200
-    return proxy_request(f'{LINE_BASE}/v2/bot/richmenu/list', method='GET')
+    return proxy_request(f'{config.LINE_API_BASE}/v2/bot/richmenu/list', method='GET')
 
 @line_proxy_bp.route('/v2/bot/richmenu', methods=['POST', 'OPTIONS'])
 @check_ip_whitelist
@@ -82,7 +84,7 @@ def create_richmenu():
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/richmenu',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu',
         method='POST',
         data=request.get_json()
     )
@@ -96,7 +98,7 @@ def upload_richmenu_content(rich_menu_id):
     # 圖片上傳需要使用 api-data.line.me
     content_type = request.headers.get('Content-Type', 'image/png')
     return proxy_request(
-        f'{LINE_DATA_BASE}/v2/bot/richmenu/{rich_menu_id}/content',
+        f'{config.LINE_API_DATA_BASE}/v2/bot/richmenu/{rich_menu_id}/content',
         method='POST',
         data=request.get_data(),
         headers={'Content-Type': content_type},
@@ -109,7 +111,7 @@ def delete_richmenu(rich_menu_id):
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/richmenu/{rich_menu_id}',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/{rich_menu_id}',
         method='DELETE'
     )
 
@@ -121,7 +123,7 @@ def set_default_richmenu(rich_menu_id):
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/user/all/richmenu/{rich_menu_id}',
+        f'{config.LINE_API_BASE}/v2/bot/user/all/richmenu/{rich_menu_id}',
         method='POST'
     )
 
@@ -131,7 +133,7 @@ def unset_default_richmenu():
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/user/all/richmenu',
+        f'{config.LINE_API_BASE}/v2/bot/user/all/richmenu',
         method='DELETE'
     )
 
@@ -141,7 +143,7 @@ def link_richmenu_to_user(user_id, rich_menu_id):
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/user/{user_id}/richmenu/{rich_menu_id}',
+        f'{config.LINE_API_BASE}/v2/bot/user/{user_id}/richmenu/{rich_menu_id}',
         method='POST'
     )
 
@@ -151,7 +153,7 @@ def unlink_richmenu_from_user(user_id):
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/user/{user_id}/richmenu',
+        f'{config.LINE_API_BASE}/v2/bot/user/{user_id}/richmenu',
         method='DELETE'
     )
 
@@ -163,7 +165,7 @@ def list_aliases():
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/richmenu/alias/list',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/list',
         method='GET'
     )
 
@@ -173,7 +175,7 @@ def get_alias(alias_id):
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/richmenu/alias/{alias_id}',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{alias_id}',
         method='GET'
     )
 
@@ -183,7 +185,7 @@ def create_alias():
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/richmenu/alias',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias',
         method='POST',
         data=request.get_json()
     )
@@ -194,7 +196,7 @@ def update_alias(alias_id):
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/richmenu/alias/{alias_id}',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{alias_id}',
         method='POST',
         data=request.get_json()
     )
@@ -205,7 +207,7 @@ def delete_alias(alias_id):
     if request.method == 'OPTIONS':
         return '', 200
     return proxy_request(
-        f'{LINE_BASE}/v2/bot/richmenu/alias/{alias_id}',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{alias_id}',
         method='DELETE'
     )
 
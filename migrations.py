@@ -0,0 +1,373 @@
+# migrations.py - 資料庫 schema 遷移
+#
+# 每個步驟有固定的版本號，依序套用，各自在一個交易內執行，完成後記錄在
+# schema_version 表。已發佈的步驟不可修改，新的變更一律往後加一個版本。
+# 啟動時只查一次 schema_version，已是最新版本就不再執行任何 DDL。
+
+import sqlite3
+from datetime import datetime
+
+
+def _baseline(cursor):
+    """建立所有資料表；沒有版本紀錄的舊資料庫也會在這一步補齊欄位與索引"""
+    # accounts 表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            channel_access_token TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+    # projects 表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE,
+            UNIQUE (account_id, name)
+        )
+    ''')
+
+    # rich_menus 表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rich_menus (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            rich_menu_id TEXT,
+            name TEXT NOT NULL,
+            alias TEXT,
+            chat_bar_text TEXT,
+            size_width INTEGER NOT NULL DEFAULT 2500,
+            size_height INTEGER NOT NULL DEFAULT 1686,
+            selected BOOLEAN NOT NULL DEFAULT 1,
+            areas TEXT,
+            image_path TEXT,
+            thumbnail_path TEXT,
+            image_status TEXT,
+            version INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (project_id) REFERENCES projects (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # aliases 表（用於 LINE API alias 管理）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS aliases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL,
+            alias_id TEXT NOT NULL,
+            rich_menu_id TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE,
+            UNIQUE (account_id, alias_id)
+        )
+    ''')
+
+    # images 表（圖片元數據）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rich_menu_id INTEGER NOT NULL,
+            original_path TEXT NOT NULL,
+            thumbnail_path TEXT,
+            content_type TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            FOREIGN KEY (rich_menu_id) REFERENCES rich_menus (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # flex_messages 表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS flex_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            json_content TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT
+        )
+    ''')
+
+    # scheduled_jobs 表（定時排程上傳）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            scope TEXT NOT NULL DEFAULT 'all',
+            current_tab_index INTEGER DEFAULT 0,
+            publish_target TEXT NOT NULL DEFAULT 'all',
+            user_ids TEXT,
+            default_menu_index INTEGER DEFAULT -1,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            run_time TEXT NOT NULL DEFAULT '00:00',
+            repeat_type TEXT NOT NULL DEFAULT 'daily',
+            repeat_weekday INTEGER,
+            repeat_day INTEGER,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            last_run_at TEXT,
+            last_run_status TEXT,
+            last_run_message TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (project_id) REFERENCES projects (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # scheduled_job_runs 表（每次排程執行的完整紀錄，含各階段耗時）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            project_id INTEGER NOT NULL,
+            trigger TEXT NOT NULL DEFAULT 'schedule',
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            duration_ms INTEGER,
+            phase_ms TEXT,
+            line_calls INTEGER NOT NULL DEFAULT 0,
+            bytes_uploaded INTEGER NOT NULL DEFAULT 0,
+            warnings TEXT,
+            message TEXT,
+            FOREIGN KEY (job_id) REFERENCES scheduled_jobs (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # scheduler_leases 表（多 worker 部署時選出唯一執行排程的 leader）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+    # collab_workers / collab_presence 表（多 worker Socket.IO 共用的線上名單）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collab_workers (
+            worker_id TEXT PRIMARY KEY,
+            heartbeat_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collab_presence (
+            project_id TEXT NOT NULL,
+            sid TEXT NOT NULL,
+            worker_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            user_name TEXT,
+            color TEXT,
+            rich_menu_id INTEGER,
+            short_id INTEGER,
+            joined_at REAL NOT NULL,
+            PRIMARY KEY (project_id, sid)
+        )
+    ''')
+
+    # collab_locks 表（Rich Menu 編輯鎖；多 worker 時共用）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collab_locks (
+            project_id TEXT NOT NULL,
+            rich_menu_id TEXT NOT NULL,
+            sid TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            user_name TEXT,
+            token TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (project_id, rich_menu_id)
+        )
+    ''')
+
+    # scheduled_job_claims 表（每個排程的每次執行只能被一個 worker 認領）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_job_claims (
+            job_id INTEGER NOT NULL,
+            run_key TEXT NOT NULL,
+            holder TEXT NOT NULL,
+            claimed_at TEXT NOT NULL,
+            PRIMARY KEY (job_id, run_key),
+            FOREIGN KEY (job_id) REFERENCES scheduled_jobs (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # broadcast_events 表（LINE Biz 後台手動群發續傳事件）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bot_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            status TEXT NOT NULL DEFAULT 'active',
+            selected_filters TEXT,
+            message_plan TEXT,
+            created_by TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+    # broadcast_event_contacts 表（事件的目標聯絡人快照與進度）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_event_contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            contact_id TEXT NOT NULL,
+            display_name TEXT,
+            profile_name TEXT,
+            nickname TEXT,
+            tags TEXT,
+            position INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            sent_count INTEGER NOT NULL DEFAULT 0,
+            failed_count INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            last_actor TEXT,
+            last_sent_at TEXT,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (event_id) REFERENCES broadcast_events (id) ON DELETE CASCADE,
+            UNIQUE (event_id, contact_id)
+        )
+    ''')
+
+    # broadcast_event_logs 表（每次送出或失敗的細節）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_event_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            contact_id TEXT,
+            message_index INTEGER,
+            message_type TEXT,
+            status TEXT NOT NULL,
+            actor TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (event_id) REFERENCES broadcast_events (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # 既有資料庫補上後來新增的欄位
+    _ensure_column(cursor, 'rich_menus', 'image_status', 'TEXT')
+    _ensure_column(cursor, 'rich_menus', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    _ensure_column(cursor, 'flex_messages', 'updated_at', 'TEXT')
+    _ensure_column(cursor, 'collab_presence', 'short_id', 'INTEGER')
+    for column, definition in (('width', 'INTEGER'), ('height', 'INTEGER'), ('format', 'TEXT'),
+                               ('content_hash', 'TEXT'), ('line_jpeg_path', 'TEXT'),
+                               ('line_jpeg_bytes', 'INTEGER'), ('renditions', 'TEXT'),
+                               ('created_at', 'TEXT'), ('updated_at', 'TEXT')):
+        _ensure_column(cursor, 'images', column, definition)
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_events_bot_id ON broadcast_events (bot_id, updated_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_contacts_event_status ON broadcast_event_contacts (event_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_logs_event ON broadcast_event_logs (event_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_runs_job ON scheduled_job_runs (job_id, started_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_runs_project ON scheduled_job_runs (project_id, started_at)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_images_original_path ON images (original_path)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_collab_presence_sid ON collab_presence (sid)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_collab_presence_worker ON collab_presence (worker_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_collab_locks_sid ON collab_locks (sid)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_collab_locks_rich_menu ON collab_locks (rich_menu_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_rich_menu ON images (rich_menu_id)')
+
+
+def _ensure_column(cursor, table, column, definition):
+    """欄位不存在時以 ALTER TABLE 補上（CREATE TABLE IF NOT EXISTS 不會更新既有表）"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+# (版本, 說明, SQL 清單或接收 cursor 的函式)
+MIGRATIONS = [
+    (1, '建立資料表', _baseline),
+    (2, '熱門查詢的索引', [
+        # get_project 的 Rich Menu 列表（含 created_at 排序）與 list_projects_by_account 的 COUNT 子查詢
+        'CREATE INDEX IF NOT EXISTS idx_rich_menus_project_created ON rich_menus (project_id, created_at)',
+        # get_project_version 的 MAX(updated_at)
+        'CREATE INDEX IF NOT EXISTS idx_rich_menus_project_updated ON rich_menus (project_id, updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_projects_account_updated ON projects (account_id, updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_project ON scheduled_jobs (project_id, created_at)',
+        # 排程器每分鐘的到期掃描只看啟用中的排程
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_due '
+        'ON scheduled_jobs (run_time, start_date, end_date) WHERE enabled = 1'
+    ]),
+    (3, '多 worker 共用的協作即時文件', [
+        # 每個 Rich Menu 的即時文件（版本、操作紀錄、未寫回欄位）整份存成 JSON
+        '''
+        CREATE TABLE IF NOT EXISTS collab_documents (
+            project_id TEXT NOT NULL,
+            rich_menu_id TEXT NOT NULL,
+            state TEXT NOT NULL,
+            dirty INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (project_id, rich_menu_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_collab_documents_rich_menu ON collab_documents (rich_menu_id)'
+    ])
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """目前已套用的最高版本；還沒有 schema_version 表時為 0"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(conn):
+    """依序套用尚未執行的步驟，回傳本次套用的版本"""
+    current = current_version(conn)
+    if current >= LATEST_VERSION:
+        return []
+
+    # 交易由這裡明確控制（預設模式下 sqlite3 不會把 DDL 包進交易）
+    conn.isolation_level = None
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # 拿到寫入鎖後再確認一次：其他 worker 可能剛套用完同一步
+            cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+            if cursor.fetchone():
+                cursor.execute('COMMIT')
+                continue
+            if callable(step):
+                step(cursor)
+            else:
+                for statement in step:
+                    cursor.execute(statement)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (version, description, datetime.utcnow().isoformat())
+            )
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        applied.append(version)
+        print(f'✓ 資料庫遷移 {version}：{description}')
+    return applied
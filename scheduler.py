@@ -2,13 +2,21 @@
 
 import os
 import json
+import time
+import uuid
+import atexit
+import socket
+import hashlib
 import logging
+import threading
 import requests
-from datetime import datetime, timedelta, timezone
-from io import BytesIO
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 import db
 import config
+import image_pipeline
+import upload_paths
 
 logger = logging.getLogger('scheduler')
 logger.setLevel(logging.INFO)
@@ -19,6 +27,15 @@ from apscheduler.triggers.interval import IntervalTrigger
 
 scheduler = None
 
+# 多 worker / 多副本時每個行程都會啟動排程器，但只有持有 lease 的 leader 會執行排程。
+LEASE_NAME = 'scheduled_upload_checker'
+_INSTANCE_ID = uuid.uuid4().hex[:8]
+_is_leader = False
+
+def _holder_id():
+    """lease 持有者識別；每次呼叫重新取 pid，fork 出來的 worker 不會共用同一個 ID"""
+    return f'{socket.gethostname()}:{os.getpid()}:{_INSTANCE_ID}'
+
 def init_scheduler(app):
     """初始化排程器，每 15 秒檢查一次，將排程誤差控制在 15 秒內。"""
     global scheduler
@@ -30,13 +47,87 @@ def init_scheduler(app):
         name='Check and run scheduled uploads',
         replace_existing=True
     )
+    scheduler.add_job(
+        func=_heartbeat,
+        trigger=IntervalTrigger(seconds=config.SCHEDULER_HEARTBEAT_SECONDS),
+        id='scheduler_lease_heartbeat',
+        name='Renew scheduler leader lease',
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=_run_upload_gc,
+        trigger=IntervalTrigger(hours=config.UPLOAD_GC_INTERVAL_HOURS),
+        id='upload_gc',
+        name='Delete unreferenced uploads',
+        replace_existing=True
+    )
     scheduler.start()
+    _heartbeat()
+    atexit.register(_release_leadership)
     logger.info('✓ 排程器已啟動（每 15 秒檢查一次）')
 
 
+def _heartbeat():
+    """續約或爭取 leader lease；leader 失聯超過 TTL 後由下一個心跳成功的行程接手"""
+    global _is_leader
+    try:
+        acquired = db.acquire_scheduler_lease(
+            LEASE_NAME, _holder_id(), config.SCHEDULER_LEASE_TTL
+        )
+    except Exception as e:
+        # 無法確認 lease 時一律視為非 leader，寧可延後也不重複發佈
+        logger.error(f'❌ 排程 lease 續約失敗: {e}')
+        acquired = False
+
+    if acquired and not _is_leader:
+        logger.info(f'👑 {_holder_id()} 成為排程 leader')
+        try:
+            db.prune_scheduled_job_claims(
+                (datetime.utcnow() - timedelta(days=90)).isoformat()
+            )
+        except Exception as e:
+            logger.warning(f'⚠️ 清理排程認領紀錄失敗: {e}')
+    elif _is_leader and not acquired:
+        logger.warning(f'⚠️ {_holder_id()} 失去排程 leader 身分')
+    _is_leader = acquired
+    return acquired
+
+
+def _release_leadership():
+    global _is_leader
+    if _is_leader:
+        try:
+            db.release_scheduler_lease(LEASE_NAME, _holder_id())
+        except Exception:
+            pass
+        _is_leader = False
+
+
+def _run_upload_gc():
+    """定期清理孤兒上傳檔；只由 leader 執行，避免多個行程同時掃描同一資料夾"""
+    if not _is_leader:
+        return
+    try:
+        import upload_gc
+        upload_gc.collect(dry_run=False)
+    except Exception as e:
+        logger.error(f'❌ 上傳檔清理失敗: {e}')
+
+
+def get_leader_status():
+    """目前 lease 狀態與本行程是否為 leader"""
+    lease = db.get_scheduler_lease(LEASE_NAME)
+    return {
+        'holder': _holder_id(),
+        'is_leader': bool(lease and lease['holder'] == _holder_id()
+                          and lease['expires_at'] > time.time()),
+        'lease': lease
+    }
+
+
 def _taipei_now():
     """統一使用帶時區的台北時間，避免手動與自動執行紀錄相差 8 小時。"""
-    return datetime.now(timezone(timedelta(hours=8)))
+    return db.taipei_now()
 
 def check_and_run_jobs():
     """檢查並執行到期的排程任務"""
@@ -47,6 +138,10 @@ def check_and_run_jobs():
     weekday = now.weekday()       # Monday=0
     day_of_month = now.day
     
+    # 執行前再續約一次，確保此刻仍是 leader
+    if not _heartbeat():
+        return
+
     try:
         due_jobs = db.list_due_scheduled_jobs(today_str, current_time_str, weekday, day_of_month)
         
@@ -61,10 +156,16 @@ def check_and_run_jobs():
                 last_run_date = job['last_run_at'][:10]
                 if last_run_date == today_str:
                     continue
+
+            # 原子認領這一次執行；lease 交接期間短暫出現兩個 leader 時也只有一個會發佈
+            run_key = f'{today_str} {job["run_time"]}'
+            if not db.claim_scheduled_job_run(job['id'], run_key, _holder_id()):
+                logger.info(f'  ⏭️ 排程 #{job["id"]} ({run_key}) 已由其他行程認領')
+                continue
             
             succeeded = False
             try:
-                result = _execute_job(job)
+                result = _run_with_history(job, 'schedule')
                 cleanup_warnings = result.get('cleanup_warnings', [])
                 switch_warnings = result.get('switch_warnings', [])
                 success_message = '上傳完成'
@@ -102,7 +203,7 @@ def execute_single_job(job_id):
         raise ValueError(f'找不到排程 #{job_id}')
     
     try:
-        result = _execute_job(job)
+        result = _run_with_history(job, 'manual')
         now = _taipei_now().isoformat()
         cleanup_warnings = result.get('cleanup_warnings', [])
         switch_warnings = result.get('switch_warnings', [])
@@ -136,6 +237,211 @@ def _execute_job(job):
     """執行排程上傳任務（伺服器端重現安全版 uploadAllRichMenus 邏輯）"""
     logger.info(f'🚀 開始執行排程 #{job["id"]} (project_id={job["project_id"]}, scope={job.get("scope")}, repeat={job.get("repeat_type")})')
     
+    with _phase('validate'):
+        context = _prepare_publish(job)
+        token = context['token']
+        prepared_menus = context['prepared_menus']
+        link_target = context['link_target']
+
+        remote_state = _fetch_remote_state(token, use_cache=False)
+        switch_warnings = _find_missing_switch_targets(
+            prepared_menus,
+            remote_state['aliases'],
+            context['aliases_being_published']
+        )
+    if switch_warnings:
+        logger.warning(
+            '  ⚠️ 部分切換目標不存在，選單仍會發佈：'
+            + '、'.join(switch_warnings)
+        )
+
+    old_menu_ids = _find_superseded_menu_ids(prepared_menus, remote_state['menus'])
+
+    # 接下來會寫入 LINE；不論成功與否，快取的遠端狀態都已失效。
+    invalidate_remote_state(token)
+
+    uploaded_menu_ids = {}
+    logger.info(f'  📦 準備上傳 {len(prepared_menus)} 個 Rich Menu')
+
+    # 先建立並上傳所有新版本。此階段不改 Alias、預設選單，也不刪舊版。
+    try:
+        for position, item in enumerate(prepared_menus, start=1):
+            logger.info(
+                f'    ({position}/{len(prepared_menus)}) '
+                f'建立 Rich Menu: {item["name"]}'
+            )
+            with _phase('create'):
+                rich_menu_id = _create_rich_menu(token, item['metadata'])
+            uploaded_menu_ids[item['project_index']] = rich_menu_id
+
+            logger.info(
+                f'    ({position}/{len(prepared_menus)}) '
+                f'上傳圖片: {os.path.basename(item["image_path"])}'
+            )
+            with _phase('upload'):
+                _upload_image(token, rich_menu_id, item['image_path'], item['line_jpeg_path'])
+    except Exception:
+        # 尚未切換任何引用，可以安全清掉這次建立的未完成版本。
+        for rich_menu_id in uploaded_menu_ids.values():
+            _delete_rich_menu_best_effort(token, rich_menu_id)
+        raise
+
+    # 新版本全部有圖片後，才切換 Alias。
+    with _phase('alias'):
+        for item in prepared_menus:
+            alias = item['alias']
+            if alias:
+                _sync_alias(
+                    token,
+                    alias,
+                    uploaded_menu_ids[item['project_index']]
+                )
+
+    # Alias 切換完成後才設定預設或綁定使用者。
+    if link_target['mode']:
+        target_id = link_target['rich_menu_id'] or uploaded_menu_ids[link_target['project_index']]
+        with _phase('default'):
+            if link_target['mode'] == 'default':
+                _set_default_richmenu(token, target_id)
+            else:
+                for uid in link_target['user_ids']:
+                    _link_richmenu_to_user(token, uid, target_id)
+
+    # 遠端切換完成後才保存新 ID，最後清掉同名舊版本。
+    for item in prepared_menus:
+        rm = item['record']
+        new_id = uploaded_menu_ids[item['project_index']]
+        if isinstance(rm.get('id'), int):
+            db.update_rich_menu(rm['id'], rich_menu_id=new_id)
+        logger.info(f'    ✅ 已上傳 Rich Menu: {item["name"]} -> {new_id}')
+
+    cleanup_warnings = []
+    with _phase('cleanup'):
+        for project_index, ids in old_menu_ids.items():
+            new_id = uploaded_menu_ids[project_index]
+            for old_id in ids:
+                if old_id == new_id:
+                    continue
+                try:
+                    _delete_rich_menu(token, old_id)
+                except Exception as exc:
+                    cleanup_warnings.append(str(exc))
+                    logger.warning(f'    ⚠️ 舊版清理失敗: {exc}')
+
+    return {
+        'cleanup_warnings': cleanup_warnings,
+        'switch_warnings': switch_warnings
+    }
+
+
+def plan_job(job, use_cache=True):
+    """計算排程發佈的預覽（dry-run），只讀取 LINE 狀態，不做任何寫入。
+
+    回傳內容與 _execute_job 實際會做的事一一對應：建立哪些新版本、
+    沿用哪些既有版本、刪除哪些舊版、Alias 如何切換，以及預設選單
+    與使用者綁定的變化。
+    """
+    context = _prepare_publish(job)
+    token = context['token']
+    prepared_menus = context['prepared_menus']
+    link_target = context['link_target']
+
+    remote_state = _fetch_remote_state(token, use_cache=use_cache, include_default=True)
+    remote_names = {
+        menu['richMenuId']: menu.get('name')
+        for menu in remote_state['menus']
+    }
+    old_menu_ids = _find_superseded_menu_ids(prepared_menus, remote_state['menus'])
+
+    menus = []
+    deletes = []
+    aliases = []
+    for item in prepared_menus:
+        project_index = item['project_index']
+        superseded = sorted(old_menu_ids[project_index])
+        menus.append({
+            'project_index': project_index,
+            'id': item['record'].get('id'),
+            'name': item['name'],
+            'alias': item['alias'] or None,
+            'action': 'create',
+            'area_count': len(item['metadata']['areas']),
+            'replaces': superseded
+        })
+        for old_id in superseded:
+            deletes.append({
+                'rich_menu_id': old_id,
+                'name': remote_names.get(old_id, item['name']),
+                'remote_exists': old_id in remote_names,
+                'replaced_by': project_index
+            })
+
+        alias = item['alias']
+        if alias:
+            current_target = remote_state['aliases'].get(alias)
+            aliases.append({
+                'alias_id': alias,
+                'action': 'switch' if current_target else 'create',
+                'from': current_target,
+                'to': {'project_index': project_index}
+            })
+
+    reused = []
+    default_menu = None
+    user_links = []
+    if link_target['mode']:
+        if link_target['rich_menu_id']:
+            target = {'rich_menu_id': link_target['rich_menu_id']}
+            reused.append({
+                'project_index': link_target['project_index'],
+                'rich_menu_id': link_target['rich_menu_id'],
+                'remote_exists': link_target['rich_menu_id'] in remote_names
+            })
+        else:
+            target = {'project_index': link_target['project_index']}
+        if link_target['mode'] == 'default':
+            default_menu = {
+                'action': 'set',
+                'from': remote_state.get('default_rich_menu_id'),
+                'to': target
+            }
+        else:
+            user_links = [
+                {'user_id': uid, 'to': target}
+                for uid in link_target['user_ids']
+            ]
+
+    switch_warnings = _find_missing_switch_targets(
+        prepared_menus,
+        remote_state['aliases'],
+        context['aliases_being_published']
+    )
+    return {
+        'job_id': job.get('id'),
+        'project_id': job['project_id'],
+        'scope': job.get('scope', 'all'),
+        'remote_state': {
+            'fetched_at': remote_state['fetched_at'],
+            'cached': remote_state['cached'],
+            'menu_count': len(remote_state['menus']),
+            'alias_count': len(remote_state['aliases'])
+        },
+        'menus': menus,
+        'reused': reused,
+        'deletes': deletes,
+        'aliases': aliases,
+        'default_menu': default_menu,
+        'user_links': user_links,
+        'switch_warnings': switch_warnings,
+        'write_calls': (
+            2 * len(menus) + len(aliases) + len(deletes)
+            + (1 if default_menu else 0) + len(user_links)
+        )
+    }
+
+
+def _prepare_publish(job):
+    """在本機完成所有驗證並整理發佈所需資料；任何錯誤都不會碰到 LINE。"""
     project = db.get_project(job['project_id'])
     if not project:
         raise ValueError(f'找不到專案 #{job["project_id"]}')
@@ -146,8 +452,6 @@ def _execute_job(job):
     
     logger.info(f'  📋 專案: {project.get("name", "?")} | 帳號 ID: {account["id"]}')
     
-    token = account['channel_access_token']
-    
     rich_menus = project['rich_menus']
     if not rich_menus:
         raise ValueError('專案中沒有 Rich Menu')
@@ -163,7 +467,10 @@ def _execute_job(job):
     else:
         indexed_menus = list(enumerate(rich_menus))
 
-    # 先在本機完成所有驗證，任何錯誤都不能碰到 LINE 上的現有選單。
+    # 一次查出所有圖片的元數據（預先產生的 LINE JPEG）；原圖一律先確認存在，
+    # 缺檔要在任何 LINE 呼叫之前失敗，plan_job 也才會回報
+    images = db.get_images([rm.get('image_path') for _, rm in indexed_menus])
+
     prepared_menus = []
     for project_index, rm in indexed_menus:
         rm_name = rm.get('name') or rm.get('metadata', {}).get(
@@ -173,9 +480,13 @@ def _execute_job(job):
         if not image_path:
             raise ValueError(f'「{rm_name}」缺少圖片')
 
-        full_image_path = os.path.join(config.UPLOAD_FOLDER, image_path)
-        if not os.path.exists(full_image_path):
+        full_image_path = upload_paths.resolve(image_path)
+        if not full_image_path:
             raise ValueError(f'「{rm_name}」的圖片檔案不存在: {image_path}')
+        image = images.get(image_path)
+        line_jpeg_path = None
+        if image and image['line_jpeg_path']:
+            line_jpeg_path = upload_paths.path_for(image['line_jpeg_path'])
 
         metadata = rm.get('metadata', {})
         line_metadata = _build_line_metadata(rm_name, metadata)
@@ -186,25 +497,56 @@ def _execute_job(job):
             'name': rm_name,
             'alias': rm.get('alias', '').strip(),
             'metadata': line_metadata,
-            'image_path': full_image_path
+            'image_path': full_image_path,
+            'line_jpeg_path': line_jpeg_path
         })
 
-    remote_menus = _list_remote_menus(token)
-    remote_aliases = _list_remote_aliases(token)
-    aliases_being_published = {
-        item['alias'] for item in prepared_menus if item['alias']
+    return {
+        'project': project,
+        'account': account,
+        'token': account['channel_access_token'],
+        'prepared_menus': prepared_menus,
+        'aliases_being_published': {
+            item['alias'] for item in prepared_menus if item['alias']
+        },
+        'link_target': _resolve_link_target(job, prepared_menus, rich_menus)
     }
-    switch_warnings = _find_missing_switch_targets(
-        prepared_menus,
-        remote_aliases,
-        aliases_being_published
-    )
-    if switch_warnings:
-        logger.warning(
-            '  ⚠️ 部分切換目標不存在，選單仍會發佈：'
-            + '、'.join(switch_warnings)
-        )
 
+
+def _resolve_link_target(job, prepared_menus, rich_menus):
+    """決定發佈後要設為預設或綁定給使用者的選單。
+
+    回傳 mode 為 'default'、'users' 或 None；目標若是這次發佈的選單，
+    以 project_index 表示，否則沿用既有的 rich_menu_id。
+    """
+    default_idx = job.get('default_menu_index', -1)
+    publish_target = job.get('publish_target', 'all')
+    user_ids = job.get('user_ids') or []
+    published_indexes = {item['project_index'] for item in prepared_menus}
+    first_index = prepared_menus[0]['project_index']
+
+    if default_idx >= 0:
+        if default_idx in published_indexes:
+            return {'mode': 'default', 'project_index': default_idx,
+                    'rich_menu_id': None, 'user_ids': []}
+        existing_id = None
+        if 0 <= default_idx < len(rich_menus):
+            existing_id = rich_menus[default_idx].get('rich_menu_id')
+        if not existing_id:
+            raise ValueError('指定的預設 Rich Menu 尚未上傳')
+        return {'mode': 'default', 'project_index': default_idx,
+                'rich_menu_id': existing_id, 'user_ids': []}
+    if publish_target == 'all':
+        return {'mode': 'default', 'project_index': first_index,
+                'rich_menu_id': None, 'user_ids': []}
+    if publish_target == 'users' and user_ids:
+        return {'mode': 'users', 'project_index': first_index,
+                'rich_menu_id': None, 'user_ids': list(user_ids)}
+    return {'mode': None, 'project_index': None, 'rich_menu_id': None, 'user_ids': []}
+
+
+def _find_superseded_menu_ids(prepared_menus, remote_menus):
+    """找出每個要發佈的選單在 LINE 上的舊版本（同名或本機記錄的 ID）"""
     old_menu_ids = {}
     for item in prepared_menus:
         project_index = item['project_index']
@@ -217,93 +559,49 @@ def _execute_job(job):
         if stored_id:
             old_ids.add(stored_id)
         old_menu_ids[project_index] = old_ids
+    return old_menu_ids
 
-    uploaded_menu_ids = {}
-    logger.info(f'  📦 準備上傳 {len(prepared_menus)} 個 Rich Menu')
 
-    # 先建立並上傳所有新版本。此階段不改 Alias、預設選單，也不刪舊版。
-    try:
-        for position, item in enumerate(prepared_menus, start=1):
-            logger.info(
-                f'    ({position}/{len(prepared_menus)}) '
-                f'建立 Rich Menu: {item["name"]}'
-            )
-            rich_menu_id = _create_rich_menu(token, item['metadata'])
-            uploaded_menu_ids[item['project_index']] = rich_menu_id
+# === 遠端狀態快取（供 plan_job 預覽使用）===
 
-            logger.info(
-                f'    ({position}/{len(prepared_menus)}) '
-                f'上傳圖片: {os.path.basename(item["image_path"])}'
-            )
-            _upload_image(token, rich_menu_id, item['image_path'])
-    except Exception:
-        # 尚未切換任何引用，可以安全清掉這次建立的未完成版本。
-        for rich_menu_id in uploaded_menu_ids.values():
-            _delete_rich_menu_best_effort(token, rich_menu_id)
-        raise
+REMOTE_STATE_CACHE_TTL = 60  # 秒
 
-    # 新版本全部有圖片後，才切換 Alias。
-    for item in prepared_menus:
-        alias = item['alias']
-        if alias:
-            _sync_alias(
-                token,
-                alias,
-                uploaded_menu_ids[item['project_index']]
-            )
+_remote_state_cache = {}  # {token 指紋: remote_state}
 
-    # Alias 切換完成後才設定預設或綁定使用者。
-    default_idx = job.get('default_menu_index', -1)
-    publish_target = job.get('publish_target', 'all')
-    user_ids = job.get('user_ids') or []
 
-    if default_idx >= 0:
-        default_rm_id = uploaded_menu_ids.get(default_idx)
-        if not default_rm_id and 0 <= default_idx < len(rich_menus):
-            default_rm_id = rich_menus[default_idx].get('rich_menu_id')
-        if not default_rm_id:
-            raise ValueError('指定的預設 Rich Menu 尚未上傳')
-        _set_default_richmenu(token, default_rm_id)
-    elif publish_target == 'all':
-        first_index = prepared_menus[0]['project_index']
-        _set_default_richmenu(token, uploaded_menu_ids[first_index])
-    elif publish_target == 'users' and user_ids:
-        first_index = prepared_menus[0]['project_index']
-        for uid in user_ids:
-            _link_richmenu_to_user(
-                token, uid, uploaded_menu_ids[first_index]
-            )
+def _token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
 
-    # 遠端切換完成後才保存新 ID，最後清掉同名舊版本。
-    for item in prepared_menus:
-        rm = item['record']
-        new_id = uploaded_menu_ids[item['project_index']]
-        if isinstance(rm.get('id'), int):
-            db.update_rich_menu(rm['id'], rich_menu_id=new_id)
-        logger.info(f'    ✅ 已上傳 Rich Menu: {item["name"]} -> {new_id}')
 
-    cleanup_warnings = []
-    for project_index, ids in old_menu_ids.items():
-        new_id = uploaded_menu_ids[project_index]
-        for old_id in ids:
-            if old_id == new_id:
-                continue
-            try:
-                _delete_rich_menu(token, old_id)
-            except Exception as exc:
-                cleanup_warnings.append(str(exc))
-                logger.warning(f'    ⚠️ 舊版清理失敗: {exc}')
+def _fetch_remote_state(token, use_cache=True, include_default=False):
+    """讀取 LINE 上的選單、Alias（與預設選單）；只發出 GET 請求"""
+    key = _token_key(token)
+    cached = _remote_state_cache.get(key)
+    if (
+        use_cache and cached
+        and time.monotonic() - cached['_loaded_at'] < REMOTE_STATE_CACHE_TTL
+        and (not include_default or cached['default_loaded'])
+    ):
+        return {**cached, 'cached': True}
 
-    return {
-        'cleanup_warnings': cleanup_warnings,
-        'switch_warnings': switch_warnings
+    state = {
+        'menus': _list_remote_menus(token),
+        'aliases': _list_remote_aliases(token),
+        'default_rich_menu_id': _get_default_richmenu_id(token) if include_default else None,
+        'default_loaded': include_default,
+        'fetched_at': _taipei_now().isoformat(),
+        '_loaded_at': time.monotonic()
     }
+    _remote_state_cache[key] = state
+    return {**state, 'cached': False}
 
 
-# === LINE API 伺服器端直接呼叫 ===
+def invalidate_remote_state(token):
+    """清掉該 token 的遠端狀態快取；任何寫入 LINE 的路徑（發佈、line_proxy）之後都要呼叫"""
+    _remote_state_cache.pop(_token_key(token), None)
 
-LINE_BASE = config.LINE_API_BASE
-LINE_DATA_BASE = config.LINE_API_DATA_BASE
+
+# === LINE API 伺服器端直接呼叫 ===
 
 def _build_line_metadata(name, metadata):
     """組裝 LINE Rich Menu metadata"""
@@ -420,9 +718,92 @@ def _find_missing_switch_targets(prepared_menus, remote_aliases, aliases_being_p
     return missing
 
 
+class _RunRecorder:
+    """累計單次排程執行的各階段耗時、LINE 呼叫次數與上傳位元組數"""
+
+    def __init__(self):
+        self.phase_ms = {}
+        self.line_calls = 0
+        self.bytes_uploaded = 0
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.phase_ms[name] = round(self.phase_ms.get(name, 0) + elapsed, 1)
+
+
+# 目前執行緒正在記錄的執行；plan_job 或直接呼叫 _execute_job 時為 None
+_run_context = threading.local()
+
+
+@contextmanager
+def _phase(name):
+    recorder = getattr(_run_context, 'recorder', None)
+    if recorder is None:
+        yield
+        return
+    with recorder.phase(name):
+        yield
+
+
+def _line_request(method, url, **kwargs):
+    """所有對 LINE 的請求都經過這裡，以便累計呼叫次數與上傳量"""
+    recorder = getattr(_run_context, 'recorder', None)
+    if recorder is not None:
+        recorder.line_calls += 1
+        data = kwargs.get('data')
+        if isinstance(data, (bytes, bytearray)):
+            recorder.bytes_uploaded += len(data)
+    return requests.request(method, url, **kwargs)
+
+
+def _run_with_history(job, trigger):
+    """執行排程並寫入 scheduled_job_runs；失敗時記錄完整錯誤後重新拋出"""
+    run_id = db.create_scheduled_job_run(
+        job['id'], job['project_id'], trigger, _taipei_now().isoformat()
+    )
+    recorder = _RunRecorder()
+    _run_context.recorder = recorder
+    started = time.perf_counter()
+    status = 'error'
+    warnings = {}
+    message = ''
+    try:
+        result = _execute_job(job)
+        status = 'success'
+        warnings = {
+            'cleanup': result.get('cleanup_warnings', []),
+            'switch': result.get('switch_warnings', [])
+        }
+        return result
+    except Exception as e:
+        message = str(e)
+        raise
+    finally:
+        _run_context.recorder = None
+        try:
+            db.finish_scheduled_job_run(
+                run_id, status,
+                finished_at=_taipei_now().isoformat(),
+                duration_ms=round((time.perf_counter() - started) * 1000),
+                phase_ms=recorder.phase_ms,
+                line_calls=recorder.line_calls,
+                bytes_uploaded=recorder.bytes_uploaded,
+                warnings=warnings,
+                message=message
+            )
+        except Exception as exc:
+            # 紀錄寫入失敗不應影響發佈結果
+            logger.warning(f'  ⚠️ 排程 #{job["id"]} 執行紀錄寫入失敗: {exc}')
+
+
 def _list_remote_menus(token):
     headers = {'Authorization': f'Bearer {token}'}
-    r = requests.get(f'{LINE_BASE}/v2/bot/richmenu/list', headers=headers, timeout=30)
+    r = _line_request('GET', f'{config.LINE_API_BASE}/v2/bot/richmenu/list', headers=headers, timeout=30)
     if r.status_code != 200:
         raise ValueError(f'列出 Rich Menu 失敗 ({r.status_code}): {r.text[:200]}')
     return r.json().get('richmenus', [])
@@ -430,8 +811,9 @@ def _list_remote_menus(token):
 
 def _list_remote_aliases(token):
     headers = {'Authorization': f'Bearer {token}'}
-    r = requests.get(
-        f'{LINE_BASE}/v2/bot/richmenu/alias/list',
+    r = _line_request(
+        'GET',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/list',
         headers=headers,
         timeout=30
     )
@@ -443,10 +825,26 @@ def _list_remote_aliases(token):
     }
 
 
+def _get_default_richmenu_id(token):
+    headers = {'Authorization': f'Bearer {token}'}
+    r = _line_request(
+        'GET',
+        f'{config.LINE_API_BASE}/v2/bot/user/all/richmenu',
+        headers=headers,
+        timeout=30
+    )
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise ValueError(f'查詢預設 Rich Menu 失敗 ({r.status_code}): {r.text[:200]}')
+    return r.json().get('richMenuId')
+
+
 def _delete_rich_menu(token, rich_menu_id):
     headers = {'Authorization': f'Bearer {token}'}
-    r = requests.delete(
-        f'{LINE_BASE}/v2/bot/richmenu/{rich_menu_id}',
+    r = _line_request(
+        'DELETE',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/{rich_menu_id}',
         headers=headers,
         timeout=30
     )
@@ -468,8 +866,9 @@ def _create_rich_menu(token, metadata):
         'Authorization': f'Bearer {token}',
         'Content-Type': 'application/json'
     }
-    r = requests.post(
-        f'{LINE_BASE}/v2/bot/richmenu',
+    r = _line_request(
+        'POST',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu',
         headers=headers,
         json=metadata,
         timeout=30
@@ -478,34 +877,35 @@ def _create_rich_menu(token, metadata):
         raise ValueError(f'建立 Rich Menu 失敗 ({r.status_code}): {r.text[:200]}')
     return r.json()['richMenuId']
 
-def _upload_image(token, rich_menu_id, image_path):
+def _encode_line_image(image_path, line_jpeg_path=None):
+    """取得 LINE 用 JPEG bytes；上傳時已由 image_pipeline 預先產生則直接沿用
+
+    line_jpeg_path 來自 images 表；沒有紀錄的舊圖才比對檔案時間判斷快取是否可用。
+    """
+    if line_jpeg_path:
+        try:
+            with open(line_jpeg_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+    else:
+        cached = image_pipeline.line_jpeg_path(image_path)
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(image_path):
+            with open(cached, 'rb') as f:
+                return f.read()
+    return image_pipeline.encode_line_jpeg(image_path)
+
+def _upload_image(token, rich_menu_id, image_path, line_jpeg_path=None):
     """上傳圖片到 Rich Menu（自動壓縮為 JPEG，確保不超過 LINE 限制）"""
-    from PIL import Image
-    
-    MAX_BYTES = 4_500_000  # 與前端 uploadAllRichMenus 一致
-    
-    img = Image.open(image_path)
-    # 轉為 RGB（去除 alpha channel，JPEG 不支援）
-    if img.mode in ('RGBA', 'LA', 'P'):
-        img = img.convert('RGB')
-    
-    # 嘗試不同品質，直到檔案大小低於限制
-    quality = 90
-    while quality >= 60:
-        buf = BytesIO()
-        img.save(buf, format='JPEG', quality=quality, optimize=True)
-        if buf.tell() <= MAX_BYTES:
-            break
-        quality -= 10
-    
-    image_data = buf.getvalue()
+    image_data = _encode_line_image(image_path, line_jpeg_path)
     
     headers = {
         'Authorization': f'Bearer {token}',
         'Content-Type': 'image/jpeg'
     }
-    r = requests.post(
-        f'{LINE_DATA_BASE}/v2/bot/richmenu/{rich_menu_id}/content',
+    r = _line_request(
+        'POST',
+        f'{config.LINE_API_DATA_BASE}/v2/bot/richmenu/{rich_menu_id}/content',
         headers=headers,
         data=image_data,
         timeout=60
@@ -520,16 +920,18 @@ def _sync_alias(token, alias_id, rich_menu_id):
         'Content-Type': 'application/json'
     }
     # 嘗試更新
-    r = requests.post(
-        f'{LINE_BASE}/v2/bot/richmenu/alias/{alias_id}',
+    r = _line_request(
+        'POST',
+        f'{config.LINE_API_BASE}/v2/bot/richmenu/alias/{alias_id}',
         headers=headers,
         json={'richMenuId': rich_menu_id},
         timeout=30
     )
     if r.status_code == 404:
         # 嘗試建立
-        r = requests.post(
-            f'{LINE_BASE}/v2/bot/richmenu/alias',
+        r = _line_request(
+            'POST',
+            f'{config.LINE_API_BASE}/v2/bot/richmenu/alias',
             headers=headers,
             json={'richMenuAliasId': alias_id, 'richMenuId': rich_menu_id},
             timeout=30
@@ -542,8 +944,9 @@ def _sync_alias(token, alias_id, rich_menu_id):
 def _set_default_richmenu(token, rich_menu_id):
     """設定預設 Rich Menu"""
     headers = {'Authorization': f'Bearer {token}'}
-    r = requests.post(
-        f'{LINE_BASE}/v2/bot/user/all/richmenu/{rich_menu_id}',
+    r = _line_request(
+        'POST',
+        f'{config.LINE_API_BASE}/v2/bot/user/all/richmenu/{rich_menu_id}',
         headers=headers,
         timeout=30
     )
@@ -553,8 +956,9 @@ def _set_default_richmenu(token, rich_menu_id):
 def _link_richmenu_to_user(token, user_id, rich_menu_id):
     """綁定 Rich Menu 到使用者"""
     headers = {'Authorization': f'Bearer {token}'}
-    r = requests.post(
-        f'{LINE_BASE}/v2/bot/user/{user_id}/richmenu/{rich_menu_id}',
+    r = _line_request(
+        'POST',
+        f'{config.LINE_API_BASE}/v2/bot/user/{user_id}/richmenu/{rich_menu_id}',
         headers=headers,
         timeout=30
     )
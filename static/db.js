@@ -177,83 +177,15 @@ window.saveProjectDetails = async function saveProjectDetails(project) {
 
 window.saveProject = async function saveProject(project) {
     try {
-        // 先取得 account_id
-        const accounts = await fetch(`${API_BASE}/accounts`).then(r => r.json());
-        const account = accounts.data.find(a => a.name === project.accountId);
-
-        if (!account) {
-            throw new Error('找不到對應的帳號');
-        }
+        if (!project.id) {
+            // 新建專案，再以 snapshot 建立 Rich Menus
+            const accounts = await fetch(`${API_BASE}/accounts`).then(r => r.json());
+            const account = accounts.data.find(a => a.name === project.accountId);
 
-        if (project.id) {
-            // 更新現有專案
-            await saveProjectDetails(project);
-
-            // 取得資料庫中的所有 Rich Menu ID
-            const projectData = await getProject(project.projectId || project.id);
-            const dbRichMenuIds = new Set(
-                projectData.richMenus
-                    .filter(rm => typeof rm.id === 'number')
-                    .map(rm => rm.id)
-            );
-
-            // 取得目前前端陣列中的 Rich Menu ID（僅包含數字 ID）
-            const currentRichMenuIds = new Set(
-                (project.richMenus || [])
-                    .filter(rm => typeof rm.id === 'number')
-                    .map(rm => rm.id)
-            );
-
-            // 找出需要刪除的 Rich Menu ID（在資料庫中但不在目前陣列中）
-            const idsToDelete = [...dbRichMenuIds].filter(id => !currentRichMenuIds.has(id));
-
-            // 刪除不在目前陣列中的 Rich Menu
-            for (const idToDelete of idsToDelete) {
-                try {
-                    await fetch(`${API_BASE}/richmenus/${idToDelete}`, {
-                        method: 'DELETE'
-                    });
-                    console.log(`已刪除 Rich Menu ID: ${idToDelete}`);
-                } catch (e) {
-                    console.error(`刪除 Rich Menu ${idToDelete} 失敗:`, e);
-                }
+            if (!account) {
+                throw new Error('找不到對應的帳號');
             }
 
-            // 處理 Rich Menus（更新或新增）
-            if (project.richMenus) {
-                for (const rm of project.richMenus) {
-                    // 檢查 rm.id 是數字還是臨時 ID（如 rm_123456）
-                    if (typeof rm.id === 'number') {
-                        // 已存在的 Rich Menu，更新
-                        await updateRichMenuInBackend(rm);
-                    } else if (typeof rm.id === 'string' && rm.id.startsWith('rm_')) {
-                        // 新的 Rich Menu（臨時 ID），創建
-                        const createResponse = await fetch(`${API_BASE}/projects/${project.id}/richmenus`, {
-                            method: 'POST',
-                            headers: {
-                                'Content-Type': 'application/json'
-                            },
-                            body: JSON.stringify({
-                                name: rm.name,
-                                alias: rm.alias,
-                                metadata: rm.metadata
-                            })
-                        });
-
-                        const createData = await createResponse.json();
-                        if (createData.ok) {
-                            rm.id = createData.data.id;  // 更新為真實 ID
-
-                            // 如果有圖片，上傳到後端
-                            if (rm.image && rm.image.dataUrl) {
-                                await uploadImageToBackend(rm.id, rm.image);
-                            }
-                        }
-                    }
-                }
-            }
-        } else {
-            // 新建專案
             const response = await fetch(`${API_BASE}/projects`, {
                 method: 'POST',
                 headers: {
@@ -273,33 +205,9 @@ window.saveProject = async function saveProject(project) {
 
             project.id = data.data.id;
             project.projectId = String(data.data.id);
-
-            // 新建專案時創建 Rich Menus
-            if (project.richMenus) {
-                for (const rm of project.richMenus) {
-                    const createResponse = await fetch(`${API_BASE}/projects/${project.id}/richmenus`, {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            name: rm.name,
-                            alias: rm.alias || '',
-                            metadata: rm.metadata
-                        })
-                    });
-
-                    const createData = await createResponse.json();
-                    if (createData.ok) {
-                        rm.id = createData.data.id;
-
-                        // 如果有圖片，上傳到後端
-                        if (rm.image && rm.image.dataUrl) {
-                            await uploadImageToBackend(rm.id, rm.image);
-                        }
-                    }
-                }
-            }
+            await saveProjectSnapshot(project, true);
+        } else {
+            await saveProjectSnapshot(project, false);
         }
 
         return project;
@@ -309,26 +217,149 @@ window.saveProject = async function saveProject(project) {
     }
 };
 
+// 整份專案狀態一次送到後端：伺服器與資料庫比對後，在同一個交易內更新專案、
+// 新增／更新／刪除 Rich Menu，回傳暫時 ID 對應的新 ID；之後再上傳新圖片
+async function saveProjectSnapshot(project, isNew) {
+    const richMenus = project.richMenus || [];
+    const created = richMenus.map(rm => isNew || typeof rm.id !== 'number');
+    const payloadIds = richMenus.map((rm, index) => (
+        created[index] ? (typeof rm.id === 'string' ? rm.id : `rm_new_${index}`) : rm.id
+    ));
+
+    const response = await fetch(`${API_BASE}/projects/${project.id}/snapshot`, {
+        method: 'PUT',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            name: project.name,
+            description: project.description || '',
+            rich_menus: richMenus.map((rm, index) => ({
+                id: payloadIds[index],
+                name: rm.name,
+                alias: rm.alias || '',
+                rich_menu_id: rm.richMenuId,
+                metadata: rm.metadata
+            }))
+        })
+    });
+
+    const data = await response.json();
+    if (!data.ok) {
+        throw new Error(data.message || '儲存專案失敗');
+    }
+    for (const failure of data.data.failed) {
+        console.error(`刪除 Rich Menu ${failure.id} 失敗:`, failure.message);
+    }
+
+    const updated = new Set(data.data.updated);
+    for (const [index, rm] of richMenus.entries()) {
+        // 伺服器已寫入新版本，下次自動儲存先整份更新一次再改回 PATCH
+        if (created[index] || updated.has(rm.id)) savedRichMenus.delete(rm);
+        if (created[index]) {
+            rm.id = data.data.created[String(payloadIds[index])];  // 更新為真實 ID
+
+            // 如果有圖片，上傳到後端
+            if (rm.image && rm.image.dataUrl) {
+                await uploadImageToBackend(rm.id, rm.image);
+            }
+        } else if (rm.image && rm.image.dataUrl && !rm.image.path) {
+            await uploadImageToBackend(rm.id, rm.image);
+        }
+    }
+}
+
+// 最近一次載入或儲存時的 Rich Menu 內容與版本；自動儲存只 PATCH 有變動的部分
+const savedRichMenus = new WeakMap();
+
+function richMenuDocument(richMenu) {
+    return JSON.parse(JSON.stringify({
+        name: richMenu.name,
+        alias: richMenu.alias,
+        rich_menu_id: richMenu.richMenuId,
+        metadata: richMenu.metadata
+    }));
+}
+
+function rememberSavedRichMenu(richMenu, version) {
+    if (version === null || version === undefined) {
+        savedRichMenus.delete(richMenu);
+        return;
+    }
+    savedRichMenus.set(richMenu, { version, document: richMenuDocument(richMenu) });
+}
+
+function isPlainObject(value) {
+    return value !== null && typeof value === 'object' && !Array.isArray(value);
+}
+
+// RFC 7396 merge-patch：物件逐層比較，陣列與其他值整個取代
+function createMergePatch(before, after) {
+    const patch = {};
+    for (const key of Object.keys(before)) {
+        if (!(key in after)) patch[key] = null;
+    }
+    for (const [key, value] of Object.entries(after)) {
+        const previous = before[key];
+        if (isPlainObject(value) && isPlainObject(previous)) {
+            const nested = createMergePatch(previous, value);
+            if (Object.keys(nested).length) patch[key] = nested;
+        } else if (JSON.stringify(value) !== JSON.stringify(previous)) {
+            patch[key] = value;
+        }
+    }
+    return patch;
+}
+
+// 只送出變動的欄位；回傳新版本，版本衝突（別處已更新）時回傳 null
+async function patchRichMenuInBackend(richMenu, saved) {
+    const patch = createMergePatch(saved.document, richMenuDocument(richMenu));
+    if (!Object.keys(patch).length) return saved.version;
+
+    const response = await fetch(`${API_BASE}/richmenus/${richMenu.id}`, {
+        method: 'PATCH',
+        headers: {
+            'Content-Type': 'application/merge-patch+json',
+            'If-Match': `"${saved.version}"`
+        },
+        body: JSON.stringify(patch)
+    });
+    if (response.status === 412) return null;
+
+    const data = await response.json();
+    if (!data.ok) {
+        throw new Error(data.message || '更新 Rich Menu 失敗');
+    }
+    return data.data.version;
+}
+
 async function updateRichMenuInBackend(richMenu) {
     try {
-        // 更新 metadata
-        const response = await fetch(`${API_BASE}/richmenus/${richMenu.id}`, {
-            method: 'PUT',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                name: richMenu.name,
-                alias: richMenu.alias,
-                rich_menu_id: richMenu.richMenuId,
-                metadata: richMenu.metadata
-            })
-        });
+        const saved = savedRichMenus.get(richMenu);
+        let version = saved ? await patchRichMenuInBackend(richMenu, saved) : null;
 
-        const data = await response.json();
-        if (!data.ok) {
-            throw new Error(data.message || '更新 Rich Menu 失敗');
+        if (version === null) {
+            // 沒有上次儲存的版本或版本衝突：整份更新 metadata（以這次編輯為準）
+            const response = await fetch(`${API_BASE}/richmenus/${richMenu.id}`, {
+                method: 'PUT',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    name: richMenu.name,
+                    alias: richMenu.alias,
+                    rich_menu_id: richMenu.richMenuId,
+                    metadata: richMenu.metadata
+                })
+            });
+
+            const data = await response.json();
+            if (!data.ok) {
+                throw new Error(data.message || '更新 Rich Menu 失敗');
+            }
+            version = data.data.version;
         }
+        rememberSavedRichMenu(richMenu, version);
 
         // 如果有圖片且圖片是新上傳的（有 dataUrl），則上傳圖片到後端
         if (richMenu.image && richMenu.image.dataUrl && !richMenu.image.path) {
@@ -456,14 +487,15 @@ window.getProject = async function getProject(projectId) {
             const imageData = rm.image_path ? {
                 name: rm.image_path,
                 type: /\.jpe?g$/i.test(rm.image_path) ? 'image/jpeg' : 'image/png',
-                dataUrl: `${API_BASE}/uploads/${encodeURIComponent(rm.image_path)}?v=${encodeURIComponent(rm.updated_at || '')}`,
+                // 檔名每次上傳都不同，可直接沿用瀏覽器快取，不需再加版本參數
+                dataUrl: `${API_BASE}/uploads/${encodeURIComponent(rm.image_path)}`,
                 width: rm.metadata.size.width,
                 height: rm.metadata.size.height,
                 path: rm.image_path,
                 thumbnail: rm.thumbnail_path
             } : null;
 
-            return {
+            const richMenu = {
                 id: rm.id,
                 richMenuId: rm.rich_menu_id,
                 name: rm.name,
@@ -472,6 +504,8 @@ window.getProject = async function getProject(projectId) {
                 metadata: rm.metadata,
                 updatedAt: rm.updated_at
             };
+            rememberSavedRichMenu(richMenu, rm.version);
+            return richMenu;
         });
 
         return {
@@ -701,3 +735,50 @@ window.deleteScheduledJob = async function deleteScheduledJob(jobId) {
         return { ok: false, message: e.message };
     }
 };
+
+window.getSchedulePlan = async function getSchedulePlan(jobId, refresh = false) {
+    try {
+        const query = refresh ? '?refresh=1' : '';
+        const response = await fetch(`${API_BASE}/schedules/${jobId}/plan${query}`);
+        return await response.json();
+    } catch (e) {
+        console.error('getSchedulePlan error:', e);
+        return { ok: false, message: e.message };
+    }
+};
+
+window.previewPublishPlan = async function previewPublishPlan(projectId, data, refresh = false) {
+    try {
+        const query = refresh ? '?refresh=1' : '';
+        const response = await fetch(`${API_BASE}/projects/${projectId}/publish-plan${query}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(data)
+        });
+        return await response.json();
+    } catch (e) {
+        console.error('previewPublishPlan error:', e);
+        return { ok: false, message: e.message };
+    }
+};
+
+window.getScheduleRuns = async function getScheduleRuns(jobId, limit = 50) {
+    try {
+        const response = await fetch(`${API_BASE}/schedules/${jobId}/runs?limit=${limit}`);
+        return await response.json();
+    } catch (e) {
+        console.error('getScheduleRuns error:', e);
+        return { ok: false, message: e.message };
+    }
+};
+
+window.getProjectScheduleRunStats = async function getProjectScheduleRunStats(projectId, days = null) {
+    try {
+        const query = days ? `?days=${days}` : '';
+        const response = await fetch(`${API_BASE}/projects/${projectId}/schedule-runs/stats${query}`);
+        return await response.json();
+    } catch (e) {
+        console.error('getProjectScheduleRunStats error:', e);
+        return { ok: false, message: e.message };
+    }
+};
@@ -1,7 +1,7 @@
 // ui/canvas.js - Canvas drawing and area interactions
 
 import { getCurrentRichMenu } from '../utils/helpers.js';
-import { drawImageOnCanvas } from '../utils/image.js';
+import { drawImageOnCanvas, editorImageUrl } from '../utils/image.js';
 import { broadcastAreasUpdate } from '../socket/collaboration.js';
 
 /**
@@ -80,7 +80,7 @@ export async function drawBackground(state) {
     ctx.clearRect(0, 0, bgCanvas.width, bgCanvas.height);
 
     if (currentRM.image && currentRM.image.dataUrl) {
-        await drawImageOnCanvas(ctx, currentRM.image.dataUrl, bgCanvas.width, bgCanvas.height);
+        await drawImageOnCanvas(ctx, editorImageUrl(currentRM.image.dataUrl, bgCanvas.width), bgCanvas.width, bgCanvas.height);
     } else {
         ctx.fillStyle = '#fafafa';
         ctx.fillRect(0, 0, bgCanvas.width, bgCanvas.height);
@@ -74,6 +74,18 @@ export function getImageDimensions(dataUrl) {
     });
 }
 
+/**
+ * Point backend upload URLs at the rendition matching the canvas pixel width
+ * @param {string} url - Image URL or data URL
+ * @param {number} pixelWidth - Canvas width in device pixels
+ * @returns {string} URL with a w= query for /api/uploads, otherwise unchanged
+ */
+export function editorImageUrl(url, pixelWidth) {
+    if (!url || !url.startsWith('/api/uploads/')) return url;
+    const separator = url.includes('?') ? '&' : '?';
+    return `${url}${separator}w=${Math.ceil(pixelWidth)}`;
+}
+
 /**
  * Draw image on canvas context
  * @param {CanvasRenderingContext2D} ctx - Canvas 2D context
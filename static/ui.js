@@ -11,6 +11,11 @@ let myUserName = '使用者' + Math.floor(Math.random() * 1000);
 let myColor = generateRandomColor();
 let remoteCursors = {};  // {userId: {richMenuId, element, color, name}}
 let activeEditors = {};  // 新增：追蹤其他用戶正在編輯的 Rich Menu {userId: {richMenuId, userName, color}}
+let areaVersions = {};  // 各 Rich Menu 已套用的區域操作版本 {richMenuId: version}
+let wireMode = 'json';  // 協作事件的傳輸格式，加入房間時與伺服器協商（'json' 或 'msgpack'）
+let roomMembers = {};  // 房間成員 {shortId: {user_id, user_name, color}}
+const WIRE_QUANT = 10000;  // 精簡格式的相對座標解析度（與 collab_wire.QUANT 相同）
+let liveDocumentReady = false;  // 已加入房間並收到伺服器 snapshot：已存檔的 Rich Menu 由伺服器寫回資料庫
 
 function generateUserId() {
     return 'user_' + Math.random().toString(36).substr(2, 9) + '_' + Date.now();
@@ -34,16 +39,24 @@ function initSocketIO() {
 
     socket.on('disconnect', () => {
         console.log('✗ Socket.IO 已斷線');
+        liveDocumentReady = false;
     });
 
     // 使用者加入/離開
     socket.on('user:joined', (data) => {
         console.log(`${data.user_name} 加入專案`);
+        rememberRoomMember(data);
         showNotification(`${data.user_name} 加入協作`, 'info');
     });
 
+    socket.on('users:list', (data) => {
+        roomMembers = {};
+        (data.users || []).forEach(rememberRoomMember);
+    });
+
     socket.on('user:left', (data) => {
         console.log(`${data.user_name} 離開專案`);
+        delete roomMembers[data.short_id];
         // 移除游標
         if (remoteCursors[data.user_id]) {
             remoteCursors[data.user_id].element.remove();
@@ -57,35 +70,55 @@ function initSocketIO() {
         }
     });
 
-    // Rich Menu 同步
-    socket.on('richmenu:update_areas', (data) => {
-        if (data.sender === myUserId) return;
-        console.log('收到區域更新', data);
+    // Rich Menu 區域同步：伺服器排序後的單一操作，版本不連續時重新同步
+    socket.on('richmenu:snapshot', (data) => {
+        // 伺服器上正在編輯中的內容比 REST 載入的資料庫內容新
+        areaVersions = {};
+        (data.menus || []).forEach(applyAreaSnapshot);
+        (data.locks || []).forEach((lock) => {
+            showNotification(`${lock.user_name} 鎖定了 Rich Menu 正在編輯`, 'info');
+        });
+        liveDocumentReady = true;
+    });
 
-        if (!window.editorState) return;
-        const state = window.editorState;
-        const targetRM = getRichMenuById(state, data.rich_menu_id);
-        if (!targetRM) return;
+    // 編輯鎖由伺服器強制：被別人鎖住的 Rich Menu，編輯會被拒絕並改回伺服器內容
+    socket.on('richmenu:locked', (data) => {
+        showNotification(`${data.user_name} 鎖定了 Rich Menu 正在編輯`, 'info');
+    });
 
-        // 不可丟棄非目前分頁的同步資料，否則稍後 autosave 會寫回舊版本。
-        targetRM.metadata.areas = data.areas;
+    socket.on('richmenu:unlocked', (data) => {
+        if (data.reason === 'expired') {
+            showNotification(`${data.user_name} 的編輯鎖已逾時釋放`, 'info');
+        }
+    });
 
-        if (isCurrentRichMenu(state, targetRM)) {
-            // 重繪畫布
-            drawOverlay(state);
+    // 有人直接儲存（REST）時蓋掉了尚未寫回的即時編輯
+    socket.on('richmenu:edits_overwritten', (data) => {
+        const targetRM = window.editorState && getRichMenuById(window.editorState, data.rich_menu_id);
+        const name = targetRM ? targetRM.name : data.rich_menu_id;
+        showNotification(`「${name}」的 ${data.fields.join('、')} 已被其他人儲存的內容取代`, 'error');
+    });
 
-            // 如果當前選中的區域已被刪除，取消選擇
-            if (state.selectedAreaIndex >= targetRM.metadata.areas.length) {
-                state.selectedAreaIndex = -1;
-                updateActionPanel(state);
-            }
+    socket.on('richmenu:area_op', onAreaOp);
 
-            // 更新 JSON 預覽
-            renderJsonPreview(state);
+    function onAreaOp(data) {
+        if (data.sender === myUserId) return;
+        if (!window.editorState) return;
+        const targetRM = getRichMenuById(window.editorState, data.rich_menu_id);
+        if (!targetRM) return;
 
-            showNotification('其他使用者更新了區域', 'info');
+        const current = areaVersions[data.rich_menu_id] || 0;
+        if (data.version <= current) return;
+        if (data.version !== current + 1) {
+            requestAreaResync(data.rich_menu_id);
+            return;
         }
-    });
+
+        // 不可丟棄非目前分頁的同步資料，否則稍後 autosave 會寫回舊版本。
+        applyAreaOp(targetRM.metadata.areas, data.op);
+        areaVersions[data.rich_menu_id] = data.version;
+        refreshSyncedAreas(targetRM);
+    }
 
     socket.on('richmenu:update_metadata', async (data) => {
         if (data.sender === myUserId) return;
@@ -99,6 +132,10 @@ function initSocketIO() {
 
         if (data.metadata.name !== undefined) {
             targetRM.metadata.name = data.metadata.name;
+            targetRM.name = data.metadata.name;
+        }
+        if (data.metadata.alias !== undefined) {
+            targetRM.alias = data.metadata.alias;
         }
         if (data.metadata.chatBarText !== undefined) {
             targetRM.metadata.chatBarText = data.metadata.chatBarText;
@@ -126,7 +163,7 @@ function initSocketIO() {
             targetRM.image = {
                 name: data.metadata.imageName || data.metadata.imagePath,
                 type: /\.jpe?g$/i.test(data.metadata.imagePath) ? 'image/jpeg' : 'image/png',
-                dataUrl: `${API_BASE}/uploads/${encodeURIComponent(data.metadata.imagePath)}?v=${Date.now()}`,
+                dataUrl: `${API_BASE}/uploads/${encodeURIComponent(data.metadata.imagePath)}`,
                 width: targetRM.metadata.size.width,
                 height: targetRM.metadata.size.height,
                 path: data.metadata.imagePath,
@@ -144,8 +181,27 @@ function initSocketIO() {
         if (isActive) renderJsonPreview(state);
     });
 
-    // 游標移動同步
-    socket.on('cursor:move', (data) => {
+    // 背景圖片處理完成（縮圖、LINE 用 JPEG）
+    socket.on('richmenu:image_ready', (data) => {
+        if (!window.editorState) return;
+        const targetRM = getRichMenuById(window.editorState, data.rich_menu_id);
+        if (!targetRM || !targetRM.image || targetRM.image.path !== data.image_path) return;
+
+        targetRM.image.status = data.status;
+        if (data.status === 'ready') {
+            targetRM.image.thumbnail = data.thumbnail_path;
+        } else {
+            showNotification(`圖片處理失敗：${data.message || ''}`, 'error');
+        }
+    });
+
+    // 游標移動同步（伺服器合併後以 cursors:update 批次送出；cursor:move 為未合併時的逐筆轉送）
+    socket.on('cursors:update', (data) => {
+        (data.cursors || []).forEach(applyRemoteCursor);
+    });
+    socket.on('cursor:move', applyRemoteCursor);
+
+    function applyRemoteCursor(data) {
         if (data.user_id === myUserId) return;
 
         // 檢查是否在同一個 Rich Menu
@@ -174,10 +230,12 @@ function initSocketIO() {
             x: absoluteX,
             y: absoluteY
         });
-    });
+    }
 
     // 游標離開事件
-    socket.on('cursor:leave', (data) => {
+    socket.on('cursor:leave', onCursorLeave);
+
+    function onCursorLeave(data) {
         if (data.user_id === myUserId) return;
 
         const cursor = remoteCursors[data.user_id];
@@ -192,10 +250,12 @@ function initSocketIO() {
                 cursor.element.style.opacity = '1'; // 重置以便下次顯示
             }, 300);
         }
-    });
+    }
 
     // Tab 切換事件（其他用戶切換 Tab）
-    socket.on('tab:switch', (data) => {
+    socket.on('tab:switch', onTabSwitch);
+
+    function onTabSwitch(data) {
         if (data.user_id === myUserId) return;
 
         console.log('收到 tab:switch 事件', {
@@ -234,6 +294,38 @@ function initSocketIO() {
                 );
             }
         }
+    }
+
+    // 精簡格式（msgpack）：使用者以房間內的 short_id 表示，座標為 0..WIRE_QUANT 的整數
+    socket.on('c:cursors', (buffer) => {
+        const items = MessagePack.decode(buffer);
+        for (let i = 0; i + 3 < items.length; i += 4) {
+            const member = roomMembers[items[i]];
+            if (!member) continue;
+            applyRemoteCursor({
+                ...member,
+                rich_menu_id: items[i + 1],
+                relative_x: items[i + 2] / WIRE_QUANT,
+                relative_y: items[i + 3] / WIRE_QUANT
+            });
+        }
+    });
+
+    socket.on('c:cursor_leave', (buffer) => {
+        const [shortId, richMenuId] = MessagePack.decode(buffer);
+        const member = roomMembers[shortId];
+        if (member) onCursorLeave({ user_id: member.user_id, rich_menu_id: richMenuId });
+    });
+
+    socket.on('c:tab', (buffer) => {
+        const [shortId, richMenuId] = MessagePack.decode(buffer);
+        const member = roomMembers[shortId];
+        if (member) onTabSwitch({ ...member, rich_menu_id: richMenuId });
+    });
+
+    socket.on('c:area_op', (buffer) => {
+        const [richMenuId, version, , op] = MessagePack.decode(buffer);
+        onAreaOp({ rich_menu_id: richMenuId, version, op });
     });
 
     // 接收初始標籤狀態（當加入專案時）
@@ -268,10 +360,46 @@ function joinProject(projectId) {
     }
 
     currentProjectId = projectId;
+    liveDocumentReady = false;
+    wireMode = 'json';
+    roomMembers = {};
     socket.emit('join_project', {
         project_id: projectId,
         user_id: myUserId,
         user_name: myUserName,
+        color: myColor,
+        wire: window.MessagePack ? 'msgpack' : 'json'
+    }, (res) => {
+        if (!res || !res.ok || currentProjectId !== projectId) return;
+        wireMode = res.wire;
+    });
+}
+
+function rememberRoomMember(info) {
+    if (info.short_id === null || info.short_id === undefined) return;
+    roomMembers[info.short_id] = {
+        user_id: info.user_id,
+        user_name: info.user_name,
+        color: info.color
+    };
+}
+
+// 精簡格式送出：[project_id, ...欄位] 以 msgpack 編碼成 bytes（身分由伺服器依連線判斷）
+function emitCompact(event, items) {
+    socket.emit(event, MessagePack.encode([currentProjectId, ...items]));
+}
+
+function broadcastTabSwitch(richMenuId) {
+    if (!socket || !currentProjectId) return;
+    if (wireMode === 'msgpack') {
+        emitCompact('tab:switch', [richMenuId]);
+        return;
+    }
+    socket.emit('tab:switch', {
+        project_id: currentProjectId,
+        rich_menu_id: richMenuId,
+        user_id: myUserId,
+        user_name: myUserName,
         color: myColor
     });
 }
@@ -281,15 +409,131 @@ function leaveProject() {
         socket.emit('leave_project', { project_id: currentProjectId });
         currentProjectId = null;
     }
+    liveDocumentReady = false;
+    wireMode = 'json';
+}
+
+function isLiveDocument(richMenu) {
+    return liveDocumentReady && Boolean(socket && socket.connected) && typeof richMenu.id === 'number';
+}
+
+function applyAreaOp(areas, op) {
+    switch (op.type) {
+        case 'add':
+            areas.push(JSON.parse(JSON.stringify(op.area)));
+            break;
+        case 'bounds':
+            areas[op.index].bounds = { ...op.bounds };
+            break;
+        case 'action':
+            if (op.action) {
+                areas[op.index].action = JSON.parse(JSON.stringify(op.action));
+            } else {
+                delete areas[op.index].action;
+            }
+            break;
+        case 'delete':
+            areas.splice(op.index, 1);
+            break;
+        case 'replace':
+            areas.splice(0, areas.length, ...JSON.parse(JSON.stringify(op.areas)));
+            break;
+    }
+}
+
+function refreshSyncedAreas(targetRM) {
+    const state = window.editorState;
+    if (!state || !isCurrentRichMenu(state, targetRM)) return;
+
+    // 重繪畫布
+    drawOverlay(state);
+
+    // 如果當前選中的區域已被刪除，取消選擇
+    if (state.selectedAreaIndex >= targetRM.metadata.areas.length) {
+        state.selectedAreaIndex = -1;
+    }
+    updateActionPanel(state);
+
+    // 更新 JSON 預覽
+    renderJsonPreview(state);
+}
+
+function applyAreaSnapshot(snapshot) {
+    if (!snapshot || !window.editorState) return;
+    const targetRM = getRichMenuById(window.editorState, snapshot.rich_menu_id);
+    if (!targetRM) return;
+    targetRM.metadata.areas = snapshot.areas;
+    if (snapshot.size) {
+        targetRM.metadata.size = snapshot.size;
+        targetRM.metadata.name = snapshot.name;
+        targetRM.metadata.chatBarText = snapshot.chatBarText;
+        targetRM.metadata.selected = snapshot.selected;
+        targetRM.name = snapshot.name;
+        targetRM.alias = snapshot.alias;
+        renderTabs(window.editorState);
+    }
+    areaVersions[snapshot.rich_menu_id] = snapshot.version;
+    refreshSyncedAreas(targetRM);
+}
+
+function requestAreaResync(richMenuId) {
+    if (!socket || !currentProjectId) return;
+    socket.emit('richmenu:resync', {
+        project_id: currentProjectId,
+        rich_menu_id: richMenuId
+    }, (res) => {
+        if (res && res.ok) applyAreaSnapshot(res.snapshot);
+    });
+}
+
+function broadcastAreaActionOp(richMenu, area) {
+    const index = richMenu.metadata.areas.indexOf(area);
+    if (index < 0) return;
+    broadcastAreaOp(richMenu.id, { type: 'action', index, action: area.action || null });
 }
 
-function broadcastAreasUpdate(richMenuId, areas) {
+// 送出單一區域操作（本地已先套用）；伺服器調整過或拒絕時以 snapshot 為準
+function broadcastAreaOp(richMenuId, op) {
     if (!socket || !currentProjectId) return;
-    socket.emit('richmenu:update_areas', {
+    const baseVersion = areaVersions[richMenuId] || 0;
+    const localRM = window.editorState && getRichMenuById(window.editorState, richMenuId);
+    // add 由伺服器決定索引，本地是附加在最後
+    const expectedIndex = op.type === 'add' && localRM
+        ? localRM.metadata.areas.length - 1
+        : op.index;
+    socket.emit('richmenu:area_op', {
         project_id: currentProjectId,
         rich_menu_id: richMenuId,
-        areas: areas,
+        base_version: baseVersion,
+        op: op,
         sender: myUserId
+    }, (res) => {
+        if (!res) return;
+        if (res.ok && res.version === (areaVersions[richMenuId] || 0) + 1 && res.op.index === expectedIndex) {
+            areaVersions[richMenuId] = res.version;
+            return;
+        }
+        if (res.ok || res.code === 'stale') {
+            if (res.snapshot) {
+                applyAreaSnapshot(res.snapshot);
+            } else {
+                requestAreaResync(richMenuId);
+            }
+            return;
+        }
+        if (res.code === 'not_found') {
+            // 伺服器還不認得這個 Rich Menu（例如尚未儲存）：整批送出建立文件
+            if (localRM && op.type !== 'replace') {
+                broadcastAreaOp(richMenuId, {
+                    type: 'replace',
+                    size: localRM.metadata.size,
+                    areas: localRM.metadata.areas
+                });
+            }
+            return;
+        }
+        showNotification(`區域同步失敗：${res.message || ''}`, 'error');
+        requestAreaResync(richMenuId);
     });
 }
 
@@ -300,11 +544,24 @@ function broadcastMetadataUpdate(richMenuId, metadata) {
         rich_menu_id: richMenuId,
         metadata: metadata,
         sender: myUserId
+    }, (res) => {
+        if (!res || res.ok || res.code === 'not_found') return;
+        // 伺服器拒絕這次編輯：改回伺服器上的內容
+        showNotification(`設定同步失敗：${res.message || ''}`, 'error');
+        requestAreaResync(richMenuId);
     });
 }
 
 function broadcastCursorMove(relativeX, relativeY) {
     if (!socket || !currentProjectId || !currentRichMenuId) return;
+    if (wireMode === 'msgpack') {
+        emitCompact('cursor:move', [
+            currentRichMenuId,
+            Math.round(relativeX * WIRE_QUANT),
+            Math.round(relativeY * WIRE_QUANT)
+        ]);
+        return;
+    }
     socket.emit('cursor:move', {
         project_id: currentProjectId,
         rich_menu_id: currentRichMenuId,  // 新增
@@ -1925,13 +2182,7 @@ async function renderEditor(projectId) {
         const currentRM = state.project.richMenus[state.currentTabIndex];
         if (socket && currentProjectId && currentRM) {
             console.log('廣播初始標籤狀態', currentRM.id);
-            socket.emit('tab:switch', {
-                project_id: currentProjectId,
-                rich_menu_id: currentRM.id,
-                user_id: myUserId,
-                user_name: myUserName,
-                color: myColor
-            });
+            broadcastTabSwitch(currentRM.id);
         }
     }, 100);  // 100ms 延遲確保加入房間的操作完成
 
@@ -1996,6 +2247,11 @@ async function renderEditor(projectId) {
 
     state.scheduleAutosave = function scheduleAutosave(richMenu = getCurrentRichMenu(state)) {
         if (!richMenu) return;
+        // 編輯已經由 Socket 送到伺服器的即時文件，伺服器會批次寫回，不必再各自 PUT
+        if (isLiveDocument(richMenu)) {
+            setSaved();
+            return;
+        }
         dirtyRichMenus.set(String(richMenu.id), richMenu);
         if (autosaveTimer) clearTimeout(autosaveTimer);
         setSaving();
@@ -2052,15 +2308,7 @@ async function loadCurrentTab(state) {
     currentRichMenuId = currentRM.id;
 
     // 廣播 Tab 切換事件
-    if (socket && currentProjectId) {
-        socket.emit('tab:switch', {
-            project_id: currentProjectId,
-            rich_menu_id: currentRM.id,
-            user_id: myUserId,
-            user_name: myUserName,
-            color: myColor
-        });
-    }
+    broadcastTabSwitch(currentRM.id);
 
     // 保存當前滾動位置（頁面和編輯區）
     const pageScrollTop = window.pageYOffset || document.documentElement.scrollTop;
@@ -2333,6 +2581,7 @@ function wireTabControls(state) {
                 renderTabs(state);
                 renderSettingsTabs();
                 if (state.scheduleAutosave) state.scheduleAutosave(currentRM);
+                broadcastMetadataUpdate(currentRM.id, { name: autoName, alias: currentRM.alias });
             });
 
             document.getElementById('copy-rm-id').addEventListener('click', async () => {
@@ -2826,7 +3075,7 @@ async function drawBackground(state, bgCanvas, currentRM) {
 
     if (currentRM.image && currentRM.image.dataUrl) {
         try {
-            await drawImageOnCanvas(ctx, currentRM.image.dataUrl, logicalWidth, logicalHeight);
+            await drawImageOnCanvas(ctx, editorImageUrl(currentRM.image.dataUrl, logicalWidth * dpr), logicalWidth, logicalHeight);
         } catch (error) {
             console.error('背景圖載入失敗:', error);
             ctx.fillStyle = '#fff7ed';
@@ -2945,6 +3194,13 @@ function drawAreas(state) {
     });
 }
 
+// 後端圖片改抓符合畫布像素寬度的預覽版本（WebP/PNG），不必每次載入完整原圖
+function editorImageUrl(url, pixelWidth) {
+    if (!url || !url.startsWith(`${API_BASE}/uploads/`)) return url;
+    const separator = url.includes('?') ? '&' : '?';
+    return `${url}${separator}w=${Math.ceil(pixelWidth)}`;
+}
+
 function drawImageOnCanvas(ctx, dataUrl, w, h) {
     return new Promise((resolve, reject) => {
         const img = new Image();
@@ -2975,22 +3231,23 @@ function wireAreaButtons(state) {
         renderJsonPreview(state);
         if (state.scheduleAutosave) state.scheduleAutosave();
 
-        // 廣播區域更新
-        broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+        // 廣播新增的區域
+        broadcastAreaOp(currentRM.id, { type: 'add', area });
     });
 
     document.getElementById('delete-area').addEventListener('click', () => {
         if (state.selectedAreaIndex < 0) return;
         const currentRM = getCurrentRichMenu(state);
-        currentRM.metadata.areas.splice(state.selectedAreaIndex, 1);
+        const deletedIndex = state.selectedAreaIndex;
+        currentRM.metadata.areas.splice(deletedIndex, 1);
         state.selectedAreaIndex = -1;
         setupCanvas(state);
         updateActionPanel(state);
         renderJsonPreview(state);
         if (state.scheduleAutosave) state.scheduleAutosave();
 
-        // 廣播區域更新
-        broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+        // 廣播刪除的區域
+        broadcastAreaOp(currentRM.id, { type: 'delete', index: deletedIndex });
     });
 }
 
@@ -3224,16 +3481,21 @@ function enableAreaInteractions(canvas, state) {
                 if (state.scheduleAutosave) state.scheduleAutosave();
 
                 // 廣播新增的區域
-                broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+                broadcastAreaOp(currentRM.id, { type: 'add', area });
             }
 
             drawOverlay(state);
         }
 
         // 如果完成拖曳或調整大小，廣播更新
-        if (mode === 'dragging' || mode === 'resizing') {
+        if ((mode === 'dragging' || mode === 'resizing') && state.selectedAreaIndex >= 0) {
             const currentRM = getCurrentRichMenu(state);
-            broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+            const index = state.selectedAreaIndex;
+            broadcastAreaOp(currentRM.id, {
+                type: 'bounds',
+                index,
+                bounds: currentRM.metadata.areas[index].bounds
+            });
         }
 
         mode = 'select';
@@ -3291,6 +3553,10 @@ function enableAreaInteractions(canvas, state) {
     // 滑鼠離開 Canvas 時廣播離開事件
     canvas.onmouseleave = () => {
         if (!socket || !currentProjectId || !currentRichMenuId) return;
+        if (wireMode === 'msgpack') {
+            emitCompact('cursor:leave', [currentRichMenuId]);
+            return;
+        }
         socket.emit('cursor:leave', {
             project_id: currentProjectId,
             rich_menu_id: currentRichMenuId,
@@ -3428,7 +3694,7 @@ function wireActionPanel(state) {
         if (state.scheduleAutosave) state.scheduleAutosave();
 
         // 廣播區域更新（action type 改變）
-        broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+        broadcastAreaActionOp(currentRM, area);
     });
     renderActionFields(state);
 }
@@ -3492,8 +3758,7 @@ function renderActionFields(state) {
             if (state.scheduleAutosave) state.scheduleAutosave();
 
             // 廣播區域更新（action 改變）
-            const currentRM = getCurrentRichMenu(state);
-            broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+            broadcastAreaActionOp(getCurrentRichMenu(state), area);
         });
         group.appendChild(lab);
         group.appendChild(input);
@@ -3520,8 +3785,7 @@ function renderActionFields(state) {
             if (state.scheduleAutosave) state.scheduleAutosave();
 
             // 廣播區域更新（action 改變）
-            const currentRM = getCurrentRichMenu(state);
-            broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+            broadcastAreaActionOp(getCurrentRichMenu(state), area);
         });
         group.appendChild(lab);
         group.appendChild(select);
@@ -3567,8 +3831,7 @@ function renderActionFields(state) {
             if (state.scheduleAutosave) state.scheduleAutosave();
 
             // 廣播區域更新（action 改變）
-            const currentRM = getCurrentRichMenu(state);
-            broadcastAreasUpdate(currentRM.id, currentRM.metadata.areas);
+            broadcastAreaActionOp(getCurrentRichMenu(state), area);
         });
 
         group.appendChild(lab);
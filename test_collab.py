@@ -0,0 +1,633 @@
+import atexit
+import json
+import os
+import queue
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import socketio
+
+import collab
+import config
+import db
+
+
+class _QueueStandIn(socketio.PubSubManager):
+    """代替 Redis/Kombu 的訊息佇列：同一個 bus 上的 worker 互相轉送（同樣以 JSON 字串傳遞）"""
+
+    name = 'stand-in'
+
+    def __init__(self, bus):
+        super().__init__()
+        self._bus = bus
+        self._inbox = queue.Queue()
+        bus.append(self._inbox)
+
+    def _publish(self, data):
+        for inbox in self._bus:
+            inbox.put(json.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+def _cursor(user_id, x, rich_menu_id=1):
+    return {'rich_menu_id': rich_menu_id, 'relative_x': x, 'relative_y': 0.5,
+            'user_id': user_id, 'user_name': user_id, 'color': '#02a568'}
+
+
+class CursorAggregatorTests(unittest.TestCase):
+    def setUp(self):
+        self.emitted = []
+        self.room_sizes = {'1': 3, '2': 2}
+        self.aggregator = collab.CursorAggregator(
+            lambda event, payload, room: self.emitted.append((event, payload, room)), 0.05,
+            lambda room: self.room_sizes.get(room, 0)
+        )
+
+    def test_flush_sends_latest_position_per_user_once_per_room(self):
+        for x in (0.1, 0.2, 0.3):
+            self.aggregator.push('1', _cursor('alice', x))
+        self.aggregator.push('1', _cursor('bob', 0.9))
+        self.aggregator.push('2', _cursor('carol', 0.4))
+
+        self.assertEqual(self.aggregator.flush(), 2)
+
+        frames = {room: payload for event, payload, room in self.emitted}
+        self.assertEqual({event for event, _, _ in self.emitted}, {'cursors:update'})
+        self.assertEqual(
+            {c['user_id']: c['relative_x'] for c in frames['1']['cursors']},
+            {'alice': 0.3, 'bob': 0.9}
+        )
+        self.assertEqual(len(frames['2']['cursors']), 1)
+
+    def test_empty_flush_sends_nothing(self):
+        self.aggregator.flush()
+        self.aggregator.push('1', _cursor('alice', 0.1))
+        self.aggregator.flush()
+        self.aggregator.flush()
+
+        self.assertEqual(len(self.emitted), 1)
+
+    def test_discard_drops_pending_position(self):
+        self.aggregator.push('1', _cursor('alice', 0.1))
+        self.aggregator.discard('1', 'alice')
+
+        self.assertEqual(self.aggregator.flush(), 0)
+        self.assertEqual(self.emitted, [])
+
+    def test_stats_count_saved_deliveries(self):
+        self.room_sizes['1'] = 4
+        for _ in range(10):
+            for user in ('a', 'b', 'c', 'd'):
+                self.aggregator.push('1', _cursor(user, 0.5))
+        self.aggregator.flush()
+
+        stats = self.aggregator.stats()
+        self.assertEqual(stats['received'], 40)
+        self.assertEqual(stats['superseded'], 36)
+        self.assertEqual(stats['frames'], 1)
+        self.assertEqual(stats['cursors_sent'], 4)
+        self.assertEqual(stats['relay_deliveries'], 40 * 3)
+        self.assertEqual(stats['deliveries'], 4)
+        self.assertEqual(stats['saved'], 116)
+        self.assertEqual(stats['tick_hz'], 20)
+
+
+class PresenceTests(unittest.TestCase):
+    def setUp(self):
+        self.presence = collab.Presence()
+
+    def test_join_returns_other_members(self):
+        self.presence.join('1', 'sid-a', 'alice', 'Alice', '#111')
+        others = self.presence.join('1', 'sid-b', 'bob', 'Bob', '#222')
+
+        self.assertEqual(list(others), ['sid-a'])
+        self.assertEqual(others['sid-a']['user_name'], 'Alice')
+        self.assertEqual(self.presence.room_size('1'), 2)
+
+    def test_short_ids_are_assigned_per_room(self):
+        self.presence.join('1', 'sid-a', 'alice', 'Alice', '#111')
+        self.presence.join('1', 'sid-b', 'bob', 'Bob', '#222')
+        self.presence.join('2', 'sid-b', 'bob', 'Bob', '#222')
+
+        self.assertEqual(self.presence.member('1', 'sid-b')['short_id'], 2)
+        self.assertEqual(self.presence.member('2', 'sid-b')['short_id'], 1)
+        self.presence.leave('1', 'sid-b')
+        self.assertEqual(self.presence.join('1', 'sid-c', 'carol', 'Carol', '#333')['sid-a']['short_id'], 1)
+        self.assertEqual(self.presence.member('1', 'sid-c')['short_id'], 2)
+        self.assertIsNone(self.presence.member('1', 'sid-b'))
+
+    def test_leave_all_touches_only_joined_rooms(self):
+        for room in range(100):
+            self.presence.join(str(room), f'sid-{room}', f'user-{room}', 'U', '#000')
+        self.presence.join('1', 'sid-x', 'x', 'X', '#000')
+        self.presence.join('2', 'sid-x', 'x', 'X', '#000')
+
+        left = self.presence.leave_all('sid-x')
+
+        self.assertEqual(sorted(project_id for project_id, _ in left), ['1', '2'])
+        self.assertEqual(self.presence.room_size('1'), 1)
+        self.assertEqual(self.presence.leave_all('sid-x'), [])
+
+    def test_leave_and_switch_tab(self):
+        self.presence.join('1', 'sid-a', 'alice', 'Alice', '#111')
+        self.presence.join('2', 'sid-a', 'alice', 'Alice', '#111')
+
+        self.assertTrue(self.presence.switch_tab('1', 'sid-a', 7))
+        self.assertFalse(self.presence.switch_tab('3', 'sid-a', 7))
+        self.assertEqual(self.presence.leave('1', 'sid-a')['rich_menu_id'], 7)
+        self.assertIsNone(self.presence.leave('1', 'sid-a'))
+        self.assertEqual([room for room, _ in self.presence.leave_all('sid-a')], ['2'])
+        self.assertEqual(self.presence.stats(),
+                         {'rooms': 0, 'connections': 0, 'members': 0, 'largest_room': 0})
+
+    def test_stats_gauges(self):
+        self.presence.join('1', 'sid-a', 'alice', 'Alice', '#111')
+        self.presence.join('1', 'sid-b', 'bob', 'Bob', '#222')
+        self.presence.join('2', 'sid-a', 'alice', 'Alice', '#111')
+
+        self.assertEqual(self.presence.stats(),
+                         {'rooms': 2, 'connections': 2, 'members': 3, 'largest_room': 2})
+
+
+
+class LocksTests(unittest.TestCase):
+    def setUp(self):
+        self.locks = collab.Locks()
+
+    def test_second_owner_is_rejected_until_release(self):
+        acquired, lock = self.locks.acquire('1', 10, 'sid-a', 'alice', 'Alice', now=1000)
+        self.assertTrue(acquired)
+
+        acquired, holder = self.locks.acquire('1', '10', 'sid-b', 'bob', 'Bob', now=1001)
+        self.assertFalse(acquired)
+        self.assertEqual(holder['user_id'], 'alice')
+        self.assertIsNone(self.locks.release('1', 10, 'sid-b'))
+
+        self.assertEqual(self.locks.release('1', 10, 'sid-a')['token'], lock['token'])
+        self.assertTrue(self.locks.acquire('1', 10, 'sid-b', 'bob', 'Bob', now=1002)[0])
+
+    def test_lock_expires_without_heartbeat(self):
+        self.locks.acquire('1', 10, 'sid-a', 'alice', 'Alice', now=1000)
+        ttl = config.COLLAB_LOCK_TTL
+
+        self.assertIsNotNone(self.locks.heartbeat('1', 10, 'sid-a', now=1000 + ttl - 1))
+        self.assertIsNone(self.locks.heartbeat('1', 10, 'sid-b', now=1000 + ttl - 1))
+        self.assertIsNotNone(self.locks.holder('1', 10, now=1000 + 2 * ttl - 2))
+        self.assertIsNone(self.locks.holder(None, 10, now=1000 + 2 * ttl))
+        self.assertTrue(self.locks.acquire('1', 10, 'sid-b', 'bob', 'Bob', now=1000 + 2 * ttl)[0])
+        self.assertEqual(self.locks.expire(now=1000 + 4 * ttl)[0]['user_id'], 'bob')
+        self.assertEqual(self.locks.stats(), {'locks': 0})
+
+    def test_release_sid_frees_only_that_connection(self):
+        self.locks.acquire('1', 10, 'sid-a', 'alice', 'Alice')
+        self.locks.acquire('2', 20, 'sid-a', 'alice', 'Alice')
+        self.locks.acquire('1', 11, 'sid-b', 'bob', 'Bob')
+
+        self.assertEqual([lock['rich_menu_id'] for lock in self.locks.release_sid('sid-a', '2')], ['20'])
+        self.assertEqual([lock['rich_menu_id'] for lock in self.locks.release_sid('sid-a')], ['10'])
+        self.assertEqual([collab.public_lock(lock)['rich_menu_id']
+                          for lock in self.locks.project_locks('1')], [11])
+
+    def test_conflict_ignores_owner_sid_and_token(self):
+        original = collab.locks
+        collab.locks = self.locks
+        try:
+            _, lock = self.locks.acquire('1', 10, 'sid-a', 'alice', 'Alice')
+
+            self.assertIsNone(collab.lock_conflict('1', 10, sid='sid-a'))
+            self.assertIsNone(collab.lock_conflict(None, 10, token=lock['token']))
+            self.assertIsNone(collab.lock_conflict('1', 11, sid='sid-b'))
+            conflict = collab.lock_conflict(None, 10, token='wrong')
+            self.assertEqual((conflict['rich_menu_id'], conflict['user_name']), (10, 'Alice'))
+            self.assertNotIn('token', conflict)
+        finally:
+            collab.locks = original
+
+
+def _area(x=0, width=100, action_type='message'):
+    return {'bounds': {'x': x, 'y': 0, 'width': width, 'height': 100},
+            'action': {'type': action_type, 'text': 'hi'}}
+
+
+class MenuDocumentsTests(unittest.TestCase):
+    def setUp(self):
+        self.stored = {
+            ('1', '10'): {'size': {'width': 1200, 'height': 810},
+                          'areas': [_area(0), _area(200), _area(400)],
+                          'name': 'Main', 'alias': 'main', 'chatBarText': 'Menu', 'selected': True},
+            ('1', '11'): {'size': {'width': 1200, 'height': 810}, 'areas': []}
+        }
+        self.saved = []
+        self.documents = collab.MenuDocuments(
+            lambda project_id, rich_menu_id: self.stored.get((project_id, str(rich_menu_id))),
+            self.saved.append
+        )
+
+    def test_ops_are_versioned_and_applied(self):
+        version, op = self.documents.apply('1', 10, {'type': 'add', 'area': _area(600)}, 0)
+        self.assertEqual((version, op['index']), (1, 3))
+
+        self.documents.apply('1', 10, {'type': 'bounds', 'index': 0,
+                                       'bounds': {'x': 5, 'y': 5, 'width': 50, 'height': 50}}, 1)
+        self.documents.apply('1', 10, {'type': 'action', 'index': 1, 'action': None}, 2)
+        self.documents.apply('1', 10, {'type': 'delete', 'index': 2}, 3)
+
+        snapshot = self.documents.snapshot('1', 10)
+        self.assertEqual(snapshot['version'], 4)
+        self.assertEqual([area['bounds']['x'] for area in snapshot['areas']], [5, 200, 600])
+        self.assertNotIn('action', snapshot['areas'][1])
+        self.assertEqual(self.documents.versions('1'), {'10': 4})
+
+    def test_concurrent_delete_shifts_later_index(self):
+        self.documents.apply('1', 10, {'type': 'delete', 'index': 0}, 0)
+
+        version, op = self.documents.apply(
+            '1', 10, {'type': 'action', 'index': 2, 'action': {'type': 'uri', 'uri': 'x'}}, 0
+        )
+
+        self.assertEqual((version, op['index']), (2, 1))
+        self.assertEqual(self.documents.snapshot('1', 10)['areas'][1]['action']['type'], 'uri')
+
+    def test_op_on_concurrently_deleted_area_is_stale(self):
+        self.documents.apply('1', 10, {'type': 'delete', 'index': 1}, 0)
+
+        with self.assertRaises(collab.AreaOpError) as ctx:
+            self.documents.apply('1', 10, {'type': 'action', 'index': 1, 'action': None}, 0)
+        self.assertEqual(ctx.exception.code, 'stale')
+        self.assertEqual(self.documents.snapshot('1', 10)['version'], 1)
+
+    def test_invalid_ops_are_rejected(self):
+        for op in ({'type': 'move'},
+                   {'type': 'bounds', 'index': 0, 'bounds': {'x': 1150, 'y': 0, 'width': 100, 'height': 10}},
+                   {'type': 'bounds', 'index': 0, 'bounds': {'x': 0.5, 'y': 0, 'width': 1, 'height': 1}},
+                   {'type': 'action', 'index': 0, 'action': 'uri'},
+                   {'type': 'delete', 'index': 9}):
+            with self.assertRaises(collab.AreaOpError):
+                self.documents.apply('1', 10, op)
+        with self.assertRaises(collab.AreaOpError) as ctx:
+            self.documents.apply('2', 10, {'type': 'delete', 'index': 0})
+        self.assertEqual(ctx.exception.code, 'not_found')
+        self.assertEqual(self.documents.snapshot('1', 10)['version'], 0)
+
+    def test_replace_creates_unsaved_menu_and_seed_is_kept(self):
+        version, _ = self.documents.apply('1', 'rm_new', {
+            'type': 'replace', 'size': {'width': 2500, 'height': 843}, 'areas': [_area(2000, 500)]
+        })
+        self.documents.seed('1', 'rm_other', {'size': {'width': 2500, 'height': 843},
+                                              'areas': [_area()]})
+
+        self.assertEqual(version, 1)
+        self.assertEqual(len(self.documents.snapshot('1', 'rm_other')['areas']), 1)
+        self.documents.drop_project('1')
+        self.assertEqual(self.documents.versions('1'), {})
+
+    def test_saved_menu_outside_project_is_not_created(self):
+        with self.assertRaises(collab.AreaOpError) as ctx:
+            self.documents.apply('2', 10, {'type': 'replace', 'areas': []})
+        self.documents.seed('2', 10, {'areas': [_area()]})
+
+        self.assertEqual(ctx.exception.code, 'not_found')
+        self.assertEqual(self.documents.versions('2'), {})
+
+    def test_edits_are_persisted_in_one_debounced_batch(self):
+        self.documents.apply('1', 10, {'type': 'delete', 'index': 0})
+        self.documents.update_metadata('1', 10, {'chatBarText': 'Open', 'imagePath': 'x.png'})
+        self.documents.update_metadata('1', 11, {'name': 'Second', 'alias': 'second'})
+        self.documents.apply('1', 'rm_new', {'type': 'replace', 'areas': []})
+        now = time.time()
+
+        self.assertEqual(self.documents.persist(now=now), 0)
+        self.assertEqual(self.documents.persist(now=now + config.COLLAB_PERSIST_DELAY + 0.1), 2)
+        self.assertEqual(self.documents.persist(force=True), 0)
+
+        self.assertEqual(len(self.saved), 1)
+        rows = dict(self.saved[0])
+        self.assertEqual(set(rows[10]), {'areas', 'chat_bar_text'})
+        self.assertEqual(len(rows[10]['areas']), 2)
+        self.assertEqual(rows[11], {'name': 'Second', 'alias': 'second'})
+        stats = self.documents.stats()
+        self.assertEqual((stats['edits'], stats['batches'], stats['menus_written']), (4, 1, 2))
+
+    def test_failed_write_is_retried(self):
+        self.documents.update_metadata('1', 10, {'selected': False})
+        self.documents._save = lambda updates: (_ for _ in ()).throw(OSError('disk full'))
+
+        with self.assertRaises(OSError):
+            self.documents.persist(force=True)
+        self.documents._save = self.saved.append
+
+        self.assertEqual(self.documents.persist(force=True), 1)
+        self.assertEqual(self.saved[0], [(10, {'selected': False})])
+
+    def test_invalid_metadata_is_rejected(self):
+        for metadata in ({'name': 3}, {'size': {'width': '1200', 'height': 810}}, 'name'):
+            with self.assertRaises(collab.AreaOpError):
+                self.documents.update_metadata('1', 10, metadata)
+        self.assertEqual(self.documents.stats()['dirty'], 0)
+
+    def test_project_snapshot_serves_latest_content(self):
+        self.documents.update_metadata('1', 10, {'chatBarText': 'Open'})
+        self.documents.apply('1', 10, {'type': 'delete', 'index': 2})
+
+        menus = self.documents.project_snapshot('1')
+
+        self.assertEqual(len(menus), 1)
+        self.assertEqual(menus[0]['rich_menu_id'], 10)
+        self.assertEqual((menus[0]['version'], menus[0]['chatBarText'], menus[0]['alias']),
+                         (1, 'Open', 'main'))
+        self.assertEqual(len(menus[0]['areas']), 2)
+
+    def test_reload_after_conflicting_rest_write_bumps_version_and_reports_field(self):
+        self.documents.apply('1', 10, {'type': 'delete', 'index': 0})
+        self.stored[('1', '10')] = {**self.stored[('1', '10')], 'areas': [_area(0)], 'alias': 'home'}
+
+        (project_id, version, op, snapshot, overwritten), = self.documents.reload(10)
+
+        self.assertEqual((project_id, version, op['type']), ('1', 2, 'replace'))
+        self.assertEqual(snapshot['alias'], 'home')
+        self.assertEqual(overwritten, ['areas'])
+        self.assertEqual(self.documents.persist(force=True), 0)
+        with self.assertRaises(collab.AreaOpError) as ctx:
+            self.documents.apply('1', 10, {'type': 'delete', 'index': 0}, 1)
+        self.assertEqual(ctx.exception.code, 'stale')
+        self.assertEqual(self.documents.reload(99), [])
+
+    def test_reload_keeps_pending_edits_the_rest_write_did_not_touch(self):
+        self.documents.apply('1', 10, {'type': 'delete', 'index': 0})
+        self.documents.update_metadata('1', 10, {'chatBarText': 'Open'})
+        self.stored[('1', '10')] = {**self.stored[('1', '10')], 'alias': 'home'}
+
+        (_, version, op, snapshot, overwritten), = self.documents.reload(10)
+
+        self.assertEqual((version, op, overwritten), (1, None, []))
+        self.assertEqual((snapshot['alias'], snapshot['chatBarText'], len(snapshot['areas'])),
+                         ('home', 'Open', 2))
+        self.assertEqual(self.documents.persist(force=True), 1)
+        self.assertEqual(set(self.saved[0][0][1]), {'areas', 'chat_bar_text'})
+
+    def test_reload_reads_database_outside_the_lock(self):
+        self.documents.snapshot('1', 10)
+        load = self.documents._load
+        self.documents._load = lambda *args: (self.assertFalse(self.documents._lock.locked()), load(*args))[1]
+
+        self.assertEqual(len(self.documents.reload(10)), 1)
+
+
+class SharedDocumentsTests(MenuDocumentsTests):
+    """同一組測試套用在共用資料庫的即時文件，另外驗證兩個 worker 共用版本"""
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self._original_path = config.DATABASE_PATH
+        config.DATABASE_PATH = os.path.join(self.tmpdir, 'test.db')
+        db.init_db()
+        load = lambda project_id, rich_menu_id: self.stored.get((project_id, str(rich_menu_id)))
+        save = lambda cursor, updates: self.saved.append(updates)
+        self.documents = collab.SharedDocuments(load, save)
+        self.other_worker = collab.SharedDocuments(load, save)
+
+    def tearDown(self):
+        config.DATABASE_PATH = self._original_path
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_failed_write_is_retried(self):
+        self.documents.update_metadata('1', 10, {'selected': False})
+        self.documents._save = lambda cursor, updates: (_ for _ in ()).throw(OSError('disk full'))
+
+        with self.assertRaises(OSError):
+            self.documents.persist(force=True)
+
+        # 交易已還原，仍是未寫回：任一 worker 都能接著寫回
+        self.assertEqual(self.other_worker.persist(force=True), 1)
+        self.assertEqual(self.saved[0], [(10, {'selected': False})])
+
+    def test_persist_writes_rich_menus_in_the_document_transaction(self):
+        account_id = db.create_account('Test', 'token')
+        project_id = str(db.create_project(account_id, 'Project'))
+        rich_menu_id = db.create_rich_menu(int(project_id), 'Main', 'main', {
+            'size': {'width': 2500, 'height': 1686}, 'chatBarText': 'Menu', 'areas': [_area()]
+        })
+        documents = collab.SharedDocuments(collab._load_menu_document, db.update_rich_menu_rows)
+
+        documents.apply(project_id, rich_menu_id, {'type': 'add', 'area': _area(500)})
+        documents.update_metadata(project_id, rich_menu_id, {'chatBarText': 'Open'})
+        self.assertEqual(documents.persist(force=True), 1)
+
+        rm = db.get_rich_menu(rich_menu_id)
+        self.assertEqual((len(rm['metadata']['areas']), rm['metadata']['chatBarText']), (2, 'Open'))
+        self.assertEqual(documents.stats()['dirty'], 0)
+
+    def test_workers_share_one_version_history(self):
+        version, _ = self.documents.apply('1', 10, {'type': 'delete', 'index': 0}, 0)
+        self.assertEqual(version, 1)
+
+        # 另一個 worker 收到根據版本 0 產生的操作：依共用的操作紀錄調整索引
+        version, op = self.other_worker.apply(
+            '1', 10, {'type': 'action', 'index': 2, 'action': {'type': 'uri', 'uri': 'x'}}, 0
+        )
+
+        self.assertEqual((version, op['index']), (2, 1))
+        self.assertEqual(self.documents.versions('1'), {'10': 2})
+        self.assertEqual(self.documents.snapshot('1', 10)['areas'][1]['action']['type'], 'uri')
+        with self.assertRaises(collab.AreaOpError) as ctx:
+            self.documents.apply('1', 10, {'type': 'delete', 'index': 0}, 3)
+        self.assertEqual(ctx.exception.code, 'stale')
+
+    def test_one_worker_persists_edits_made_on_another(self):
+        self.other_worker.update_metadata('1', 10, {'chatBarText': 'Open'})
+
+        self.assertEqual(self.documents.persist(force=True), 1)
+        self.assertEqual(self.other_worker.persist(force=True), 0)
+        self.assertEqual(self.saved, [[(10, {'chat_bar_text': 'Open'})]])
+        self.documents.drop_project('1')
+        self.assertEqual(self.other_worker.versions('1'), {})
+
+
+class SharedPresenceTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._original = (config.DATABASE_PATH, config.SOCKETIO_MESSAGE_QUEUE)
+        config.DATABASE_PATH = os.path.join(self.tmpdir, 'test.db')
+        db.init_db()
+        self.worker_a = collab.SharedPresence('host:1:a')
+        self.worker_b = collab.SharedPresence('host:2:b')
+        self.worker_a.heartbeat(now=1000)
+        self.worker_b.heartbeat(now=1000)
+
+    def tearDown(self):
+        config.DATABASE_PATH, config.SOCKETIO_MESSAGE_QUEUE = self._original
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_members_are_visible_across_workers(self):
+        self.worker_a.join('1', 'sid-a', 'alice', 'Alice', '#111')
+        self.worker_a.switch_tab('1', 'sid-a', 7)
+
+        others = self.worker_b.join('1', 'sid-b', 'bob', 'Bob', '#222')
+
+        self.assertEqual(others['sid-a']['rich_menu_id'], 7)
+        self.assertEqual((others['sid-a']['short_id'], self.worker_b.member('1', 'sid-b')['short_id']), (1, 2))
+        self.assertIsNone(self.worker_a.member('1', 'sid-b'))
+        self.worker_a.heartbeat(now=1001)
+        self.assertEqual(self.worker_a.room_size('1'), 2)
+        self.assertEqual(self.worker_b.stats()['workers'], 2)
+        self.assertEqual(self.worker_b.leave_all('sid-a')[0][1]['user_id'], 'alice')
+        self.worker_a.heartbeat(now=1002)
+        self.assertEqual(self.worker_a.room_size('1'), 1)
+
+    def test_room_size_is_cached_until_presence_changes(self):
+        self.worker_a.join('1', 'sid-a', 'alice', 'Alice', '#111')
+        self.worker_b.join('1', 'sid-b', 'bob', 'Bob', '#222')
+
+        with mock.patch('db.count_collab_presence', wraps=db.count_collab_presence) as count:
+            self.assertEqual(self.worker_b.room_size('1'), 2)
+            self.assertEqual(self.worker_b.room_size('1'), 2)
+            self.assertEqual(count.call_count, 0)
+
+            # 其他 worker 的變動在下一次心跳後生效；自己的 leave 立即重新計算
+            self.worker_a.leave('1', 'sid-a')
+            self.assertEqual(self.worker_b.room_size('1'), 2)
+            self.worker_b.heartbeat(now=1001)
+            self.assertEqual(self.worker_b.room_size('1'), 1)
+            self.worker_b.leave('1', 'sid-b')
+            self.assertEqual(self.worker_b.room_size('1'), 0)
+            self.assertEqual(count.call_count, 2)
+
+    def test_expired_worker_connections_are_pruned(self):
+        self.worker_a.join('1', 'sid-a', 'alice', 'Alice', '#111')
+        self.worker_b.join('1', 'sid-b', 'bob', 'Bob', '#222')
+
+        removed = self.worker_b.heartbeat(now=1000 + config.COLLAB_WORKER_TTL + 1)
+
+        self.assertEqual([(room, info['user_id']) for room, info in removed], [('1', 'alice')])
+        self.assertEqual(self.worker_b.room_size('1'), 1)
+        self.assertEqual(self.worker_b.stats()['workers'], 1)
+
+    def test_documents_round_trip_through_rich_menus(self):
+        account_id = db.create_account('Test', 'token')
+        project_id = db.create_project(account_id, 'Project')
+        rich_menu_id = db.create_rich_menu(project_id, 'Main', 'main', {
+            'size': {'width': 2500, 'height': 1686}, 'chatBarText': 'Menu', 'selected': True,
+            'areas': [_area()]
+        })
+        documents = collab.MenuDocuments(collab._load_menu_document, db.update_rich_menus)
+
+        documents.apply(str(project_id), rich_menu_id, {'type': 'add', 'area': _area(500)})
+        documents.update_metadata(str(project_id), rich_menu_id, {'chatBarText': 'Open'})
+        documents.persist(force=True)
+
+        rm = db.get_rich_menu(rich_menu_id)
+        self.assertEqual(len(rm['metadata']['areas']), 2)
+        self.assertEqual((rm['metadata']['chatBarText'], rm['alias']), ('Open', 'main'))
+        with self.assertRaises(collab.AreaOpError):
+            documents.snapshot(str(project_id + 1), rich_menu_id)
+
+    def test_locks_are_shared_across_workers(self):
+        worker_a, worker_b = collab.SharedLocks(), collab.SharedLocks()
+
+        acquired, lock = worker_a.acquire('1', 10, 'sid-a', 'alice', 'Alice', now=1000)
+        self.assertTrue(acquired)
+        self.assertEqual(worker_b.acquire('1', 10, 'sid-b', 'bob', 'Bob', now=1001)[1]['token'],
+                         lock['token'])
+        self.assertEqual(worker_b.holder(None, 10, now=1001)['user_id'], 'alice')
+        self.assertIsNone(worker_b.heartbeat('1', 10, 'sid-b', now=1001))
+        self.assertIsNotNone(worker_a.heartbeat('1', 10, 'sid-a', now=1010))
+        self.assertEqual(len(worker_b.project_locks('1', now=1010)), 1)
+
+        expired = worker_b.expire(now=1010 + config.COLLAB_LOCK_TTL)
+        self.assertEqual([row['sid'] for row in expired], ['sid-a'])
+        self.assertTrue(worker_b.acquire('1', 10, 'sid-b', 'bob', 'Bob', now=1100)[0])
+        self.assertEqual(worker_a.release_sid('sid-b')[0]['rich_menu_id'], '10')
+
+    def test_rest_write_is_rejected_while_locked(self):
+        from flask import Flask
+        from api_routes import api_bp
+
+        account_id = db.create_account('Test', 'token')
+        project_id = db.create_project(account_id, 'Project')
+        rich_menu_id = db.create_rich_menu(project_id, 'Main', 'main')
+        app = Flask(__name__)
+        app.register_blueprint(api_bp)
+        client = app.test_client()
+        original = collab.locks
+        collab.locks = collab.Locks()
+        try:
+            _, lock = collab.locks.acquire(str(project_id), rich_menu_id, 'sid-a', 'alice', 'Alice')
+
+            response = client.put(f'/api/richmenus/{rich_menu_id}', json={'alias': 'other'})
+            self.assertEqual(response.status_code, 423)
+            self.assertEqual(response.get_json()['lock']['user_id'], 'alice')
+            self.assertEqual(client.delete(f'/api/richmenus/{rich_menu_id}').status_code, 423)
+
+            response = client.put(f'/api/richmenus/{rich_menu_id}', json={'alias': 'other'},
+                                  headers={'X-Lock-Token': lock['token']})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(db.get_rich_menu(rich_menu_id)['alias'], 'other')
+        finally:
+            collab.locks = original
+
+    def _worker(self, bus):
+        """模擬一個 gunicorn worker：自己的 Socket.IO 伺服器，經由訊息佇列與其他 worker 相連
+
+        回傳 (伺服器, 連上本 worker 的 socket, 送給該 socket 的 [(事件, 資料)])。
+        """
+        server = socketio.Server(async_mode='threading', client_manager=_QueueStandIn(bus))
+        server.manager.initialize()
+        eio_sid = f'eio-{len(bus)}'
+        sid = server.manager.connect(eio_sid, '/')
+        received = []
+        server._send_eio_packet = lambda to, pkt: received.append(tuple(json.loads(pkt.data[1:])))
+        return server, sid, received
+
+    def test_cursor_frames_reach_rooms_on_other_workers_through_the_queue(self):
+        bus = []
+        server_a, sid_a, _ = self._worker(bus)
+        server_b, sid_b, received_b = self._worker(bus)
+        server_a.enter_room(sid_a, '1')
+        server_b.enter_room(sid_b, '1')
+        self.worker_a.join('1', sid_a, 'alice', 'Alice', '#111')
+        self.worker_b.join('1', sid_b, 'bob', 'Bob', '#222')
+        self.worker_a.heartbeat(now=1001)
+        cursors = collab.CursorAggregator(
+            lambda event, payload, room: server_a.emit(event, payload, room=room), 0.05,
+            self.worker_a.room_size
+        )
+
+        cursors.push('1', _cursor('alice', 0.4))
+        cursors.flush()
+
+        deadline = time.time() + 5
+        while not received_b and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([(event, [c['user_id'] for c in payload['cursors']])
+                          for event, payload in received_b], [('cursors:update', ['alice'])])
+        # 送達數以所有 worker 合計的人數估算
+        self.assertEqual(cursors.stats()['deliveries'], 2)
+
+    def test_message_queue_selects_shared_presence(self):
+        config.SOCKETIO_MESSAGE_QUEUE = 'redis://localhost:6379/0'
+        tasks = []
+        try:
+            presence = collab.init(lambda *args: None,
+                                   lambda *args: tasks.append(args), lambda seconds: None)
+            self.assertIsInstance(presence, collab.SharedPresence)
+            self.assertEqual(len(tasks), 4)
+            self.assertIsInstance(collab.locks, collab.SharedLocks)
+            self.assertIsInstance(collab.documents, collab.SharedDocuments)
+            self.assertIs(collab.cursors._room_size.__self__, presence)
+            atexit.unregister(presence.close)
+            atexit.unregister(collab._persist_documents)
+            presence.close()
+        finally:
+            collab.presence, collab.locks, collab.cursors = collab.Presence(), collab.Locks(), None
+            collab.documents = collab.MenuDocuments(collab._load_menu_document, db.update_rich_menus)
+
+
+if __name__ == '__main__':
+    unittest.main()
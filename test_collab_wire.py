@@ -0,0 +1,59 @@
+import json
+import unittest
+
+import msgpack
+
+import collab
+import collab_wire
+
+
+def _cursor(short_id, x, y):
+    return {'rich_menu_id': 12, 'relative_x': x, 'relative_y': y, 'user_id': f'user_{short_id}_1760000000000',
+            'user_name': f'使用者{short_id}', 'color': '#02a568', 'short_id': short_id}
+
+
+class CollabWireTests(unittest.TestCase):
+    def test_cursor_frame_round_trips_with_quantised_coordinates(self):
+        packed = collab_wire.encode_cursors([_cursor(1, 0.123456, 0.5), _cursor(2, 1.7, -0.2)])
+
+        self.assertEqual(msgpack.unpackb(packed), [1, 12, 1235, 5000, 2, 12, 10000, 0])
+
+    def test_compact_frame_is_much_smaller_than_json(self):
+        cursors = [_cursor(short_id, 0.41234567, 0.76543211) for short_id in range(1, 6)]
+        legacy = [{key: value for key, value in cursor.items() if key != 'short_id'}
+                  for cursor in cursors]
+
+        json_bytes = len(json.dumps({'cursors': legacy}).encode())
+        compact_bytes = len(collab_wire.encode_cursors(cursors))
+
+        self.assertLess(compact_bytes * 5, json_bytes)
+
+    def test_inbound_events_are_decoded(self):
+        data = msgpack.packb([7, 'rm_abc', 2500, 12000])
+        self.assertEqual(collab_wire.decode_cursor(data), ('7', 'rm_abc', 0.25, 1.0))
+        self.assertEqual(collab_wire.decode_target(msgpack.packb([7, 12])), ('7', 12))
+        for bad in (b'\xc1', msgpack.packb({'x': 1}), msgpack.packb([1, 2])):
+            with self.assertRaises(ValueError):
+                collab_wire.decode_cursor(bad)
+
+    def test_unknown_wire_falls_back_to_json(self):
+        self.assertEqual(collab_wire.negotiate('msgpack'), 'msgpack')
+        self.assertEqual(collab_wire.negotiate(None), 'json')
+        self.assertEqual(collab_wire.negotiate('protobuf'), 'json')
+
+    def test_cursor_frame_is_sent_once_per_wire(self):
+        emitted = []
+
+        collab.emit_cursors(lambda event, payload, room: emitted.append((event, payload, room)),
+                            [_cursor(1, 0.5, 0.5), {**_cursor(2, 0.1, 0.1), 'short_id': None}], '3')
+
+        (json_event, json_payload, json_room), (compact_event, compact_payload, compact_room) = emitted
+        self.assertEqual((json_event, json_room), ('cursors:update', '3:json'))
+        self.assertEqual(len(json_payload['cursors']), 2)
+        self.assertNotIn('short_id', json_payload['cursors'][0])
+        self.assertEqual((compact_event, compact_room), ('c:cursors', '3:msgpack'))
+        self.assertEqual(msgpack.unpackb(compact_payload), [1, 12, 5000, 5000])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+import db
+from db_testcase import DatabaseTestCase
+
+
+class ConditionalGetTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rm_ids = [db.create_rich_menu(self.project_id, name, '') for name in ('A', 'B')]
+        self.client = self.make_client()
+
+    def _revalidate(self, url):
+        """第一次 GET 取得 ETag，再帶 If-None-Match 重新驗證，回傳 (ETag, 第二次的回應)"""
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['Cache-Control'], 'no-cache')
+        etag = first.headers['ETag']
+        return etag, self.client.get(url, headers={'If-None-Match': etag})
+
+    def test_project_not_modified_until_rich_menu_changes(self):
+        url = f'/api/projects/{self.project_id}'
+        etag, response = self._revalidate(url)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, b'')
+
+        db.update_rich_menu(self.rm_ids[1], chat_bar_text='開啟')
+        changed = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+        # 刪除不是最新的那一個也要讓 ETag 失效
+        etag = changed.headers['ETag']
+        db.delete_rich_menu(self.rm_ids[0])
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_rich_menu_etag_starts_with_its_version(self):
+        url = f'/api/richmenus/{self.rm_ids[0]}'
+        etag, response = self._revalidate(url)
+        self.assertTrue(etag.startswith('"1.'))
+        self.assertEqual(response.status_code, 304)
+
+        # 背景寫入（圖片處理狀態）不改版本，但內容變了，不能回 304
+        db.update_rich_menu(self.rm_ids[0], image_status='ready')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['ETag'].startswith('"1.'))
+
+        db.update_rich_menu(self.rm_ids[0], name='Renamed')
+        self.assertTrue(self.client.get(url).headers['ETag'].startswith('"2.'))
+
+    def test_flex_messages(self):
+        flex_id = db.create_flex_message('Card', {'type': 'bubble'})
+        for url in ('/api/flex-messages', f'/api/flex-messages/{flex_id}',
+                    f'/api/public/flex-messages/{flex_id}'):
+            with self.subTest(url=url):
+                etag, response = self._revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                db.update_flex_message(flex_id, name=f'Card {url}')
+                self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_schedule_list(self):
+        url = f'/api/projects/{self.project_id}/schedules'
+        job_id = db.create_scheduled_job(self.project_id, start_date='2026-01-01', end_date='2026-12-31')
+        etag, response = self._revalidate(url)
+        self.assertEqual(response.status_code, 304)
+
+        db.update_scheduled_job(job_id, last_run_status='success')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_missing_resources_are_404(self):
+        self.assertEqual(self.client.get('/api/projects/999').status_code, 404)
+        self.assertEqual(self.client.get('/api/richmenus/999').status_code, 404)
+        self.assertEqual(self.client.get('/api/flex-messages/999').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
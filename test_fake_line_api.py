@@ -0,0 +1,81 @@
+import unittest
+
+import db
+import scheduler
+from api_routes import _delete_owned_line_rich_menu
+from db_testcase import FakeLineApiTestCase
+
+
+class FakeLineApiPublishTests(FakeLineApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.menu_ids = []
+        for index, alias in enumerate(['main', 'sub']):
+            rm_id = db.create_rich_menu(self.project_id, f'Menu {index}', alias, {
+                'size': {'width': 2500, 'height': 843},
+                'selected': True,
+                'name': f'Menu {index}',
+                'chatBarText': '選單',
+                'areas': [{
+                    'bounds': {'x': 0, 'y': 0, 'width': 1250, 'height': 843},
+                    'action': {'type': 'richmenuswitch', 'richMenuAliasId': 'sub' if alias == 'main' else 'main'}
+                }]
+            })
+            self.attach_image(rm_id, (2500, 843), color=(2, 165, 104))
+            self.menu_ids.append(rm_id)
+        self.job_id = db.create_scheduled_job(
+            self.project_id, start_date='2026-01-01', end_date='2026-12-31'
+        )
+
+    def test_publish_creates_menus_aliases_and_default(self):
+        result = scheduler._execute_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual(result['switch_warnings'], [])
+        self.assertEqual(len(self.fake.rich_menus), 2)
+        self.assertEqual(set(self.fake.aliases), {'main', 'sub'})
+        first = db.get_rich_menu(self.menu_ids[0])
+        self.assertEqual(self.fake.aliases['main'], first['rich_menu_id'])
+        self.assertEqual(self.fake.default_rich_menu_id, first['rich_menu_id'])
+        self.assertGreater(self.fake.stats()['bytes_uploaded'], 0)
+
+    def test_republish_replaces_old_versions(self):
+        job = db.get_scheduled_job(self.job_id)
+        scheduler._execute_job(job)
+        old_ids = set(self.fake.rich_menus)
+
+        scheduler._execute_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual(len(self.fake.rich_menus), 2)
+        self.assertFalse(old_ids & set(self.fake.rich_menus))
+
+    def test_failed_upload_rolls_back_new_menus(self):
+        self.fake.inject_error('POST', '/v2/bot/richmenu/*/content', status=500)
+
+        with self.assertRaisesRegex(ValueError, '上傳圖片失敗'):
+            scheduler._execute_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual(self.fake.rich_menus, {})
+        self.assertEqual(self.fake.aliases, {})
+
+    def test_rate_limited_listing_aborts_before_writes(self):
+        self.fake.inject_error('GET', '/v2/bot/richmenu/list', status=429)
+
+        with self.assertRaisesRegex(ValueError, '429'):
+            scheduler._execute_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual(self.fake.stats()['write_calls'], 0)
+
+    def test_delete_owned_menu_keeps_alias_switched_elsewhere(self):
+        scheduler._execute_job(db.get_scheduled_job(self.job_id))
+        main_id = db.get_rich_menu(self.menu_ids[0])['rich_menu_id']
+        sub_id = db.get_rich_menu(self.menu_ids[1])['rich_menu_id']
+
+        result = _delete_owned_line_rich_menu(self.channel_access_token, sub_id, 'main')
+
+        self.assertTrue(result['alias_preserved'])
+        self.assertTrue(result['remote_deleted'])
+        self.assertEqual(self.fake.aliases['main'], main_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
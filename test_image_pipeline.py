@@ -0,0 +1,257 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+
+import config
+import db
+import image_pipeline
+import scheduler
+import upload_paths
+from db_testcase import DatabaseTestCase
+
+
+def _png_bytes(size=(1200, 810)):
+    buf = BytesIO()
+    Image.new('RGB', size, (2, 165, 104)).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class ImagePipelineTests(DatabaseTestCase):
+    use_upload_folder = True
+
+    def setUp(self):
+        super().setUp()
+        self.patch_config(IMAGE_PROCESS_WORKERS=0)
+
+        self.notifications = []
+        self.notified = threading.Event()
+
+        def notify(project_id, payload):
+            self.notifications.append((project_id, payload))
+            self.notified.set()
+
+        self._notify = notify
+        image_pipeline.set_notifier(notify)
+
+        self.rm_id = db.create_rich_menu(self.project_id, 'Image', 'image')
+        self.client = self.make_client()
+
+    def tearDown(self):
+        image_pipeline.shutdown()
+        image_pipeline.set_notifier(None)
+
+    def _upload(self, data=None, name='menu.png'):
+        return self.client.post(
+            f'/api/richmenus/{self.rm_id}/upload',
+            data={'image': (BytesIO(data or _png_bytes()), name)},
+            content_type='multipart/form-data'
+        )
+
+    def test_upload_generates_derivatives_and_notifies(self):
+        response = self._upload()
+
+        self.assertEqual(response.status_code, 200)
+        filename = response.get_json()['data']['image_path']
+        rm = db.get_rich_menu(self.rm_id)
+        self.assertEqual(rm['image_status'], 'ready')
+        self.assertEqual(rm['thumbnail_path'], f'thumb_{filename}')
+        with Image.open(upload_paths.resolve(rm['thumbnail_path'])) as thumb:
+            self.assertEqual(thumb.width, 400)
+        line_path = image_pipeline.line_jpeg_path(upload_paths.resolve(filename))
+        with Image.open(line_path) as line_image:
+            self.assertEqual(line_image.format, 'JPEG')
+        self.assertEqual(self.notifications[0][0], self.project_id)
+        self.assertEqual(self.notifications[0][1]['status'], 'ready')
+
+    def test_upload_serves_renditions_by_width_and_accept(self):
+        filename = self._upload(_png_bytes((2500, 843))).get_json()['data']['image_path']
+        url = f'/api/uploads/{filename}'
+
+        webp = self.client.get(f'{url}?w=300', headers={'Accept': 'image/webp,image/*'})
+        png = self.client.get(f'{url}?w=300', headers={'Accept': 'image/png'})
+        original = self.client.get(f'{url}?w=3000', headers={'Accept': 'image/webp'})
+
+        self.assertEqual(webp.mimetype, 'image/webp')
+        self.assertIn('Accept', webp.headers['Vary'])
+        with Image.open(BytesIO(webp.data)) as image:
+            self.assertEqual(image.size, (400, 135))
+        self.assertEqual(png.mimetype, 'image/png')
+        with Image.open(BytesIO(png.data)) as image:
+            self.assertEqual(image.width, 400)
+        with Image.open(BytesIO(original.data)) as image:
+            self.assertEqual(image.width, 2500)
+        self.assertLess(len(webp.data) * 10, len(original.data))
+        for response in (webp, png, original):
+            response.close()
+
+    def test_upload_records_image_metadata(self):
+        data = _png_bytes((2500, 843))
+        filename = self._upload(data).get_json()['data']['image_path']
+
+        image = db.get_image(filename)
+        self.assertEqual(image['rich_menu_id'], self.rm_id)
+        self.assertEqual((image['width'], image['height'], image['format']), (2500, 843, 'PNG'))
+        self.assertEqual(image['size_bytes'], len(data))
+        self.assertEqual(image['content_hash'], hashlib.sha256(data).hexdigest())
+        self.assertEqual(image['line_jpeg_path'], image_pipeline.line_jpeg_filename(filename))
+        self.assertEqual(len(image['renditions']), 4 * len(image_pipeline.RENDITION_FORMATS))
+
+        replacement = self._upload().get_json()['data']['image_path']
+        self.assertIsNone(db.get_image(filename))
+        self.assertEqual(db.get_image(replacement)['width'], 1200)
+
+    def test_serving_uses_recorded_hashes_without_reading_files(self):
+        data = _png_bytes((2500, 843))
+        filename = self._upload(data).get_json()['data']['image_path']
+        url = f'/api/uploads/{filename}'
+
+        with mock.patch('api_routes._upload_etag', side_effect=AssertionError('hashed file')):
+            original = self.client.get(url)
+            rendition = self.client.get(f'{url}?w=300', headers={'Accept': 'image/webp'})
+
+        self.assertEqual(original.headers['ETag'], f'"{hashlib.sha256(data).hexdigest()[:32]}"')
+        self.assertEqual(original.mimetype, 'image/png')
+        self.assertEqual(rendition.mimetype, 'image/webp')
+        self.assertEqual(
+            rendition.headers['ETag'], f'"{hashlib.sha256(rendition.data).hexdigest()[:32]}"'
+        )
+        for response in (original, rendition):
+            response.close()
+
+    def test_upload_rejects_bad_header_without_saving(self):
+        response = self._upload(data=b'GIF89a' + b'\x00' * 100)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(os.listdir(config.UPLOAD_FOLDER), [])
+        self.assertIsNone(db.get_rich_menu(self.rm_id)['image_path'])
+
+    def test_process_pool_finishes_in_background(self):
+        config.IMAGE_PROCESS_WORKERS = 1
+        tasks = []
+
+        def start_background_task(target, *args):
+            tasks.append(target)
+            threading.Thread(target=target, args=args).start()
+
+        image_pipeline.set_notifier(self._notify, start_background_task)
+        response = self._upload()
+        data = response.get_json()['data']
+
+        self.assertTrue(self.notified.wait(30))
+        self.assertEqual(tasks, [image_pipeline._complete])
+        self.assertNotEqual(image_pipeline._get_executor()._mp_context.get_start_method(), 'fork')
+        self.assertEqual(data['image_status'], 'processing')
+        rm = db.get_rich_menu(self.rm_id)
+        self.assertEqual(rm['image_status'], 'ready')
+        self.assertEqual(rm['thumbnail_path'], f'thumb_{data["image_path"]}')
+
+    def test_stale_result_does_not_overwrite_newer_upload(self):
+        db.update_rich_menu(self.rm_id, image_path='rm_new.png', image_status='processing')
+
+        image_pipeline._finish(self.rm_id, 'rm_old.png',
+                               result={'thumbnail_path': 'thumb_rm_old.png'})
+
+        rm = db.get_rich_menu(self.rm_id)
+        self.assertEqual(rm['image_status'], 'processing')
+        self.assertIsNone(rm['thumbnail_path'])
+        self.assertEqual(self.notifications, [])
+
+    def test_publish_reuses_pregenerated_line_jpeg(self):
+        filename = self._upload().get_json()['data']['image_path']
+        image_path = upload_paths.resolve(filename)
+        with open(image_pipeline.line_jpeg_path(image_path), 'rb') as f:
+            pregenerated = f.read()
+
+        self.assertEqual(scheduler._encode_line_image(image_path), pregenerated)
+        line_jpeg_path = upload_paths.path_for(db.get_image(filename)['line_jpeg_path'])
+        with mock.patch('image_pipeline.encode_line_jpeg', side_effect=AssertionError('re-encoded')):
+            self.assertEqual(scheduler._encode_line_image(image_path, line_jpeg_path), pregenerated)
+
+
+
+class HeaderValidationTests(unittest.TestCase):
+    def _encoded(self, size, image_format, **params):
+        buf = BytesIO()
+        Image.new('RGB', size).save(buf, format=image_format, **params)
+        buf.seek(0)
+        return buf
+
+    def test_probe_reads_png_and_jpeg_dimensions(self):
+        self.assertEqual(
+            image_pipeline.probe_image_header(self._encoded((2500, 843), 'PNG')),
+            ('PNG', 2500, 843)
+        )
+        exif = b'Exif\x00\x00' + b'\x00' * 30000
+        stream = self._encoded((1200, 810), 'JPEG', exif=exif, progressive=True)
+        self.assertEqual(image_pipeline.probe_image_header(stream), ('JPEG', 1200, 810))
+        self.assertEqual(stream.tell(), 0)
+
+    def test_probe_rejects_other_formats(self):
+        with self.assertRaisesRegex(ValueError, 'PNG 或 JPEG'):
+            image_pipeline.probe_image_header(self._encoded((1200, 810), 'GIF'))
+        with self.assertRaises(ValueError):
+            image_pipeline.probe_image_header(BytesIO(b'\xff\xd8\xff'))
+
+    def test_validate_rejects_wrong_size_and_oversized_body(self):
+        with self.assertRaisesRegex(ValueError, '目前是 800x600'):
+            image_pipeline.validate_upload(self._encoded((800, 600), 'PNG'))
+
+        padded = self._encoded((1200, 810), 'PNG')
+        padded.seek(0, 2)
+        padded.write(b'\x00' * config.RICHMENU_IMAGE_MAX_BYTES[(1200, 810)])
+        padded.seek(0)
+        with self.assertRaisesRegex(ValueError, '不可超過'):
+            image_pipeline.validate_upload(padded)
+
+    def _multipart(self, data, filename='menu.png'):
+        boundary = 'test-boundary'
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        return BytesIO(body), boundary
+
+    def test_multipart_upload_rejects_header_without_reading_body(self):
+        image = self._encoded((800, 600), 'PNG').getvalue() + b'\x00' * (4 * 1024 * 1024)
+        stream, boundary = self._multipart(image)
+        upload = image_pipeline.MultipartUpload(stream, boundary, chunk_size=4096)
+
+        self.assertEqual(upload.open('image'), 'menu.png')
+        with self.assertRaisesRegex(ValueError, '目前是 800x600'):
+            upload.probe()
+        self.assertLess(stream.tell(), 16 * 1024)
+
+    def test_multipart_upload_saves_and_enforces_size_limit(self):
+        data = _png_bytes()
+        stream, boundary = self._multipart(data)
+        upload = image_pipeline.MultipartUpload(stream, boundary, chunk_size=1024)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = os.path.join(tmpdir, 'saved.png')
+
+        upload.open('image')
+        self.assertEqual(upload.probe(), ('PNG', (1200, 810)))
+        self.assertEqual(upload.save(path), (len(data), hashlib.sha256(data).hexdigest()))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        padded = data + b'\x00' * config.RICHMENU_IMAGE_MAX_BYTES[(1200, 810)]
+        stream, boundary = self._multipart(padded)
+        upload = image_pipeline.MultipartUpload(stream, boundary)
+        upload.open('image')
+        upload.probe()
+        with self.assertRaisesRegex(ValueError, '不可超過'):
+            upload.save(path)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
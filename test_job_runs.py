@@ -0,0 +1,89 @@
+import unittest
+from datetime import timedelta
+
+import db
+import scheduler
+from db_testcase import FakeLineApiTestCase
+
+
+class ScheduledJobRunHistoryTests(FakeLineApiTestCase):
+    def setUp(self):
+        super().setUp()
+        rm_id = db.create_rich_menu(self.project_id, 'Runs', 'runs-main', {
+            'size': {'width': 1200, 'height': 810},
+            'selected': True,
+            'name': 'Runs',
+            'chatBarText': '選單',
+            'areas': [{
+                'bounds': {'x': 0, 'y': 0, 'width': 1200, 'height': 810},
+                'action': {'type': 'message', 'text': 'hi'}
+            }]
+        })
+        self.attach_image(rm_id, (1200, 810), 'runs')
+        self.job_id = db.create_scheduled_job(
+            self.project_id, start_date='2026-01-01', end_date='2026-12-31'
+        )
+
+    def test_successful_run_records_phases_calls_and_bytes(self):
+        scheduler.execute_single_job(self.job_id)
+
+        runs = db.list_scheduled_job_runs(job_id=self.job_id)
+        self.assertEqual(len(runs), 1)
+        run = runs[0]
+        self.assertEqual(run['status'], 'success')
+        self.assertEqual(run['trigger'], 'manual')
+        self.assertEqual(
+            set(run['phase_ms']),
+            {'validate', 'create', 'upload', 'alias', 'default', 'cleanup'}
+        )
+        stats = self.fake.stats()
+        self.assertEqual(run['line_calls'], stats['calls'])
+        self.assertEqual(run['bytes_uploaded'], stats['bytes_uploaded'])
+        self.assertIsNotNone(run['finished_at'])
+
+    def test_failed_run_keeps_full_message(self):
+        long_message = 'x' * 500
+        self.fake.inject_error('POST', '/v2/bot/richmenu/*/content', status=500,
+                               message=long_message)
+
+        with self.assertRaises(ValueError):
+            scheduler.execute_single_job(self.job_id)
+
+        run = db.list_scheduled_job_runs(job_id=self.job_id)[0]
+        self.assertEqual(run['status'], 'error')
+        self.assertIn('上傳圖片失敗', run['message'])
+        self.assertGreater(len(run['message']), 200)
+        self.assertEqual(len(db.get_scheduled_job(self.job_id)['last_run_message']), 200)
+
+    def test_stats_report_percentiles_for_successful_runs(self):
+        for duration in [100, 200, 300, 400]:
+            run_id = db.create_scheduled_job_run(self.job_id, self.project_id)
+            db.finish_scheduled_job_run(run_id, 'success', duration_ms=duration,
+                                        phase_ms={'upload': duration / 2})
+        run_id = db.create_scheduled_job_run(self.job_id, self.project_id)
+        db.finish_scheduled_job_run(run_id, 'error', duration_ms=5, message='boom')
+
+        stats = db.get_scheduled_job_run_stats(self.project_id)
+
+        self.assertEqual((stats['success'], stats['error']), (4, 1))
+        self.assertEqual(stats['duration_ms']['p50'], 200)
+        self.assertEqual(stats['duration_ms']['p90'], 400)
+        self.assertEqual(stats['phase_ms']['upload']['max'], 200)
+
+    def test_default_timestamps_use_the_scheduler_clock(self):
+        scheduled = db.create_scheduled_job_run(self.job_id, self.project_id, 'schedule',
+                                                scheduler._taipei_now().isoformat())
+        manual = db.create_scheduled_job_run(self.job_id, self.project_id, 'manual')
+        db.finish_scheduled_job_run(manual, 'success', duration_ms=1)
+
+        runs = db.list_scheduled_job_runs(job_id=self.job_id)
+
+        self.assertEqual([run['id'] for run in runs], [manual, scheduled])
+        self.assertTrue(runs[0]['started_at'].endswith('+08:00'))
+        self.assertTrue(runs[0]['finished_at'].endswith('+08:00'))
+        since = (scheduler._taipei_now() - timedelta(minutes=1)).isoformat()
+        self.assertEqual(db.get_scheduled_job_run_stats(self.project_id, since=since)['success'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
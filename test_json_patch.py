@@ -0,0 +1,163 @@
+import unittest
+
+import db
+import json_patch
+from db_testcase import DatabaseTestCase
+
+
+class JsonPatchTests(unittest.TestCase):
+    def setUp(self):
+        self.document = {
+            'name': 'Main',
+            'metadata': {
+                'chatBarText': '選單',
+                'areas': [{'action': {'type': 'message', 'text': 'a'}}, {'action': None}]
+            }
+        }
+
+    def test_operations_apply_in_order_without_touching_input(self):
+        patched = json_patch.apply_patch(self.document, [
+            {'op': 'test', 'path': '/name', 'value': 'Main'},
+            {'op': 'replace', 'path': '/metadata/chatBarText', 'value': '開啟'},
+            {'op': 'add', 'path': '/metadata/areas/-', 'value': {'action': None}},
+            {'op': 'remove', 'path': '/metadata/areas/1'},
+            {'op': 'copy', 'from': '/name', 'path': '/alias'},
+            {'op': 'move', 'from': '/metadata/areas/0/action/text', 'path': '/metadata/areas/0/label'}
+        ])
+
+        self.assertEqual(patched['metadata']['chatBarText'], '開啟')
+        self.assertEqual(patched['alias'], 'Main')
+        self.assertEqual(patched['metadata']['areas'], [
+            {'action': {'type': 'message'}, 'label': 'a'}, {'action': None}
+        ])
+        self.assertEqual(self.document['metadata']['chatBarText'], '選單')
+        self.assertEqual(len(self.document['metadata']['areas']), 2)
+
+    def test_test_operation_compares_json_types(self):
+        document = {'count': 1, 'flag': True, 'list': [1, {'a': None}]}
+        for path, value in (('/count', True), ('/flag', 1), ('/count', '1'),
+                            ('/list', [True, {'a': None}]), ('/list/1', {'a': False})):
+            with self.subTest(path=path, value=value):
+                with self.assertRaises(json_patch.PatchConflict):
+                    json_patch.apply_patch(document, [{'op': 'test', 'path': path, 'value': value}])
+        # JSON 只有一種數字型別：數值相同即相等
+        json_patch.apply_patch(document, [{'op': 'test', 'path': '/count', 'value': 1.0},
+                                          {'op': 'test', 'path': '/list', 'value': [1, {'a': None}]}])
+
+    def test_pointer_escapes(self):
+        patched = json_patch.apply_patch({'a/b': {'~c': 1}}, [
+            {'op': 'replace', 'path': '/a~1b/~0c', 'value': 2}
+        ])
+        self.assertEqual(patched, {'a/b': {'~c': 2}})
+
+    def test_failed_test_raises_conflict(self):
+        with self.assertRaises(json_patch.PatchConflict):
+            json_patch.apply_patch(self.document, [{'op': 'test', 'path': '/name', 'value': 'Other'}])
+
+    def test_invalid_operations_raise_patch_error(self):
+        for operations in (
+            {'op': 'add'},
+            [{'op': 'replace', 'path': '/missing', 'value': 1}],
+            [{'op': 'add', 'path': '/metadata/areas/5', 'value': {}}],
+            [{'op': 'remove', 'path': '/metadata/areas/01'}],
+            [{'op': 'move', 'from': '/metadata', 'path': '/metadata/areas'}],
+            [{'op': 'add', 'path': 'name', 'value': 1}],
+            [{'op': 'increment', 'path': '/name'}]
+        ):
+            with self.subTest(operations=operations):
+                with self.assertRaises(json_patch.PatchError):
+                    json_patch.apply_patch(self.document, operations)
+
+    def test_merge_patch(self):
+        patched = json_patch.apply_merge_patch(self.document, {
+            'name': None,
+            'metadata': {'chatBarText': '開啟', 'areas': []}
+        })
+        self.assertEqual(patched, {'metadata': {'chatBarText': '開啟', 'areas': []}})
+        self.assertEqual(self.document['name'], 'Main')
+
+
+class RichMenuPatchRouteTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.areas = [{
+            'bounds': {'x': 0, 'y': 0, 'width': 1250, 'height': 843},
+            'action': {'type': 'message', 'text': 'hi'}
+        }]
+        self.rm_id = db.create_rich_menu(self.project_id, 'Main', 'main', {
+            'size': {'width': 2500, 'height': 843},
+            'selected': True,
+            'chatBarText': '選單',
+            'areas': self.areas
+        })
+        self.client = self.make_client()
+
+    def _patch(self, body, if_match='"1"', content_type='application/merge-patch+json'):
+        headers = {'If-Match': if_match} if if_match else {}
+        return self.client.patch(f'/api/richmenus/{self.rm_id}', json=body,
+                                 headers=headers, content_type=content_type)
+
+    def test_merge_patch_writes_only_changed_column(self):
+        response = self._patch({'metadata': {'chatBarText': '開啟'}})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"2"')
+        self.assertEqual(response.get_json()['data'], {'version': 2, 'changed': ['chat_bar_text']})
+        rm = db.get_rich_menu(self.rm_id)
+        self.assertEqual(rm['metadata']['chatBarText'], '開啟')
+        self.assertEqual(rm['metadata']['areas'], self.areas)
+
+    def test_json_patch_updates_area(self):
+        response = self._patch([
+            {'op': 'replace', 'path': '/metadata/areas/0/action/text', 'value': 'bye'}
+        ], content_type='application/json-patch+json')
+
+        self.assertEqual(response.get_json()['data']['changed'], ['areas'])
+        self.assertEqual(db.get_rich_menu(self.rm_id)['metadata']['areas'][0]['action']['text'], 'bye')
+
+    def test_stale_version_is_rejected(self):
+        db.update_rich_menu(self.rm_id, name='Renamed')
+
+        response = self._patch({'metadata': {'chatBarText': '開啟'}})
+
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.get_json()['version'], 2)
+        self.assertEqual(db.get_rich_menu(self.rm_id)['metadata']['chatBarText'], '選單')
+
+    def test_null_clears_optional_fields(self):
+        response = self._patch({'alias': None, 'metadata': {'chatBarText': None}})
+
+        self.assertEqual(response.get_json()['data']['changed'], ['alias', 'chat_bar_text'])
+        rm = db.get_rich_menu(self.rm_id)
+        self.assertEqual((rm['alias'], rm['metadata']['chatBarText']), ('', ''))
+        self.assertEqual(self._patch({'metadata': {'selected': None}}, if_match='*').status_code, 400)
+
+    def test_background_writes_keep_version(self):
+        etag = self.client.get(f'/api/richmenus/{self.rm_id}').headers['ETag']
+        db.update_rich_menu(self.rm_id, image_status='ready', thumbnail_path='t.webp', rich_menu_id='richmenu-1')
+        db.update_rich_menu(self.rm_id, name='Main')
+
+        response = self._patch({'metadata': {'chatBarText': '開啟'}}, if_match=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['version'], 2)
+
+    def test_unchanged_patch_keeps_version(self):
+        response = self._patch({'name': 'Main'})
+
+        self.assertEqual(response.get_json()['data'], {'version': 1, 'changed': []})
+        self.assertEqual(db.get_rich_menu_version(self.rm_id), 1)
+
+    def test_requires_if_match_and_valid_result(self):
+        self.assertEqual(self._patch({'name': 'X'}, if_match=None).status_code, 428)
+        self.assertEqual(self._patch({'name': ''}, if_match='*').status_code, 400)
+        self.assertEqual(self._patch({'metadata': {'size': {'width': 0}}}).status_code, 400)
+        self.assertEqual(self._patch(
+            [{'op': 'test', 'path': '/name', 'value': 'Other'}],
+            content_type='application/json-patch+json'
+        ).status_code, 409)
+        self.assertEqual(db.get_rich_menu_version(self.rm_id), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import config
+import db
+import migrations
+
+
+class MigrationTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._original_path = config.DATABASE_PATH
+        config.DATABASE_PATH = os.path.join(self.tmpdir, 'test.db')
+
+    def tearDown(self):
+        config.DATABASE_PATH = self._original_path
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _connect(self):
+        return sqlite3.connect(config.DATABASE_PATH)
+
+    def _versions(self):
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+        finally:
+            conn.close()
+
+    def test_fresh_database_applies_every_step(self):
+        db.init_db()
+
+        self.assertEqual(self._versions(), [version for version, _, _ in migrations.MIGRATIONS])
+        conn = self._connect()
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        finally:
+            conn.close()
+        self.assertTrue({'accounts', 'projects', 'rich_menus', 'scheduled_jobs'} <= tables)
+
+    def test_up_to_date_startup_runs_one_version_check(self):
+        db.init_db()
+        statements = []
+        original_get_db = db.get_db
+
+        def traced_get_db():
+            conn = original_get_db()
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        with mock.patch.object(db, 'get_db', traced_get_db):
+            db.init_db()
+
+        self.assertEqual(statements, ['SELECT MAX(version) FROM schema_version'])
+
+    def test_unversioned_database_is_adopted(self):
+        # 版本化之前建立的資料庫：表已存在但缺後來新增的欄位
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE rich_menus (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute("INSERT INTO rich_menus (project_id, name, created_at, updated_at) VALUES (1, 'Main', 'a', 'a')")
+        conn.commit()
+        conn.close()
+
+        db.init_db()
+
+        self.assertEqual(self._versions(), [version for version, _, _ in migrations.MIGRATIONS])
+        self.assertEqual(db.get_rich_menu_version(1), 1)
+
+    def test_failed_step_rolls_back_only_itself(self):
+        def broken(cursor):
+            cursor.execute('CREATE TABLE half_done (id INTEGER)')
+            cursor.execute('SELECT * FROM missing_table')
+
+        steps = migrations.MIGRATIONS + [(migrations.LATEST_VERSION + 1, 'broken', broken)]
+        with mock.patch.object(migrations, 'MIGRATIONS', steps), \
+                mock.patch.object(migrations, 'LATEST_VERSION', migrations.LATEST_VERSION + 1):
+            with self.assertRaises(sqlite3.OperationalError):
+                db.init_db()
+
+        self.assertEqual(self._versions(), [version for version, _, _ in migrations.MIGRATIONS])
+        conn = self._connect()
+        try:
+            self.assertIsNone(conn.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'half_done'"
+            ).fetchone())
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+import collab
+import db
+from db_testcase import DatabaseTestCase
+
+
+def _metadata(chat_bar_text='選單', areas=None):
+    return {
+        'size': {'width': 2500, 'height': 843},
+        'selected': True,
+        'name': 'menu',
+        'chatBarText': chat_bar_text,
+        'areas': areas or []
+    }
+
+
+class ProjectSnapshotTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        original_locks = collab.locks
+        self.addCleanup(setattr, collab, 'locks', original_locks)
+        collab.locks = collab.Locks()
+
+        self.keep_id = db.create_rich_menu(self.project_id, 'Keep', 'keep', _metadata())
+        self.edit_id = db.create_rich_menu(self.project_id, 'Edit', 'edit', _metadata())
+        self.drop_id = db.create_rich_menu(self.project_id, 'Drop', 'drop', _metadata())
+        self.client = self.make_client()
+
+    def _payload(self, *menus, name='demo'):
+        return {'name': name, 'description': '', 'rich_menus': list(menus)}
+
+    def _menu(self, menu_id, name, alias, chat_bar_text='選單'):
+        return {'id': menu_id, 'name': name, 'alias': alias, 'metadata': _metadata(chat_bar_text)}
+
+    def test_snapshot_creates_updates_and_deletes_in_one_request(self):
+        keep_before = db.get_rich_menu(self.keep_id)['updated_at']
+        response = self.client.put(f'/api/projects/{self.project_id}/snapshot', json=self._payload(
+            self._menu(self.keep_id, 'Keep', 'keep'),
+            self._menu(self.edit_id, 'Edit', 'edit', chat_bar_text='開啟'),
+            self._menu('rm_1700000000000', 'New', 'new'),
+            name='renamed'
+        ))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()['data']
+        new_id = data['created']['rm_1700000000000']
+        self.assertEqual(data['updated'], [self.edit_id])
+        self.assertEqual(data['deleted'], [self.drop_id])
+        self.assertEqual(data['failed'], [])
+
+        project = db.get_project(self.project_id)
+        self.assertEqual(project['name'], 'renamed')
+        self.assertEqual([rm['id'] for rm in project['rich_menus']], [self.keep_id, self.edit_id, new_id])
+        self.assertEqual(project['rich_menus'][1]['metadata']['chatBarText'], '開啟')
+        # 沒有變動的 Rich Menu 不寫入
+        self.assertEqual(db.get_rich_menu(self.keep_id)['updated_at'], keep_before)
+
+    def test_unchanged_snapshot_writes_nothing(self):
+        response = self.client.put(f'/api/projects/{self.project_id}/snapshot', json=self._payload(
+            self._menu(self.keep_id, 'Keep', 'keep'),
+            self._menu(self.edit_id, 'Edit', 'edit'),
+            self._menu(self.drop_id, 'Drop', 'drop')
+        ))
+
+        data = response.get_json()['data']
+        self.assertEqual((data['created'], data['updated'], data['deleted']), ({}, [], []))
+
+    def test_rejects_rich_menu_from_another_project(self):
+        other_project = db.create_project(db.get_project(self.project_id)['account_id'], 'other')
+        foreign_id = db.create_rich_menu(other_project, 'Foreign', '', _metadata())
+
+        response = self.client.put(f'/api/projects/{self.project_id}/snapshot', json=self._payload(
+            self._menu(foreign_id, 'Foreign', ''),
+            self._menu('rm_1', 'New', 'new')
+        ))
+
+        self.assertEqual(response.status_code, 400)
+        # 整份拒絕，沒有任何變更
+        self.assertEqual(len(db.get_project(self.project_id)['rich_menus']), 3)
+        self.assertIsNotNone(db.get_rich_menu(self.drop_id))
+
+    def test_locked_rich_menu_rejects_whole_snapshot(self):
+        collab.locks.acquire(str(self.project_id), self.drop_id, 'sid-1', 'u1', 'Alice')
+
+        response = self.client.put(f'/api/projects/{self.project_id}/snapshot', json=self._payload(
+            self._menu(self.keep_id, 'Keep', 'keep'),
+            self._menu(self.edit_id, 'Edit', 'edit', chat_bar_text='開啟')
+        ))
+
+        self.assertEqual(response.status_code, 423)
+        self.assertEqual(db.get_rich_menu(self.edit_id)['metadata']['chatBarText'], '選單')
+        self.assertIsNotNone(db.get_rich_menu(self.drop_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import unittest
+
+import config
+import db
+import scheduler
+from db_testcase import FakeLineApiTestCase
+from line_proxy import line_proxy_bp
+
+
+class PublishPlanTests(FakeLineApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.menu_ids = []
+        for index in range(2):
+            rm_id = db.create_rich_menu(self.project_id, f'Plan {index}', f'plan-{index}', {
+                'size': {'width': 1200, 'height': 810},
+                'selected': True,
+                'name': f'Plan {index}',
+                'chatBarText': '選單',
+                'areas': [{
+                    'bounds': {'x': 0, 'y': 0, 'width': 1200, 'height': 810},
+                    'action': {'type': 'message', 'text': 'hi'}
+                }]
+            })
+            self.attach_image(rm_id, (1200, 810), 'plan')
+            self.menu_ids.append(rm_id)
+        self.job_id = db.create_scheduled_job(
+            self.project_id, start_date='2026-01-01', end_date='2026-12-31'
+        )
+
+    def test_first_plan_creates_everything_without_writes(self):
+        plan = scheduler.plan_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual([menu['action'] for menu in plan['menus']], ['create', 'create'])
+        self.assertEqual([alias['action'] for alias in plan['aliases']], ['create', 'create'])
+        self.assertEqual(plan['deletes'], [])
+        self.assertEqual(plan['default_menu']['to'], {'project_index': 0})
+        self.assertEqual(self.fake.stats()['write_calls'], 0)
+
+    def test_plan_after_publish_lists_switches_and_deletes(self):
+        scheduler._execute_job(db.get_scheduled_job(self.job_id))
+        published = {
+            db.get_rich_menu(rm_id)['rich_menu_id'] for rm_id in self.menu_ids
+        }
+        self.fake.clear_calls()
+
+        plan = scheduler.plan_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual({item['rich_menu_id'] for item in plan['deletes']}, published)
+        self.assertEqual([alias['action'] for alias in plan['aliases']], ['switch', 'switch'])
+        self.assertIn(plan['default_menu']['from'], published)
+        self.assertEqual(plan['write_calls'], 2 * 2 + 2 + 2 + 1)
+        self.assertEqual(self.fake.stats()['write_calls'], 0)
+
+    def test_second_plan_uses_cached_remote_state(self):
+        job = db.get_scheduled_job(self.job_id)
+        scheduler.plan_job(job)
+        calls = self.fake.stats()['calls']
+
+        plan = scheduler.plan_job(job)
+
+        self.assertTrue(plan['remote_state']['cached'])
+        self.assertEqual(self.fake.stats()['calls'], calls)
+
+    def test_proxy_writes_clear_cached_remote_state(self):
+        job = db.get_scheduled_job(self.job_id)
+        scheduler.plan_job(job)
+        client = self.make_client(line_proxy_bp)
+        headers = {'Authorization': f'Bearer {self.channel_access_token}'}
+
+        client.get('/proxy/v2/bot/richmenu/list', headers=headers)
+        self.assertTrue(scheduler.plan_job(job)['remote_state']['cached'])
+
+        client.delete('/proxy/v2/bot/richmenu/richmenu-gone', headers=headers)
+        self.assertFalse(scheduler.plan_job(job)['remote_state']['cached'])
+
+    def test_deleting_a_published_menu_clears_cached_remote_state(self):
+        job = db.get_scheduled_job(self.job_id)
+        scheduler._execute_job(job)
+        scheduler.plan_job(job)
+
+        response = self.make_client().delete(f'/api/richmenus/{self.menu_ids[1]}')
+
+        self.assertTrue(response.get_json()['data']['remote_deleted'])
+        self.assertFalse(scheduler.plan_job(job)['remote_state']['cached'])
+
+    def test_single_scope_reuses_published_default(self):
+        scheduler._execute_job(db.get_scheduled_job(self.job_id))
+        existing_id = db.get_rich_menu(self.menu_ids[1])['rich_menu_id']
+        db.update_scheduled_job(self.job_id, scope='single', current_tab_index=0,
+                                default_menu_index=1)
+
+        plan = scheduler.plan_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual(len(plan['menus']), 1)
+        self.assertEqual(plan['reused'][0]['rich_menu_id'], existing_id)
+        self.assertEqual(plan['default_menu']['to'], {'rich_menu_id': existing_id})
+
+    def test_missing_default_target_fails_before_any_write(self):
+        db.update_scheduled_job(self.job_id, scope='single', current_tab_index=0,
+                                default_menu_index=1)
+
+        with self.assertRaisesRegex(ValueError, '尚未上傳'):
+            scheduler._execute_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual(self.fake.stats()['calls'], 0)
+
+    def test_missing_recorded_image_fails_before_any_call(self):
+        filename = db.get_rich_menu(self.menu_ids[0])['image_path']
+        db.record_image(self.menu_ids[0], filename, 'image/png', 10)
+        os.remove(os.path.join(config.UPLOAD_FOLDER, filename))
+
+        with self.assertRaisesRegex(ValueError, '圖片檔案不存在'):
+            scheduler.plan_job(db.get_scheduled_job(self.job_id))
+        with self.assertRaisesRegex(ValueError, '圖片檔案不存在'):
+            scheduler._execute_job(db.get_scheduled_job(self.job_id))
+
+        self.assertEqual(self.fake.stats()['calls'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
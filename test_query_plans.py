@@ -0,0 +1,73 @@
+import re
+import sqlite3
+import unittest
+
+import config
+import db
+from db_testcase import DatabaseTestCase
+
+# 以 EXPLAIN QUERY PLAN 檢查熱門讀取路徑實際送出的 SQL：不可整表掃描，
+# 有 ORDER BY 的也不可另外排序（應由索引提供順序）
+TABLE_SCAN = re.compile(r'^SCAN (TABLE )?(?!CONSTANT ROW)\w+')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+class QueryPlanTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rm_id = db.create_rich_menu(self.project_id, 'Main', 'main')
+        self.job_id = db.create_scheduled_job(
+            self.project_id, start_date='2026-01-01', end_date='2026-12-31'
+        )
+
+        self.statements = []
+        original_get_db = db.get_db
+        self.addCleanup(setattr, db, 'get_db', original_get_db)
+
+        def traced_get_db():
+            conn = original_get_db()
+            conn.set_trace_callback(self.statements.append)
+            return conn
+
+        db.get_db = traced_get_db
+
+    def _plan(self, sql):
+        conn = sqlite3.connect(config.DATABASE_PATH)
+        try:
+            return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        finally:
+            conn.close()
+
+    def assertIndexedReads(self, call):
+        """執行 call，檢查期間所有 SELECT 的查詢計畫"""
+        self.statements.clear()
+        call()
+        selects = [sql for sql in self.statements if sql.lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            plan = self._plan(sql)
+            for detail in plan:
+                self.assertIsNone(
+                    TABLE_SCAN.match(detail),
+                    f'整表掃描：{detail}\n{" ".join(sql.split())}\n{plan}'
+                )
+                self.assertNotIn(TEMP_SORT, detail, f'額外排序：{" ".join(sql.split())}\n{plan}')
+
+    def test_project_reads(self):
+        self.assertIndexedReads(lambda: db.get_project(self.project_id))
+        self.assertIndexedReads(lambda: db.get_project_version(self.project_id))
+        self.assertIndexedReads(lambda: db.list_projects_by_account(self.account_id))
+
+    def test_rich_menu_reads(self):
+        self.assertIndexedReads(lambda: db.get_rich_menu(self.rm_id))
+        self.assertIndexedReads(lambda: db.get_rich_menu_version(self.rm_id))
+
+    def test_schedule_reads(self):
+        self.assertIndexedReads(lambda: db.list_due_scheduled_jobs('2026-06-01', '00:00', 0, 1))
+        self.assertIndexedReads(lambda: db.list_scheduled_jobs_by_project(self.project_id))
+        self.assertIndexedReads(lambda: db.get_scheduled_jobs_version(self.project_id))
+        self.assertIndexedReads(lambda: db.get_scheduled_job(self.job_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import config
+import db
+import scheduler
+
+
+class SchedulerLeaseTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._original_path = config.DATABASE_PATH
+        config.DATABASE_PATH = os.path.join(self.tmpdir, 'test.db')
+        db.init_db()
+        scheduler._is_leader = False
+
+    def tearDown(self):
+        scheduler._is_leader = False
+        config.DATABASE_PATH = self._original_path
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_only_one_holder_gets_the_lease(self):
+        self.assertTrue(db.acquire_scheduler_lease('lease', 'a', ttl=30, now=100))
+        self.assertFalse(db.acquire_scheduler_lease('lease', 'b', ttl=30, now=110))
+        self.assertTrue(db.acquire_scheduler_lease('lease', 'a', ttl=30, now=120))
+        self.assertEqual(db.get_scheduler_lease('lease')['expires_at'], 150)
+
+    def test_expired_lease_fails_over(self):
+        db.acquire_scheduler_lease('lease', 'a', ttl=30, now=100)
+
+        self.assertTrue(db.acquire_scheduler_lease('lease', 'b', ttl=30, now=131))
+        lease = db.get_scheduler_lease('lease')
+        self.assertEqual((lease['holder'], lease['acquired_at']), ('b', 131))
+        self.assertFalse(db.acquire_scheduler_lease('lease', 'a', ttl=30, now=140))
+
+    def test_release_lets_next_holder_in_immediately(self):
+        db.acquire_scheduler_lease('lease', 'a', ttl=30, now=100)
+        db.release_scheduler_lease('lease', 'a')
+
+        self.assertTrue(db.acquire_scheduler_lease('lease', 'b', ttl=30, now=101))
+
+    def test_concurrent_claims_yield_a_single_winner(self):
+        results = []
+        barrier = threading.Barrier(8)
+
+        def claim(holder):
+            barrier.wait()
+            results.append(db.claim_scheduled_job_run(1, '2026-01-01 09:00', holder))
+
+        threads = [threading.Thread(target=claim, args=(f'w{i}',)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 1)
+        self.assertTrue(db.claim_scheduled_job_run(1, '2026-01-02 09:00', 'w0'))
+
+    def test_follower_does_not_run_due_jobs(self):
+        db.acquire_scheduler_lease(scheduler.LEASE_NAME, 'other-process', ttl=30)
+
+        with mock.patch.object(db, 'list_due_scheduled_jobs') as list_due:
+            scheduler.check_and_run_jobs()
+
+        list_due.assert_not_called()
+        self.assertFalse(scheduler.get_leader_status()['is_leader'])
+
+    def test_leader_skips_runs_already_claimed(self):
+        account_id = db.create_account('lease-bot', 'token-lease')
+        project_id = db.create_project(account_id, 'lease')
+        job_id = db.create_scheduled_job(project_id, start_date='2000-01-01',
+                                         end_date='2999-12-31')
+        job = db.get_scheduled_job(job_id)
+        today = scheduler._taipei_now().strftime('%Y-%m-%d')
+        db.claim_scheduled_job_run(job_id, f'{today} {job["run_time"]}', 'other-process')
+
+        with mock.patch.object(db, 'list_due_scheduled_jobs', return_value=[job]), \
+                mock.patch.object(scheduler, '_run_with_history') as run:
+            scheduler.check_and_run_jobs()
+
+        run.assert_not_called()
+        self.assertTrue(scheduler.get_leader_status()['is_leader'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+import config
+from api_routes import api_bp
+
+
+class UploadCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._original = (config.UPLOAD_FOLDER, config.UPLOADS_X_ACCEL_PREFIX)
+        config.UPLOAD_FOLDER = self.tmpdir
+        config.UPLOADS_X_ACCEL_PREFIX = ''
+
+        self.unique_name = 'rm_7_0123456789ab.png'
+        self.legacy_name = 'legacy.png'
+        for name in (self.unique_name, self.legacy_name):
+            with open(os.path.join(self.tmpdir, name), 'wb') as f:
+                f.write(b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4)
+
+        app = Flask(__name__)
+        app.register_blueprint(api_bp)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        config.UPLOAD_FOLDER, config.UPLOADS_X_ACCEL_PREFIX = self._original
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _get(self, name, **headers):
+        response = self.client.get(f'/api/uploads/{name}', headers=headers)
+        response.close()
+        return response
+
+    def test_unique_upload_is_immutable_with_content_etag(self):
+        response = self._get(self.unique_name)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        etag = response.headers['ETag']
+        self.assertEqual(self._get(self.legacy_name).headers['ETag'], etag)
+
+    def test_if_none_match_returns_304(self):
+        etag = self._get(self.unique_name).headers['ETag']
+
+        response = self._get(self.unique_name, **{'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_range_request_returns_partial_content(self):
+        response = self._get(self.unique_name, Range='bytes=0-7')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'\x89PNG\r\n\x1a\n')
+
+    def test_legacy_name_must_revalidate(self):
+        response = self._get(self.legacy_name)
+
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
+    def test_x_accel_redirect_offloads_body(self):
+        config.UPLOADS_X_ACCEL_PREFIX = '/protected-uploads'
+
+        response = self._get(self.unique_name)
+
+        self.assertEqual(response.headers['X-Accel-Redirect'],
+                         f'/protected-uploads/{self.unique_name}')
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_missing_file_is_404(self):
+        self.assertEqual(self._get('rm_7_ffffffffffff.png').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
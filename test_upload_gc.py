@@ -0,0 +1,129 @@
+import os
+import time
+import unittest
+
+import collab
+import config
+import db
+import upload_gc
+from db_testcase import DatabaseTestCase
+
+DAY = 24 * 3600
+
+
+class UploadGcTests(DatabaseTestCase):
+    use_upload_folder = True
+
+    def setUp(self):
+        super().setUp()
+        self.rm_id = db.create_rich_menu(self.project_id, 'GC', 'gc')
+        db.update_rich_menu(self.rm_id, image_path='rm_1_aaaaaaaaaaaa.png',
+                            thumbnail_path='thumb_rm_1_aaaaaaaaaaaa.png')
+        self.event_id = db.create_broadcast_event('bot', 'event', message_plan=[
+            {'type': 'image', 'attachment': {'url': f'/api/uploads/broadcast_1_{"b" * 32}_a.png'}}
+        ])
+
+    def _touch(self, name, age=2 * DAY):
+        path = os.path.join(config.UPLOAD_FOLDER, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def _names(self, report):
+        return {item['name'] for item in report['files']}
+
+    def test_referenced_files_and_derivatives_are_kept(self):
+        for name in ['rm_1_aaaaaaaaaaaa.png', 'thumb_rm_1_aaaaaaaaaaaa.png',
+                     'r400_rm_1_aaaaaaaaaaaa.webp', 'line_rm_1_aaaaaaaaaaaa.jpg',
+                     f'broadcast_1_{"b" * 32}_a.png', 'unrelated.txt']:
+            self._touch(name)
+
+        report = upload_gc.collect(dry_run=True)
+
+        self.assertEqual(report['orphaned'], 0)
+        self.assertEqual(report['scanned'], 6)
+
+    def test_replaced_and_deleted_files_are_orphans(self):
+        self._touch('rm_1_000000000000.png')
+        self._touch('r800_rm_1_000000000000.png')
+        self._touch(f'broadcast_1_{"c" * 32}_b.png')
+        self._touch(f'broadcast_99_{"d" * 32}_c.png')
+        self._touch('thumb_rm_1_aaaaaaaaaaaa.png.tmp')
+
+        report = upload_gc.collect(dry_run=True)
+
+        reasons = {item['name']: item['reason'] for item in report['files']}
+        self.assertEqual(len(reasons), 5)
+        self.assertEqual(reasons['thumb_rm_1_aaaaaaaaaaaa.png.tmp'], 'incomplete write')
+        self.assertEqual(reasons[f'broadcast_99_{"d" * 32}_c.png'], 'broadcast event deleted')
+        self.assertEqual(reasons[f'broadcast_1_{"c" * 32}_b.png'], 'not in message_plan')
+
+    def test_recorded_derivatives_replace_naming_guess(self):
+        db.record_image(self.rm_id, 'rm_1_aaaaaaaaaaaa.png', 'image/png', 10)
+        db.update_image('rm_1_aaaaaaaaaaaa.png', thumbnail_path='thumb_rm_1_aaaaaaaaaaaa.png',
+                        line_jpeg_path='line_rm_1_aaaaaaaaaaaa.jpg',
+                        renditions=[{'name': 'r400_rm_1_aaaaaaaaaaaa.webp', 'width': 400}])
+        for name in ['rm_1_aaaaaaaaaaaa.png', 'r400_rm_1_aaaaaaaaaaaa.webp',
+                     'line_rm_1_aaaaaaaaaaaa.jpg', 'r800_rm_1_aaaaaaaaaaaa.webp']:
+            self._touch(name)
+
+        report = upload_gc.collect(dry_run=True)
+
+        self.assertEqual(self._names(report), {'r800_rm_1_aaaaaaaaaaaa.webp'})
+
+    def test_only_pipeline_temp_files_count_as_incomplete_writes(self):
+        self._touch('notes.tmp')
+        self._touch('backup_rm_1.tmp')
+        self._touch('line_rm_1_000000000000.jpg.tmp')
+
+        report = upload_gc.collect(dry_run=True)
+
+        self.assertEqual(self._names(report), {'line_rm_1_000000000000.jpg.tmp'})
+
+    def test_files_in_unsaved_live_documents_are_kept(self):
+        documents = collab.MenuDocuments(lambda project_id, rich_menu_id: None)
+        documents.seed(self.project_id, 'draft-1', {'areas': [
+            {'bounds': {'x': 0, 'y': 0, 'width': 10, 'height': 10},
+             'action': {'type': 'uri', 'uri': '/api/uploads/rm_1_000000000000.png'}}
+        ]})
+        self._touch('rm_1_000000000000.png')
+        self._touch('rm_1_111111111111.png')
+        original = collab.documents
+        collab.documents = documents
+        try:
+            report = upload_gc.collect(dry_run=True)
+        finally:
+            collab.documents = original
+
+        self.assertEqual(self._names(report), {'rm_1_111111111111.png'})
+
+    def test_grace_period_protects_recent_uploads(self):
+        self._touch('rm_1_000000000000.png', age=60)
+
+        report = upload_gc.collect(dry_run=True)
+
+        self.assertEqual(report['orphaned'], 0)
+        self.assertEqual(report['skipped_recent'], 1)
+
+    def test_deleted_project_releases_its_images(self):
+        kept = self._touch('rm_1_aaaaaaaaaaaa.png')
+        db.delete_project(self.project_id)
+
+        report = upload_gc.collect(dry_run=False, batch_size=1)
+
+        self.assertEqual(report['deleted'], 1)
+        self.assertFalse(os.path.exists(kept))
+
+    def test_dry_run_deletes_nothing(self):
+        path = self._touch('rm_1_000000000000.png')
+
+        report = upload_gc.collect(dry_run=True)
+
+        self.assertEqual(report['deleted'], 0)
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+import upload_paths
+
+
+class UploadPathsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._original = config.UPLOAD_FOLDER
+        config.UPLOAD_FOLDER = self.tmpdir
+
+    def tearDown(self):
+        config.UPLOAD_FOLDER = self._original
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        return path
+
+    def test_derivatives_share_the_original_shard(self):
+        original = upload_paths.relative_path('rm_3_0123456789ab.png')
+        shard = os.path.dirname(original)
+
+        self.assertTrue(original.startswith('rm/'))
+        for name in ['thumb_rm_3_0123456789ab.png', 'r400_rm_3_0123456789ab.webp',
+                     'line_rm_3_0123456789ab.jpg']:
+            self.assertEqual(os.path.dirname(upload_paths.relative_path(name)), shard)
+
+    def test_broadcast_attachments_are_grouped_by_event(self):
+        self.assertEqual(
+            upload_paths.relative_path(f'broadcast_12_{"a" * 32}_x.pdf'),
+            f'broadcast/12/broadcast_12_{"a" * 32}_x.pdf'
+        )
+        path = self._write(upload_paths.path_for(f'broadcast_12_{"a" * 32}_x.pdf'))
+        other = self._write(upload_paths.path_for(f'broadcast_13_{"a" * 32}_x.pdf'))
+
+        upload_paths.delete_broadcast_attachments(12)
+
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(other))
+
+    def test_resolve_falls_back_to_legacy_flat_file(self):
+        legacy = self._write(os.path.join(self.tmpdir, 'rm_3_0123456789ab.png'))
+
+        self.assertEqual(upload_paths.resolve('rm_3_0123456789ab.png'), legacy)
+        self.assertIsNone(upload_paths.resolve('rm_3_missing.png'))
+
+    def test_migrate_moves_flat_files_and_is_idempotent(self):
+        names = ['rm_3_0123456789ab.png', 'thumb_rm_3_0123456789ab.png',
+                 f'broadcast_1_{"b" * 32}_y.png', 'other.bin']
+        for name in names:
+            self._write(os.path.join(self.tmpdir, name))
+
+        self.assertEqual(upload_paths.migrate(dry_run=True)['moved'], 4)
+        self.assertEqual(upload_paths.migrate()['moved'], 4)
+        self.assertEqual(upload_paths.migrate()['moved'], 0)
+
+        for name in names:
+            self.assertEqual(upload_paths.resolve(name), upload_paths.path_for(name))
+        self.assertEqual(
+            {entry.name for entry in upload_paths.iter_files()}, set(names)
+        )
+
+    def test_rejects_path_traversal(self):
+        with self.assertRaises(ValueError):
+            upload_paths.relative_path('../etc/passwd')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# upload_gc.py - 清理 UPLOAD_FOLDER（含分層子目錄）中已無人引用的上傳檔
+#
+# 換圖、刪除 Rich Menu／專案／帳號或群發事件後，舊的原圖、縮圖、預覽版本、
+# LINE 用 JPEG 與群發附件都會留在磁碟上。這裡比對資料庫中的引用：
+#   - rich_menus.image_path / thumbnail_path，及 images 表記錄的衍生檔
+#     （沒有 images 紀錄的舊圖依命名規則推算所有可能的衍生檔）
+#   - broadcast_events.message_plan 內出現的附件檔名
+#   - 協作即時文件（collab.documents）中尚未寫回資料庫的內容
+# 找出超過寬限期仍未被引用的檔案，分批刪除；dry_run 只回報不刪除。
+# 不符合本系統命名規則的檔案一律不碰；.tmp 只認衍生檔寫到一半留下的暫存檔。
+#
+# 單一 worker 時即時文件只在 web 行程的記憶體內，命令列執行看不到；這時靠寬限期
+# 保護，UPLOAD_GC_GRACE_HOURS 須長於協作寫回延遲（COLLAB_PERSIST_MAX_DELAY）加上
+# 一次編輯工作階段的長度。多 worker（SOCKETIO_MESSAGE_QUEUE）時文件在共用資料庫，
+# 命令列也讀得到。
+#
+# 用法：
+#   python upload_gc.py              # dry-run，列出會刪除的檔案
+#   python upload_gc.py --delete     # 實際刪除
+
+import argparse
+import os
+import re
+import sys
+import time
+import logging
+
+import collab
+import config
+import db
+import image_pipeline
+import upload_paths
+
+logger = logging.getLogger('upload_gc')
+
+RICH_MENU_FILE = re.compile(r'^(?:thumb_|line_|r\d+_)?rm_\d+_')
+BROADCAST_FILE = re.compile(r'^broadcast_(\d+)_')
+# image_pipeline._write_atomic 寫衍生檔時的暫存檔（縮圖、LINE 用 JPEG、預覽版本）
+DERIVATIVE_TEMP_FILE = re.compile(
+    r'^(?:thumb_|line_|r\d+_)rm_\d+_.+' + re.escape(image_pipeline.TEMP_SUFFIX) + '$'
+)
+REPORT_FILE_LIMIT = 500
+
+
+def _derivative_names(image_path):
+    names = {
+        image_path,
+        image_pipeline.thumbnail_filename(image_path),
+        image_pipeline.line_jpeg_filename(image_path)
+    }
+    for width in image_pipeline.RENDITION_WIDTHS:
+        for extension in image_pipeline.RENDITION_FORMATS:
+            names.add(image_pipeline.rendition_filename(image_path, width, extension))
+    return names
+
+
+def _plan_strings(value):
+    """遞迴取出 message_plan 或即時文件內所有字串（附件可能以 stored_name 或 url 記錄）"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _plan_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _plan_strings(item)
+
+
+def _build_reference_index():
+    references = db.list_upload_references()
+    rich_menu_files = set(references['thumbnails'])
+    for image_path in references['images']:
+        rich_menu_files.add(image_path)
+        derivatives = references['derivatives'].get(image_path)
+        rich_menu_files |= derivatives if derivatives is not None else _derivative_names(image_path)
+
+    broadcast_files = {}
+    for event_id, plan in references['broadcast_plans'].items():
+        broadcast_files[event_id] = {
+            text.rsplit('/', 1)[-1] for text in _plan_strings(plan)
+        }
+
+    # 即時文件的編輯可能還沒寫回資料庫，其中提到的檔案一律視為引用中
+    live_files = {
+        text.rsplit('/', 1)[-1] for text in _plan_strings(collab.documents.live_values())
+    }
+    return rich_menu_files, broadcast_files, live_files
+
+
+def _orphan_reason(name, rich_menu_files, broadcast_files, live_files):
+    """回傳孤兒原因；仍被引用或不是本系統管理的檔案回傳 None"""
+    if name in live_files:
+        return None
+
+    if DERIVATIVE_TEMP_FILE.match(name):
+        return 'incomplete write'
+
+    if RICH_MENU_FILE.match(name):
+        return None if name in rich_menu_files else 'rich menu image not referenced'
+
+    match = BROADCAST_FILE.match(name)
+    if match:
+        event_id = int(match.group(1))
+        if event_id not in broadcast_files:
+            return 'broadcast event deleted'
+        return None if name in broadcast_files[event_id] else 'not in message_plan'
+
+    return None
+
+
+def find_orphans(grace_seconds=None, now=None):
+    """掃描上傳資料夾，回傳 (孤兒清單, 掃描檔數, 寬限期內略過數)"""
+    grace_seconds = config.UPLOAD_GC_GRACE_HOURS * 3600 if grace_seconds is None else grace_seconds
+    # 寫回前的即時文件在寫回延遲內一定還在記憶體或共用存放，寬限期至少要涵蓋它
+    grace_seconds = max(grace_seconds, config.COLLAB_PERSIST_MAX_DELAY)
+    now = time.time() if now is None else now
+    rich_menu_files, broadcast_files, live_files = _build_reference_index()
+
+    orphans = []
+    scanned = 0
+    skipped_recent = 0
+    for entry in upload_paths.iter_files():
+        scanned += 1
+        reason = _orphan_reason(entry.name, rich_menu_files, broadcast_files, live_files)
+        if not reason:
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        # 剛上傳、尚未寫入資料庫或 message_plan 的檔案不可刪
+        if now - stat.st_mtime < grace_seconds:
+            skipped_recent += 1
+            continue
+        orphans.append({
+            'name': entry.name,
+            'path': entry.path,
+            'size': stat.st_size,
+            'age_hours': round((now - stat.st_mtime) / 3600, 1),
+            'reason': reason
+        })
+    return orphans, scanned, skipped_recent
+
+
+def collect(dry_run=True, grace_seconds=None, batch_size=None, now=None):
+    """找出並（非 dry_run 時）分批刪除孤兒檔，回傳報告"""
+    batch_size = batch_size or config.UPLOAD_GC_BATCH_SIZE
+    orphans, scanned, skipped_recent = find_orphans(grace_seconds, now)
+
+    report = {
+        'dry_run': dry_run,
+        'scanned': scanned,
+        'skipped_recent': skipped_recent,
+        'orphaned': len(orphans),
+        'orphaned_bytes': sum(item['size'] for item in orphans),
+        'deleted': 0,
+        'deleted_bytes': 0,
+        'errors': [],
+        'files': [
+            {key: item[key] for key in ('name', 'size', 'age_hours', 'reason')}
+            for item in orphans[:REPORT_FILE_LIMIT]
+        ]
+    }
+    if dry_run:
+        return report
+
+    for start in range(0, len(orphans), batch_size):
+        for item in orphans[start:start + batch_size]:
+            try:
+                os.remove(item['path'])
+            except FileNotFoundError:
+                continue
+            except OSError as exc:
+                report['errors'].append(f'{item["name"]}: {exc}')
+                continue
+            report['deleted'] += 1
+            report['deleted_bytes'] += item['size']
+        # 每批之間讓出執行權，避免長時間佔住 eventlet worker
+        time.sleep(0)
+    upload_paths.remove_empty_dirs()
+
+    logger.info(
+        f'🧹 上傳檔清理：刪除 {report["deleted"]} 個檔案 '
+        f'({report["deleted_bytes"] / 1e6:.1f} MB)'
+    )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='清理沒有被引用的上傳檔')
+    parser.add_argument('--delete', action='store_true', help='實際刪除（預設只列出）')
+    parser.add_argument('--grace-hours', type=float, default=config.UPLOAD_GC_GRACE_HOURS,
+                        help='修改時間在此時數內的檔案不刪除')
+    args = parser.parse_args(argv)
+
+    report = collect(dry_run=not args.delete, grace_seconds=args.grace_hours * 3600)
+    for item in report['files']:
+        print(f'{item["name"]:<70} {item["size"]:>10} B {item["age_hours"]:>8} h  {item["reason"]}')
+    action = '已刪除' if args.delete else '可刪除'
+    count = report['deleted'] if args.delete else report['orphaned']
+    size = report['deleted_bytes'] if args.delete else report['orphaned_bytes']
+    print(f'\n掃描 {report["scanned"]} 個檔案，{action} {count} 個（{size / 1e6:.1f} MB），'
+          f'寬限期內略過 {report["skipped_recent"]} 個')
+    for error in report['errors']:
+        print(f'  ⚠️ {error}')
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# upload_paths.py - 上傳檔案的分層目錄配置
+#
+# 所有上傳檔不再平放在 UPLOAD_FOLDER，而是依檔名分到子目錄：
+#   rm/<hh>/            Rich Menu 原圖與其衍生檔（縮圖、預覽版本、LINE 用 JPEG），
+#                       hh 取自原圖檔名的雜湊，衍生檔與原圖永遠在同一層
+#   broadcast/<event>/  群發事件附件，刪除事件時整個目錄移除
+#   misc/<hh>/          其他檔案
+# 資料庫與 URL 仍只記錄檔名；讀寫一律經過 path_for / resolve。尚未搬移的舊檔
+# 仍可從 UPLOAD_FOLDER 根目錄讀到，執行 `python upload_paths.py --migrate` 搬移。
+
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+import config
+
+RICH_MENU_FILE = re.compile(r'^(?:thumb_|line_|r\d+_)?(rm_\d+_[^.]+)')
+BROADCAST_FILE = re.compile(r'^broadcast_(\d+)_')
+
+
+def _hash_shard(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:2]
+
+
+def relative_path(name):
+    """檔名對應的相對路徑（以 / 分隔）"""
+    if not name or '/' in name or os.sep in name or name in ('.', '..'):
+        raise ValueError(f'無效的檔名: {name!r}')
+
+    match = RICH_MENU_FILE.match(name)
+    if match:
+        return f'rm/{_hash_shard(match.group(1))}/{name}'
+
+    match = BROADCAST_FILE.match(name)
+    if match:
+        return f'broadcast/{match.group(1)}/{name}'
+
+    return f'misc/{_hash_shard(name)}/{name}'
+
+
+def path_for(name, root=None, create=False):
+    """新檔案應寫入的絕對路徑；create=True 時建立所在目錄"""
+    path = os.path.join(root or config.UPLOAD_FOLDER, *relative_path(name).split('/'))
+    if create:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def resolve(name, root=None):
+    """既有檔案的絕對路徑；分層位置找不到時退回根目錄的舊檔，都沒有回傳 None"""
+    root = root or config.UPLOAD_FOLDER
+    path = path_for(name, root)
+    if os.path.isfile(path):
+        return path
+    legacy_path = os.path.join(root, name)
+    if os.path.isfile(legacy_path):
+        return legacy_path
+    return None
+
+
+def broadcast_dir(event_id, root=None):
+    return os.path.join(root or config.UPLOAD_FOLDER, 'broadcast', str(int(event_id)))
+
+
+def iter_files(root=None):
+    """逐一列出所有上傳檔（os.DirEntry），含根目錄尚未搬移的舊檔"""
+    root = root or config.UPLOAD_FOLDER
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def remove_empty_dirs(root=None):
+    """刪除空的分層目錄（不含根目錄）"""
+    root = root or config.UPLOAD_FOLDER
+    removed = 0
+    for directory, _, _ in os.walk(root, topdown=False):
+        if directory == root:
+            continue
+        try:
+            os.rmdir(directory)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def migrate(root=None, dry_run=False):
+    """把根目錄的舊檔搬到分層位置；可重複執行"""
+    root = root or config.UPLOAD_FOLDER
+    report = {'moved': 0, 'skipped': 0, 'errors': []}
+    with os.scandir(root) as entries:
+        legacy = [entry for entry in entries if entry.is_file(follow_symlinks=False)]
+
+    for entry in legacy:
+        try:
+            target = path_for(entry.name, root, create=not dry_run)
+        except ValueError:
+            report['skipped'] += 1
+            continue
+        if os.path.exists(target):
+            # 分層位置已有同名檔（先前搬到一半）：以分層位置為準
+            report['skipped'] += 1
+            continue
+        if not dry_run:
+            try:
+                os.replace(entry.path, target)
+            except OSError as exc:
+                report['errors'].append(f'{entry.name}: {exc}')
+                continue
+        report['moved'] += 1
+    return report
+
+
+def delete_broadcast_attachments(event_id, root=None):
+    """刪除群發事件的整個附件目錄"""
+    shutil.rmtree(broadcast_dir(event_id, root), ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='上傳檔分層目錄工具')
+    parser.add_argument('--migrate', action='store_true', help='把根目錄的舊檔搬到分層目錄')
+    parser.add_argument('--dry-run', action='store_true', help='只計算會搬移的檔案數')
+    args = parser.parse_args(argv)
+
+    if not args.migrate:
+        parser.print_help()
+        return 0
+
+    report = migrate(dry_run=args.dry_run)
+    action = '可搬移' if args.dry_run else '已搬移'
+    print(f'{action} {report["moved"]} 個檔案，略過 {report["skipped"]} 個')
+    for error in report['errors']:
+        print(f'  ⚠️ {error}')
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
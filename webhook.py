@@ -113,4 +113,4 @@ def send_flex_reply(token, reply_token, flex_msg_row):
         "messages": [message]
     }
     
-    requests.post("https://api.line.me/v2/bot/message/reply", headers=headers, json=payload)
+    requests.post(f"{config.LINE_API_BASE}/v2/bot/message/reply", headers=headers, json=payload, timeout=30)